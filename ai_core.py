@@ -20,7 +20,6 @@ import time
 import sqlite3
 import threading
 import subprocess
-import requests
 from datetime import datetime
 from typing import Any
 
@@ -35,13 +34,22 @@ if os.path.isdir(_AC_AI_CONFIG) and _AC_AI_CONFIG not in sys.path:
 # ── Внешние зависимости проекта ─────────────────────────────────────────────
 import llama_handler
 from llama_handler import (
-    USE_OLLAMA, OLLAMA_HOST, OLLAMA_MODEL, SUPPORTED_MODELS,
+    USE_OLLAMA, OLLAMA_MODEL, SUPPORTED_MODELS,
     AI_MODE_FAST, AI_MODE_THINKING, AI_MODE_PRO,
     SYSTEM_PROMPTS, MODE_STRATEGY_RULES,
     get_current_ollama_model, get_current_display_name,
-    call_ollama_chat, warm_up_model, unload_model, unload_all_models,
+    call_ollama_chat, stream_ollama_chat, warm_up_model, unload_model, unload_all_models,
 )
 
+from ollama_client import is_cancelled
+from model_residency import get_residency_manager
+from prompt_cache import is_stable_layout, build_volatile_block, stable_history_window
+from token_estimator import estimate_tokens, chars_for_tokens
+from llm_cache import get_llm_cache
+from context_sizer import get_context_sizer
+from ollama_metrics import set_metrics_context, STAGE_MAIN, STAGE_VALIDATE_REGEN
+from pipeline import Pipeline, PipelineAbort
+from search_deadline import search_deadline_for_mode, RETRY_MIN_SECONDS
 from chat_manager import ChatManager
 from context_memory_manager import ContextMemoryManager
 
@@ -140,7 +148,9 @@ from error_handler import (
 from web_search import (
     analyze_intent_for_search,
     deep_web_search,
-    build_contextual_search_query,
+    build_search_query,
+    detect_search_language,
+    search_region,
     detect_question_parts,
     validate_answer,
     build_final_answer_prompt,
@@ -152,7 +162,10 @@ from web_search import (
     translate_to_russian,
     remove_english_words_from_russian,
     summarize_sources,
+    resolve_summarizer_model,
     compress_search_results,
+    SUMMARIZE_TIMEOUT,
+    SUMMARIZE_MIN_SECONDS,
     version_search_pipeline,
     is_version_query,
     validate_versions_before_answer,
@@ -398,64 +411,44 @@ def _is_conversational_message(text: str) -> bool:
 # Sentinel — отличает отменённый стрим от реально пустого ответа
 _STREAM_CANCELLED = "[Ollama cancelled]"
 
-def _ollama_stream(payload: dict, timeout: int, on_chunk, cancelled_flag) -> str:
+def _ollama_stream(payload: dict, timeout: int, on_chunk, cancelled_flag,
+                   stage: str = STAGE_MAIN) -> str:
     """
-    Выполняет стриминговый запрос к Ollama /api/chat.
-    Вызывает on_chunk(text) для каждого токена.
-    Возвращает полный собранный текст.
+    Стриминговый запрос к Ollama /api/chat — см. llama_handler.stream_ollama_chat
+    (отмена, single_flight, метрики). timeout оставлен для совместимости:
+    у стрима нет общего таймаута чтения.
     При отмене пользователем возвращает _STREAM_CANCELLED (не пустую строку!).
     """
-    import json as _json
-    payload = dict(payload)
-    payload["stream"] = True
-    full = []
-    was_cancelled = False
-    try:
-        with requests.post(
-            f"{OLLAMA_HOST}/api/chat",
-            json=payload,
-            stream=True,
-            timeout=(30, None),
-        ) as r:
-            if r.status_code != 200:
-                return f"[Ollama error] HTTP {r.status_code}"
-            for raw_line in r.iter_lines():
-                if callable(cancelled_flag) and cancelled_flag():
-                    was_cancelled = True
-                    break
-                if not raw_line:
-                    continue
-                try:
-                    obj = _json.loads(raw_line)
-                except Exception:
-                    continue
-                token = obj.get("message", {}).get("content", "")
-                if token:
-                    full.append(token)
-                    if on_chunk:
-                        try:
-                            on_chunk(token)
-                        except Exception:
-                            pass
-                if obj.get("done", False):
-                    break
-    except requests.exceptions.Timeout:
-        return "[Ollama timeout]"
-    except requests.exceptions.ConnectionError:
-        return "[Ollama connection error]"
-    if was_cancelled:
-        return _STREAM_CANCELLED
-    return "".join(full)
+    return stream_ollama_chat(payload, on_chunk=on_chunk, cancelled_flag=cancelled_flag,
+                              stage=stage)
 
 
-def get_ai_response(user_message: str, current_language: str, deep_thinking: bool, use_search: bool, should_forget: bool = False, chat_manager=None, chat_id=None, file_paths: list = None, ai_mode: str = AI_MODE_FAST, model_key: str = None, on_chunk=None, cancelled_flag=None):
-    """Получить ответ от AI (с жёстким закреплением языка)"""
+def get_ai_response(user_message: str, current_language: str, deep_thinking: bool, use_search: bool, should_forget: bool = False, chat_manager=None, chat_id=None, file_paths: list = None, ai_mode: str = AI_MODE_FAST, model_key: str = None, on_chunk=None, cancelled_flag=None, on_stream_reset=None):
+    """Получить ответ от AI (с жёстким закреплением языка)
+
+    on_stream_reset() — вызывается, когда уже показанный стрим заменяется
+    новым (перегенерация после валидации): UI очищает пузырь ответа.
+    """
     # Авто-анализ стиля пользователя (если включён улучшенный подтекст)
     subtext_track_message(user_message)
 
     # Фиксируем модель ОДИН РАЗ — используем переданный ключ или читаем глобал
     # Это предотвращает любую гонку потоков с llama_handler.CURRENT_AI_MODEL_KEY
     _mk = model_key if model_key is not None else llama_handler.CURRENT_AI_MODEL_KEY
+    set_metrics_context(model_key=_mk, ai_mode=ai_mode, chat_id=chat_id)
+
+    def _resolve_ollama_model_name(mk: str) -> str:
+        if mk == "mistral":
+            return MISTRAL_MODEL_NAME
+        if mk == "qwen":
+            return QWEN_MODEL_NAME
+        entry = SUPPORTED_MODELS.get(mk)
+        if entry:
+            return entry[0]
+        return OLLAMA_MODEL
+
+    # Имя модели в Ollama — для калибровки оценки токенов (token_estimator)
+    _ollama_model = _resolve_ollama_model_name(_mk)
     print(f"\n[GET_AI_RESPONSE] ========== НАЧАЛО ==========")
     print(f"[GET_AI_RESPONSE] Сообщение пользователя: {user_message}")
     print(f"[GET_AI_RESPONSE] Текущий язык интерфейса: {current_language}")
@@ -476,13 +469,24 @@ def get_ai_response(user_message: str, current_language: str, deep_thinking: boo
     user_message = user_message.replace('—', '-')  # Длинное тире
     print(f"[GET_AI_RESPONSE] Нормализованное сообщение: {user_message}")
 
+    # ═══════════════════════════════════════════════════════════
+    # СТАДИИ ЗАПРОСА (pipeline.py)
+    # Независимые стадии — память, история, чтение файлов (vision),
+    # поисковый запрос → поиск → суммаризация — стартуют фоном сразу
+    # после анализа запроса; сборка промпта ждёт только нужные ей.
+    # Остальные стадии выполняются по месту, но тоже замеряются и
+    # отключаются через AI_ASSISTANT_SKIP_STAGES.
+    # ═══════════════════════════════════════════════════════════
+    pipe = Pipeline("get_ai_response", cancelled=cancelled_flag)
+
     # ═══════════════════════════════════════════════════════════
     # ОБРАБОТКА КОМАНД ПАМЯТИ
     # ═══════════════════════════════════════════════════════════
     user_lower = user_message.lower().strip()
-    
-    # Команда "ЗАПОМНИ"
-    if chat_id and (user_lower.startswith("запомни") or user_lower.startswith("remember")):
+    _is_memory_command = user_lower.startswith("запомни") or user_lower.startswith("remember")
+
+    def _stage_memory_command() -> str:
+        # Команда "ЗАПОМНИ"
         try:
             context_mgr = get_memory_manager(_mk)
             # Извлекаем текст после команды
@@ -501,30 +505,34 @@ def get_ai_response(user_message: str, current_language: str, deep_thinking: boo
                 return "✓ Запомнил!"
         except Exception as e:
             print(f"[MEMORY] ✗ Ошибка сохранения: {e}")
-
-    # ПРОВЕРЯЕМ РОЛЕВУЮ КОМАНДУ
-    role_info = detect_role_command(user_message)
-    role_instruction = ""
-    if role_info["is_role_command"]:
-        print(f"[GET_AI_RESPONSE] 🎭 Обнаружена РОЛЕВАЯ КОМАНДА: {role_info['role']}")
-        role_instruction = role_info["instruction"]
-    
-    # ОПРЕДЕЛЯЕМ РЕАЛЬНЫЙ ЯЗЫК ВОПРОСА
-    detected_language = detect_message_language(user_message)
-    # Для Qwen: если есть хоть одна кириллическая буква — принудительно русский.
-    if _mk == "qwen":
-        _has_cyrillic = any('\u0400' <= ch <= '\u04FF' for ch in user_message)
-        if _has_cyrillic and detected_language != "russian":
-            detected_language = "russian"
-            print(f"[GET_AI_RESPONSE] [Qwen] Переопределён язык → РУССКИЙ (найдена кириллица)")
-    # Для Mistral: если есть хоть одна кириллическая буква — принудительно русский.
-    # Исправляет ложное определение "english" из-за технических терминов (API, JSON...).
-    if _mk == "mistral":
-        _has_cyrillic = any('\u0400' <= ch <= '\u04FF' for ch in user_message)
-        if _has_cyrillic and detected_language != "russian":
-            detected_language = "russian"
-            print(f"[GET_AI_RESPONSE] [Mistral] Переопределён язык → РУССКИЙ (найдена кириллица)")
-    print(f"[GET_AI_RESPONSE] Определённый язык вопроса: {detected_language}")
+        return ""
+
+    _remembered = pipe.run("memory_command", _stage_memory_command,
+                           skip=not (chat_id and _is_memory_command), default="")
+    if _remembered:
+        pipe.report()
+        return _remembered
+
+    def _stage_intent():
+        # ПРОВЕРЯЕМ РОЛЕВУЮ КОМАНДУ
+        role_info = detect_role_command(user_message)
+        if role_info["is_role_command"]:
+            print(f"[GET_AI_RESPONSE] 🎭 Обнаружена РОЛЕВАЯ КОМАНДА: {role_info['role']}")
+
+        # ОПРЕДЕЛЯЕМ РЕАЛЬНЫЙ ЯЗЫК ВОПРОСА
+        # (для Qwen/Mistral хоть одна кириллическая буква — русский)
+        detected_language = detect_search_language(user_message, _mk)
+        print(f"[GET_AI_RESPONSE] Определённый язык вопроса: {detected_language}")
+
+        # ОПРЕДЕЛЯЕМ, ЯВЛЯЕТСЯ ЛИ ЗАПРОС МАТЕМАТИЧЕСКОЙ ЗАДАЧЕЙ
+        is_math_problem = detect_math_problem(user_message)
+        return role_info, detected_language, is_math_problem
+
+    # При пропуске — без роли и математики, язык по письменности сообщения
+    role_info, detected_language, is_math_problem = pipe.run(
+        "intent", _stage_intent,
+        default=({"is_role_command": False}, detect_message_language(user_message), False))
+    role_instruction = role_info["instruction"] if role_info["is_role_command"] else ""
 
     # ═══════════════════════════════════════════════════════════
     # DEEPSEEK: BYPASS ПРОСТОЙ АРИФМЕТИКИ
@@ -537,12 +545,14 @@ def get_ai_response(user_message: str, current_language: str, deep_thinking: boo
             _arith_result = compute_simple_arithmetic(_arith_expr, detected_language)
             if _arith_result:
                 print(f"[GET_AI_RESPONSE] [DeepSeek] Простая арифметика — вычислено Python: {_arith_result}")
+                pipe.report()
                 return _arith_result, []
 
-    # ОПРЕДЕЛЯЕМ, ЯВЛЯЕТСЯ ЛИ ЗАПРОС МАТЕМАТИЧЕСКОЙ ЗАДАЧЕЙ
-    is_math_problem = detect_math_problem(user_message)
     if is_math_problem:
         print(f"[GET_AI_RESPONSE] 🔬 Обнаружена МАТЕМАТИЧЕСКАЯ ЗАДАЧА - применяю олимпиадный режим")
+        print(f"[GET_AI_RESPONSE] ⚠️ Интернет ЗАПРЕЩЁН для математических задач")
+        # КРИТИЧНО: Для математических задач ЗАПРЕЩАЕМ интернет
+        use_search = False
 
     # Выбираем режим системного промпта на основе ai_mode
     if ai_mode == AI_MODE_FAST:
@@ -557,6 +567,358 @@ def get_ai_response(user_message: str, current_language: str, deep_thinking: boo
     
     print(f"[GET_AI_RESPONSE] Выбран системный промпт: mode='{mode}', ai_mode='{ai_mode}'")
 
+    # ── Фоновые стадии ──────────────────────────────────────────────
+    # Память, история, файлы и поиск друг от друга не зависят — идут
+    # параллельно, пока собирается системный промпт. summarize ждёт и
+    # files: vision и суммаризатор не грузят две модели одновременно.
+    def _stage_memory() -> list:
+        return get_memory_manager(_mk).get_context_memory(chat_id, limit=20)
+
+    _history_limit = 20 if _mk in ("deepseek", "deepseek-r1") else MAX_HISTORY_LOAD
+
+    def _stage_history() -> list:
+        # Загружаем историю диалога из memory_manager (primary) или chat_manager (fallback)
+        # memory_manager хранит только чистые повороты user/assistant — без мусора.
+        # Это гарантирует, что ИИ ВИДИТ СВОИ предыдущие ответы.
+        mem_mgr = get_memory_manager(_mk)
+        mem_messages = []
+        if chat_id and hasattr(mem_mgr, 'get_messages'):
+            try:
+                mem_messages = mem_mgr.get_messages(chat_id, limit=_history_limit)
+                print(f"[GET_AI_RESPONSE] Загружено {len(mem_messages)} сообщений из memory_manager ({_mk})")
+            except Exception as _mex:
+                print(f"[GET_AI_RESPONSE] ⚠️ memory_manager.get_messages: {_mex}")
+
+        # Fallback: если memory_manager пустой (старые чаты) — грузим из chat_manager
+        if not mem_messages:
+            if chat_manager and chat_id:
+                _fb_history = chat_manager.get_chat_messages(chat_id, limit=_history_limit)
+                print(f"[GET_AI_RESPONSE] Fallback: {len(_fb_history)} сообщений из chat_manager")
+                _fb = list(_fb_history)
+                if _fb and _fb[-1][0] == "user" and _fb[-1][1] in (_user_message_raw, user_message):
+                    _fb = _fb[:-1]
+                mem_messages = [
+                    {"role": r[0], "content": r[1]}
+                    for r in _fb if r[0] in ("user", "assistant")
+                ]
+            else:
+                # Старая БД chat_memory.db не имеет chat_id — читать её НЕЛЬЗЯ,
+                # иначе любая модель получает историю ВСЕХ удалённых чатов.
+                # Намеренно возвращаем пустую историю.
+                print(f"[GET_AI_RESPONSE] ⚠️ chat_id=None — история не загружается (защита от утечки)")
+                mem_messages = []
+        else:
+            # memory_manager уже содержит текущий user_message (сохранён до вызова ИИ)
+            # Убираем последний элемент если он совпадает с текущим запросом (анти-дубль)
+            # ✅ ИСПРАВЛЕНО: сравниваем с _user_message_raw (то что реально сохранено в БД),
+            # а не с нормализованным user_message — иначе при спецсимволах антидубль не срабатывал
+            # и текущий запрос попадал в историю ДВАЖДЫ (raw + normalized).
+            if mem_messages and mem_messages[-1]["role"] == "user" and mem_messages[-1]["content"] in (_user_message_raw, user_message):
+                mem_messages = mem_messages[:-1]
+        return mem_messages
+
+
+    def _stage_files() -> list:
+        # Обрабатываем прикреплённые файлы (текст читаем, изображения — vision).
+        # PipelineAbort(сообщение) — файл не прочитан, запрос завершается им.
+        all_files_context = []
+        print(f"[GET_AI_RESPONSE] Обработка файлов: {len(file_paths)}")
+        
+        for file_path in file_paths:
+            # УЛУЧШЕНИЕ: Нормализуем путь к файлу
+            file_path = os.path.normpath(os.path.abspath(file_path))
+            print(f"[GET_AI_RESPONSE] Обработка файла: {file_path}")
+            print(f"[GET_AI_RESPONSE] ════════════════════════════════════════")
+            
+            try:
+                file_ext = os.path.splitext(file_path)[1].lower()
+                file_name = os.path.basename(file_path)
+                
+                # ПРОВЕРКА: убеждаемся что файл существует
+                if not os.path.exists(file_path):
+                    print(f"[GET_AI_RESPONSE] ⚠️ ФАЙЛ НЕ НАЙДЕН: {file_path}")
+                    
+                    # Возвращаем понятную ошибку пользователю
+                    if detected_language == "russian":
+                        error_msg = f"""🔴 Файл '{file_name}' не найден
+
+Путь: {file_path}
+
+Возможные причины:
+• Файл был перемещён или удалён
+• Неправильный путь к файлу
+• Проблема с правами доступа
+
+Попробуйте:
+1. Прикрепите файл заново
+2. Убедитесь что файл существует на диске
+3. Проверьте права доступа к файлу"""
+                    else:
+                        error_msg = f"""🔴 File '{file_name}' not found
+
+Path: {file_path}
+
+Possible reasons:
+• File was moved or deleted
+• Incorrect file path
+• Access permission issue
+
+Try:
+1. Attach the file again
+2. Make sure the file exists on disk
+3. Check file access permissions"""
+                    
+                    raise PipelineAbort(error_msg)
+                
+                # Проверяем тип файла
+                if is_image_file(file_path):
+                    # ═══════════════════════════════════════════════════════
+                    # ИЗОБРАЖЕНИЕ — делегируем в vision_handler.py
+                    # ═══════════════════════════════════════════════════════
+                    result = process_image_file(
+                        file_path=file_path,
+                        file_name=file_name,
+                        user_message=user_message,
+                        ai_mode=ai_mode,
+                        language=detected_language,
+                    )
+                    if result["success"]:
+                        all_files_context.append(f"[Изображение: {file_name}]\n{result['content']}")
+                    else:
+                        raise PipelineAbort(result["content"])
+
+                else:
+                    # ═══════════════════════════════════════════════════════
+                    # ТЕКСТОВЫЙ ФАЙЛ - Читаем и обрабатываем обычной моделью
+                    # ═══════════════════════════════════════════════════════
+                    print(f"[GET_AI_RESPONSE] 📄 ТИП: ТЕКСТОВЫЙ ФАЙЛ")
+                    print(f"[GET_AI_RESPONSE] 🤖 МОДЕЛЬ: {OLLAMA_MODEL} (обычная модель)")
+                    print(f"[GET_AI_RESPONSE] 📖 Чтение файла...")
+                    
+                    try:
+                        # Пробуем разные кодировки
+                        encodings = ['utf-8', 'cp1251', 'latin-1']
+                        file_content = None
+                        used_encoding = None
+                        
+                        for encoding in encodings:
+                            try:
+                                with open(file_path, 'r', encoding=encoding) as f:
+                                    file_content = f.read()[:10000]  # Ограничиваем 10000 символов
+                                used_encoding = encoding
+                                break
+                            except UnicodeDecodeError:
+                                continue
+                        
+                        if file_content:
+                            if detected_language == "russian":
+                                all_files_context.append(f"""[Файл: {file_name}]
+СОДЕРЖИМОЕ:
+{file_content}""")
+                            else:
+                                all_files_context.append(f"""[File: {file_name}]
+CONTENT:
+{file_content}""")
+                            print(f"[GET_AI_RESPONSE] ✅ Файл прочитан ({used_encoding}): {file_name}")
+                        else:
+                            raise UnicodeDecodeError("all", b"", 0, 0, "Could not decode with any encoding")
+                            
+                    except Exception as e:
+                        # Не удалось прочитать как текст
+                        print(f"[GET_AI_RESPONSE] ❌ Не удалось прочитать файл: {file_name} ({e})")
+                        
+                        # Показываем понятное сообщение
+                        if detected_language == "russian":
+                            error_msg = f"""⚠️ Файл '{file_name}' не может быть прочитан
+
+Возможные причины:
+• Это бинарный файл (exe, pdf, docx и т.д.)
+• Неподдерживаемая кодировка
+
+Поддерживаемые текстовые файлы: .txt, .py, .js, .html, .css, .md и др.
+Для изображений используйте форматы: .png, .jpg, .jpeg, .gif"""
+                        else:
+                            error_msg = f"""⚠️ File '{file_name}' cannot be read
+
+Possible reasons:
+• This is a binary file (exe, pdf, docx, etc.)
+• Unsupported encoding
+
+Supported text files: .txt, .py, .js, .html, .css, .md, etc.
+For images use formats: .png, .jpg, .jpeg, .gif"""
+                        
+                        raise PipelineAbort(error_msg)
+                        
+            except PipelineAbort:
+                raise
+            except Exception as e:
+                print(f"[GET_AI_RESPONSE] Ошибка обработки файла {file_name}: {e}")
+                import traceback
+                traceback.print_exc()
+        return all_files_context
+
+    def _stage_search_query() -> str:
+        # 🔥 КОНТЕКСТНЫЙ ПОИСК: запрос с учётом истории диалога и реальными
+        # датами вместо "завтра"/"послезавтра" (тот же, что прогревает search_prefetch)
+        contextual_query = build_search_query(user_message, chat_manager, chat_id, detected_language)
+        print(f"[GET_AI_RESPONSE] 🔍 Поисковый запрос: {contextual_query}")
+        return contextual_query
+
+    def _stage_search(contextual_query: str):
+        # search_query пропущена или упала — ищем по самому сообщению
+        contextual_query = contextual_query or user_message
+        region = search_region(detected_language)
+        num_results = 8 if deep_thinking else 3
+
+        # Лимит токенов на результаты поиска. Оставляем место для
+        # системного промпта (~500 токенов) и ответа; 3/4 лимита — на
+        # фрагменты страниц, которые deep_web_search отбирает по BM25.
+        if deep_thinking:
+            # Режим "Думать" - больше токенов на контекст
+            max_search_tokens = 2000  # ~8000 символов для русского
+        else:
+            # Быстрый режим - меньше токенов
+            max_search_tokens = 1000  # ~4000 символов для русского
+        passage_tokens = max_search_tokens * 3 // 4
+
+        # Пока идёт поиск (секунды сетевых запросов), заранее грузим модель
+        # для summarize_sources — её загрузка не попадёт в критический путь.
+        get_residency_manager().prewarm(resolve_summarizer_model(_mk), reason="summarize")
+        
+        # ── Маршрутизация запросов: версии ПО → специальный пайплайн ──
+        # Запросы о версиях, релизах, changelog обрабатываются модульным
+        # пайплайном version_search_pipeline (search→filter→extract→validate→answer),
+        # который делает несколько поисковых запросов, фильтрует источники
+        # по качеству, извлекает и валидирует версии, формирует ответ
+        # с явным запретом на галлюцинации.
+        _is_version_q = is_version_query(contextual_query)
+
+        if _is_version_q:
+            print(f"[GET_AI_RESPONSE] 📦 ОПРЕДЕЛЁН ЗАПРОС О ВЕРСИИ ПО "
+                  f"→ Запускаю version_search_pipeline")
+            search_results, _page_contents = version_search_pipeline(
+                contextual_query,
+                region=region,
+                language=detected_language,
+                deadline=search_deadline,
+            )
+            # Если пайплайн ничего не вернул — откатываемся к обычному поиску
+            if not _page_contents:
+                print(f"[GET_AI_RESPONSE] ⚠️ Пайплайн версий пуст, откатываюсь к deep_web_search")
+                _is_version_q = False
+
+        if not _is_version_q:
+            # УМНЫЙ ПОИСК: все режимы заходят на сайты, отличается только глубина
+            if ai_mode in [AI_MODE_THINKING, AI_MODE_PRO]:
+                print(f"[GET_AI_RESPONSE] 🧠 Использую ГЛУБОКИЙ веб-поиск (3 сайта)")
+                search_results, _page_contents = deep_web_search(
+                    contextual_query, num_results=num_results,
+                    region=region, language=detected_language, max_pages=3,
+                    context_tokens=passage_tokens, model=_ollama_model,
+                    deadline=search_deadline)
+            else:
+                print(f"[GET_AI_RESPONSE] ⚡ Использую БЫСТРЫЙ веб-поиск (1 сайт)")
+                search_results, _page_contents = deep_web_search(
+                    contextual_query, num_results=num_results,
+                    region=region, language=detected_language, max_pages=1,
+                    context_tokens=passage_tokens, model=_ollama_model,
+                    deadline=search_deadline)
+
+            # ── ЗАЩИТА ОТ ГАЛЛЮЦИНАЦИЙ (только для обычного поиска) ──
+            _version_guard = validate_versions_before_answer(_page_contents, contextual_query)
+            if _version_guard["retry"] and not search_deadline.allows(RETRY_MIN_SECONDS):
+                print(f"[VERSION_GUARD] ⏱ До дедлайна поиска "
+                      f"{search_deadline.remaining():.1f} с — повторный поиск пропущен")
+            elif _version_guard["retry"]:
+                print(
+                    f"[VERSION_GUARD] 🔄 Источники устаревшие "
+                    f"(лучшая версия: «{_version_guard['best_version']}», "
+                    f"причина: {_version_guard['reason']}). "
+                    f"Повторяю поиск с уточнёнными ключами..."
+                )
+                import datetime as _dt
+                _retry_q = (f"{contextual_query} latest version release "
+                            f"{_dt.datetime.now().year}")
+                _retry_str, _retry_pages = deep_web_search(
+                    _retry_q, num_results=num_results,
+                    region=region, language=detected_language, max_pages=3,
+                    context_tokens=passage_tokens, model=_ollama_model,
+                    deadline=search_deadline,
+                )
+                if _retry_pages:
+                    search_results = _retry_str
+                    _page_contents = _retry_pages
+                    print(f"[VERSION_GUARD] ✅ Повторный поиск: {len(_retry_pages)} свежих страниц")
+                else:
+                    print(f"[VERSION_GUARD] ⚠️ Повторный поиск пустой, оставляем исходные данные")
+
+            if _version_guard["best_version"]:
+                print(f"[VERSION_GUARD] 📌 Лучшая версия: «{_version_guard['best_version']}» "
+                      f"из {len(_version_guard['all_versions'])} вариантов")
+        
+        print(f"[GET_AI_RESPONSE] Результаты поиска получены. Длина: {len(search_results)} символов")
+        print(f"[GET_AI_RESPONSE] Первые 300 символов результатов: {search_results[:300]}...")
+
+        # ── Извлекаем источники (Заголовок + Ссылка) для кнопки "Источники" ──
+        _src_titles = re.findall(r'Заголовок:\s*(.+)', search_results)
+        _src_urls   = re.findall(r'Ссылка:\s*(https?://\S+)', search_results)
+        found_sources = []
+        for i, url in enumerate(_src_urls):
+            title = _src_titles[i].strip() if i < len(_src_titles) else url
+            found_sources.append((title, url))
+        print(f"[GET_AI_RESPONSE] 🔗 Извлечено источников: {len(found_sources)}")
+
+        # СЖИМАЕМ результаты поиска под лимит токенов
+        # Символов на токен — по калибровке модели для письменности самих
+        # результатов (token_estimator), а не фиксированные 3–4.
+        max_search_chars = chars_for_tokens(max_search_tokens, _ollama_model, search_results[:4000])
+        print(f"[GET_AI_RESPONSE] Лимит для результатов поиска: {max_search_tokens} токенов ({max_search_chars} символов)")
+        
+        if len(search_results) > max_search_chars:
+            print(f"[GET_AI_RESPONSE] Результаты поиска слишком длинные, сжимаем...")
+            search_results = compress_search_results(search_results, max_search_chars)
+        return search_results, found_sources
+
+    def _stage_summarize(search, _files) -> str:
+        # НОВЫЙ ПАЙПЛАЙН: суммаризация → анализ вопроса → финальная генерация
+        search_results, _ = search
+        # ШАГ 1: Извлекаем только факты из сырых результатов
+        # Без вызова модели — в быстром режиме и при лимите времени поиска;
+        # PRO суммаризирует моделью, пока остаток лимита это позволяет
+        if ai_mode == AI_MODE_PRO:
+            _extractive = not search_deadline.allows(SUMMARIZE_MIN_SECONDS)
+        else:
+            _extractive = ai_mode == AI_MODE_FAST or search_deadline.limited
+        facts = summarize_sources(search_results, user_message, detected_language, model_key=_mk,
+                                  extractive=_extractive,
+                                  timeout=search_deadline.clamp(SUMMARIZE_TIMEOUT))
+
+        # ШАГ 1.5: Проверяем релевантность фактов
+        # Если суммаризатор вернул "не найдено" — говорим модели использовать свои знания
+        no_facts_markers = ["релевантных фактов не найдено", "no relevant facts found", "не найдено", "нет информации"]
+        facts_are_irrelevant = not facts or any(marker in facts.lower() for marker in no_facts_markers)
+        if facts_are_irrelevant:
+            print(f"[GET_AI_RESPONSE] ⚠️ Релевантных фактов из поиска не найдено — модель будет использовать собственные знания")
+            if detected_language == "russian":
+                facts = f"Поиск не дал релевантных результатов по запросу «{user_message}». Ответь на основе своих знаний."
+            else:
+                facts = f"Search did not return relevant results for «{user_message}». Answer based on your own knowledge."
+        return facts
+
+    pipe.add("memory", _stage_memory, skip=not chat_id, default=[])
+    pipe.add("history", _stage_history, skip=should_forget, default=[])
+    pipe.add("files", _stage_files, skip=not file_paths, default=[])
+    # Один лимит времени на поиск хода: запрос → поиск → суммаризация
+    search_deadline = search_deadline_for_mode(ai_mode)
+    if use_search:
+        print(f"[GET_AI_RESPONSE] ⏱ {search_deadline}")
+    pipe.add("search_query", _stage_search_query, skip=not use_search, default="")
+    pipe.add("search", _stage_search, deps=("search_query",), skip=not use_search,
+             default=("", []))
+    pipe.add("summarize", _stage_summarize, deps=("search", "files"), skip=not use_search,
+             default="")
+    pipe.start()
+
     # ══════════════════════════════════════════════════════════════════
     # СУБТЕКСТ: загружаем настройки пользователя один раз
     # Применяется ко ВСЕМ моделям одинаково
@@ -725,33 +1087,49 @@ def get_ai_response(user_message: str, current_language: str, deep_thinking: boo
     _tomorrow_en = _tomorrow.strftime("%B %d, %Y, %A")
     _day_after_en = _day_after.strftime("%B %d, %Y, %A")
 
+    # Префикс-стабильная раскладка (prompt_cache.py): время меняется каждую
+    # минуту, поэтому в system_prompt остаётся только дата, а время уходит
+    # в изменчивый блок последнего сообщения — иначе KV-cache промахивается.
+    _stable_prompt = is_stable_layout()
+    _volatile_parts = []
+
     # Используем _prompt_lang (не detected_language!) — чтобы при польском субтексте
     # не инжектировать русскоязычную дату, которая сбивает модель обратно на русский.
     if _prompt_lang == "russian":
+        if _stable_prompt:
+            _volatile_parts.append(f"Время сейчас: {_time_ru}")
         if _mk in ("deepseek", "deepseek-r1"):
             # Для DeepSeek — компактная однострочная инжекция даты
-            _datetime_inject = f"\n\nСегодня: {_date_ru}, время: {_time_ru}."
+            if _stable_prompt:
+                _datetime_inject = f"\n\nСегодня: {_date_ru}."
+            else:
+                _datetime_inject = f"\n\nСегодня: {_date_ru}, время: {_time_ru}."
         else:
             _datetime_inject = (
                 f"\n\n⚡ СИСТЕМНЫЙ ФАКТ (абсолютно точно, из системных часов компьютера):\n"
                 f"• Сегодня: {_date_ru}\n"
                 f"• Завтра: {_tomorrow_ru}\n"
                 f"• Послезавтра: {_day_after_ru}\n"
-                f"• Время сейчас: {_time_ru}\n"
+                + ("" if _stable_prompt else f"• Время сейчас: {_time_ru}\n") +
                 f"ОБЯЗАТЕЛЬНО используй эти данные при любых вопросах о дате, времени, дне недели.\n"
                 f"Если пользователь спрашивает про 'завтра' — это {_tomorrow_ru}.\n"
                 f"Твои обучающие данные о датах УСТАРЕЛИ — доверяй только этому системному факту."
             )
     else:
+        if _stable_prompt:
+            _volatile_parts.append(f"Current time: {_time_en}")
         if _mk in ("deepseek", "deepseek-r1"):
-            _datetime_inject = f"\n\nToday: {_date_en}, time: {_time_en}."
+            if _stable_prompt:
+                _datetime_inject = f"\n\nToday: {_date_en}."
+            else:
+                _datetime_inject = f"\n\nToday: {_date_en}, time: {_time_en}."
         else:
             _datetime_inject = (
                 f"\n\n⚡ SYSTEM FACT (exact, from computer system clock):\n"
                 f"• Today: {_date_en}\n"
                 f"• Tomorrow: {_tomorrow_en}\n"
                 f"• Day after tomorrow: {_day_after_en}\n"
-                f"• Current time: {_time_en}\n"
+                + ("" if _stable_prompt else f"• Current time: {_time_en}\n") +
                 f"ALWAYS use this when answering questions about date, time, or day of week.\n"
                 f"If user asks about 'tomorrow' — that is {_tomorrow_en}.\n"
                 f"Your training data about dates is OUTDATED — trust only this system fact."
@@ -766,8 +1144,7 @@ def get_ai_response(user_message: str, current_language: str, deep_thinking: boo
     memory_context = ""
     if chat_id:
         try:
-            context_mgr = get_memory_manager(_mk)
-            saved_memories = context_mgr.get_context_memory(chat_id, limit=20)
+            saved_memories = pipe.wait("memory")
             
             if saved_memories:
                 # Разделяем по типам
@@ -812,6 +1189,12 @@ def get_ai_response(user_message: str, current_language: str, deep_thinking: boo
                     print(f"[MEMORY] ⏭ Пропуск file_analysis — разговорное сообщение: '{user_message[:40]}'"  )
         except Exception as e:
             print(f"[MEMORY] ✗ Ошибка загрузки памяти: {e}")
+
+    # Память и контекст файлов меняются от хода к ходу (файл то подмешивается,
+    # то нет) — в stable-раскладке они идут после истории, а не перед ней.
+    if _stable_prompt and memory_context:
+        _volatile_parts.append(memory_context)
+        memory_context = ""
     
     # Добавляем математический промпт если это математическая задача
     math_prompt = ""
@@ -842,12 +1225,7 @@ def get_ai_response(user_message: str, current_language: str, deep_thinking: boo
             else:
                 math_prompt = MATH_PROMPTS["thinking"]
                 print(f"[GET_AI_RESPONSE] 🔬 Математика - режим: ДУМАЮЩИЙ (по умолчанию)")
-        
-        print(f"[GET_AI_RESPONSE] ⚠️ Интернет ЗАПРЕЩЁН для математических задач")
-        
-        # КРИТИЧНО: Для математических задач ЗАПРЕЩАЕМ интернет
-        use_search = False
-    
+
     # ══════════════════════════════════════════════════════════
     # БЛОК ПОНИМАНИЯ КОНТЕКСТА ДИАЛОГА
     # ══════════════════════════════════════════════════════════
@@ -999,178 +1377,55 @@ You ALWAYS read the full chat history before responding:
 
     # ── Железное усиление языка ─────────────────────────────────────────────────
     # Если субтекст задаёт конкретный язык — добавляем жёсткое правило В КОНЕЦ
-    # системного промпта, независимо от всех других механизмов.
-    # Это спасает от ситуации когда get_subtext_injection/reminder вернули пустое
-    # (например, после полной очистки памяти).
-    if _st_lang and _st_lang not in ("", "Не важно (как спрошу)"):
-        _lang_map_final = {
-            "Русский":     "\n\nОТВЕЧАЙ ТОЛЬКО НА РУССКОМ ЯЗЫКЕ.",
-            "English":     "\n\nRESPOND ONLY IN ENGLISH.",
-            "Украинський": "\n\nВІДПОВІДАЙ ТІЛЬКИ УКРАЇНСЬКОЮ.",
-            "Украинский":  "\n\nВІДПОВІДАЙ ТІЛЬКИ УКРАЇНСЬКОЮ.",
-            "Polski":      "\n\nODPOWIADAJ WYŁĄCZNIE PO POLSKU. Żadnego innego języka.",
-            "Español":     "\n\nRESPONDE SOLO EN ESPAÑOL.",
-            "Deutsch":     "\n\nANTWORTE NUR AUF DEUTSCH.",
-            "Français":    "\n\nRÉPONDS UNIQUEMENT EN FRANÇAIS.",
-            "Беларуский":  "\n\nАДКАЗВАЙ ТОЛЬКІ ПА-БЕЛАРУСКУ.",
-        }
-        _final_lang_rule = _lang_map_final.get(_st_lang, f"\n\nRESPOND ONLY IN: {_st_lang}.")
-        system_prompt = system_prompt + _final_lang_rule
-        print(f"[LANG] ✅ Усиление языка в конце промпта: {_st_lang!r}")
-
-    final_user_message = user_message
-
-    # User-turn инъекция директив УДАЛЕНА:
-    # модели зачитывали директиву вслух вместо молчаливого применения.
-    # Все правила теперь только в system_prompt через _identity_override.
-
-    # ── Если пользователь просит создать файл — вшиваем жёсткую инструкцию
-    # прямо в сообщение. Локальные модели следуют inline-инструкциям намного
-    # надёжнее, чем инструкциям в системном промпте.
-    # Передаём имя прикреплённого файла — если "перепиши этот файл" без имени
-    _attached_name = file_paths[0] if file_paths else None
-    _file_injection = build_file_injection(user_message, detected_language,
-                                           attached_file_name=_attached_name)
-    if _file_injection:
-        final_user_message = final_user_message + _file_injection
-        print(f"[FILE_GEN] Запрос на файл — инструкция вшита (имя: {_attached_name})")
-
-    all_files_context = []  # Инициализируем заранее — используется позже вне блока if file_paths
-    
-    # Обрабатываем прикреплённые файлы
-    if file_paths and len(file_paths) > 0:
-        print(f"[GET_AI_RESPONSE] Обработка файлов: {len(file_paths)}")
-        
-        for file_path in file_paths:
-            # УЛУЧШЕНИЕ: Нормализуем путь к файлу
-            file_path = os.path.normpath(os.path.abspath(file_path))
-            print(f"[GET_AI_RESPONSE] Обработка файла: {file_path}")
-            print(f"[GET_AI_RESPONSE] ════════════════════════════════════════")
-            
-            try:
-                file_ext = os.path.splitext(file_path)[1].lower()
-                file_name = os.path.basename(file_path)
-                
-                # ПРОВЕРКА: убеждаемся что файл существует
-                if not os.path.exists(file_path):
-                    print(f"[GET_AI_RESPONSE] ⚠️ ФАЙЛ НЕ НАЙДЕН: {file_path}")
-                    
-                    # Возвращаем понятную ошибку пользователю
-                    if detected_language == "russian":
-                        error_msg = f"""🔴 Файл '{file_name}' не найден
-
-Путь: {file_path}
-
-Возможные причины:
-• Файл был перемещён или удалён
-• Неправильный путь к файлу
-• Проблема с правами доступа
-
-Попробуйте:
-1. Прикрепите файл заново
-2. Убедитесь что файл существует на диске
-3. Проверьте права доступа к файлу"""
-                    else:
-                        error_msg = f"""🔴 File '{file_name}' not found
-
-Path: {file_path}
-
-Possible reasons:
-• File was moved or deleted
-• Incorrect file path
-• Access permission issue
-
-Try:
-1. Attach the file again
-2. Make sure the file exists on disk
-3. Check file access permissions"""
-                    
-                    return error_msg
-                
-                # Проверяем тип файла
-                if is_image_file(file_path):
-                    # ═══════════════════════════════════════════════════════
-                    # ИЗОБРАЖЕНИЕ — делегируем в vision_handler.py
-                    # ═══════════════════════════════════════════════════════
-                    result = process_image_file(
-                        file_path=file_path,
-                        file_name=file_name,
-                        user_message=user_message,
-                        ai_mode=ai_mode,
-                        language=detected_language,
-                    )
-                    if result["success"]:
-                        all_files_context.append(f"[Изображение: {file_name}]\n{result['content']}")
-                    else:
-                        return result["content"]
-
-                else:
-                    # ═══════════════════════════════════════════════════════
-                    # ТЕКСТОВЫЙ ФАЙЛ - Читаем и обрабатываем обычной моделью
-                    # ═══════════════════════════════════════════════════════
-                    print(f"[GET_AI_RESPONSE] 📄 ТИП: ТЕКСТОВЫЙ ФАЙЛ")
-                    print(f"[GET_AI_RESPONSE] 🤖 МОДЕЛЬ: {OLLAMA_MODEL} (обычная модель)")
-                    print(f"[GET_AI_RESPONSE] 📖 Чтение файла...")
-                    
-                    try:
-                        # Пробуем разные кодировки
-                        encodings = ['utf-8', 'cp1251', 'latin-1']
-                        file_content = None
-                        used_encoding = None
-                        
-                        for encoding in encodings:
-                            try:
-                                with open(file_path, 'r', encoding=encoding) as f:
-                                    file_content = f.read()[:10000]  # Ограничиваем 10000 символов
-                                used_encoding = encoding
-                                break
-                            except UnicodeDecodeError:
-                                continue
-                        
-                        if file_content:
-                            if detected_language == "russian":
-                                all_files_context.append(f"""[Файл: {file_name}]
-СОДЕРЖИМОЕ:
-{file_content}""")
-                            else:
-                                all_files_context.append(f"""[File: {file_name}]
-CONTENT:
-{file_content}""")
-                            print(f"[GET_AI_RESPONSE] ✅ Файл прочитан ({used_encoding}): {file_name}")
-                        else:
-                            raise UnicodeDecodeError("all", b"", 0, 0, "Could not decode with any encoding")
-                            
-                    except Exception as e:
-                        # Не удалось прочитать как текст
-                        print(f"[GET_AI_RESPONSE] ❌ Не удалось прочитать файл: {file_name} ({e})")
-                        
-                        # Показываем понятное сообщение
-                        if detected_language == "russian":
-                            error_msg = f"""⚠️ Файл '{file_name}' не может быть прочитан
+    # системного промпта, независимо от всех других механизмов.
+    # Это спасает от ситуации когда get_subtext_injection/reminder вернули пустое
+    # (например, после полной очистки памяти).
+    if _st_lang and _st_lang not in ("", "Не важно (как спрошу)"):
+        _lang_map_final = {
+            "Русский":     "\n\nОТВЕЧАЙ ТОЛЬКО НА РУССКОМ ЯЗЫКЕ.",
+            "English":     "\n\nRESPOND ONLY IN ENGLISH.",
+            "Украинський": "\n\nВІДПОВІДАЙ ТІЛЬКИ УКРАЇНСЬКОЮ.",
+            "Украинский":  "\n\nВІДПОВІДАЙ ТІЛЬКИ УКРАЇНСЬКОЮ.",
+            "Polski":      "\n\nODPOWIADAJ WYŁĄCZNIE PO POLSKU. Żadnego innego języka.",
+            "Español":     "\n\nRESPONDE SOLO EN ESPAÑOL.",
+            "Deutsch":     "\n\nANTWORTE NUR AUF DEUTSCH.",
+            "Français":    "\n\nRÉPONDS UNIQUEMENT EN FRANÇAIS.",
+            "Беларуский":  "\n\nАДКАЗВАЙ ТОЛЬКІ ПА-БЕЛАРУСКУ.",
+        }
+        _final_lang_rule = _lang_map_final.get(_st_lang, f"\n\nRESPOND ONLY IN: {_st_lang}.")
+        system_prompt = system_prompt + _final_lang_rule
+        print(f"[LANG] ✅ Усиление языка в конце промпта: {_st_lang!r}")
 
-Возможные причины:
-• Это бинарный файл (exe, pdf, docx и т.д.)
-• Неподдерживаемая кодировка
+    final_user_message = user_message
 
-Поддерживаемые текстовые файлы: .txt, .py, .js, .html, .css, .md и др.
-Для изображений используйте форматы: .png, .jpg, .jpeg, .gif"""
-                        else:
-                            error_msg = f"""⚠️ File '{file_name}' cannot be read
+    # User-turn инъекция директив УДАЛЕНА:
+    # модели зачитывали директиву вслух вместо молчаливого применения.
+    # Все правила теперь только в system_prompt через _identity_override.
 
-Possible reasons:
-• This is a binary file (exe, pdf, docx, etc.)
-• Unsupported encoding
+    # ── Если пользователь просит создать файл — вшиваем жёсткую инструкцию
+    # прямо в сообщение. Локальные модели следуют inline-инструкциям намного
+    # надёжнее, чем инструкциям в системном промпте.
+    # Передаём имя прикреплённого файла — если "перепиши этот файл" без имени
+    _attached_name = file_paths[0] if file_paths else None
+    _file_injection = build_file_injection(user_message, detected_language,
+                                           attached_file_name=_attached_name)
+    if _file_injection:
+        final_user_message = final_user_message + _file_injection
+        print(f"[FILE_GEN] Запрос на файл — инструкция вшита (имя: {_attached_name})")
+
+    all_files_context = []  # Инициализируем заранее — используется позже вне блока if file_paths
+    
+    # Обрабатываем прикреплённые файлы
+    if file_paths and len(file_paths) > 0:
+        try:
+            all_files_context = pipe.wait("files")
+        except PipelineAbort as e:
+            # Файл не найден / не читается / ошибка vision — ответ пользователю;
+            # поиск и суммаризация, запущенные параллельно, больше не нужны
+            pipe.cancel()
+            pipe.report()
+            return e.value
 
-Supported text files: .txt, .py, .js, .html, .css, .md, etc.
-For images use formats: .png, .jpg, .jpeg, .gif"""
-                        
-                        return error_msg
-                        
-            except Exception as e:
-                print(f"[GET_AI_RESPONSE] Ошибка обработки файла {file_name}: {e}")
-                import traceback
-                traceback.print_exc()
-        
         # Объединяем контекст всех файлов
         if all_files_context:
             # Формируем инструкцию в зависимости от режима
@@ -1261,152 +1516,14 @@ IMPORTANT:
     print(f"[GET_AI_RESPONSE] Контекстная память добавлена в системный промпт")
 
     found_sources = []  # Список (title, url) — заполняется если был поиск
+    facts = ""          # Факты суммаризатора — нужны и валидации ответа
 
     if use_search:
-        print(f"[GET_AI_RESPONSE] ПОИСК АКТИВИРОВАН! Выполняю поиск...")
-        if detected_language == "russian":
-            region = "ru-ru"
-        else:
-            region = "us-en"
-        num_results = 8 if deep_thinking else 3
-        
-        # 🔥 КОНТЕКСТНЫЙ ПОИСК: формируем запрос с учётом истории диалога
-        contextual_query = build_contextual_search_query(user_message, chat_manager, chat_id, detected_language)
-
-        # ── Подстановка реальных дат вместо "завтра"/"послезавтра" ──────────
-        # Чтобы поисковик получал точную дату, а не относительное слово
-        from datetime import timedelta as _td
-        _sq_now = datetime.now()
-        _sq_months_ru = ["января","февраля","марта","апреля","мая","июня",
-                         "июля","августа","сентября","октября","ноября","декабря"]
-        _sq_tomorrow  = _sq_now + _td(days=1)
-        _sq_dayafter  = _sq_now + _td(days=2)
-        _sq_yesterday = _sq_now - _td(days=1)
-        _sq_tom_ru  = f"{_sq_tomorrow.day} {_sq_months_ru[_sq_tomorrow.month-1]}"
-        _sq_daf_ru  = f"{_sq_dayafter.day} {_sq_months_ru[_sq_dayafter.month-1]}"
-        _sq_yes_ru  = f"{_sq_yesterday.day} {_sq_months_ru[_sq_yesterday.month-1]}"
-        _sq_tom_en  = _sq_tomorrow.strftime("%B %d")
-        _sq_daf_en  = _sq_dayafter.strftime("%B %d")
-        _sq_yes_en  = _sq_yesterday.strftime("%B %d")
-        import re as _re_sq
-        if detected_language == "russian":
-            contextual_query = _re_sq.sub(r'\bпослезавтра\b', _sq_daf_ru,  contextual_query, flags=_re_sq.IGNORECASE)
-            contextual_query = _re_sq.sub(r'\bзавтра\b',      _sq_tom_ru,   contextual_query, flags=_re_sq.IGNORECASE)
-            contextual_query = _re_sq.sub(r'\bвчера\b',       _sq_yes_ru,   contextual_query, flags=_re_sq.IGNORECASE)
-        else:
-            contextual_query = _re_sq.sub(r'\bday after tomorrow\b', _sq_daf_en, contextual_query, flags=_re_sq.IGNORECASE)
-            contextual_query = _re_sq.sub(r'\btomorrow\b',            _sq_tom_en, contextual_query, flags=_re_sq.IGNORECASE)
-            contextual_query = _re_sq.sub(r'\byesterday\b',           _sq_yes_en, contextual_query, flags=_re_sq.IGNORECASE)
-
-        print(f"[GET_AI_RESPONSE] 🔍 Поисковый запрос: {contextual_query}")
-        
-        # ── Маршрутизация запросов: версии ПО → специальный пайплайн ──
-        # Запросы о версиях, релизах, changelog обрабатываются модульным
-        # пайплайном version_search_pipeline (search→filter→extract→validate→answer),
-        # который делает несколько поисковых запросов, фильтрует источники
-        # по качеству, извлекает и валидирует версии, формирует ответ
-        # с явным запретом на галлюцинации.
-        _is_version_q = is_version_query(contextual_query)
-
-        if _is_version_q:
-            print(f"[GET_AI_RESPONSE] 📦 ОПРЕДЕЛЁН ЗАПРОС О ВЕРСИИ ПО "
-                  f"→ Запускаю version_search_pipeline")
-            search_results, _page_contents = version_search_pipeline(
-                contextual_query,
-                region=region,
-                language=detected_language,
-            )
-            # Если пайплайн ничего не вернул — откатываемся к обычному поиску
-            if not _page_contents:
-                print(f"[GET_AI_RESPONSE] ⚠️ Пайплайн версий пуст, откатываюсь к deep_web_search")
-                _is_version_q = False
-
-        if not _is_version_q:
-            # УМНЫЙ ПОИСК: все режимы заходят на сайты, отличается только глубина
-            if ai_mode in [AI_MODE_THINKING, AI_MODE_PRO]:
-                print(f"[GET_AI_RESPONSE] 🧠 Использую ГЛУБОКИЙ веб-поиск (3 сайта)")
-                search_results, _page_contents = deep_web_search(
-                    contextual_query, num_results=num_results,
-                    region=region, language=detected_language, max_pages=3)
-            else:
-                print(f"[GET_AI_RESPONSE] ⚡ Использую БЫСТРЫЙ веб-поиск (1 сайт)")
-                search_results, _page_contents = deep_web_search(
-                    contextual_query, num_results=num_results,
-                    region=region, language=detected_language, max_pages=1)
-
-            # ── ЗАЩИТА ОТ ГАЛЛЮЦИНАЦИЙ (только для обычного поиска) ──
-            _version_guard = validate_versions_before_answer(_page_contents, contextual_query)
-            if _version_guard["retry"]:
-                print(
-                    f"[VERSION_GUARD] 🔄 Источники устаревшие "
-                    f"(лучшая версия: «{_version_guard['best_version']}», "
-                    f"причина: {_version_guard['reason']}). "
-                    f"Повторяю поиск с уточнёнными ключами..."
-                )
-                import datetime as _dt
-                _retry_q = (f"{contextual_query} latest version release "
-                            f"{_dt.datetime.now().year}")
-                _retry_str, _retry_pages = deep_web_search(
-                    _retry_q, num_results=num_results,
-                    region=region, language=detected_language, max_pages=3,
-                )
-                if _retry_pages:
-                    search_results = _retry_str
-                    _page_contents = _retry_pages
-                    print(f"[VERSION_GUARD] ✅ Повторный поиск: {len(_retry_pages)} свежих страниц")
-                else:
-                    print(f"[VERSION_GUARD] ⚠️ Повторный поиск пустой, оставляем исходные данные")
-
-            if _version_guard["best_version"]:
-                print(f"[VERSION_GUARD] 📌 Лучшая версия: «{_version_guard['best_version']}» "
-                      f"из {len(_version_guard['all_versions'])} вариантов")
-        
-        print(f"[GET_AI_RESPONSE] Результаты поиска получены. Длина: {len(search_results)} символов")
-        print(f"[GET_AI_RESPONSE] Первые 300 символов результатов: {search_results[:300]}...")
-
-        # ── Извлекаем источники (Заголовок + Ссылка) для кнопки "Источники" ──
-        _src_titles = re.findall(r'Заголовок:\s*(.+)', search_results)
-        _src_urls   = re.findall(r'Ссылка:\s*(https?://\S+)', search_results)
-        found_sources = []
-        for i, url in enumerate(_src_urls):
-            title = _src_titles[i].strip() if i < len(_src_titles) else url
-            found_sources.append((title, url))
-        print(f"[GET_AI_RESPONSE] 🔗 Извлечено источников: {len(found_sources)}")
-
-        # СЖИМАЕМ результаты поиска под лимит токенов
-        # Примерно 1 токен ≈ 4 символа для русского, ≈ 3 символа для английского
-        # Оставляем место для системного промпта (~500 токенов) и ответа
-        if deep_thinking:
-            # Режим "Думать" - больше токенов на контекст
-            max_search_tokens = 2000  # ~8000 символов для русского
-        else:
-            # Быстрый режим - меньше токенов
-            max_search_tokens = 1000  # ~4000 символов для русского
-        
-        max_search_chars = max_search_tokens * 4 if detected_language == "russian" else max_search_tokens * 3
-        print(f"[GET_AI_RESPONSE] Лимит для результатов поиска: {max_search_tokens} токенов ({max_search_chars} символов)")
-        
-        if len(search_results) > max_search_chars:
-            print(f"[GET_AI_RESPONSE] Результаты поиска слишком длинные, сжимаем...")
-            search_results = compress_search_results(search_results, max_search_chars)
-
-        # ══════════════════════════════════════════════════════════
-        # НОВЫЙ ПАЙПЛАЙН: суммаризация → анализ вопроса → финальная генерация
-        # ══════════════════════════════════════════════════════════
-
-        # ШАГ 1: Извлекаем только факты из сырых результатов
-        facts = summarize_sources(search_results, user_message, detected_language, model_key=_mk)
+        print(f"[GET_AI_RESPONSE] ПОИСК АКТИВИРОВАН! Жду результаты поиска...")
+        search_results, found_sources = pipe.wait("search")
 
-        # ШАГ 1.5: Проверяем релевантность фактов
-        # Если суммаризатор вернул "не найдено" — говорим модели использовать свои знания
-        no_facts_markers = ["релевантных фактов не найдено", "no relevant facts found", "не найдено", "нет информации"]
-        facts_are_irrelevant = any(marker in facts.lower() for marker in no_facts_markers)
-        if facts_are_irrelevant:
-            print(f"[GET_AI_RESPONSE] ⚠️ Релевантных фактов из поиска не найдено — модель будет использовать собственные знания")
-            if detected_language == "russian":
-                facts = f"Поиск не дал релевантных результатов по запросу «{user_message}». Ответь на основе своих знаний."
-            else:
-                facts = f"Search did not return relevant results for «{user_message}». Answer based on your own knowledge."
+        # ШАГ 1: факты из результатов (стадия summarize)
+        facts = pipe.wait("summarize")
 
         # ШАГ 2: Определяем структуру вопроса
         question_parts = detect_question_parts(user_message)
@@ -1440,6 +1557,13 @@ Consider information from BOTH sources: search results AND attached files."""
     else:
         print(f"[GET_AI_RESPONSE] Поиск НЕ активирован")
 
+    # Изменчивый контекст — в начало последнего сообщения, после истории.
+    # Всё, что до него (system + история), совпадает с прошлым ходом побайтово.
+    if _stable_prompt:
+        _volatile_block = build_volatile_block(_volatile_parts, _prompt_lang)
+        if _volatile_block:
+            final_user_message = _volatile_block + "\n\n" + final_user_message
+
     # Если запрошено забывание, НЕ загружаем историю
     if should_forget:
         messages = [{"role": "system", "content": system_prompt}]
@@ -1449,55 +1573,20 @@ Consider information from BOTH sources: search results AND attached files."""
         })
         print(f"[GET_AI_RESPONSE] Режим забывания: история не загружается")
     else:
-        # Загружаем историю диалога из memory_manager (primary) или chat_manager (fallback)
-        # memory_manager хранит только чистые повороты user/assistant — без мусора.
-        # Это гарантирует, что ИИ ВИДИТ СВОИ предыдущие ответы.
-        _history_limit = 20 if _mk in ("deepseek", "deepseek-r1") else MAX_HISTORY_LOAD
-
-        mem_mgr = get_memory_manager(_mk)
-        mem_messages = []
-        if chat_id and hasattr(mem_mgr, 'get_messages'):
-            try:
-                mem_messages = mem_mgr.get_messages(chat_id, limit=_history_limit)
-                print(f"[GET_AI_RESPONSE] Загружено {len(mem_messages)} сообщений из memory_manager ({_mk})")
-            except Exception as _mex:
-                print(f"[GET_AI_RESPONSE] ⚠️ memory_manager.get_messages: {_mex}")
-
-        # Fallback: если memory_manager пустой (старые чаты) — грузим из chat_manager
-        if not mem_messages:
-            if chat_manager and chat_id:
-                _fb_history = chat_manager.get_chat_messages(chat_id, limit=_history_limit)
-                print(f"[GET_AI_RESPONSE] Fallback: {len(_fb_history)} сообщений из chat_manager")
-                _fb = list(_fb_history)
-                if _fb and _fb[-1][0] == "user" and _fb[-1][1] in (_user_message_raw, user_message):
-                    _fb = _fb[:-1]
-                mem_messages = [
-                    {"role": r[0], "content": r[1]}
-                    for r in _fb if r[0] in ("user", "assistant")
-                ]
-            else:
-                # Старая БД chat_memory.db не имеет chat_id — читать её НЕЛЬЗЯ,
-                # иначе любая модель получает историю ВСЕХ удалённых чатов.
-                # Намеренно возвращаем пустую историю.
-                print(f"[GET_AI_RESPONSE] ⚠️ chat_id=None — история не загружается (защита от утечки)")
-                mem_messages = []
-        else:
-            # memory_manager уже содержит текущий user_message (сохранён до вызова ИИ)
-            # Убираем последний элемент если он совпадает с текущим запросом (анти-дубль)
-            # ✅ ИСПРАВЛЕНО: сравниваем с _user_message_raw (то что реально сохранено в БД),
-            # а не с нормализованным user_message — иначе при спецсимволах антидубль не срабатывал
-            # и текущий запрос попадал в историю ДВАЖДЫ (raw + normalized).
-            if mem_messages and mem_messages[-1]["role"] == "user" and mem_messages[-1]["content"] in (_user_message_raw, user_message):
-                mem_messages = mem_messages[:-1]
+        # Сырую историю уже загрузила фоновая стадия history
+        mem_messages = pipe.wait("history")
 
         # ── Обрезка истории по токен-бюджету ─────────────────────────────────
-        # Грубая оценка: 1 токен ≈ 4 символа.
+        # Токены оцениваются token_estimator по модели и письменности
+        # (кириллица на LLaMA/Qwen заметно «дороже» 4 символов на токен).
         # Бюджет контекста модели минус системный промпт и текущий запрос.
-        # num_ctx для Qwen3 и файловых запросов может быть 8192, иначе 4096.
+        # Это бюджет истории, а не num_ctx: num_ctx потом подбирает context_sizer
+        # под фактический промпт (не больше потолка модели).
         # Qwen3:14b поддерживает до 32K — используем 16384 для длинных диалогов.
-        _ctx_window = 16384 if _mk == "qwen" else 4096
-        _sys_tokens  = len(system_prompt) // 4
-        _user_tokens = len(final_user_message) // 4
+        _ctx_window = min(16384 if _mk == "qwen" else 4096,
+                          get_context_sizer().ceiling(_ollama_model))
+        _sys_tokens  = estimate_tokens(system_prompt, _ollama_model)
+        _user_tokens = estimate_tokens(final_user_message, _ollama_model)
         _answer_budget = 800
         # Если system_prompt слишком большой и съедает весь контекст,
         # не схлопываем историю в 400 токенов — берём хотя бы последние 6 сообщений отдельно.
@@ -1509,18 +1598,26 @@ Consider information from BOTH sources: search results AND attached files."""
         else:
             _history_budget = _raw_budget
 
-        # Оставляем только последние сообщения, пока не превышен бюджет.
-        # Идём с конца (самые свежие сохраняем в первую очередь).
         _original_count = len(mem_messages)
-        _trimmed: list = []
-        _used = 0
-        for _m in reversed(mem_messages):
-            _tok = len(_m.get("content", "")) // 4
-            if _used + _tok > _history_budget:
-                break
-            _trimmed.append(_m)
-            _used += _tok
-        mem_messages = list(reversed(_trimmed))
+        if _stable_prompt and chat_id:
+            # Окно с якорем: начало истории не сдвигается на каждом ходу,
+            # иначе общий префикс с прошлым промптом обрывается на первом сообщении.
+            mem_messages = stable_history_window(
+                f"{chat_id}:{_mk}", mem_messages, _history_limit, _history_budget,
+                estimate_tokens=lambda _t: estimate_tokens(_t, _ollama_model))
+            _used = sum(estimate_tokens(_m.get("content", ""), _ollama_model) for _m in mem_messages)
+        else:
+            # Оставляем только последние сообщения, пока не превышен бюджет.
+            # Идём с конца (самые свежие сохраняем в первую очередь).
+            _trimmed: list = []
+            _used = 0
+            for _m in reversed(mem_messages):
+                _tok = estimate_tokens(_m.get("content", ""), _ollama_model)
+                if _used + _tok > _history_budget:
+                    break
+                _trimmed.append(_m)
+                _used += _tok
+            mem_messages = list(reversed(_trimmed))
         if len(mem_messages) < _original_count:
             print(f"[GET_AI_RESPONSE] ✂️ История обрезана до {len(mem_messages)} сообщений "
                   f"(~{_used} токенов из бюджета {_history_budget})")
@@ -1707,16 +1804,6 @@ Consider information from BOTH sources: search results AND attached files."""
     # моделей .get() давал фолбэк get_current_ollama_model() (LLaMA).
     # Решение: явный маппинг всех ключей в точное Ollama-имя модели.
     # ═══════════════════════════════════════════════════════════════
-    def _resolve_ollama_model_name(mk: str) -> str:
-        if mk == "mistral":
-            return MISTRAL_MODEL_NAME
-        if mk == "qwen":
-            return QWEN_MODEL_NAME
-        entry = SUPPORTED_MODELS.get(mk)
-        if entry:
-            return entry[0]
-        return OLLAMA_MODEL
-
     # ═══════════════════════════════════════════════════════════════
     # DEEPSEEK: параметры Ollama для надёжной работы с историей диалога
     #
@@ -1724,34 +1811,26 @@ Consider information from BOTH sources: search results AND attached files."""
     # Это КРИТИЧЕСКИ МАЛО: системный промпт + 3-4 сообщения истории
     # уже не влезают → модель "забывает" предыдущие реплики и начинает
     # галлюцинировать (отвечать мусором или говорить что она GPT-4).
-    # Решение: явно задаём num_ctx=4096 для обеих DeepSeek-моделей.
+    # num_ctx здесь НЕ задаётся: его выбирает context_sizer (через
+    # get_residency_manager().prepare) по реальному размеру промпта,
+    # с «липкими» корзинами, чтобы Ollama не перезагружала модель.
     #
     # deepseek-r1: temperature=0.6 рекомендована командой DeepSeek.
     # ═══════════════════════════════════════════════════════════════
     _extra_options: dict = {}
     if _mk == "deepseek":
         _extra_options = {
-            "num_ctx": 4096,        # Хватит для системного промпта + ~15 реплик истории
             "temperature": 0.7,
             "repeat_penalty": 1.1,
         }
-        if _is_file_request:
-            _extra_options["num_ctx"] = 8192
         print(f"[GET_AI_RESPONSE] [DeepSeek 7b] Опции: {_extra_options}")
     elif _mk == "deepseek-r1":
         _extra_options = {
-            "num_ctx": 4096,          # Меньше контекст — быстрее KV-cache
             "temperature": 0.6,       # Рекомендовано DeepSeek для R1-distilled
             "repeat_penalty": 1.05,   # Минимальный — не тормозит сэмплинг
         }
-        if _is_file_request:
-            # Файловый запрос: нужен полный контекст чтобы не обрезать содержимое
-            _extra_options["num_ctx"] = 8192
-            _extra_options["temperature"] = 0.6
-            print(f"[GET_AI_RESPONSE] [R1] Файловый режим: num_ctx=8192")
-        elif ai_mode == AI_MODE_FAST:
-            # Быстрый режим без файла: агрессивно ограничиваем для скорости
-            _extra_options["num_ctx"] = 2048
+        if not _is_file_request and ai_mode == AI_MODE_FAST:
+            # Быстрый режим без файла: более собранные ответы
             _extra_options["temperature"] = 0.4
         print(f"[GET_AI_RESPONSE] [R1] Применены R1-опции: {_extra_options}")
 
@@ -1762,8 +1841,6 @@ Consider information from BOTH sources: search results AND attached files."""
         # РЕШЕНИЕ: всегда think=False + /no_think токен в user-сообщении.
         if _mk == "qwen" and not _extra_options:
             _extra_options = {
-                # 16384 токенов контекста — хватит для длинных диалогов с историей
-                "num_ctx": 16384 if _is_file_request else 16384,
                 "temperature": 0.7,
                 "repeat_penalty": 1.1,
                 "think": False,   # Всегда отключаем — thinking ломает content
@@ -1771,17 +1848,18 @@ Consider information from BOTH sources: search results AND attached files."""
             print(f"[GET_AI_RESPONSE] [QWEN] Опции: {_extra_options} (think=False, принудительно)")
 
         # Для всех остальных моделей без явных _extra_options (LLaMA, Mistral)
-        # задаём num_ctx=4096 и repeat_penalty чтобы модели не зацикливались.
-        # Дефолт Ollama = 2048 — этого не хватает при длинных разговорах.
+        # задаём repeat_penalty чтобы модели не зацикливались.
         if not _extra_options:
             _extra_options = {
-                "num_ctx": 4096,
                 "temperature": 0.7,
                 "repeat_penalty": 1.1,
             }
-            if _is_file_request:
-                _extra_options["num_ctx"] = 8192
             print(f"[GET_AI_RESPONSE] [{_mk.upper()}] Опции: {_extra_options}")
+
+    def _stage_generate() -> str:
+        if not USE_OLLAMA:
+            return ""
+        response_text = ""
         _resolved_name = _resolve_ollama_model_name(_mk)
         print(f"[GET_AI_RESPONSE] Использую Ollama → модель: {_resolved_name} (ключ: {_mk})")
         try:
@@ -1815,7 +1893,6 @@ Consider information from BOTH sources: search results AND attached files."""
                     _retry_messages = [{"role": "system", "content": _retry_system}] + _retry_messages
                     _retry_opts = {
                         "num_predict": max_tokens,
-                        "num_ctx": 4096,
                         "temperature": 0.9,
                         "repeat_penalty": 1.05,
                     }
@@ -1870,236 +1947,280 @@ Consider information from BOTH sources: search results AND attached files."""
         except Exception as e:
             print(f"[GET_AI_RESPONSE] Исключение при вызове Ollama: {e}")
             response_text = f"❌ Ошибка подключения к LLaMA: {e}"
-    
-    # ══════════════════════════════════════════════════════════
-    # ШАГ 4 ПАЙПЛАЙНА: Валидация ответа и перегенерация при необходимости
-    # ══════════════════════════════════════════════════════════
-    # Валидация запускается только при поиске И только для содержательных вопросов.
-    # Короткие запросы (< 20 символов) или простые ответы (< 30 символов) пропускаем —
-    # они не требуют развёрнутой проверки и перегенерация только вредит.
-    _skip_validation = (
-        len(user_message.strip()) < 20         # слишком короткий вопрос
-        or len(response_text.strip()) < 30     # слишком короткий ответ (например "Да" / "Нет")
-    )
-    if use_search and response_text and not response_text.startswith("❌") and not _skip_validation:
-        facts_for_validation = locals().get("facts", "")
-        validation = validate_answer(response_text, user_message, detected_language, facts_for_validation)
+        return response_text
+
+    response_text = pipe.run("generate", _stage_generate, default="")
+
+    def _stage_validate(response_text: str) -> str:
+        # ══════════════════════════════════════════════════════════
+        # ШАГ 4 ПАЙПЛАЙНА: Валидация ответа и перегенерация при необходимости
+        # ══════════════════════════════════════════════════════════
+        # Валидация запускается только при поиске И только для содержательных вопросов.
+        # Короткие запросы (< 20 символов) или простые ответы (< 30 символов) пропускаем —
+        # они не требуют развёрнутой проверки и перегенерация только вредит.
+        _skip_validation = (
+            len(user_message.strip()) < 20         # слишком короткий вопрос
+            or len(response_text.strip()) < 30     # слишком короткий ответ (например "Да" / "Нет")
+        )
+        if use_search and response_text and not response_text.startswith("❌") and not _skip_validation and not is_cancelled():
+            facts_for_validation = facts
+            validation = validate_answer(response_text, user_message, detected_language, facts_for_validation)
         
-        if not validation["valid"]:
-            print(f"[GET_AI_RESPONSE] 🔄 Ответ не прошёл валидацию, перегенерирую...")
-            try:
-                regen_prompt = build_final_answer_prompt(
-                    user_message, facts_for_validation,
-                    detect_question_parts(user_message),
-                    detected_language, validation["issues"]
-                )
-                regen_messages = [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": regen_prompt}
-                ]
-                regen_resp = call_ollama_chat(regen_messages, max_tokens=max_tokens, timeout=timeout, model_key=_mk)
-                if regen_resp and not regen_resp.startswith("[Ollama"):
-                    print(f"[GET_AI_RESPONSE] ✓ Перегенерация успешна. Длина: {len(regen_resp)}")
-                    response_text = regen_resp
+            if not validation["valid"]:
+                print(f"[GET_AI_RESPONSE] 🔄 Ответ не прошёл валидацию, перегенерирую...")
+                try:
+                    regen_prompt = build_final_answer_prompt(
+                        user_message, facts_for_validation,
+                        detect_question_parts(user_message),
+                        detected_language, validation["issues"]
+                    )
+                    regen_messages = [
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": regen_prompt}
+                    ]
+                    # Перегенерация стримится в тот же пузырь: UI очищает его
+                    # (on_stream_reset) и показывает новые токены по мере генерации.
+                    _regen_model = _resolve_ollama_model_name(_mk)
+                    _regen_payload = {
+                        "model": _regen_model,
+                        "messages": regen_messages,
+                        "options": dict(_extra_options, num_predict=max_tokens),
+                    }
+                    _regen_streamed = []
+
+                    def _regen_call() -> str:
+                        _regen_streamed.append(True)
+                        if callable(on_stream_reset):
+                            on_stream_reset()
+                        return _ollama_stream(_regen_payload, timeout, on_chunk, cancelled_flag,
+                                              stage=STAGE_VALIDATE_REGEN)
+
+                    regen_resp = get_llm_cache().get_or_compute(
+                        f"chat:{STAGE_VALIDATE_REGEN}", _regen_model, regen_messages,
+                        _regen_payload["options"], _regen_call, ttl=3600,
+                        accept=lambda r: bool(r) and not r.startswith("[Ollama"))
+                    if regen_resp and not _regen_streamed and not regen_resp.startswith("[Ollama"):
+                        # Из кэша — показываем целиком вместо первого ответа
+                        if callable(on_stream_reset):
+                            on_stream_reset()
+                        if on_chunk:
+                            on_chunk(regen_resp)
+                    if regen_resp and not regen_resp.startswith("[Ollama"):
+                        print(f"[GET_AI_RESPONSE] ✓ Перегенерация успешна. Длина: {len(regen_resp)}")
+                        response_text = regen_resp
+                    else:
+                        print(f"[GET_AI_RESPONSE] ⚠️ Перегенерация не удалась, оставляю первый ответ")
+                except Exception as e:
+                    print(f"[GET_AI_RESPONSE] ⚠️ Ошибка перегенерации: {e}")
+        return response_text
+
+    response_text = pipe.run("validate", lambda: _stage_validate(response_text),
+                             skip=not use_search, default=response_text)
+
+    def _stage_translate(response_text: str) -> str:
+        # КРИТИЧЕСКАЯ ПРОВЕРКА: если вопрос на русском, но ответ содержит много английского - переводим
+        # НЕ переводим если субтекст явно задал другой язык (English, Polski и т.д.) —
+        # иначе мы заглушаем именно тот язык, который пользователь и выбрал.
+        if detected_language == "russian" and not _subtext_overrides_lang:
+            # Проверяем, есть ли в ответе много английского
+            response_lang = detect_message_language(response_text)
+            if response_lang == "english":
+                print(f"[GET_AI_RESPONSE] ⚠️⚠️⚠️ КРИТИЧНО! Ответ ПОЛНОСТЬЮ на английском! Переводим...")
+                try:
+                    response_text = translate_to_russian(response_text)
+                    print(f"[GET_AI_RESPONSE] ✓ Перевод завершён успешно")
+                except Exception as e:
+                    print(f"[GET_AI_RESPONSE] ✗ Ошибка перевода: {e}")
+        return response_text
+
+    response_text = pipe.run("translate", lambda: _stage_translate(response_text),
+                             default=response_text)
+
+    def _stage_sanitize(response_text) -> str:
+        # ═══════════════════════════════════════════════════════════════
+        # DEEPSEEK: очистка LaTeX-разметки из ответа
+        # DeepSeek иногда генерирует \frac{}{}, \sqrt{}, $...$, что
+        # не рендерится и выглядит как мусор. Заменяем на читаемый текст.
+        # ═══════════════════════════════════════════════════════════════
+        # ═══════════════════════════════════════════════════════════════
+        # DEEPSEEK R1: очистка блоков <think>...</think>
+        # R1 генерирует внутренние рассуждения — они замедляют генерацию
+        # и засоряют вывод. Всегда вырезаем их из финального ответа.
+        # В режиме БЫСТРЫЙ (fast) — полностью убираем весь think-блок.
+        # В режиме ДУМАЮЩИЙ/ПРО — убираем теги, но оставляем содержимое
+        # в виде свёрнутого спойлера-заголовка для продвинутых пользователей.
+        # ═══════════════════════════════════════════════════════════════
+        # Защита от NoneType в постпроцессинге
+        if not isinstance(response_text, str):
+            response_text = str(response_text) if response_text is not None else ""
+
+        if _mk == "deepseek-r1" and response_text and not response_text.startswith("❌"):
+            import re as _re_r1
+            _think_pattern = _re_r1.compile(r'<think>(.*?)</think>', _re_r1.DOTALL | _re_r1.IGNORECASE)
+            _think_match = _think_pattern.search(response_text)
+            if _think_match:
+                if ai_mode == AI_MODE_FAST:
+                    # Быстрый режим: think-блок полностью удаляем — экономим время
+                    response_text = _think_pattern.sub('', response_text).strip()
+                    print(f"[GET_AI_RESPONSE] [R1] 🧹 Think-блок удалён (режим: быстрый)")
                 else:
-                    print(f"[GET_AI_RESPONSE] ⚠️ Перегенерация не удалась, оставляю первый ответ")
-            except Exception as e:
-                print(f"[GET_AI_RESPONSE] ⚠️ Ошибка перегенерации: {e}")
-
-    # КРИТИЧЕСКАЯ ПРОВЕРКА: если вопрос на русском, но ответ содержит много английского - переводим
-    # НЕ переводим если субтекст явно задал другой язык (English, Polski и т.д.) —
-    # иначе мы заглушаем именно тот язык, который пользователь и выбрал.
-    if detected_language == "russian" and not _subtext_overrides_lang:
-        # Проверяем, есть ли в ответе много английского
-        response_lang = detect_message_language(response_text)
-        if response_lang == "english":
-            print(f"[GET_AI_RESPONSE] ⚠️⚠️⚠️ КРИТИЧНО! Ответ ПОЛНОСТЬЮ на английском! Переводим...")
-            try:
-                response_text = translate_to_russian(response_text)
-                print(f"[GET_AI_RESPONSE] ✓ Перевод завершён успешно")
-            except Exception as e:
-                print(f"[GET_AI_RESPONSE] ✗ Ошибка перевода: {e}")
-    
-    # ═══════════════════════════════════════════════════════════════
-    # DEEPSEEK: очистка LaTeX-разметки из ответа
-    # DeepSeek иногда генерирует \frac{}{}, \sqrt{}, $...$, что
-    # не рендерится и выглядит как мусор. Заменяем на читаемый текст.
-    # ═══════════════════════════════════════════════════════════════
-    # ═══════════════════════════════════════════════════════════════
-    # DEEPSEEK R1: очистка блоков <think>...</think>
-    # R1 генерирует внутренние рассуждения — они замедляют генерацию
-    # и засоряют вывод. Всегда вырезаем их из финального ответа.
-    # В режиме БЫСТРЫЙ (fast) — полностью убираем весь think-блок.
-    # В режиме ДУМАЮЩИЙ/ПРО — убираем теги, но оставляем содержимое
-    # в виде свёрнутого спойлера-заголовка для продвинутых пользователей.
-    # ═══════════════════════════════════════════════════════════════
-    # Защита от NoneType в постпроцессинге
-    if not isinstance(response_text, str):
-        response_text = str(response_text) if response_text is not None else ""
-
-    if _mk == "deepseek-r1" and response_text and not response_text.startswith("❌"):
-        import re as _re_r1
-        _think_pattern = _re_r1.compile(r'<think>(.*?)</think>', _re_r1.DOTALL | _re_r1.IGNORECASE)
-        _think_match = _think_pattern.search(response_text)
-        if _think_match:
-            if ai_mode == AI_MODE_FAST:
-                # Быстрый режим: think-блок полностью удаляем — экономим время
-                response_text = _think_pattern.sub('', response_text).strip()
-                print(f"[GET_AI_RESPONSE] [R1] 🧹 Think-блок удалён (режим: быстрый)")
-            else:
-                # Думающий/Про: убираем теги, think-содержимое скрываем в сворачиваемый блок
-                _thinking_content = _think_match.group(1).strip()
-                response_text = _think_pattern.sub('', response_text).strip()
-                if _thinking_content:
-                    _thinking_summary = _thinking_content[:120].replace('\n', ' ').strip()
-                    if len(_thinking_content) > 120:
-                        _thinking_summary += '...'
-                    response_text = f"💭 *Рассуждение:* _{_thinking_summary}_\n\n" + response_text
-                print(f"[GET_AI_RESPONSE] [R1] 🧠 Think-блок свёрнут (режим: {ai_mode})")
-        # Убираем незакрытые <think> без закрывающего тега (прерванная генерация)
-        response_text = _re_r1.sub(r'<think>.*', '', response_text, flags=_re_r1.DOTALL).strip()
-
-    # ── Универсальный fallback для файлов (все модели) ──────────────────────────
-    # Если был запрос на файл, но в ответе нет тегов [FILE:..][/FILE] — оборачиваем.
-    if (_is_file_creation_request or _needs_file_gen_prompt) and _file_injection and response_text and not response_text.startswith("❌"):
-        import re as _re_univ
-        _has_file_tag = _re_univ.search(r'\[FILE:[\w\-_.() ]+\]', response_text, _re_univ.IGNORECASE)
-        if not _has_file_tag:
-            _fb_match2 = _re_univ.search(
-                r'\[FILE:([\w\-_.() ]+\.(?:txt|json|csv|md|xml|yaml|yml|html|py|log|sql|ini|cfg|toml))\]',
-                _file_injection, _re_univ.IGNORECASE
-            )
-            if _fb_match2:
-                _fb_name2 = _fb_match2.group(1)
-                _clean_resp2 = _re_univ.sub(
-                    r'^(вот\s+файл[:\s!]*|here.*?file[:\s!]*|конечно[!\s]*|создаю\s+файл[:\s]*|готово[!\s]*|сделано[!\s]*|пожалуйста[!\s]*)',
-                    '', response_text.strip(), flags=_re_univ.IGNORECASE | _re_univ.MULTILINE
-                ).strip()
-                if _clean_resp2:
-                    response_text = (f"Вот файл!\n"
-                                     f"[FILE:{_fb_name2}]\n"
-                                     f"{_clean_resp2}\n"
-                                     "[/FILE]")
-                    print(f"[GET_AI_RESPONSE] 📄 Universal fallback: обернули в [FILE:{_fb_name2}] ({_mk})")
-
-    if _mk in ("deepseek", "deepseek-r1") and response_text and not response_text.startswith("❌"):
-        # Постобработка файловых ответов (убираем дубли, мусорные заголовки)
-        response_text = sanitize_deepseek_file_response(response_text)
-
-        # ── Fallback: модель написала содержимое без тегов [FILE:...][/FILE] ──
-        # Если был запрос на создание файла, но в ответе нет тегов FILE —
-        # пробуем обернуть весь ответ в правильный тег.
-        if _is_file_creation_request and _file_injection:
-            import re as _re_fb
-            _has_tag = _re_fb.search(r'\[FILE:', response_text, _re_fb.IGNORECASE)
-            if not _has_tag:
-                # Угадываем имя файла из инжекции
-                _fb_match = _re_fb.search(
+                    # Думающий/Про: убираем теги, think-содержимое скрываем в сворачиваемый блок
+                    _thinking_content = _think_match.group(1).strip()
+                    response_text = _think_pattern.sub('', response_text).strip()
+                    if _thinking_content:
+                        _thinking_summary = _thinking_content[:120].replace('\n', ' ').strip()
+                        if len(_thinking_content) > 120:
+                            _thinking_summary += '...'
+                        response_text = f"💭 *Рассуждение:* _{_thinking_summary}_\n\n" + response_text
+                    print(f"[GET_AI_RESPONSE] [R1] 🧠 Think-блок свёрнут (режим: {ai_mode})")
+            # Убираем незакрытые <think> без закрывающего тега (прерванная генерация)
+            response_text = _re_r1.sub(r'<think>.*', '', response_text, flags=_re_r1.DOTALL).strip()
+
+        # ── Универсальный fallback для файлов (все модели) ──────────────────────────
+        # Если был запрос на файл, но в ответе нет тегов [FILE:..][/FILE] — оборачиваем.
+        if (_is_file_creation_request or _needs_file_gen_prompt) and _file_injection and response_text and not response_text.startswith("❌"):
+            import re as _re_univ
+            _has_file_tag = _re_univ.search(r'\[FILE:[\w\-_.() ]+\]', response_text, _re_univ.IGNORECASE)
+            if not _has_file_tag:
+                _fb_match2 = _re_univ.search(
                     r'\[FILE:([\w\-_.() ]+\.(?:txt|json|csv|md|xml|yaml|yml|html|py|log|sql|ini|cfg|toml))\]',
-                    _file_injection, _re_fb.IGNORECASE
+                    _file_injection, _re_univ.IGNORECASE
                 )
-                if _fb_match:
-                    _fb_name = _fb_match.group(1)
-                    # Убираем вводные фразы типа "Вот файл:", "Конечно!", "Создаю файл:" и пустые строки в начале
-                    _clean_resp = _re_fb.sub(
-                        r'^(вот\s+файл[:\s!]*|конечно[!\s]*|создаю\s+файл[:\s]*|готово[!\s]*|пожалуйста[!\s]*)',
-                        '', response_text.strip(), flags=_re_fb.IGNORECASE
+                if _fb_match2:
+                    _fb_name2 = _fb_match2.group(1)
+                    _clean_resp2 = _re_univ.sub(
+                        r'^(вот\s+файл[:\s!]*|here.*?file[:\s!]*|конечно[!\s]*|создаю\s+файл[:\s]*|готово[!\s]*|сделано[!\s]*|пожалуйста[!\s]*)',
+                        '', response_text.strip(), flags=_re_univ.IGNORECASE | _re_univ.MULTILINE
                     ).strip()
-                    if _clean_resp:
-                        response_text = ("Вот файл!\n"
-                                         f"[FILE:{_fb_name}]\n"
-                                         f"{_clean_resp}\n"
+                    if _clean_resp2:
+                        response_text = (f"Вот файл!\n"
+                                         f"[FILE:{_fb_name2}]\n"
+                                         f"{_clean_resp2}\n"
                                          "[/FILE]")
-                        print(f"[GET_AI_RESPONSE] 📄 Fallback: обернули ответ в [FILE:{_fb_name}]")
-        # ШАГ 1: Проверяем на мусор (scss-блоки, выдуманные формулы и т.п.)
-        # Расширено: проверяем мусор даже если is_math_problem=False, но в запросе есть арифметика
-        _should_check_garbage = is_math_problem
-        if not _should_check_garbage and re.search(r'\d+\s*[\+\-\*\/\%\^]\s*\d+', user_message):
-            _should_check_garbage = True
-        if _should_check_garbage and is_garbage_math_response(response_text):
-            print(f"[GET_AI_RESPONSE] [DeepSeek] ⚠️ Обнаружен мусорный мат. ответ — заменяю!")
-            response_text = sanitize_deepseek_math(response_text, user_message, detected_language)
-        # ШАГ 2: Очищаем LaTeX из оставшегося ответа
-        response_text = clean_deepseek_latex(response_text)
-        print(f"[GET_AI_RESPONSE] [DeepSeek] LaTeX-разметка очищена")
+                        print(f"[GET_AI_RESPONSE] 📄 Universal fallback: обернули в [FILE:{_fb_name2}] ({_mk})")
+
+        if _mk in ("deepseek", "deepseek-r1") and response_text and not response_text.startswith("❌"):
+            # Постобработка файловых ответов (убираем дубли, мусорные заголовки)
+            response_text = sanitize_deepseek_file_response(response_text)
+
+            # ── Fallback: модель написала содержимое без тегов [FILE:...][/FILE] ──
+            # Если был запрос на создание файла, но в ответе нет тегов FILE —
+            # пробуем обернуть весь ответ в правильный тег.
+            if _is_file_creation_request and _file_injection:
+                import re as _re_fb
+                _has_tag = _re_fb.search(r'\[FILE:', response_text, _re_fb.IGNORECASE)
+                if not _has_tag:
+                    # Угадываем имя файла из инжекции
+                    _fb_match = _re_fb.search(
+                        r'\[FILE:([\w\-_.() ]+\.(?:txt|json|csv|md|xml|yaml|yml|html|py|log|sql|ini|cfg|toml))\]',
+                        _file_injection, _re_fb.IGNORECASE
+                    )
+                    if _fb_match:
+                        _fb_name = _fb_match.group(1)
+                        # Убираем вводные фразы типа "Вот файл:", "Конечно!", "Создаю файл:" и пустые строки в начале
+                        _clean_resp = _re_fb.sub(
+                            r'^(вот\s+файл[:\s!]*|конечно[!\s]*|создаю\s+файл[:\s]*|готово[!\s]*|пожалуйста[!\s]*)',
+                            '', response_text.strip(), flags=_re_fb.IGNORECASE
+                        ).strip()
+                        if _clean_resp:
+                            response_text = ("Вот файл!\n"
+                                             f"[FILE:{_fb_name}]\n"
+                                             f"{_clean_resp}\n"
+                                             "[/FILE]")
+                            print(f"[GET_AI_RESPONSE] 📄 Fallback: обернули ответ в [FILE:{_fb_name}]")
+            # ШАГ 1: Проверяем на мусор (scss-блоки, выдуманные формулы и т.п.)
+            # Расширено: проверяем мусор даже если is_math_problem=False, но в запросе есть арифметика
+            _should_check_garbage = is_math_problem
+            if not _should_check_garbage and re.search(r'\d+\s*[\+\-\*\/\%\^]\s*\d+', user_message):
+                _should_check_garbage = True
+            if _should_check_garbage and is_garbage_math_response(response_text):
+                print(f"[GET_AI_RESPONSE] [DeepSeek] ⚠️ Обнаружен мусорный мат. ответ — заменяю!")
+                response_text = sanitize_deepseek_math(response_text, user_message, detected_language)
+            # ШАГ 2: Очищаем LaTeX из оставшегося ответа
+            response_text = clean_deepseek_latex(response_text)
+            print(f"[GET_AI_RESPONSE] [DeepSeek] LaTeX-разметка очищена")
     
-    # ═══════════════════════════════════════════════════════════════
-    # ФИЛЬТРАЦИЯ CJK + АНГЛИЙСКИХ СЛОВ
-    # ═══════════════════════════════════════════════════════════════
-    # Постобработка ответа Mistral — убираем артефакты токенизатора
-    if _mk == "mistral" and response_text and not response_text.startswith("❌"):
-        response_text = clean_mistral_response(response_text)
-        print(f"[GET_AI_RESPONSE] [Mistral] Постобработка применена")
-    if _mk == "qwen" and response_text and not response_text.startswith("❌"):
-        response_text = clean_qwen_response(response_text)
-        import re as _re_qw
-
-        # 1. Удаляем <think>...</think> блоки
-        _qw_think = _re_qw.compile(r'<think>(.*?)</think>', _re_qw.DOTALL | _re_qw.IGNORECASE)
-        if _qw_think.search(response_text):
-            _qw_thinking_text = "\n".join(_re_qw.findall(r'<think>(.*?)</think>', response_text, _re_qw.DOTALL))
-            response_text = _qw_think.sub('', response_text).strip()
-            if not response_text and _qw_thinking_text:
-                response_text = _qw_thinking_text.strip()
-            print(f"[GET_AI_RESPONSE] [QWEN] <think>-блоки очищены из ответа")
-
-        # 2. Удаляем незакрытые <think> и одиночные </think>
-        response_text = _re_qw.sub(r'<think>.*', '', response_text, flags=_re_qw.DOTALL).strip()
-        response_text = _re_qw.sub(r'</think>', '', response_text).strip()
-
-        # 3. ДЕТЕКТОР УТЕЧКИ МЫШЛЕНИЯ (без тегов):
-        # Qwen3 иногда сливает внутренний монолог прямо в content без <think> тегов.
-        # Признаки: начинается с фраз типа "Хорошо, пользователь...", "Нужно убедиться...",
-        # "Итак, мне нужно...", "Думаю, что..." и длиннее 200 символов без реального ответа.
-        _leaked_thinking_patterns = [
-            r'^(Нужно убедиться)',
-            r'^(Давайте подумаем)',
-            r'^(Пользователь просит)',
-            r'^(Пользователь попросил)',
-            r'^(Давайте разберём)',
-            r'^(Мне нужно (подумать|проанализировать|разобрать))',
-            r'^(Я должен (подумать|проанализировать))',
-            r'^(Let me think)',
-            r'^(Okay[,.]? (so|let me|I need))',
-        ]
-        _is_leaked = any(_re_qw.match(p, response_text) for p in _leaked_thinking_patterns)
-        if _is_leaked and len(response_text) > 200:
-            print(f"[GET_AI_RESPONSE] [QWEN] ⚠️ Обнаружена утечка мышления — пробуем извлечь ответ")
-            # Берём последний непустой абзац — обычно там финальный ответ
-            _paragraphs = [p.strip() for p in response_text.split('\n\n') if p.strip()]
-            if len(_paragraphs) > 1:
-                # Ищем первый абзац который НЕ похож на монолог
-                _real_answer = None
-                for _para in reversed(_paragraphs):
-                    _is_mono = any(_re_qw.match(p, _para) for p in _leaked_thinking_patterns)
-                    if not _is_mono and len(_para) > 20:
-                        _real_answer = _para
-                        break
-                if _real_answer:
-                    response_text = _real_answer
-                    print(f"[GET_AI_RESPONSE] [QWEN] ✓ Извлечён финальный ответ из монолога")
-
-        print(f"[GET_AI_RESPONSE] [Qwen] Постобработка применена")
-
-    # CJK (китайский/японский/корейский) фильтруем ВСЕГДА для deepseek
-    if _mk in ("deepseek", "deepseek-r1") and response_text:
-        import re as _re_cjk_check
-        _cjk = _re_cjk_check.compile(
-            '[\u4e00-\u9fff\u3400-\u4dbf\uf900-\ufaff'
-            '\u3000-\u303f\u30a0-\u30ff\u3040-\u309f\uac00-\ud7af]+'
-        )
-        if _cjk.search(response_text):
-            response_text = _cjk.sub('', response_text)
-            response_text = re.sub(r'  +', ' ', response_text).strip()
-            print("[GET_AI_RESPONSE] [DeepSeek] ⚠️ CJK-символы удалены из ответа")
-            print(f"[GET_AI_RESPONSE] [DeepSeek] ⚠️ CJK-символы удалены из ответа")
-    # Используем расширенный словарь из forbidden_english_words.py
-    # Фильтр отключён для Mistral — он уже настроен на русский язык через промпт.
-    # Фильтр также отключён когда субтекст явно задал нерусский язык ответа —
-    # иначе мы вырезаем нужные слова из английского/польского/etc. ответа.
-    if detected_language == "russian" and not _subtext_overrides_lang and _mk not in ("mistral", "mistral-nemo", MISTRAL_MODEL_NAME, "qwen", QWEN_MODEL_NAME):
-        print(f"[GET_AI_RESPONSE] Фильтрация английских слов...")
-        response_text = remove_english_words_from_russian(response_text)
+        # ═══════════════════════════════════════════════════════════════
+        # ФИЛЬТРАЦИЯ CJK + АНГЛИЙСКИХ СЛОВ
+        # ═══════════════════════════════════════════════════════════════
+        # Постобработка ответа Mistral — убираем артефакты токенизатора
+        if _mk == "mistral" and response_text and not response_text.startswith("❌"):
+            response_text = clean_mistral_response(response_text)
+            print(f"[GET_AI_RESPONSE] [Mistral] Постобработка применена")
+        if _mk == "qwen" and response_text and not response_text.startswith("❌"):
+            response_text = clean_qwen_response(response_text)
+            import re as _re_qw
+
+            # 1. Удаляем <think>...</think> блоки
+            _qw_think = _re_qw.compile(r'<think>(.*?)</think>', _re_qw.DOTALL | _re_qw.IGNORECASE)
+            if _qw_think.search(response_text):
+                _qw_thinking_text = "\n".join(_re_qw.findall(r'<think>(.*?)</think>', response_text, _re_qw.DOTALL))
+                response_text = _qw_think.sub('', response_text).strip()
+                if not response_text and _qw_thinking_text:
+                    response_text = _qw_thinking_text.strip()
+                print(f"[GET_AI_RESPONSE] [QWEN] <think>-блоки очищены из ответа")
+
+            # 2. Удаляем незакрытые <think> и одиночные </think>
+            response_text = _re_qw.sub(r'<think>.*', '', response_text, flags=_re_qw.DOTALL).strip()
+            response_text = _re_qw.sub(r'</think>', '', response_text).strip()
+
+            # 3. ДЕТЕКТОР УТЕЧКИ МЫШЛЕНИЯ (без тегов):
+            # Qwen3 иногда сливает внутренний монолог прямо в content без <think> тегов.
+            # Признаки: начинается с фраз типа "Хорошо, пользователь...", "Нужно убедиться...",
+            # "Итак, мне нужно...", "Думаю, что..." и длиннее 200 символов без реального ответа.
+            _leaked_thinking_patterns = [
+                r'^(Нужно убедиться)',
+                r'^(Давайте подумаем)',
+                r'^(Пользователь просит)',
+                r'^(Пользователь попросил)',
+                r'^(Давайте разберём)',
+                r'^(Мне нужно (подумать|проанализировать|разобрать))',
+                r'^(Я должен (подумать|проанализировать))',
+                r'^(Let me think)',
+                r'^(Okay[,.]? (so|let me|I need))',
+            ]
+            _is_leaked = any(_re_qw.match(p, response_text) for p in _leaked_thinking_patterns)
+            if _is_leaked and len(response_text) > 200:
+                print(f"[GET_AI_RESPONSE] [QWEN] ⚠️ Обнаружена утечка мышления — пробуем извлечь ответ")
+                # Берём последний непустой абзац — обычно там финальный ответ
+                _paragraphs = [p.strip() for p in response_text.split('\n\n') if p.strip()]
+                if len(_paragraphs) > 1:
+                    # Ищем первый абзац который НЕ похож на монолог
+                    _real_answer = None
+                    for _para in reversed(_paragraphs):
+                        _is_mono = any(_re_qw.match(p, _para) for p in _leaked_thinking_patterns)
+                        if not _is_mono and len(_para) > 20:
+                            _real_answer = _para
+                            break
+                    if _real_answer:
+                        response_text = _real_answer
+                        print(f"[GET_AI_RESPONSE] [QWEN] ✓ Извлечён финальный ответ из монолога")
+
+            print(f"[GET_AI_RESPONSE] [Qwen] Постобработка применена")
+
+        # CJK (китайский/японский/корейский) фильтруем ВСЕГДА для deepseek
+        if _mk in ("deepseek", "deepseek-r1") and response_text:
+            import re as _re_cjk_check
+            _cjk = _re_cjk_check.compile(
+                '[\u4e00-\u9fff\u3400-\u4dbf\uf900-\ufaff'
+                '\u3000-\u303f\u30a0-\u30ff\u3040-\u309f\uac00-\ud7af]+'
+            )
+            if _cjk.search(response_text):
+                response_text = _cjk.sub('', response_text)
+                response_text = re.sub(r'  +', ' ', response_text).strip()
+                print("[GET_AI_RESPONSE] [DeepSeek] ⚠️ CJK-символы удалены из ответа")
+                print(f"[GET_AI_RESPONSE] [DeepSeek] ⚠️ CJK-символы удалены из ответа")
+        # Используем расширенный словарь из forbidden_english_words.py
+        # Фильтр отключён для Mistral — он уже настроен на русский язык через промпт.
+        # Фильтр также отключён когда субтекст явно задал нерусский язык ответа —
+        # иначе мы вырезаем нужные слова из английского/польского/etc. ответа.
+        if detected_language == "russian" and not _subtext_overrides_lang and _mk not in ("mistral", "mistral-nemo", MISTRAL_MODEL_NAME, "qwen", QWEN_MODEL_NAME):
+            print(f"[GET_AI_RESPONSE] Фильтрация английских слов...")
+            response_text = remove_english_words_from_russian(response_text)
+        return response_text
+
+    response_text = pipe.run("sanitize", lambda: _stage_sanitize(response_text),
+                             default=response_text)
     
     # ИСПРАВЛЕНО: НЕ сохраняем полный контекст поиска, чтобы избежать дублирования
     # Сохраняем только метаданные о том, что поиск был выполнен
@@ -2119,6 +2240,7 @@ Consider information from BOTH sources: search results AND attached files."""
     # Финальный перехватчик: удаляет эхо промпта, зацикливание, цензурные отказы.
     response_text = _sanitize_final_response(response_text, system_prompt)
 
+    pipe.report()
     return response_text, found_sources
 
 # -------------------------
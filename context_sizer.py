@@ -0,0 +1,180 @@
+# ═══════════════════════════════════════════════════════════════════════
+# context_sizer.py — адаптивный num_ctx с «липкими» корзинами
+#
+# Содержит:
+#   • CTX_BUCKETS          — допустимые размеры контекста
+#   • MODEL_CTX_CEILING    — потолок num_ctx по модели
+#   • ContextSizer         — выбор num_ctx по реальному промпту + гистерезис
+#   • get_context_sizer()  — общий экземпляр
+#
+# Раньше num_ctx был зашит по модели и флагу файла: Qwen — всегда 16384,
+# файлы — 8192, R1 в быстром режиме — 2048. KV-cache на 16k для диалога
+# из трёх реплик занимает RAM и время, а смена num_ctx между ходами
+# заставляет Ollama ПЕРЕЗАГРУЖАТЬ модель (другие параметры раннера).
+#
+# Здесь num_ctx = промпт (token_estimator) + num_predict + запас,
+# округлённый вверх до корзины. Уже загруженный размер держится, пока
+# промпт в него влезает; сжатие — только после SHRINK_AFTER подряд
+# «маленьких» ходов и если нужная корзина хотя бы вчетверо меньше.
+#
+# Вызывается из ModelResidencyManager.prepare() для всех запросов.
+# ═══════════════════════════════════════════════════════════════════════
+
+import threading
+
+from token_estimator import get_token_estimator
+
+CTX_BUCKETS = (2048, 4096, 8192, 16384, 32768)
+
+# Потолок по подстроке имени модели (первое совпадение), иначе DEFAULT
+MODEL_CTX_CEILING = [
+    ("qwen3", 16384),
+]
+DEFAULT_CTX_CEILING = 8192
+
+# Запас поверх оценки промпта (погрешность оценщика + шаблон чата)
+_SAFETY = 1.15
+# Токены на одно изображение для vision-моделей
+_IMAGE_TOKENS = 1024
+# Ответ, если num_predict не задан
+_DEFAULT_PREDICT = 800
+
+# Гистерезис сжатия
+SHRINK_AFTER = 4
+SHRINK_FACTOR = 4
+
+# num_ctx для прогрева модели, размер которой ещё не выбирался
+WARM_DEFAULT_CTX = 4096
+
+
+def _key(model: str) -> str:
+    """llama3 и llama3:latest — одна модель (как в model_residency)."""
+    if not model or ":" in model:
+        return model
+    return f"{model}:latest"
+
+
+class ContextSizer:
+    """Выбирает num_ctx для запроса и помнит, с каким размером загружена модель."""
+
+    def __init__(self, buckets=CTX_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._current: dict = {}        # модель → num_ctx, с которым она загружена
+        self._small_streak: dict = {}   # модель → ходов подряд с меньшей корзиной
+        self._stats = {"requests": 0, "reloads": 0, "reloads_avoided": 0}
+
+    def ceiling(self, model: str) -> int:
+        low = (model or "").lower()
+        for pattern, limit in MODEL_CTX_CEILING:
+            if pattern in low:
+                return limit
+        return DEFAULT_CTX_CEILING
+
+    def current(self, model: str):
+        """num_ctx, с которым модель загружена сейчас (None — неизвестно)."""
+        with self._lock:
+            return self._current.get(_key(model))
+
+    def warm_size(self, model: str) -> int:
+        """
+        num_ctx для прогрева: текущий размер или WARM_DEFAULT_CTX.
+        Прогрев без num_ctx загрузил бы модель с дефолтом Ollama, и первый
+        же настоящий запрос перезагрузил бы её с другим размером.
+        """
+        with self._lock:
+            size = self._current.setdefault(
+                _key(model), min(WARM_DEFAULT_CTX, self.ceiling(model)))
+        return size
+
+    def forget(self, model: str):
+        """Модель выгружена — следующий запрос выберет размер заново."""
+        with self._lock:
+            self._current.pop(_key(model), None)
+            self._small_streak.pop(_key(model), None)
+
+    def needed_tokens(self, payload: dict) -> int:
+        model = payload.get("model")
+        options = payload.get("options") or {}
+        messages = payload.get("messages") or []
+        prompt = get_token_estimator().estimate_messages(messages, model)
+        if payload.get("prompt"):
+            prompt += get_token_estimator().estimate(payload["prompt"], model)
+        prompt += _IMAGE_TOKENS * sum(len(m.get("images") or []) for m in messages)
+        predict = options.get("num_predict")
+        if not isinstance(predict, int) or predict <= 0:
+            predict = _DEFAULT_PREDICT
+        return int((prompt + predict) * _SAFETY)
+
+    def bucket_for(self, tokens: int, model: str = None) -> int:
+        limit = self.ceiling(model)
+        for b in self.buckets:
+            if b >= tokens:
+                return min(b, limit)
+        return limit
+
+    def choose(self, model: str, need: int, floor: int = 0, resident: bool = True) -> int:
+        """
+        Возвращает num_ctx для запроса с need токенами.
+        resident=False — модели нет в памяти: загрузка всё равно будет,
+        поэтому берётся точная корзина без гистерезиса.
+        """
+        target = max(self.bucket_for(need, model), min(floor or 0, self.ceiling(model)))
+        model = _key(model)
+        with self._lock:
+            self._stats["requests"] += 1
+            cur = self._current.get(model)
+            if cur is None or not resident:
+                chosen = target
+                self._small_streak[model] = 0
+            elif target > cur:
+                chosen = target
+                self._stats["reloads"] += 1
+                self._small_streak[model] = 0
+                print(f"[NUM_CTX] ⬆ {model}: {cur} → {target} (промпт ~{need} ток.), перезагрузка")
+            elif target < cur:
+                streak = self._small_streak.get(model, 0) + 1
+                if streak >= SHRINK_AFTER and target * SHRINK_FACTOR <= cur:
+                    chosen = target
+                    self._stats["reloads"] += 1
+                    self._small_streak[model] = 0
+                    print(f"[NUM_CTX] ⬇ {model}: {cur} → {target} после {streak} малых ходов")
+                else:
+                    chosen = cur
+                    self._small_streak[model] = streak
+                    self._stats["reloads_avoided"] += 1
+            else:
+                chosen = cur
+                self._small_streak[model] = 0
+            self._current[model] = chosen
+            avoided, total = self._stats["reloads_avoided"], self._stats["requests"]
+        if chosen != target:
+            print(f"[NUM_CTX] {model}: нужно ~{need} → {target}, держим {chosen} "
+                  f"(перезагрузок предотвращено: {avoided} из {total})")
+        return chosen
+
+    def apply(self, payload: dict, resident: bool = True) -> dict:
+        """
+        Проставляет options.num_ctx. Явно заданный num_ctx считается
+        нижней границей (например, повтор с упрощённым промптом).
+        """
+        model = payload.get("model")
+        if not model:
+            return payload
+        options = dict(payload.get("options") or {})
+        floor = options.get("num_ctx") if isinstance(options.get("num_ctx"), int) else 0
+        options["num_ctx"] = self.choose(model, self.needed_tokens(payload), floor, resident)
+        payload = dict(payload)
+        payload["options"] = options
+        return payload
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, current=dict(self._current))
+
+
+_SIZER = ContextSizer()
+
+
+def get_context_sizer() -> ContextSizer:
+    return _SIZER
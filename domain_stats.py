@@ -0,0 +1,263 @@
+# ═══════════════════════════════════════════════════════════════════════
+# domain_stats.py — накопленная статистика сайтов для веб-поиска
+#
+# Содержит:
+#   • DomainStats          — по каждому домену: время загрузки (p50/p90),
+#                            доля ошибок, доля страниц, прошедших фильтр
+#                            релевантности, средний балл качества;
+#                            временная блокировка сайтов, которые
+#                            раз за разом не отвечают
+#   • get_domain_stats()   — общий экземпляр
+#
+# source_quality_score и _vp_domain_score знают только статические
+# списки доменов. При этом часть сайтов в каждом поиске отвечает по 10 с
+# таймаута или 403 — и в следующем поиске мы снова ждём их. Теперь
+# fetch_page_content записывает время и исход каждой загрузки, фильтры
+# релевантности и rank_and_select_sources — результат проверки. URL в
+# deep_web_search и vp_filter упорядочиваются с учётом priority(): быстрые
+# сайты, страницы которых обычно проходят фильтры, идут первыми. После
+# BLOCK_AFTER_FAILURES неудач подряд сайт пропускается на BLOCK_BASE_SECONDS,
+# при повторных неудачах срок удваивается (до BLOCK_MAX_SECONDS). Неудача
+# сайта (FAIL_HOST) — нет соединения, таймаут, 5xx, 403 и 429; прочие 4xx
+# (FAIL_CLIENT) засчитываются, только если приходят на разные URL сайта.
+# Битая ссылка (404, 410 — FAIL_PAGE) — ошибка загрузки, но не повод
+# пропускать весь сайт.
+#
+# Хранится последние WINDOW наблюдений каждого вида — старые исходы
+# вытесняются, и сайт, который починили, быстро восстанавливается.
+# Статистика сохраняется в domain_stats.json (не чаще раза в 30 с и при
+# выходе из run.py).
+#
+# Использование:
+#   stats = get_domain_stats()
+#   if stats.is_blocked(url): ...
+#   stats.record_fetch(url, seconds, ok=True)
+#   stats.record_fetch(url, seconds, ok=False, failure=FAIL_PAGE)    # 404
+#   stats.record_relevance(url, passed)
+#   stats.record_quality(url, score)
+#   urls = stats.order(urls)            # без заблокированных, лучшие первыми
+#   stats.summary(url)                  # {"p50": …, "error_rate": …, …}
+# ═══════════════════════════════════════════════════════════════════════
+
+import os
+import json
+import time
+import threading
+
+from page_fetcher import url_host
+
+DOMAIN_STATS_FILE = "domain_stats.json"
+
+# Сколько последних наблюдений каждого вида хранить на домен
+WINDOW = 50
+# Меньше наблюдений — статистике не доверяем, priority() = 0
+MIN_SAMPLES = 3
+# Доменов в файле не больше (вытесняются давно не встречавшиеся)
+MAX_DOMAINS = 2000
+
+# Временная блокировка сайта после неудач подряд
+BLOCK_AFTER_FAILURES = 3
+BLOCK_BASE_SECONDS = 15 * 60
+BLOCK_MAX_SECONDS = 24 * 3600
+
+# Виды неудачной загрузки (record_fetch(..., failure=...))
+FAIL_HOST = "host"        # сайт не отвечает или отказывает всем: в счётчик блокировки
+FAIL_CLIENT = "client"    # прочие 4xx: в счётчик, только если URL ещё не отказывал
+FAIL_PAGE = "page"        # 404, 410 — битая ссылка: только в долю ошибок
+# Сколько последних отказавших URL (FAIL_CLIENT) помнить на домен
+_CLIENT_URLS = 10
+
+# Загрузка дольше этого (p90, сек) понижает приоритет
+SLOW_FETCH_SECONDS = 2.0
+
+_SAVE_INTERVAL = 30.0
+
+
+def _percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+class DomainStats:
+    """Статистика загрузок и качества страниц по доменам."""
+
+    def __init__(self, path: str = DOMAIN_STATS_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        # домен → {"fetch": [сек | None для ошибки], "rel": [0/1], "quality": [балл],
+        #          "fails": неудач подряд, "blocks": блокировок подряд,
+        #          "blocked_until": time.time(), "seen": time.time()}
+        self._domains: dict = {}
+        self._dirty = False
+        self._last_save = 0.0
+        self._load()
+
+    def _entry(self, url: str) -> dict:
+        domain = url_host(url)
+        entry = self._domains.get(domain)
+        if entry is None:
+            entry = self._domains[domain] = {"fetch": [], "rel": [], "quality": [],
+                                             "fails": 0, "blocks": 0, "blocked_until": 0.0}
+        entry["seen"] = time.time()
+        return entry
+
+    @staticmethod
+    def _push(window: list, value):
+        window.append(value)
+        del window[:-WINDOW]
+
+    # ── Запись наблюдений ────────────────────────────────────────────
+    def record_fetch(self, url: str, seconds: float, ok: bool, failure: str = FAIL_HOST):
+        """
+        Загрузка страницы по сети: время и исход (ok=False — ошибка).
+        failure — вид ошибки: FAIL_HOST идёт в счётчик неудач подряд для
+        блокировки; FAIL_CLIENT — тоже, если этот URL ещё не отказывал
+        (один битый URL, загружаемый в каждом поиске, сайт не блокирует);
+        FAIL_PAGE — только в долю ошибок.
+        """
+        with self._lock:
+            entry = self._entry(url)
+            self._push(entry["fetch"], round(seconds, 3) if ok else None)
+            client_urls = entry.setdefault("client_urls", [])
+            counts = failure == FAIL_HOST
+            if not ok and failure == FAIL_CLIENT:
+                counts = url not in client_urls
+                if counts:
+                    client_urls.append(url)
+                    del client_urls[:-_CLIENT_URLS]
+            if ok:
+                entry["fails"] = entry["blocks"] = 0
+                client_urls.clear()
+            elif counts:
+                entry["fails"] += 1
+                if entry["fails"] >= BLOCK_AFTER_FAILURES:
+                    ttl = min(BLOCK_BASE_SECONDS * 2 ** entry["blocks"], BLOCK_MAX_SECONDS)
+                    entry["blocked_until"] = time.time() + ttl
+                    entry["blocks"] += 1
+                    entry["fails"] = 0
+                    print(f"[DOMAIN_STATS] ⛔ {url_host(url)}: {BLOCK_AFTER_FAILURES} неудачи "
+                          f"подряд — пропускаю {ttl // 60:.0f} мин")
+            self._dirty = True
+        self._maybe_save()
+
+    def record_relevance(self, url: str, passed: bool):
+        with self._lock:
+            self._push(self._entry(url)["rel"], 1 if passed else 0)
+            self._dirty = True
+        self._maybe_save()
+
+    def record_quality(self, url: str, score: float):
+        with self._lock:
+            self._push(self._entry(url)["quality"], round(score, 1))
+            self._dirty = True
+        self._maybe_save()
+
+    # ── Использование ────────────────────────────────────────────────
+    def is_blocked(self, url: str) -> bool:
+        with self._lock:
+            entry = self._domains.get(url_host(url))
+            return entry is not None and entry["blocked_until"] > time.time()
+
+    def summary(self, url: str) -> dict:
+        """
+        p50/p90 загрузки (сек), доля ошибок, число проверок релевантности и
+        доля прошедших, средний балл качества; {} — домен не встречался.
+        """
+        with self._lock:
+            entry = self._domains.get(url_host(url))
+            if entry is None:
+                return {}
+            fetch, rel, quality = list(entry["fetch"]), list(entry["rel"]), list(entry["quality"])
+            blocked_until = entry["blocked_until"]
+        times = [t for t in fetch if t is not None]
+        return {
+            "fetches":       len(fetch),
+            "p50":           _percentile(times, 0.5) if times else None,
+            "p90":           _percentile(times, 0.9) if times else None,
+            "error_rate":    (len(fetch) - len(times)) / len(fetch) if fetch else None,
+            "checks":        len(rel),
+            "pass_rate":     sum(rel) / len(rel) if rel else None,
+            "avg_quality":   sum(quality) / len(quality) if quality else None,
+            "blocked_until": blocked_until if blocked_until > time.time() else None,
+        }
+
+    def priority(self, url: str) -> float:
+        """
+        Поправка к приоритету URL (в баллах _vp_domain_score): минус за
+        ошибки и медленные загрузки, плюс/минус за долю релевантных страниц
+        и средний балл качества. Домен без статистики — 0.
+        """
+        s = self.summary(url)
+        if not s:
+            return 0.0
+        score = 0.0
+        if s["fetches"] >= MIN_SAMPLES:
+            score -= 60 * s["error_rate"]
+            if s["p90"] is not None and s["p90"] > SLOW_FETCH_SECONDS:
+                score -= min(30.0, 5 * (s["p90"] - SLOW_FETCH_SECONDS))
+        if s["checks"] >= MIN_SAMPLES:
+            score += 40 * (s["pass_rate"] - 0.5)
+        if s["avg_quality"] is not None:
+            score += max(-15.0, min(15.0, (s["avg_quality"] - 30) / 2))
+        return round(score, 1)
+
+    def order(self, urls: list) -> list:
+        """urls без заблокированных сайтов; при равном приоритете — исходный порядок."""
+        allowed = [u for u in urls if not self.is_blocked(u)]
+        if len(allowed) < len(urls):
+            print(f"[DOMAIN_STATS] ⏭ Пропущено {len(urls) - len(allowed)} URL "
+                  f"временно заблокированных сайтов")
+        return sorted(allowed, key=self.priority, reverse=True)
+
+    # ── Хранение ─────────────────────────────────────────────────────
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                self._domains = {d: e for d, e in data.items()
+                                 if isinstance(e, dict) and "fetch" in e}
+                print(f"[DOMAIN_STATS] ✓ Статистика загружена для {len(self._domains)} сайтов")
+        except (OSError, ValueError, TypeError) as e:
+            print(f"[DOMAIN_STATS] ⚠️ Не удалось прочитать {self.path}: {e}")
+
+    def _maybe_save(self):
+        with self._lock:
+            due = self._dirty and time.monotonic() - self._last_save >= _SAVE_INTERVAL
+        if due:
+            self.save()
+
+    def save(self):
+        """
+        Записывает статистику сразу (без троттлинга). Запись и os.replace —
+        под блокировкой: потоки загрузок не пишут один .tmp одновременно.
+        """
+        with self._lock:
+            if len(self._domains) > MAX_DOMAINS:
+                keep = sorted(self._domains, key=lambda d: self._domains[d].get("seen", 0),
+                              reverse=True)[:MAX_DOMAINS]
+                self._domains = {d: self._domains[d] for d in keep}
+            self._last_save = time.monotonic()
+            try:
+                tmp = self.path + ".tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(self._domains, f, ensure_ascii=False, separators=(",", ":"))
+                os.replace(tmp, self.path)
+                self._dirty = False
+            except OSError as e:
+                print(f"[DOMAIN_STATS] ⚠️ Не удалось сохранить статистику: {e}")
+
+
+_STATS = None
+_STATS_LOCK = threading.Lock()
+
+
+def get_domain_stats() -> DomainStats:
+    global _STATS
+    if _STATS is None:
+        with _STATS_LOCK:
+            if _STATS is None:
+                _STATS = DomainStats()
+    return _STATS
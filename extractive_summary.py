@@ -0,0 +1,171 @@
+# ═══════════════════════════════════════════════════════════════════════
+# extractive_summary.py — выжимка фактов из результатов поиска без модели
+#
+# Содержит:
+#   • source_sentences()     — предложения из текста результатов поиска
+#   • summarize_extractive() — список «• факт» из лучших предложений
+#
+# summarize_sources перед ответом делал отдельный полный вызов модели
+# (таймаут 45 с) только чтобы выписать из источников «• факты». В
+# быстром режиме это дольше самого ответа. Здесь факты выбираются без
+# модели: предложения источников — векторы TF-IDF, вес предложения —
+# близость к запросу и к центроиду всех предложений (о чём пишут все
+# источники), плюс немного за числа (версии, даты). Предложения берутся
+# по убыванию веса, почти повторяющие уже выбранные пропускаются.
+#
+# Векторы — матрица «предложение × терм» (numpy, если установлен); без
+# numpy те же косинусы считаются по словарям.
+#
+# Использование:
+#   facts = summarize_extractive(search_results, query, language="russian")
+# ═══════════════════════════════════════════════════════════════════════
+
+import re
+import math
+from collections import Counter
+
+try:
+    import numpy as _np            # необязательная зависимость (есть в setup.py)
+except ImportError:
+    _np = None
+
+from passage_rank import terms, split_sentences
+
+# Сколько фактов выдавать (как «максимум 10 фактов» в промпте суммаризатора)
+EXTRACTIVE_MAX_FACTS = 10
+# Вес близости к запросу; остальное — близость к центроиду
+QUERY_WEIGHT = 0.7
+# Множитель веса предложения с числами (версии, даты, размеры)
+NUMBER_BONUS = 1.15
+# Предложение, похожее на выбранное сильнее этого, — повтор
+REDUNDANCY_COSINE = 0.6
+# Границы длины предложения-факта (символов)
+MIN_SENTENCE_CHARS = 25
+MAX_SENTENCE_CHARS = 300
+
+NO_FACTS = {
+    "russian": "Релевантных фактов не найдено",
+    "english": "No relevant facts found",
+}
+
+# Служебные строки результатов поиска и блока страниц
+_SKIP_LINE_RE = re.compile(r"^(?:Ссылка:|URL:|\[Результат|\[Источник|[═─\-]{10,}|📄)")
+_LABEL_RE = re.compile(r"^(?:Заголовок|Описание|Текст):\s*")
+_HEADING_RE = re.compile(r"^#+\s")
+_DIGIT_RE = re.compile(r"\d")
+
+
+def source_sentences(search_results: str) -> list:
+    """Предложения из описаний и текста страниц без служебных строк и повторов."""
+    seen, sentences = set(), []
+    for line in search_results.split("\n"):
+        line = line.strip()
+        if not line or _SKIP_LINE_RE.match(line):
+            continue
+        line = _LABEL_RE.sub("", line)
+        if _HEADING_RE.match(line):
+            continue
+        for sentence in split_sentences(line):
+            sentence = sentence.strip(" .…")
+            if len(sentence) < MIN_SENTENCE_CHARS:
+                continue
+            if len(sentence) > MAX_SENTENCE_CHARS:
+                sentence = sentence[:MAX_SENTENCE_CHARS].rsplit(" ", 1)[0] + "…"
+            key = sentence.lower()
+            if key not in seen:
+                seen.add(key)
+                sentences.append(sentence)
+    return sentences
+
+
+def _idf(bags: list) -> dict:
+    df = Counter(t for bag in bags for t in bag)
+    n = len(bags)
+    return {t: math.log(1 + n / c) for t, c in df.items()}
+
+
+def _unit(vector: dict) -> dict:
+    norm = math.sqrt(sum(v * v for v in vector.values()))
+    return {t: v / norm for t, v in vector.items()} if norm else {}
+
+
+def _dot(a: dict, b: dict) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(t, 0.0) for t, v in a.items())
+
+
+class _Vectors:
+    """Единичные векторы TF-IDF предложений; cosine(i, j) и веса."""
+
+    def __init__(self, bags: list, idf: dict):
+        self._idf = idf
+        if _np is not None:
+            vocab = {t: k for k, t in enumerate(idf)}
+            matrix = _np.zeros((len(bags), len(vocab)), dtype=_np.float64)
+            for i, bag in enumerate(bags):
+                for t, tf in Counter(bag).items():
+                    matrix[i, vocab[t]] = (1 + math.log(tf)) * idf[t]
+            norms = _np.linalg.norm(matrix, axis=1)
+            norms[norms == 0] = 1.0
+            self._vocab = vocab
+            self._matrix = matrix / norms[:, None]
+        else:
+            self._rows = [_unit({t: (1 + math.log(tf)) * idf[t] for t, tf in Counter(bag).items()})
+                          for bag in bags]
+
+    def scores(self, query_terms: list, query_weight: float) -> list:
+        """query_weight·cos(предложение, запрос) + остаток·cos(предложение, центроид)."""
+        query = _unit({t: self._idf[t] for t in set(query_terms) if t in self._idf})
+        if _np is not None:
+            q = _np.zeros(len(self._vocab))
+            for t, v in query.items():
+                q[self._vocab[t]] = v
+            centroid = self._matrix.mean(axis=0)
+            c_norm = _np.linalg.norm(centroid)
+            if c_norm:
+                centroid /= c_norm
+            return (query_weight * (self._matrix @ q)
+                    + (1 - query_weight) * (self._matrix @ centroid)).tolist()
+        centroid = Counter()
+        for row in self._rows:
+            centroid.update(row)
+        centroid = _unit(centroid)
+        return [query_weight * _dot(row, query) + (1 - query_weight) * _dot(row, centroid)
+                for row in self._rows]
+
+    def cosine(self, i: int, j: int) -> float:
+        if _np is not None:
+            return float(self._matrix[i] @ self._matrix[j])
+        return _dot(self._rows[i], self._rows[j])
+
+
+def summarize_extractive(search_results: str, query: str, language: str = "russian",
+                         max_facts: int = EXTRACTIVE_MAX_FACTS) -> str:
+    """
+    До max_facts предложений источников, ближайших к запросу, строками
+    «• …». Если ни одно предложение не содержит термов запроса —
+    NO_FACTS (как ответ суммаризатора-модели).
+    """
+    no_facts = NO_FACTS.get(language, NO_FACTS["english"])
+    sentences = source_sentences(search_results)
+    query_terms = set(terms(query))
+    bags = [terms(s) for s in sentences]
+    candidates = [i for i, bag in enumerate(bags) if query_terms.intersection(bag)]
+    if not candidates:
+        return no_facts
+
+    vectors = _Vectors(bags, _idf(bags))
+    scores = vectors.scores(list(query_terms), QUERY_WEIGHT)
+    for i in candidates:
+        if _DIGIT_RE.search(sentences[i]):
+            scores[i] *= NUMBER_BONUS
+
+    chosen = []
+    for i in sorted(candidates, key=lambda k: scores[k], reverse=True):
+        if any(vectors.cosine(i, j) > REDUNDANCY_COSINE for j in chosen):
+            continue
+        chosen.append(i)
+        if len(chosen) >= max_facts:
+            break
+    return "\n".join(f"• {sentences[i]}" for i in chosen)
@@ -0,0 +1,513 @@
+# ═══════════════════════════════════════════════════════════════════════
+# html_extract.py — быстрое извлечение текста из HTML
+#
+# Содержит:
+#   • extract_text()        — HTML (bytes) → текст, не больше max_chars
+#   • extract_main_content() — основной текст статьи с заголовками, без
+#                             меню, баннеров cookie, сайдбаров (readability)
+#   • decode_html()         — bytes → str по charset заголовка / <meta> / utf-8
+#   • charset_from_content_type(), is_text_content_type() — разбор Content-Type
+#
+# fetch_page_content разбирал страницу целиком через BeautifulSoup
+# (html.parser — самый медленный его бэкенд), а потом обрезал текст до
+# 3–5 тыс. символов: на многомегабайтных страницах секунды CPU уходили
+# на текст, который тут же выбрасывался. Теперь:
+#   • если установлен lxml — дерево строит C-парсер, текст собирается
+#     ленивым itertext() и сбор прекращается, набрав max_chars;
+#   • иначе — потоковый токенизатор на stdlib html.parser: HTML подаётся
+#     кусками, и разбор останавливается, как только текста достаточно.
+# В обоих случаях выкидываются script/style/nav/header/footer и т.п.
+#
+# Основной текст (extract_main_content) — по плотности текста и ссылок,
+# как в jusText/boilerpipe: страница режется на блоки (p, li, td, h1..h6,
+# div ...), у каждого считаются длина текста и доля текста в ссылках.
+# Длинные блоки без ссылок — содержимое, блоки из ссылок — навигация,
+# короткие решаются по соседям; заголовок остаётся, если за ним идёт
+# содержимое. Элементы с class/id вида cookie/banner/sidebar/share
+# выкидываются целиком. Если на странице есть <article>/<main> и в нём
+# основная часть хорошего текста — берётся только он. Если ничего
+# похожего на статью не нашлось — возвращается обычный extract_text.
+#
+# Использование:
+#   text = extract_text(body, encoding=charset, max_chars=16000)
+#   text = extract_main_content(body, encoding=charset, max_chars=16000)
+#
+#   python html_extract.py page1.html page2.html   # время и экономия токенов
+#   python html_extract.py --page-cache            # на страницах page_cache.db
+# ═══════════════════════════════════════════════════════════════════════
+
+import os
+import re
+import sys
+import time
+import argparse
+from html.parser import HTMLParser
+
+try:
+    import lxml.html as _lxml_html
+except ImportError:  # lxml — необязательная зависимость
+    _lxml_html = None
+
+# Элементы, текст которых не относится к содержимому страницы
+SKIP_TAGS = frozenset({
+    "script", "style", "noscript", "template", "svg", "iframe",
+    "nav", "header", "footer", "head", "title",
+})
+
+# Типы содержимого, из которых имеет смысл извлекать текст
+_TEXT_CONTENT_TYPES = ("text/html", "application/xhtml+xml", "text/plain",
+                       "text/xml", "application/xml")
+
+# Сколько HTML подаётся токенизатору за раз
+_FEED_CHUNK = 32 * 1024
+
+_WS_RE = re.compile(r"\s+")
+_META_CHARSET_RE = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?\s*([\w.:-]+)""", re.I)
+
+
+def charset_from_content_type(content_type: str):
+    """charset из Content-Type или None, если сервер его не указал."""
+    for part in (content_type or "").split(";")[1:]:
+        name, _, value = part.partition("=")
+        if name.strip().lower() == "charset" and value.strip():
+            return value.strip().strip("\"'")
+    return None
+
+
+def is_text_content_type(content_type: str) -> bool:
+    """HTML/XML/текст (или тип не указан) — PDF, картинки, архивы не качаем."""
+    mime = (content_type or "").split(";")[0].strip().lower()
+    return not mime or mime.startswith(_TEXT_CONTENT_TYPES)
+
+
+def decode_html(data: bytes, encoding: str = None) -> str:
+    """Кодировка: из заголовка, иначе из <meta charset> в начале, иначе utf-8."""
+    if not encoding:
+        match = _META_CHARSET_RE.search(data[:4096])
+        if match:
+            encoding = match.group(1).decode("ascii", errors="ignore")
+    try:
+        return data.decode(encoding or "utf-8", errors="replace")
+    except LookupError:
+        return data.decode("utf-8", errors="replace")
+
+
+def _normalize(parts: list, max_chars: int) -> str:
+    text = _WS_RE.sub(" ", " ".join(parts)).strip()
+    return text[:max_chars] if max_chars else text
+
+
+# ── lxml ─────────────────────────────────────────────────────────────
+def _extract_lxml(data: bytes, encoding: str, max_chars: int) -> str:
+    parser = _lxml_html.HTMLParser(encoding=encoding) if encoding else None
+    doc = _lxml_html.document_fromstring(data, parser=parser)
+    for el in doc.xpath("//comment() | //processing-instruction()"):
+        el.drop_tree()
+    for el in doc.iter(*SKIP_TAGS):
+        el.drop_tree()
+    parts, total = [], 0
+    for chunk in doc.itertext():
+        chunk = chunk.strip()
+        if chunk:
+            parts.append(chunk)
+            total += len(chunk) + 1
+            if max_chars and total >= max_chars:
+                break
+    return _normalize(parts, max_chars)
+
+
+# ── stdlib html.parser ───────────────────────────────────────────────
+class _TextCollector(HTMLParser):
+    """Токенизатор, собирающий видимый текст вне SKIP_TAGS."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.size = 0
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self._skip_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+
+    def handle_data(self, data):
+        if self._skip_depth:
+            return
+        data = data.strip()
+        if data:
+            self.parts.append(data)
+            self.size += len(data) + 1
+
+
+def _extract_stdlib(data: bytes, encoding: str, max_chars: int) -> str:
+    html = decode_html(data, encoding)
+    collector = _TextCollector()
+    for start in range(0, len(html), _FEED_CHUNK):
+        collector.feed(html[start:start + _FEED_CHUNK])
+        if max_chars and collector.size >= max_chars:
+            break
+    else:
+        collector.close()
+    return _normalize(collector.parts, max_chars)
+
+
+def extract_text(data: bytes, encoding: str = None, max_chars: int = None) -> str:
+    """
+    Видимый текст HTML-страницы одной строкой (пробелы схлопнуты).
+    max_chars — после стольких символов разбор прекращается.
+    """
+    if not data:
+        return ""
+    if _lxml_html is not None:
+        try:
+            return _extract_lxml(data, encoding, max_chars)
+        except (ValueError, LookupError, _lxml_html.etree.ParserError) as e:
+            print(f"[HTML_EXTRACT] ⚠️ lxml: {e} — разбираю html.parser")
+    return _extract_stdlib(data, encoding, max_chars)
+
+
+# ═══════════════════════════════════════════════════════════════════
+# ОСНОВНОЙ ТЕКСТ СТРАНИЦЫ
+# ═══════════════════════════════════════════════════════════════════
+
+# Для основного текста <header> не выкидываем безусловно: внутри <article>
+# в нём заголовок статьи
+MAIN_SKIP_TAGS = (SKIP_TAGS - {"header"}) | {"aside", "button", "select", "dialog"}
+# Контейнеры страницы: class/id у них (body.menu-open, article.has-comments)
+# ничего не говорит о содержимом
+_NO_HINT_TAGS = frozenset({"html", "body", "main", "article", "form"})
+
+BLOCK_TAGS = frozenset({
+    "p", "div", "section", "article", "main", "header", "li", "ul", "ol",
+    "dl", "dt", "dd", "table", "tr", "td", "th", "blockquote", "pre",
+    "figure", "figcaption", "h1", "h2", "h3", "h4", "h5", "h6", "hr",
+})
+HEADING_TAGS = {"h1": 1, "h2": 2, "h3": 3, "h4": 4, "h5": 5, "h6": 6}
+_VOID_TAGS = frozenset({"br", "hr", "img", "meta", "link", "input", "wbr",
+                        "source", "area", "base", "col", "embed", "param", "track"})
+
+# class/id служебных блоков
+_BOILERPLATE_RE = re.compile(
+    r"cookie|consent|gdpr|banner|breadcrumb|sidebar|navbar|menu|comment|share|social"
+    r"|related|promo|advert|sponsor|subscribe|newsletter|popup|modal|footer|\bads?\b",
+    re.I)
+
+# Пороги классификации блоков (символы / доля текста в ссылках)
+GOOD_BLOCK_CHARS = 70
+SHORT_BLOCK_CHARS = 25
+MAX_GOOD_LINK_DENSITY = 0.25
+MAX_LINK_DENSITY = 0.4
+# Заголовок остаётся, если хорошее содержимое идёт не дальше чем через столько блоков
+HEADING_LOOKAHEAD = 3
+# Меньше — значит статью не нашли, отдаём полный текст
+MIN_MAIN_CHARS = 200
+
+_GOOD, _BAD, _NEAR, _SHORT, _HEADING = "good", "bad", "near", "short", "heading"
+
+
+class _Block:
+    __slots__ = ("parts", "chars", "link_chars", "heading", "in_main", "cls")
+
+    def __init__(self, heading: int, in_main: bool):
+        self.parts = []
+        self.chars = 0
+        self.link_chars = 0
+        self.heading = heading
+        self.in_main = in_main
+        self.cls = None
+
+    @property
+    def text(self) -> str:
+        return _WS_RE.sub(" ", " ".join(self.parts)).strip()
+
+
+class _BlockBuilder:
+    """
+    Режет поток start/end/data на блоки. Общий для lxml (iterwalk) и
+    html.parser: стек открытых элементов чинит незакрытые теги.
+    """
+
+    def __init__(self):
+        self.blocks = []
+        self._stack = []        # (tag, skip)
+        self._skip = 0
+        self._links = 0
+        self._main = 0
+        self._headings = []
+        self._current = None
+
+    def _flush(self):
+        block = self._current
+        if block is not None and block.chars:
+            self.blocks.append(block)
+        self._current = None
+
+    def start(self, tag: str, attrs):
+        if tag in BLOCK_TAGS:
+            self._flush()
+        if tag in _VOID_TAGS:
+            return
+        hint = " ".join(v for k, v in attrs if k in ("class", "id") and v)
+        skip = (tag in MAIN_SKIP_TAGS
+                or (tag == "header" and not self._main)
+                or bool(hint and tag not in _NO_HINT_TAGS and _BOILERPLATE_RE.search(hint)))
+        self._stack.append((tag, skip))
+        if skip:
+            self._skip += 1
+        if tag == "a":
+            self._links += 1
+        elif tag in ("article", "main"):
+            self._main += 1
+        elif tag in HEADING_TAGS:
+            self._headings.append(HEADING_TAGS[tag])
+
+    def end(self, tag: str):
+        if tag in _VOID_TAGS or not any(t == tag for t, _ in self._stack):
+            return
+        while self._stack:
+            open_tag, skip = self._stack.pop()
+            if skip:
+                self._skip -= 1
+            if open_tag == "a":
+                self._links -= 1
+            elif open_tag in ("article", "main"):
+                self._main -= 1
+            elif open_tag in HEADING_TAGS and self._headings:
+                self._headings.pop()
+            if open_tag in BLOCK_TAGS:
+                self._flush()
+            if open_tag == tag:
+                break
+
+    def data(self, text: str):
+        if self._skip or not text:
+            return
+        stripped = text.strip()
+        if not stripped:
+            return
+        block = self._current
+        if block is None:
+            heading = self._headings[-1] if self._headings else 0
+            block = self._current = _Block(heading, self._main > 0)
+        block.parts.append(stripped)
+        block.chars += len(stripped) + 1
+        if self._links:
+            block.link_chars += len(stripped) + 1
+
+    def close(self) -> list:
+        self._flush()
+        return self.blocks
+
+
+class _BlockParser(HTMLParser):
+    def __init__(self, builder: _BlockBuilder):
+        super().__init__(convert_charrefs=True)
+        self.builder = builder
+
+    def handle_starttag(self, tag, attrs):
+        self.builder.start(tag, attrs)
+
+    def handle_startendtag(self, tag, attrs):
+        self.builder.start(tag, attrs)
+
+    def handle_endtag(self, tag):
+        self.builder.end(tag)
+
+    def handle_data(self, data):
+        self.builder.data(data)
+
+
+def _blocks_stdlib(data: bytes, encoding: str) -> list:
+    builder = _BlockBuilder()
+    parser = _BlockParser(builder)
+    parser.feed(decode_html(data, encoding))
+    parser.close()
+    return builder.close()
+
+
+def _blocks_lxml(data: bytes, encoding: str) -> list:
+    parser = _lxml_html.HTMLParser(encoding=encoding) if encoding else None
+    doc = _lxml_html.document_fromstring(data, parser=parser)
+    builder = _BlockBuilder()
+    for event, el in _lxml_html.etree.iterwalk(doc, events=("start", "end")):
+        if not isinstance(el.tag, str):       # комментарии, PI
+            if event == "end":
+                builder.data(el.tail)
+            continue
+        tag = el.tag.lower()
+        if event == "start":
+            builder.start(tag, el.attrib.items())
+            builder.data(el.text)
+        else:
+            builder.end(tag)
+            builder.data(el.tail)
+    return builder.close()
+
+
+def _classify(blocks: list):
+    for block in blocks:
+        density = block.link_chars / block.chars
+        if density > MAX_LINK_DENSITY:
+            block.cls = _BAD
+        elif block.heading:
+            block.cls = _HEADING
+        elif block.chars >= GOOD_BLOCK_CHARS and density <= MAX_GOOD_LINK_DENSITY:
+            block.cls = _GOOD
+        elif block.chars < SHORT_BLOCK_CHARS:
+            block.cls = _SHORT
+        else:
+            block.cls = _NEAR
+
+
+def _neighbour(blocks: list, pos: int, step: int) -> str:
+    """Класс ближайшего good/bad-соседа (короткие и заголовки пропускаются)."""
+    pos += step
+    while 0 <= pos < len(blocks):
+        if blocks[pos].cls in (_GOOD, _BAD):
+            return blocks[pos].cls
+        pos += step
+    return _BAD
+
+
+def _select(blocks: list) -> list:
+    """Какие блоки — содержимое: good + контекстно хорошие + их заголовки."""
+    keep = [block.cls == _GOOD for block in blocks]
+    for pos, block in enumerate(blocks):
+        if block.cls == _NEAR:
+            # среднего размера — если хотя бы один сосед хороший
+            keep[pos] = _GOOD in (_neighbour(blocks, pos, -1), _neighbour(blocks, pos, 1))
+        elif block.cls == _SHORT:
+            # короткие — только между хорошими (подписи, строки списков в тексте)
+            keep[pos] = _neighbour(blocks, pos, -1) == _GOOD == _neighbour(blocks, pos, 1)
+    for pos, block in enumerate(blocks):
+        if block.cls == _HEADING:
+            for nxt in range(pos + 1, min(pos + 1 + HEADING_LOOKAHEAD, len(blocks))):
+                if blocks[nxt].cls == _BAD:
+                    break
+                if keep[nxt] and blocks[nxt].cls != _HEADING:
+                    keep[pos] = True
+                    break
+    return [block for block, kept in zip(blocks, keep) if kept]
+
+
+def extract_main_content(data: bytes, encoding: str = None, max_chars: int = None) -> str:
+    """
+    Основной текст страницы: абзацы статьи и их заголовки (строки
+    «## Заголовок»), по строке на блок. Меню, баннеры, списки ссылок,
+    сайдбары отбрасываются. Если статью выделить не удалось —
+    extract_text().
+    """
+    if not data:
+        return ""
+    blocks = None
+    if _lxml_html is not None:
+        try:
+            blocks = _blocks_lxml(data, encoding)
+        except (ValueError, LookupError, _lxml_html.etree.ParserError) as e:
+            print(f"[HTML_EXTRACT] ⚠️ lxml: {e} — разбираю html.parser")
+    if blocks is None:
+        blocks = _blocks_stdlib(data, encoding)
+
+    _classify(blocks)
+    kept = _select(blocks)
+    # <article>/<main> с основной частью хорошего текста — остальное побоку
+    good_chars = sum(b.chars for b in kept if b.cls == _GOOD)
+    main_chars = sum(b.chars for b in kept if b.cls == _GOOD and b.in_main)
+    if good_chars and main_chars * 2 >= good_chars:
+        kept = [b for b in kept if b.in_main]
+
+    lines, total = [], 0
+    for block in kept:
+        text = block.text
+        if block.heading:
+            text = "#" * block.heading + " " + text
+        lines.append(text)
+        total += len(text) + 1
+        if max_chars and total >= max_chars:
+            break
+    result = "\n".join(lines)
+    if len(result) < MIN_MAIN_CHARS:
+        return extract_text(data, encoding, max_chars)
+    return result[:max_chars] if max_chars else result
+
+
+# ═══════════════════════════════════════════════════════════════════
+# БЕНЧМАРК
+# ═══════════════════════════════════════════════════════════════════
+
+def _load_fixtures(paths: list, page_cache_db: str) -> list:
+    """[(имя, html, encoding)] из файлов и/или page_cache.db."""
+    fixtures = []
+    for path in paths:
+        with open(path, "rb") as f:
+            fixtures.append((os.path.basename(path), f.read(), None))
+    if page_cache_db:
+        import sqlite3
+        conn = sqlite3.connect(page_cache_db)
+        try:
+            for url, html, encoding in conn.execute(
+                    "SELECT url, html, encoding FROM page_cache WHERE html IS NOT NULL"):
+                fixtures.append((url, bytes(html), encoding))
+        finally:
+            conn.close()
+    return fixtures
+
+
+def _timed(fn, *args, repeat: int = 3):
+    best, result = None, None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(
+        description="Бенчмарк извлечения текста: полный текст против основного")
+    p.add_argument("files", nargs="*", help="сохранённые HTML-страницы")
+    p.add_argument("--page-cache", nargs="?", const="page_cache.db", metavar="DB",
+                   help="взять страницы из кэша страниц (по умолчанию page_cache.db)")
+    p.add_argument("--max-chars", type=int, default=16000,
+                   help="бюджет текста, как в fetch_page_content")
+    args = p.parse_args(argv)
+
+    fixtures = _load_fixtures(args.files, args.page_cache)
+    if not fixtures:
+        p.error("нет страниц: укажите HTML-файлы или --page-cache")
+
+    from token_estimator import estimate_tokens
+
+    totals = {"full_s": 0.0, "main_s": 0.0, "full_tok": 0, "main_tok": 0}
+    print(f"{'страница':<48} {'КБ':>6} {'full мс':>8} {'main мс':>8} "
+          f"{'full ток':>9} {'main ток':>9} {'экономия':>9}")
+    for name, html, encoding in fixtures:
+        full, full_s = _timed(extract_text, html, encoding, args.max_chars)
+        main_text, main_s = _timed(extract_main_content, html, encoding, args.max_chars)
+        full_tok, main_tok = estimate_tokens(full), estimate_tokens(main_text)
+        saved = 1 - main_tok / full_tok if full_tok else 0.0
+        print(f"{name[-48:]:<48} {len(html) // 1024:>6} {full_s * 1000:>8.1f} "
+              f"{main_s * 1000:>8.1f} {full_tok:>9} {main_tok:>9} {saved:>8.0%}")
+        totals["full_s"] += full_s
+        totals["main_s"] += main_s
+        totals["full_tok"] += full_tok
+        totals["main_tok"] += main_tok
+
+    n = len(fixtures)
+    saved = 1 - totals["main_tok"] / totals["full_tok"] if totals["full_tok"] else 0.0
+    print(f"\nСтраниц: {n}, lxml: {'да' if _lxml_html is not None else 'нет'}")
+    print(f"Среднее время: full {totals['full_s'] / n * 1000:.1f} мс, "
+          f"main {totals['main_s'] / n * 1000:.1f} мс")
+    print(f"Токены: {totals['full_tok']} → {totals['main_tok']} "
+          f"(−{totals['full_tok'] - totals['main_tok']}, {saved:.0%}), "
+          f"в среднем −{(totals['full_tok'] - totals['main_tok']) / n:.0f} на страницу")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,12 +4,12 @@
 #
 # Содержит:
 #   • Конфигурацию: OLLAMA_HOST, OLLAMA_MODEL, SUPPORTED_MODELS,
-#                   AI_MODE_*, _APP_SHUTTING_DOWN, _OLLAMA_SESSION
+#                   AI_MODE_*, _APP_SHUTTING_DOWN, _OLLAMA_CLIENT
 #   • SYSTEM_PROMPTS  — системные промпты LLaMA 3 по режимам и языкам
 #   • MODE_STRATEGY_RULES — текстовые правила режимов
 #   • get_current_ollama_model() / get_current_display_name()
 #   • call_ollama_chat()  — вызов Ollama /api/chat
-#   • warm_up_model()     — прогрев модели в RAM
+#   • warm_up_model()     — прогрев модели в RAM (через model_residency.py)
 #
 # Поддерживаемые модели:
 #   "llama3"   → llama3
@@ -30,9 +30,17 @@
 # ═══════════════════════════════════════════════════════════════════════
 
 import os
-import threading
+import json
+import time
 import requests
 
+from ollama_client import get_ollama_client, OllamaCancelled, is_cancelled, current_cancel_token
+from model_residency import get_residency_manager
+from prompt_cache import get_prompt_cache_tracker
+from ollama_metrics import record_ollama_metrics, STAGE_MAIN, STAGE_REGEN
+from single_flight import get_single_flight, request_key, FlightTimeout
+from llm_cache import get_llm_cache
+
 # ── Конфигурация Ollama ──────────────────────────────────────────────────
 USE_OLLAMA   = True
 OLLAMA_HOST  = os.getenv("OLLAMA_HOST",  "http://127.0.0.1:11434")
@@ -42,9 +50,11 @@ OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3")
 # run.py устанавливает: llama_handler._APP_SHUTTING_DOWN = True
 _APP_SHUTTING_DOWN: bool = False
 
-# HTTP-сессия — одна на всё время работы приложения
-# run.py закрывает: llama_handler._OLLAMA_SESSION.close()
-_OLLAMA_SESSION = requests.Session()
+# Общий пул соединений Ollama (ollama_client.py) — один на всё приложение
+# run.py закрывает: llama_handler._OLLAMA_CLIENT.close()
+_OLLAMA_CLIENT = get_ollama_client()
+# Совместимость: старый код обращается к сессии напрямую
+_OLLAMA_SESSION = _OLLAMA_CLIENT.session
 
 # ── Имя ассистента ───────────────────────────────────────────────────────
 ASSISTANT_NAME = "LLaMA 3"
@@ -988,20 +998,142 @@ COMMUNICATION STYLE: Listen carefully to the user and adapt to their preferences
     }
 }
 
-def call_ollama_chat(messages: list, max_tokens: int = 800, timeout=60, model_key: str = None):
+# Маркер отменённого запроса — начинается с "[Ollama", поэтому все
+# существующие проверки resp.startswith("[Ollama") считают его неудачей
+OLLAMA_CANCELLED = "[Ollama cancelled]"
+
+
+def stream_ollama_chat(payload: dict, on_chunk=None, cancelled_flag=None,
+                       stage: str = STAGE_MAIN, should_stop=None, timeout: float = None) -> str:
+    """
+    Выполняет стриминговый запрос к Ollama /api/chat.
+    Вызывает on_chunk(text) для каждого токена.
+    Возвращает полный собранный текст.
+    При отмене пользователем возвращает OLLAMA_CANCELLED (не пустую строку!).
+
+    should_stop(text) — проверяется после каждого токена; True обрывает
+    генерацию досрочно (например, суммаризатор уже выдал все пункты),
+    и возвращается собранный к этому моменту текст.
+
+    timeout — лимит (сек) на ответ целиком: сокет без таймаута чтения,
+    поэтому лимит держит подписка single_flight — по его истечении стрим
+    обрывается, даже если модель ещё грузится и не прислала ни токена.
+    Возвращается собранный текст или "[Ollama timeout]", если его нет.
+
+    Отмена через OllamaCancelToken (cancel_scope в AIWorker) закрывает сокет
+    сразу, даже во время prompt-eval, когда ни одной строки ещё не пришло;
+    cancelled_flag проверяется между строками как запасной путь.
+
+    Метрики финального чанка (eval_count, load_duration, …) и измеренный
+    time-to-first-token пишутся в ollama_metrics с тегом stage.
+
+    Одинаковый запрос, уже идущий в другом потоке (двойной клик по
+    «Перегенерировать»), не запускается повторно: single_flight подписывает
+    на тот же апстрим, метрики пишет только запустивший его вызов.
+    """
+    payload = get_residency_manager().prepare(dict(payload))
+    payload["stream"] = True
+    full = []
+    was_cancelled = False
+    _thinking = []
+    _t0 = time.perf_counter()
+    _ttft_ms = None
+
+    def _cancel_requested() -> bool:
+        return is_cancelled() or (callable(cancelled_flag) and cancelled_flag())
+
+    def _upstream():
+        # Выполняется в потоке single_flight, внутри cancel_scope полёта
+        with _OLLAMA_CLIENT.chat(payload, timeout=(30, None), stream=True) as r:
+            yield {"_http_status": r.status_code}
+            if r.status_code != 200:
+                return
+            for raw_line in r.iter_lines():
+                if not raw_line:
+                    continue
+                try:
+                    yield json.loads(raw_line)
+                except Exception:
+                    continue
+
+    try:
+        _deadline = None if timeout is None else time.monotonic() + timeout
+        with get_single_flight().stream(request_key(payload), _upstream,
+                                        cancelled=cancelled_flag, deadline=_deadline) as sub:
+            for obj in sub:
+                if _cancel_requested():
+                    was_cancelled = True
+                    break
+                if "_http_status" in obj:
+                    if obj["_http_status"] != 200:
+                        return f"[Ollama error] HTTP {obj['_http_status']}"
+                    continue
+                token = obj.get("message", {}).get("content", "")
+                if obj.get("message", {}).get("thinking"):
+                    _thinking.append(obj["message"]["thinking"])
+                if token:
+                    if _ttft_ms is None:
+                        _ttft_ms = (time.perf_counter() - _t0) * 1000
+                    full.append(token)
+                    if on_chunk:
+                        try:
+                            on_chunk(token)
+                        except Exception:
+                            pass
+                    if should_stop is not None and should_stop("".join(full)):
+                        print(f"[OLLAMA_STREAM] ⏭ {stage}: досрочная остановка генерации")
+                        break
+                if obj.get("done", False):
+                    if sub.leader:
+                        get_prompt_cache_tracker().observe(
+                            payload.get("model"), payload.get("messages"), obj,
+                            completion_text="".join(_thinking) + "".join(full))
+                        record_ollama_metrics(
+                            payload.get("model"), obj, stage, streamed=True, ttft_ms=_ttft_ms,
+                            wall_ms=(time.perf_counter() - _t0) * 1000)
+                    break
+    except OllamaCancelled:
+        was_cancelled = True
+    except FlightTimeout:
+        print(f"[OLLAMA_STREAM] ⏱ {stage}: лимит {timeout:.1f} с истёк — запрос прерван")
+        if not full:
+            return "[Ollama timeout]"
+    except requests.exceptions.Timeout:
+        return "[Ollama timeout]"
+    except requests.exceptions.RequestException:
+        # Обрыв сокета через token.cancel() приходит как ошибка соединения
+        if not _cancel_requested():
+            return "[Ollama connection error]"
+        was_cancelled = True
+    if was_cancelled or is_cancelled():
+        _token = current_cancel_token()
+        if _token is not None:
+            _token.mark_aborted()
+        return OLLAMA_CANCELLED
+    return "".join(full)
+
+
+def call_ollama_chat(messages: list, max_tokens: int = 800, timeout=60, model_key: str = None,
+                     stage: str = STAGE_MAIN, cache_ttl: float = None):
     """Вызов Ollama через chat API с retry при временных сбоях.
     model_key передаётся явно из AIWorker (снят в main thread при создании воркера).
+    cache_ttl — если задан, ответ берётся из/кладётся в llm_cache (только для
+    вспомогательных детерминированных вызовов, не для основного ответа).
     """
     # Используем переданный ключ, иначе fallback на глобал
     _mk = model_key if model_key is not None else CURRENT_AI_MODEL_KEY
     _active_model = SUPPORTED_MODELS.get(_mk, SUPPORTED_MODELS["llama3"])[0]
+
+    if cache_ttl:
+        return get_llm_cache().get_or_compute(
+            f"chat:{stage}", _active_model, messages, {"num_predict": max_tokens},
+            lambda: call_ollama_chat(messages, max_tokens, timeout, _mk, stage),
+            ttl=cache_ttl,
+            accept=lambda r: bool(r) and not r.startswith(("[Ollama", "[shutdown]", "❌")))
     print(f"[OLLAMA_CHAT] ════════════════════════════════════════")
     print(f"[OLLAMA_CHAT] 🤖 МОДЕЛЬ: {_active_model} (key={_mk})")
     print(f"[OLLAMA_CHAT] 📨 Отправка запроса к Ollama...")
     
-    url = f"{OLLAMA_HOST}/api/chat"
-    headers = {"Content-Type": "application/json"}
-
     # Для DeepSeek используем более строгие параметры генерации
     if _mk == "deepseek":
         options = {
@@ -1023,24 +1155,36 @@ def call_ollama_chat(messages: list, max_tokens: int = 800, timeout=60, model_ke
     else:
         options = {"num_predict": max_tokens}
 
-    payload = {
+    payload = get_residency_manager().prepare({
         "model": _active_model,
         "messages": messages,
         "stream": False,
         "options": options
-    }
+    })
     
-    # Попытка с retry для временных сбоев
+    def _do_request() -> dict:
+        r = _OLLAMA_CLIENT.chat(payload, timeout=timeout)
+        r.raise_for_status()
+        return r.json()
+
+    # Попытка с retry для временных сбоев.
+    # Одинаковый запрос, уже идущий в другом потоке (двойной клик по
+    # «Перегенерировать»), не дублируется — single_flight отдаёт его результат.
     max_retries = 2
     for attempt in range(max_retries):
         try:
             print(f"[OLLAMA_CHAT] Попытка {attempt + 1}/{max_retries}: timeout={timeout}s, max_tokens={max_tokens}")
-            # Проверяем флаг завершения перед запросом
+            # Проверяем флаг завершения и отмену перед запросом
             if _APP_SHUTTING_DOWN:
                 return "[shutdown]"
-            r = _OLLAMA_SESSION.post(url, headers=headers, json=payload, timeout=timeout)
-            r.raise_for_status()
-            j = r.json()
+            if is_cancelled():
+                return OLLAMA_CANCELLED
+            _t_start = time.perf_counter()
+            j, _leader = get_single_flight().call(request_key(payload), _do_request)
+            if _leader:
+                get_prompt_cache_tracker().observe(_active_model, messages, j)
+                record_ollama_metrics(_active_model, j, stage, model_key=_mk,
+                                      wall_ms=(time.perf_counter() - _t_start) * 1000)
             
             if "message" in j and "content" in j["message"]:
                 response = j["message"]["content"].strip()
@@ -1051,11 +1195,15 @@ def call_ollama_chat(messages: list, max_tokens: int = 800, timeout=60, model_ke
             # Если формат неожиданный, но это не последняя попытка - пробуем снова
             if attempt < max_retries - 1:
                 print(f"[OLLAMA_CHAT] Повторная попытка через 1 секунду...")
-                import time
                 time.sleep(1)
                 continue
             return str(j)
             
+        except OllamaCancelled:
+            # Пользователь нажал «Стоп» — сокет уже закрыт, retry не нужен
+            print(f"[OLLAMA_CHAT] ⏹ Запрос отменён пользователем")
+            return OLLAMA_CANCELLED
+
         except requests.exceptions.Timeout:
             error = f"[Ollama timeout] Превышено время ожидания {timeout}s"
             print(f"[OLLAMA_CHAT] ⏱️ {error}")
@@ -1069,7 +1217,6 @@ def call_ollama_chat(messages: list, max_tokens: int = 800, timeout=60, model_ke
             print(f"[OLLAMA_CHAT] 🔌 {error}: {e}")
             if attempt < max_retries - 1:
                 print(f"[OLLAMA_CHAT] Повторная попытка...")
-                import time
                 time.sleep(1)
                 continue
             return error
@@ -1085,7 +1232,6 @@ def call_ollama_chat(messages: list, max_tokens: int = 800, timeout=60, model_ke
             print(f"[OLLAMA_CHAT] ❌ {error}")
             if attempt < max_retries - 1:
                 print(f"[OLLAMA_CHAT] Повторная попытка...")
-                import time
                 time.sleep(1)
                 continue
             return error
@@ -1095,54 +1241,24 @@ def call_ollama_chat(messages: list, max_tokens: int = 800, timeout=60, model_ke
 
 
 def warm_up_model(model_key: str = None):
-    """Загружает модель Ollama в память. Вызывается при запуске и смене модели."""
+    """
+    Загружает модель Ollama в память. Вызывается при запуске и смене модели.
+    Выполняется в очереди ModelResidencyManager (model_residency.py).
+    """
     _mk = model_key if model_key is not None else CURRENT_AI_MODEL_KEY
     _model_name = SUPPORTED_MODELS.get(_mk, SUPPORTED_MODELS["llama3"])[0]
-    _display = SUPPORTED_MODELS.get(_mk, SUPPORTED_MODELS["llama3"])[1]
-
-    def _do_warm_up():
-        print(f"[WARM_UP] 🔥 Загрузка модели в память: {_display} ({_model_name})…")
-        try:
-            url = f"{OLLAMA_HOST}/api/generate"
-            payload = {
-                "model": _model_name,
-                "prompt": "",
-                "keep_alive": "10m",
-                "stream": False,
-                "options": {"num_predict": 0}
-            }
-            r = requests.post(url, json=payload, timeout=120)
-            if r.status_code == 200:
-                print(f"[WARM_UP] ✅ Модель {_display} загружена и готова к работе")
-            else:
-                print(f"[WARM_UP] ⚠️ Статус {r.status_code} при прогреве {_display}")
-        except requests.exceptions.ConnectionError:
-            print(f"[WARM_UP] ❌ Ollama недоступна на {OLLAMA_HOST}. Запустите: ollama serve")
-        except Exception as e:
-            print(f"[WARM_UP] ⚠️ Ошибка прогрева {_display}: {e}")
-
-    threading.Thread(target=_do_warm_up, daemon=True).start()
+    get_residency_manager().warm(_model_name, reason=f"warm_up:{_mk}")
 
 
 def unload_model(model_key: str):
     """
     Выгружает конкретную модель из памяти Ollama (keep_alive=0).
-    Выполняется асинхронно в фоновом потоке.
+    Выполняется асинхронно в очереди ModelResidencyManager.
     """
     entry = SUPPORTED_MODELS.get(model_key)
     if not entry:
         return
-    _model_name, _display = entry[0], entry[1]
-
-    def _do_unload():
-        try:
-            url = f"{OLLAMA_HOST}/api/generate"
-            requests.post(url, json={"model": _model_name, "keep_alive": 0}, timeout=5)
-            print(f"[UNLOAD] ✅ Выгружена из памяти: {_display} ({_model_name})")
-        except Exception as e:
-            print(f"[UNLOAD] ⚠️ Не удалось выгрузить {_display}: {e}")
-
-    threading.Thread(target=_do_unload, daemon=True).start()
+    get_residency_manager().evict(entry[0], reason=f"unload:{model_key}")
 
 
 def unload_all_models(except_key: str = None, synchronous: bool = False, timeout: int = 6):
@@ -1151,34 +1267,18 @@ def unload_all_models(except_key: str = None, synchronous: bool = False, timeout
 
     except_key   — если задан, пропускает эту модель (например, только что выбранную)
     synchronous  — True: ждёт завершения (для closeEvent)
-                   False: запускает в фоне
+                   False: ставит в очередь ModelResidencyManager
     timeout      — секунд на каждый запрос при synchronous=True
     """
     targets = [
-        (key, entry[0], entry[1])
+        entry[0]
         for key, entry in SUPPORTED_MODELS.items()
         if key != except_key
     ]
     if not targets:
         return
-
-    def _do_unload_all():
-        url = f"{OLLAMA_HOST}/api/generate"
-        for key, ollama_name, display in targets:
-            try:
-                requests.post(
-                    url,
-                    json={"model": ollama_name, "keep_alive": 0},
-                    timeout=timeout,
-                )
-                print(f"[UNLOAD_ALL] ✅ {display} ({ollama_name}) выгружена")
-            except Exception as e:
-                print(f"[UNLOAD_ALL] ⚠️ {display}: {e}")
-
-    if synchronous:
-        _do_unload_all()
-    else:
-        threading.Thread(target=_do_unload_all, daemon=True).start()
+    get_residency_manager().evict_many(targets, reason="unload_all",
+                                       synchronous=synchronous, timeout=timeout)
 
 
 # ═══════════════════════════════════════════════════════════════════
@@ -1272,5 +1372,6 @@ def regenerate_response(
         max_tokens=max_tokens,
         timeout=timeout,
         model_key=target_key,
+        stage=STAGE_REGEN,
     )
     return response, target_key
\ No newline at end of file
@@ -0,0 +1,195 @@
+# ═══════════════════════════════════════════════════════════════════════
+# llm_cache.py — дисковый кэш детерминированных вспомогательных вызовов
+#
+# Содержит:
+#   • LLMCache          — SQLite-кэш с TTL и ограничением размера (LRU)
+#   • get_llm_cache()   — общий экземпляр
+#
+# summarize_sources идёт с temperature 0.1, перевод и validate-regen на
+# практике тоже детерминированы, но после «Перегенерировать» те же
+# результаты поиска заново прогонялись через модель — лишний полный
+# проход LLM. Кэш включается явно на месте вызова (get_or_compute) и
+# считает попадания/промахи по каждому месту.
+#
+# Ключ: место вызова + модель + сообщения/промпт + options (без
+# num_ctx и прочих параметров раннера, не влияющих на ответ).
+#
+# Использование:
+#   from llm_cache import get_llm_cache
+#   facts = get_llm_cache().get_or_compute(
+#       "summarize", model, messages, options, compute_fn, ttl=6 * 3600)
+#   get_llm_cache().stats()  # {"summarize": {"hits": 3, "misses": 5}, ...}
+# ═══════════════════════════════════════════════════════════════════════
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Optional
+
+LLM_CACHE_DB = "llm_cache.db"
+
+DEFAULT_TTL = 24 * 3600
+MAX_CACHE_BYTES = int(os.getenv("AI_ASSISTANT_LLM_CACHE_MB", "64")) * 1024 * 1024
+# При переполнении чистим до этой доли лимита, чтобы не вытеснять на каждой записи
+_EVICT_TO = 0.9
+
+# Опции раннера Ollama, которые не меняют текст ответа
+_KEY_IGNORED_OPTIONS = ("num_ctx", "num_thread", "num_gpu", "num_batch", "use_mmap")
+
+
+class LLMCache:
+    """Кэш ответов «модель + промпт + options → текст» в SQLite."""
+
+    def __init__(self, db_path: str = LLM_CACHE_DB, max_bytes: int = MAX_CACHE_BYTES):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._counters: dict = {}   # место вызова → {"hits": n, "misses": n}
+        self.init_db()
+
+    def init_db(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            key          TEXT PRIMARY KEY,
+            site         TEXT NOT NULL,
+            model        TEXT,
+            value        TEXT NOT NULL,
+            size         INTEGER NOT NULL,
+            created_at   REAL NOT NULL,
+            expires_at   REAL NOT NULL,
+            last_access  REAL NOT NULL
+        )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_access ON llm_cache(last_access)")
+        conn.commit()
+        conn.close()
+
+    # ── Ключ ──────────────────────────────────────────────────────────
+    @staticmethod
+    def key_for(site: str, model: str, prompt, options: dict = None) -> str:
+        opts = {k: v for k, v in (options or {}).items() if k not in _KEY_IGNORED_OPTIONS}
+        raw = json.dumps([site, model, prompt, opts], sort_keys=True,
+                         ensure_ascii=False, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    # ── Чтение / запись ──────────────────────────────────────────────
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                row = conn.execute("SELECT value, expires_at FROM llm_cache WHERE key = ?",
+                                   (key,)).fetchone()
+                if row is None:
+                    return None
+                if row[1] < now:
+                    conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    conn.commit()
+                    return None
+                conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+                conn.commit()
+                return row[0]
+            finally:
+                conn.close()
+
+    def put(self, key: str, value: str, ttl: float = DEFAULT_TTL,
+            site: str = "", model: str = None):
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                conn.execute("""
+                INSERT OR REPLACE INTO llm_cache
+                    (key, site, model, value, size, created_at, expires_at, last_access)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """, (key, site, model, value, size, now, now + ttl, now))
+                self._evict(conn, now)
+                conn.commit()
+            finally:
+                conn.close()
+
+    def _evict(self, conn, now: float):
+        conn.execute("DELETE FROM llm_cache WHERE expires_at < ?", (now,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = int(self.max_bytes * _EVICT_TO)
+        removed = 0
+        for key, size in conn.execute(
+                "SELECT key, size FROM llm_cache ORDER BY last_access ASC").fetchall():
+            if total <= target:
+                break
+            conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            total -= size
+            removed += 1
+        print(f"[LLM_CACHE] 🧹 Вытеснено {removed} записей (LRU), размер ~{total // 1024} КБ")
+
+    # ── Основной API ─────────────────────────────────────────────────
+    def get_or_compute(self, site: str, model: str, prompt, options: dict,
+                       compute, ttl: float = DEFAULT_TTL, accept=None):
+        """
+        Возвращает закэшированный ответ или вызывает compute() и кэширует
+        результат. accept(value) -> bool решает, можно ли кэшировать
+        (по умолчанию — любая непустая строка). Ошибки кэша не мешают вызову.
+        """
+        key = self.key_for(site, model, prompt, options)
+        try:
+            cached = self.get(key)
+        except sqlite3.Error as e:
+            print(f"[LLM_CACHE] ⚠️ Чтение: {e}")
+            cached = None
+        counters = self._counters.setdefault(site, {"hits": 0, "misses": 0})
+        if cached is not None:
+            counters["hits"] += 1
+            print(f"[LLM_CACHE] ✓ {site}: попадание "
+                  f"(попаданий {counters['hits']}, промахов {counters['misses']})")
+            return cached
+
+        counters["misses"] += 1
+        value = compute()
+        ok = accept(value) if accept is not None else (isinstance(value, str) and bool(value))
+        if ok:
+            try:
+                self.put(key, value, ttl=ttl, site=site, model=model)
+            except sqlite3.Error as e:
+                print(f"[LLM_CACHE] ⚠️ Запись: {e}")
+        return value
+
+    def stats(self) -> dict:
+        out = {site: dict(c) for site, c in self._counters.items()}
+        try:
+            conn = sqlite3.connect(self.db_path)
+            entries, size = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+            conn.close()
+            out["_store"] = {"entries": entries, "bytes": size, "max_bytes": self.max_bytes}
+        except sqlite3.Error:
+            pass
+        return out
+
+    def clear(self):
+        with self._lock:
+            conn = sqlite3.connect(self.db_path)
+            conn.execute("DELETE FROM llm_cache")
+            conn.commit()
+            conn.close()
+
+
+_CACHE: LLMCache = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_llm_cache() -> LLMCache:
+    global _CACHE
+    if _CACHE is None:
+        with _CACHE_LOCK:
+            if _CACHE is None:
+                _CACHE = LLMCache()
+    return _CACHE
@@ -56,6 +56,8 @@ try:
 except ImportError:
     OLLAMA_HOST = "http://localhost:11434"
 
+from ollama_client import get_ollama_client
+
 
 # ══════════════════════════════════════════════════════════════════════════
 # УТИЛИТЫ
@@ -64,7 +66,7 @@ except ImportError:
 def check_model_in_ollama(model_name: str) -> bool:
     """Проверяет, установлена ли модель в Ollama локально."""
     try:
-        resp = requests.get(f"{OLLAMA_HOST}/api/tags", timeout=5)
+        resp = get_ollama_client().get("/api/tags", timeout=5)
         if resp.status_code == 200:
             for m in resp.json().get("models", []):
                 name = m.get("name", "")
@@ -151,7 +153,7 @@ def set_ollama_models_env_and_restart(new_models_dir: str) -> tuple:
         _time.sleep(3)
         for _ in range(10):
             try:
-                resp = requests.get(f"{OLLAMA_HOST}/api/tags", timeout=2)
+                resp = get_ollama_client().get("/api/tags", timeout=2)
                 if resp.status_code == 200:
                     return True, ""
             except Exception:
@@ -551,7 +553,7 @@ class _BaseDownloadDialog(QtWidgets.QDialog):
                         # Базовое имя: namespace/ModelName:tag → modelname
                         _base      = _re.sub(r'[-_]gguf.*$', '',
                                              _cmd_low.split("/")[-1].split(":")[0])
-                        _tags = requests.get(f"{OLLAMA_HOST}/api/tags", timeout=8).json()
+                        _tags = get_ollama_client().tags(timeout=8)
                         _names = [m.get("name", "").lower()
                                   for m in _tags.get("models", [])]
                         _model_ok = any(
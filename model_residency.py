@@ -0,0 +1,357 @@
+# ═══════════════════════════════════════════════════════════════════════
+# model_residency.py — планировщик размещения моделей Ollama в памяти
+#
+# Содержит:
+#   • KEEP_ALIVE_POLICY       — keep_alive по типу модели (чат / vision)
+#   • ModelResidencyManager   — опрос /api/ps, RAM-бюджет, LRU-вытеснение,
+#                               прогрев «следующей» модели, события load/evict
+#   • get_residency_manager() — общий экземпляр на всё приложение
+#
+# Раньше warm_up_model / unload_model / unload_all_models запускали по
+# неуправляемому daemon-потоку на каждый вызов, vision всегда слал
+# keep_alive=0 (перезагрузка модели с диска на каждое изображение), а чат
+# не слал keep_alive вовсе — модель выгружалась через дефолтные 5 минут
+# простоя Ollama. Теперь все загрузки/выгрузки идут через одну очередь
+# одного фонового потока, а каждый запрос получает keep_alive по политике.
+#
+# Использование:
+#   from model_residency import get_residency_manager
+#   _rm = get_residency_manager()
+#   payload = _rm.prepare(payload)          # keep_alive + LRU + место в RAM
+#   _rm.prewarm("qwen3:14b", reason="summarize")
+#   _rm.add_listener(lambda ev: print(ev)) # {"event": "load", "duration_ms": ...}
+# ═══════════════════════════════════════════════════════════════════════
+
+import os
+import time
+import queue
+import threading
+from collections import OrderedDict, deque
+
+import requests
+
+from ollama_client import get_ollama_client
+from context_sizer import get_context_sizer
+
+# ── Конфигурация ────────────────────────────────────────────────────────
+# Период опроса /api/ps (сек): синхронизация с тем, что Ollama выгрузила сама
+POLL_INTERVAL = 15.0
+
+# keep_alive по подстроке имени модели (первое совпадение), иначе DEFAULT.
+# Vision нужна эпизодически, но между изображениями одного диалога
+# перезагружать её с диска дороже, чем подержать несколько минут.
+KEEP_ALIVE_POLICY = [
+    ("vision", "5m"),
+    ("llava",  "5m"),
+]
+DEFAULT_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+# Запас на KV-cache поверх размера весов, пока /api/ps не сообщил реальный
+_KV_OVERHEAD = 1.2
+
+_MAX_EVENTS = 200
+
+
+def _default_ram_budget() -> int:
+    """RAM-бюджет под модели: AI_ASSISTANT_RAM_BUDGET_MB или 60% физической памяти."""
+    env = os.getenv("AI_ASSISTANT_RAM_BUDGET_MB", "").strip()
+    if env.isdigit():
+        return int(env) * 1024 * 1024
+    try:
+        total = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+        return int(total * 0.6)
+    except (ValueError, OSError, AttributeError):
+        # Windows: sysconf недоступен — консервативные 12 ГБ
+        return 12 * 1024 ** 3
+
+
+class ModelResidencyManager:
+    """
+    Следит за тем, какие модели загружены в Ollama, и решает, что
+    грузить и что выгружать.
+
+    Все операции загрузки/выгрузки выполняются последовательно в одном
+    фоновом потоке (или синхронно в вызывающем — synchronous=True).
+    """
+
+    def __init__(self, client=None, ram_budget_bytes: int = None,
+                 poll_interval: float = POLL_INTERVAL):
+        self._client = client or get_ollama_client()
+        self.ram_budget_bytes = ram_budget_bytes or _default_ram_budget()
+        self.poll_interval = poll_interval
+
+        self._lock = threading.RLock()
+        self._resident: dict = {}            # имя → размер в RAM (байт) по /api/ps
+        self._last_used = OrderedDict()      # имя → время последнего использования (LRU)
+        self._sizes: dict = {}               # имя → последний известный размер
+        self._ps_known = False               # был ли хоть один успешный опрос /api/ps
+        self._pending_warm: set = set()
+
+        self._tasks: queue.Queue = queue.Queue()
+        self._thread: threading.Thread = None
+        self._last_poll = 0.0
+
+        self._events = deque(maxlen=_MAX_EVENTS)
+        self._listeners: list = []
+
+    # ── Фоновый поток ─────────────────────────────────────────────────
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="ModelResidency",
+                                            daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        self.poll()
+        while True:
+            try:
+                task = self._tasks.get(timeout=self.poll_interval)
+            except queue.Empty:
+                task = None
+            if task is not None:
+                fn, args = task
+                try:
+                    fn(*args)
+                except Exception as e:
+                    print(f"[RESIDENCY] ⚠️ Ошибка задачи {fn.__name__}: {e}")
+            if time.monotonic() - self._last_poll >= self.poll_interval:
+                self.poll()
+
+    def _submit(self, fn, *args):
+        self.start()
+        self._tasks.put((fn, args))
+
+    # ── Состояние ─────────────────────────────────────────────────────
+    def poll(self) -> dict:
+        """Опрашивает /api/ps и синхронизирует список загруженных моделей."""
+        self._last_poll = time.monotonic()
+        try:
+            data = self._client.ps(timeout=3)
+        except Exception:
+            return dict(self._resident)
+        now_resident = {}
+        for m in data.get("models", []):
+            name = _canon(m.get("name") or m.get("model") or "")
+            if not name:
+                continue
+            size = int(m.get("size") or 0)
+            now_resident[name] = size
+            if size:
+                self._sizes[name] = size
+        with self._lock:
+            # Модели, которые Ollama выгрузила сама (истёк keep_alive)
+            for name in set(self._resident) - set(now_resident):
+                get_context_sizer().forget(name)
+                self._emit({"event": "evict", "model": name, "reason": "expired",
+                            "duration_ms": 0.0})
+            for name in set(now_resident) - set(self._resident):
+                self._last_used.setdefault(name, time.time())
+            self._resident = now_resident
+            self._ps_known = True
+        return dict(now_resident)
+
+    def resident_models(self) -> dict:
+        with self._lock:
+            return dict(self._resident)
+
+    def is_resident(self, model: str) -> bool:
+        with self._lock:
+            return _canon(model) in self._resident
+
+    def keep_alive_for(self, model: str) -> str:
+        low = (model or "").lower()
+        for pattern, keep_alive in KEEP_ALIVE_POLICY:
+            if pattern in low:
+                return keep_alive
+        return DEFAULT_KEEP_ALIVE
+
+    def touch(self, model: str):
+        model = _canon(model)
+        with self._lock:
+            self._last_used[model] = time.time()
+            self._last_used.move_to_end(model)
+
+    # ── Запросы ───────────────────────────────────────────────────────
+    def prepare(self, payload: dict) -> dict:
+        """
+        Готовит payload запроса к /api/chat или /api/generate:
+        проставляет keep_alive по политике и num_ctx (context_sizer),
+        отмечает использование (LRU) и, если модели нет в памяти,
+        освобождает под неё место в RAM-бюджете.
+        """
+        model = payload.get("model")
+        if not model:
+            return payload
+        payload = dict(payload)
+        payload.setdefault("keep_alive", self.keep_alive_for(model))
+        resident = not self._ps_known or self.is_resident(model)
+        payload = get_context_sizer().apply(payload, resident=resident)
+        self.touch(model)
+        if not resident:
+            self.ensure_capacity(model)
+        self.start()
+        return payload
+
+    def prewarm(self, model: str, reason: str = ""):
+        """Загружает модель заранее (в фоне), если её ещё нет в памяти."""
+        if not model or self.is_resident(model):
+            return
+        with self._lock:
+            if model in self._pending_warm:
+                return
+            self._pending_warm.add(model)
+        print(f"[RESIDENCY] 🔮 Прогрев заранее: {model} ({reason or 'prewarm'})")
+        self._submit(self._do_warm, model, reason or "prewarm")
+
+    def warm(self, model: str, reason: str = "", synchronous: bool = False):
+        """Загружает модель в память (по умолчанию — в фоновой очереди)."""
+        if synchronous:
+            self._do_warm(model, reason)
+        else:
+            with self._lock:
+                self._pending_warm.add(model)
+            self._submit(self._do_warm, model, reason)
+
+    def evict(self, model: str, reason: str = "", synchronous: bool = False,
+              timeout: float = 5):
+        """Выгружает модель из памяти Ollama (keep_alive=0)."""
+        if synchronous:
+            self._do_evict(model, reason, timeout)
+        else:
+            self._submit(self._do_evict, model, reason, timeout)
+
+    def evict_many(self, models: list, reason: str = "", synchronous: bool = False,
+                   timeout: float = 6):
+        for model in models:
+            self.evict(model, reason=reason, synchronous=synchronous, timeout=timeout)
+
+    def ensure_capacity(self, model: str):
+        """Вытесняет наименее недавно использованные модели, пока model не влезет в бюджет."""
+        model = _canon(model)
+        need = self._estimate_size(model)
+        with self._lock:
+            resident = dict(self._resident)
+            order = [m for m in self._last_used if m in resident]
+            order += [m for m in resident if m not in order]
+        used = sum(resident.values())
+        for victim in order:
+            if used + need <= self.ram_budget_bytes:
+                break
+            if victim == model:
+                continue
+            print(f"[RESIDENCY] 📤 RAM-бюджет: вытесняю {victim} ради {model}")
+            self._do_evict(victim, f"lru:{model}", 5)
+            used -= resident.get(victim, 0)
+
+    # ── События ───────────────────────────────────────────────────────
+    def add_listener(self, callback):
+        """callback(event: dict) — вызывается из фонового потока на каждое событие."""
+        self._listeners.append(callback)
+
+    def events(self, limit: int = 50) -> list:
+        return list(self._events)[-limit:]
+
+    def _emit(self, event: dict):
+        event.setdefault("ts", time.time())
+        self._events.append(event)
+        for cb in list(self._listeners):
+            try:
+                cb(event)
+            except Exception:
+                pass
+
+    # ── Реализация ────────────────────────────────────────────────────
+    def _estimate_size(self, model: str) -> int:
+        model = _canon(model)
+        if model in self._sizes:
+            return self._sizes[model]
+        try:
+            for m in self._client.tags(timeout=3).get("models", []):
+                if _canon(m.get("name", "")) == model:
+                    size = int(int(m.get("size") or 0) * _KV_OVERHEAD)
+                    self._sizes[model] = size
+                    return size
+        except Exception:
+            pass
+        return 0
+
+    def _do_warm(self, model: str, reason: str):
+        try:
+            if self.is_resident(model):
+                return
+            if self._ps_known:
+                self.ensure_capacity(model)
+            keep_alive = self.keep_alive_for(model)
+            print(f"[WARM_UP] 🔥 Загрузка модели в память: {model} (keep_alive={keep_alive})…")
+            t0 = time.perf_counter()
+            r = self._client.generate({
+                "model": model,
+                "prompt": "",
+                "keep_alive": keep_alive,
+                "stream": False,
+                "options": {"num_predict": 0,
+                            "num_ctx": get_context_sizer().warm_size(model)},
+            }, timeout=120)
+            duration_ms = (time.perf_counter() - t0) * 1000
+            if r.status_code != 200:
+                print(f"[WARM_UP] ⚠️ Статус {r.status_code} при прогреве {model}")
+                return
+            try:
+                load_ms = r.json().get("load_duration", 0) / 1e6
+            except Exception:
+                load_ms = 0.0
+            self.touch(model)
+            with self._lock:
+                self._resident.setdefault(_canon(model), self._sizes.get(_canon(model), 0))
+            self._emit({"event": "load", "model": model, "reason": reason,
+                        "duration_ms": round(duration_ms, 1),
+                        "load_duration_ms": round(load_ms, 1)})
+            print(f"[WARM_UP] ✅ Модель {model} загружена за {duration_ms:.0f} мс")
+            self.poll()
+        except requests.exceptions.ConnectionError:
+            print(f"[WARM_UP] ❌ Ollama недоступна на {self._client.host}. Запустите: ollama serve")
+        except Exception as e:
+            print(f"[WARM_UP] ⚠️ Ошибка прогрева {model}: {e}")
+        finally:
+            with self._lock:
+                self._pending_warm.discard(model)
+
+    def _do_evict(self, model: str, reason: str, timeout: float):
+        t0 = time.perf_counter()
+        try:
+            self._client.generate({"model": model, "keep_alive": 0}, timeout=timeout)
+        except Exception as e:
+            print(f"[UNLOAD] ⚠️ Не удалось выгрузить {model}: {e}")
+            return
+        duration_ms = (time.perf_counter() - t0) * 1000
+        get_context_sizer().forget(model)
+        with self._lock:
+            was_resident = self._resident.pop(_canon(model), None) is not None
+        if was_resident or not self._ps_known:
+            self._emit({"event": "evict", "model": model, "reason": reason,
+                        "duration_ms": round(duration_ms, 1)})
+        print(f"[UNLOAD] ✅ Выгружена из памяти: {model} ({duration_ms:.0f} мс)")
+
+
+def _canon(name: str) -> str:
+    """llama3 и llama3:latest — одна и та же модель: приводим к виду с тегом."""
+    if not name or ":" in name:
+        return name
+    return f"{name}:latest"
+
+
+# ── Общий экземпляр ─────────────────────────────────────────────────────
+_MANAGER: ModelResidencyManager = None
+_MANAGER_LOCK = threading.Lock()
+
+
+def get_residency_manager() -> ModelResidencyManager:
+    """Возвращает общий ModelResidencyManager (создаётся при первом обращении)."""
+    global _MANAGER
+    if _MANAGER is None:
+        with _MANAGER_LOCK:
+            if _MANAGER is None:
+                _MANAGER = ModelResidencyManager()
+    return _MANAGER
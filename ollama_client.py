@@ -0,0 +1,391 @@
+# ═══════════════════════════════════════════════════════════════════════
+# ollama_client.py — единый HTTP-клиент Ollama (пул соединений + retry)
+#
+# Содержит:
+#   • ENDPOINT_TIMEOUTS   — таймауты (connect, read) по эндпоинтам
+#   • OllamaClient        — keep-alive пул, общая retry-политика,
+#                           обёртки chat/generate/tags/ps
+#   • get_ollama_client() — общий экземпляр на всё приложение
+#   • OllamaCancelToken / cancel_scope() — жёсткая отмена: закрывает сокет
+#                           запроса из другого потока, Ollama бросает генерацию
+#   • join_cancel_scope() — тот же токен во вспомогательном потоке запроса
+#
+# Раньше только call_ollama_chat ходил через requests.Session, остальные
+# модули (стриминг, суммаризация, vision, warm-up/unload, пинг /api/tags)
+# вызывали голый requests.post/get — каждый вызов открывал новое
+# TCP-соединение. Теперь все вызовы Ollama идут через один пул.
+#
+# Использование:
+#   from ollama_client import get_ollama_client
+#   _client = get_ollama_client()
+#   r = _client.chat(payload)                 # POST /api/chat
+#   r = _client.chat(payload, stream=True)    # стриминг
+#   _client.is_alive()                        # пинг /api/tags
+#
+#   token = OllamaCancelToken()
+#   with cancel_scope(token):                 # все вызовы Ollama этого потока
+#       get_ai_response(...)                  # привязаны к token
+#   token.cancel()                            # из GUI-потока — мгновенный обрыв
+#   part = token.child()                      # отменяется вместе с token или отдельно
+#
+# run.py закрывает пул при выходе: get_ollama_client().close()
+# ═══════════════════════════════════════════════════════════════════════
+
+import os
+import time
+import socket
+import threading
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    from urllib3.util.retry import Retry
+except ImportError:
+    Retry = None
+
+# ── Конфигурация ────────────────────────────────────────────────────────
+OLLAMA_HOST: str = os.getenv("OLLAMA_HOST", "http://127.0.0.1:11434")
+
+# Таймауты по эндпоинтам: (connect, read). read=None — без ограничения
+# (стриминг: время между токенами контролирует сам вызывающий код).
+ENDPOINT_TIMEOUTS: dict = {
+    "/api/chat":     (10, 120),
+    "/api/generate": (10, 120),
+    "/api/tags":     (2, 5),
+    "/api/ps":       (2, 5),
+    "/api/show":     (2, 10),
+    "/api/pull":     (10, None),
+}
+DEFAULT_TIMEOUT = (10, 60)
+
+# Общая retry-политика: повторяем только установку соединения и
+# «сервер занят» (502/503/504). Чтение НЕ повторяем — иначе повторно
+# отправим уже выполняющуюся генерацию и удвоим нагрузку на модель.
+RETRY_TOTAL          = 2
+RETRY_BACKOFF        = 0.5
+RETRY_STATUS_CODES   = (502, 503, 504)
+
+# Размер пула: один пользовательский ход с поиском делает 3–5 вызовов,
+# плюс фоновые warm-up/unload — 8 соединений с запасом.
+POOL_MAXSIZE = 8
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# Жёсткая отмена запросов
+# ═══════════════════════════════════════════════════════════════════════
+# Проверка cancelled_flag между строками стрима не помогает во время
+# prompt-eval: пока модель читает 16k контекста, ни одной строки не
+# приходит и «Стоп» ничего не делает. Поэтому каждое соединение пула
+# запоминает токен отмены потока, который его использует, и token.cancel()
+# из другого потока делает shutdown() сокета — блокирующий recv сразу
+# падает, а Ollama видит разрыв соединения и прекращает генерацию.
+
+class OllamaCancelled(Exception):
+    """Запрос к Ollama прерван через OllamaCancelToken."""
+
+
+class OllamaCancelToken:
+    """
+    Токен отмены одного пользовательского запроса (всех вызовов Ollama,
+    сделанных внутри cancel_scope(token)).
+
+    cancel() можно вызывать из любого потока. time_to_abort_ms() —
+    сколько прошло от cancel() до фактического обрыва запроса.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._connections: set = set()
+        self._children: list = []
+        self._cancelled = False
+        self.cancel_requested_at: float = None
+        self.aborted_at: float = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def cancel(self):
+        with self._lock:
+            if self._cancelled:
+                return
+            self._cancelled = True
+            self.cancel_requested_at = time.perf_counter()
+            conns = list(self._connections)
+            children = list(self._children)
+        for conn in conns:
+            if getattr(conn, "_ollama_cancel_token", None) is self:
+                _abort_connection(conn)
+        if not conns:
+            # Активного запроса нет — отменять нечего, обрыв мгновенный
+            self.mark_aborted()
+        for child in children:
+            child.cancel()
+
+    def child(self) -> "OllamaCancelToken":
+        """
+        Токен части запроса: отменяется вместе с этим (кнопка «Стоп») или
+        сам по себе — не затрагивая остальной запрос.
+        """
+        token = OllamaCancelToken()
+        with self._lock:
+            if not self._cancelled:
+                self._children.append(token)
+                return token
+        token.cancel()
+        return token
+
+    def mark_aborted(self):
+        """Отмечает момент фактического обрыва (идемпотентно)."""
+        if self._cancelled and self.aborted_at is None:
+            self.aborted_at = time.perf_counter()
+
+    def time_to_abort_ms(self) -> float:
+        if self.cancel_requested_at is None:
+            return 0.0
+        end = self.aborted_at if self.aborted_at is not None else time.perf_counter()
+        return round((end - self.cancel_requested_at) * 1000, 1)
+
+    def _attach(self, conn):
+        with self._lock:
+            if self._cancelled:
+                raise OllamaCancelled("Запрос отменён до отправки")
+            self._connections.add(conn)
+
+    def _detach_all(self):
+        with self._lock:
+            self._connections.clear()
+
+
+_TLS = threading.local()
+
+
+def current_cancel_token() -> OllamaCancelToken:
+    """Токен отмены, активный в текущем потоке (или None)."""
+    return getattr(_TLS, "token", None)
+
+
+def is_cancelled() -> bool:
+    """True если запрос текущего потока был отменён через токен."""
+    token = current_cancel_token()
+    return token is not None and token.cancelled
+
+
+@contextmanager
+def cancel_scope(token: OllamaCancelToken):
+    """Привязывает все вызовы Ollama текущего потока к token."""
+    prev = current_cancel_token()
+    _TLS.token = token
+    try:
+        yield token
+    finally:
+        _TLS.token = prev
+        if token is not None:
+            token.mark_aborted()
+            token._detach_all()
+
+
+@contextmanager
+def join_cancel_scope(token: OllamaCancelToken):
+    """
+    Привязывает вспомогательный поток (стадия пайплайна) к токену чужого
+    cancel_scope. В отличие от cancel_scope, на выходе не отцепляет
+    соединения токена — ими может пользоваться поток-владелец.
+    """
+    prev = current_cancel_token()
+    _TLS.token = token
+    try:
+        yield token
+    finally:
+        _TLS.token = prev
+
+
+def _abort_connection(conn):
+    sock = getattr(conn, "sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+def _bind_connection(conn):
+    """Вызывается перед отправкой запроса: привязывает соединение к токену потока."""
+    token = current_cancel_token()
+    conn._ollama_cancel_token = token
+    if token is not None:
+        token._attach(conn)
+
+
+try:
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+    class _TrackedHTTPConnection(HTTPConnection):
+        def putrequest(self, *args, **kwargs):
+            _bind_connection(self)
+            return super().putrequest(*args, **kwargs)
+
+    class _TrackedHTTPSConnection(HTTPSConnection):
+        def putrequest(self, *args, **kwargs):
+            _bind_connection(self)
+            return super().putrequest(*args, **kwargs)
+
+    class _TrackedHTTPConnectionPool(HTTPConnectionPool):
+        ConnectionCls = _TrackedHTTPConnection
+
+    class _TrackedHTTPSConnectionPool(HTTPSConnectionPool):
+        ConnectionCls = _TrackedHTTPSConnection
+
+    _TRACKED_POOL_CLASSES = {
+        "http": _TrackedHTTPConnectionPool,
+        "https": _TrackedHTTPSConnectionPool,
+    }
+except ImportError:
+    _TRACKED_POOL_CLASSES = None
+
+
+class _CancellableAdapter(HTTPAdapter):
+    """HTTPAdapter, пул которого создаёт отслеживаемые соединения."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        if _TRACKED_POOL_CLASSES:
+            self.poolmanager.pool_classes_by_scheme = _TRACKED_POOL_CLASSES
+
+
+class OllamaClient:
+    """
+    HTTP-клиент Ollama с keep-alive пулом соединений.
+
+    Все методы возвращают requests.Response (или бросают исключения
+    requests) — разбор ответа и текст ошибок остаются у вызывающего кода,
+    как было до появления клиента.
+    """
+
+    def __init__(self, host: str = OLLAMA_HOST, pool_maxsize: int = POOL_MAXSIZE,
+                 max_retries: int = RETRY_TOTAL, timeouts: dict = None):
+        self.host = host.rstrip("/")
+        self.timeouts = dict(ENDPOINT_TIMEOUTS)
+        if timeouts:
+            self.timeouts.update(timeouts)
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json"})
+
+        if Retry is not None:
+            retry = Retry(
+                total=max_retries,
+                connect=max_retries,
+                read=0,
+                status=max_retries,
+                status_forcelist=RETRY_STATUS_CODES,
+                allowed_methods=frozenset({"GET", "POST", "DELETE"}),
+                backoff_factor=RETRY_BACKOFF,
+                raise_on_status=False,
+            )
+        else:
+            retry = max_retries
+        adapter = _CancellableAdapter(pool_connections=2, pool_maxsize=pool_maxsize,
+                                      max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    # ── Служебное ─────────────────────────────────────────────────────
+    def url(self, path: str) -> str:
+        return f"{self.host}{path}"
+
+    def timeout_for(self, path: str, timeout=None):
+        """
+        Таймаут для эндпоинта. Число из вызывающего кода трактуется как
+        read-таймаут (connect берётся из таблицы), кортеж — как есть.
+        """
+        connect, read = self.timeouts.get(path, DEFAULT_TIMEOUT)
+        if timeout is None:
+            return (connect, read)
+        if isinstance(timeout, tuple):
+            return timeout
+        return (min(connect, timeout), timeout)
+
+    def request(self, method: str, path: str, timeout=None, **kwargs) -> requests.Response:
+        """
+        Выполняет запрос. Если токен отмены текущего потока сработал —
+        бросает OllamaCancelled вместо ошибки соединения.
+        """
+        if is_cancelled():
+            raise OllamaCancelled(f"{method} {path}")
+        try:
+            return self.session.request(method, self.url(path),
+                                        timeout=self.timeout_for(path, timeout), **kwargs)
+        except (requests.exceptions.RequestException, OllamaCancelled):
+            if is_cancelled():
+                current_cancel_token().mark_aborted()
+                raise OllamaCancelled(f"{method} {path}") from None
+            raise
+
+    def get(self, path: str, timeout=None, **kwargs) -> requests.Response:
+        return self.request("GET", path, timeout=timeout, **kwargs)
+
+    def post(self, path: str, json: dict = None, timeout=None, stream: bool = False,
+             **kwargs) -> requests.Response:
+        return self.request("POST", path, timeout=timeout, json=json, stream=stream, **kwargs)
+
+    # ── Эндпоинты ─────────────────────────────────────────────────────
+    def chat(self, payload: dict, timeout=None, stream: bool = False) -> requests.Response:
+        """POST /api/chat. При stream=True ответ нужно закрыть (with ... as r)."""
+        payload = dict(payload)
+        payload["stream"] = stream
+        if stream and timeout is None:
+            timeout = (self.timeouts["/api/chat"][0], None)
+        return self.post("/api/chat", json=payload, timeout=timeout, stream=stream)
+
+    def generate(self, payload: dict, timeout=None) -> requests.Response:
+        """POST /api/generate (warm-up, выгрузка keep_alive=0)."""
+        payload = dict(payload)
+        payload.setdefault("stream", False)
+        return self.post("/api/generate", json=payload, timeout=timeout)
+
+    def tags(self, timeout=None) -> dict:
+        """GET /api/tags → JSON. Бросает исключение если Ollama недоступна."""
+        r = self.get("/api/tags", timeout=timeout)
+        r.raise_for_status()
+        return r.json()
+
+    def ps(self, timeout=None) -> dict:
+        """GET /api/ps → JSON со списком загруженных в память моделей."""
+        r = self.get("/api/ps", timeout=timeout)
+        r.raise_for_status()
+        return r.json()
+
+    def is_alive(self, timeout=None) -> bool:
+        """True если Ollama отвечает на /api/tags."""
+        try:
+            return self.get("/api/tags", timeout=timeout).status_code == 200
+        except Exception:
+            return False
+
+    def close(self):
+        try:
+            self.session.close()
+        except Exception:
+            pass
+
+
+# ── Общий экземпляр ─────────────────────────────────────────────────────
+_CLIENT: OllamaClient = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def get_ollama_client() -> OllamaClient:
+    """Возвращает общий OllamaClient (создаётся при первом обращении)."""
+    global _CLIENT
+    if _CLIENT is None:
+        with _CLIENT_LOCK:
+            if _CLIENT is None:
+                _CLIENT = OllamaClient()
+    return _CLIENT
@@ -51,7 +51,8 @@ def is_ollama_running(timeout: float = 2.0) -> bool:
     if _req is None:
         return False
     try:
-        return _req.get(f"{OLLAMA_HOST}/api/tags", timeout=timeout).status_code == 200
+        from ollama_client import get_ollama_client
+        return get_ollama_client().is_alive(timeout=timeout)
     except Exception:
         return False
 
@@ -0,0 +1,250 @@
+# ═══════════════════════════════════════════════════════════════════════
+# ollama_metrics.py — метрики генерации Ollama по каждому запросу
+#
+# Содержит:
+#   • STAGE_*                  — этапы пайплайна (main, summarize, ...)
+#   • set_metrics_context()    — model_key / ai_mode / chat_id текущего потока
+#   • record_ollama_metrics()  — запись метрик из JSON-ответа Ollama
+#   • OllamaMetricsStore       — таблица ollama_metrics + запросы к ней
+#   • get_metrics_store()      — общий экземпляр
+#
+# Финальный чанк стрима и нестриминговый ответ /api/chat содержат
+# eval_count / eval_duration / prompt_eval_count / prompt_eval_duration /
+# load_duration (наносекунды). Раньше они выбрасывались — теперь каждая
+# генерация пишется в ollama_metrics.db, и можно сравнить модели:
+#
+#   from ollama_metrics import get_metrics_store
+#   get_metrics_store().model_summary(ai_mode="быстрый")
+#   → [{"model": "qwen3:14b", "tokens_per_sec": 21.4, "ttft_ms": 840.0, ...}]
+# ═══════════════════════════════════════════════════════════════════════
+
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+METRICS_DB = "ollama_metrics.db"
+
+# ── Этапы пайплайна ─────────────────────────────────────────────────────
+STAGE_MAIN = "main"
+STAGE_SUMMARIZE = "summarize"
+STAGE_TRANSLATE = "translate"
+STAGE_VALIDATE_REGEN = "validate-regen"
+STAGE_REGEN = "regen"
+STAGE_VISION = "vision"
+
+_NS = 1_000_000  # нс → мс
+
+# ── Контекст текущего запроса (на поток) ────────────────────────────────
+_TLS = threading.local()
+
+
+def set_metrics_context(model_key: str = None, ai_mode: str = None, chat_id=None):
+    """
+    Запоминает теги текущего запроса пользователя для всех вызовов Ollama
+    из этого потока. Вызывается в начале get_ai_response.
+    """
+    _TLS.context = {"model_key": model_key, "ai_mode": ai_mode, "chat_id": chat_id}
+
+
+def get_metrics_context() -> dict:
+    return dict(getattr(_TLS, "context", None) or {})
+
+
+class OllamaMetricsStore:
+    """Хранилище метрик: одна строка на один вызов /api/chat или /api/generate."""
+
+    def __init__(self, db_path: str = METRICS_DB):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self.init_db()
+
+    def init_db(self):
+        conn = sqlite3.connect(self.db_path)
+        cur = conn.cursor()
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS ollama_metrics (
+            id                   INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts                   REAL    NOT NULL,
+            model                TEXT    NOT NULL,
+            model_key            TEXT,
+            ai_mode              TEXT,
+            stage                TEXT    NOT NULL,
+            chat_id              INTEGER,
+            streamed             INTEGER NOT NULL DEFAULT 0,
+            eval_count           INTEGER,
+            eval_ms              REAL,
+            prompt_eval_count    INTEGER,
+            prompt_eval_ms       REAL,
+            load_ms              REAL,
+            total_ms             REAL,
+            ttft_ms              REAL,
+            wall_ms              REAL
+        )
+        """)
+        cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_metrics_model_stage
+        ON ollama_metrics(model, stage, ts)
+        """)
+        conn.commit()
+        conn.close()
+
+    # ── Запись ───────────────────────────────────────────────────────
+    def record(self, model: str, stage: str, response: dict, *,
+               model_key: str = None, ai_mode: str = None, chat_id=None,
+               streamed: bool = False, ttft_ms: float = None,
+               wall_ms: float = None) -> Optional[dict]:
+        """
+        Сохраняет метрики из финального JSON ответа Ollama.
+        ttft_ms — измеренное время до первого токена (только для стрима);
+        без него TTFT считается как load + prompt_eval.
+        """
+        if not model or not isinstance(response, dict):
+            return None
+
+        def _ms(key):
+            v = response.get(key)
+            return round(v / _NS, 2) if isinstance(v, (int, float)) else None
+
+        row = {
+            "ts": time.time(),
+            "model": model,
+            "model_key": model_key,
+            "ai_mode": ai_mode,
+            "stage": stage,
+            "chat_id": chat_id if isinstance(chat_id, int) else None,
+            "streamed": 1 if streamed else 0,
+            "eval_count": response.get("eval_count"),
+            "eval_ms": _ms("eval_duration"),
+            "prompt_eval_count": response.get("prompt_eval_count"),
+            "prompt_eval_ms": _ms("prompt_eval_duration"),
+            "load_ms": _ms("load_duration"),
+            "total_ms": _ms("total_duration"),
+            "ttft_ms": round(ttft_ms, 2) if ttft_ms is not None else None,
+            "wall_ms": round(wall_ms, 2) if wall_ms is not None else None,
+        }
+        if row["ttft_ms"] is None and row["prompt_eval_ms"] is not None:
+            row["ttft_ms"] = round((row["load_ms"] or 0) + row["prompt_eval_ms"], 2)
+
+        cols = ", ".join(row)
+        marks = ", ".join("?" for _ in row)
+        try:
+            with self._lock:
+                conn = sqlite3.connect(self.db_path)
+                conn.execute(f"INSERT INTO ollama_metrics ({cols}) VALUES ({marks})",
+                             tuple(row.values()))
+                conn.commit()
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"[METRICS] ⚠️ Не удалось записать метрики: {e}")
+            return None
+
+        tps = (row["eval_count"] or 0) / (row["eval_ms"] / 1000) if row["eval_ms"] else 0.0
+        print(f"[METRICS] {stage} · {model}: {row['eval_count'] or 0} ток. "
+              f"@ {tps:.1f} ток/с, TTFT {row['ttft_ms'] or 0:.0f} мс, "
+              f"загрузка {row['load_ms'] or 0:.0f} мс")
+        return row
+
+    # ── Запросы ──────────────────────────────────────────────────────
+    def model_summary(self, model: str = None, stage: str = None,
+                      ai_mode: str = None, since: float = None) -> List[dict]:
+        """
+        Сводка по моделям: средние tokens/s (генерация и prompt-eval),
+        time-to-first-token и время загрузки.
+        Фильтры необязательные; since — unix-время нижней границы.
+        """
+        where, args = [], []
+        for col, val in (("model", model), ("stage", stage), ("ai_mode", ai_mode)):
+            if val is not None:
+                where.append(f"{col} = ?")
+                args.append(val)
+        if since is not None:
+            where.append("ts >= ?")
+            args.append(since)
+        sql = """
+        SELECT model,
+               COUNT(*),
+               SUM(eval_count) * 1000.0 / NULLIF(SUM(eval_ms), 0),
+               SUM(prompt_eval_count) * 1000.0 / NULLIF(SUM(prompt_eval_ms), 0),
+               AVG(ttft_ms),
+               AVG(load_ms),
+               MAX(load_ms),
+               AVG(wall_ms)
+        FROM ollama_metrics
+        """
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " GROUP BY model ORDER BY model"
+        conn = sqlite3.connect(self.db_path)
+        rows = conn.execute(sql, args).fetchall()
+        conn.close()
+
+        def _r(v):
+            return round(v, 1) if v is not None else None
+
+        return [{
+            "model": r[0],
+            "requests": r[1],
+            "tokens_per_sec": _r(r[2]),
+            "prompt_tokens_per_sec": _r(r[3]),
+            "ttft_ms": _r(r[4]),
+            "load_ms": _r(r[5]),
+            "max_load_ms": _r(r[6]),
+            "wall_ms": _r(r[7]),
+        } for r in rows]
+
+    def tokens_per_second(self, model: str, stage: str = None) -> Optional[float]:
+        rows = self.model_summary(model=model, stage=stage)
+        return rows[0]["tokens_per_sec"] if rows else None
+
+    def time_to_first_token(self, model: str, stage: str = None) -> Optional[float]:
+        rows = self.model_summary(model=model, stage=stage)
+        return rows[0]["ttft_ms"] if rows else None
+
+    def load_time(self, model: str) -> Optional[float]:
+        rows = self.model_summary(model=model)
+        return rows[0]["load_ms"] if rows else None
+
+    def recent(self, limit: int = 50, chat_id: int = None) -> List[dict]:
+        """Последние записи (новые первыми), опционально по одному чату."""
+        sql = "SELECT * FROM ollama_metrics"
+        args = []
+        if chat_id is not None:
+            sql += " WHERE chat_id = ?"
+            args.append(chat_id)
+        sql += " ORDER BY id DESC LIMIT ?"
+        args.append(limit)
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        rows = [dict(r) for r in conn.execute(sql, args).fetchall()]
+        conn.close()
+        return rows
+
+
+# ── Общий экземпляр ─────────────────────────────────────────────────────
+_STORE: OllamaMetricsStore = None
+_STORE_LOCK = threading.Lock()
+
+
+def get_metrics_store() -> OllamaMetricsStore:
+    global _STORE
+    if _STORE is None:
+        with _STORE_LOCK:
+            if _STORE is None:
+                _STORE = OllamaMetricsStore()
+    return _STORE
+
+
+def record_ollama_metrics(model: str, response: dict, stage: str = STAGE_MAIN, **kwargs):
+    """
+    Записывает метрики ответа с тегами из set_metrics_context().
+    Никогда не бросает исключений — метрики не должны ломать ответ.
+    """
+    try:
+        tags = get_metrics_context()
+        tags.update({k: v for k, v in kwargs.items() if k in tags and v is not None})
+        extra = {k: v for k, v in kwargs.items() if k not in tags}
+        return get_metrics_store().record(model, stage, response, **tags, **extra)
+    except Exception as e:
+        print(f"[METRICS] ⚠️ {e}")
+        return None
@@ -0,0 +1,613 @@
+#!/usr/bin/env python3
+# ═══════════════════════════════════════════════════════════════════════
+# ollama_standin.py — локальная подмена Ollama для тестов и бенчмарков
+#
+# Содержит:
+#   • StandInConfig     — задержки, ток/с, модели, инъекция сбоев
+#   • Cassette          — запись/воспроизведение сессий (JSON-файл)
+#   • OllamaStandIn     — HTTP-сервер: /api/chat, /api/generate, /api/tags,
+#                         /api/ps, /api/pull, /api/show
+#
+# Без настоящей Ollama и моделей нельзя было прогнать get_ai_response,
+# call_ollama_chat, warm_up_model или загрузчик. Подмена слушает на
+# 127.0.0.1 и говорит тем же NDJSON-протоколом, поэтому приложение
+# направляется на неё обычной переменной OLLAMA_HOST.
+#
+# Режимы:
+#   synthetic — ответы генерируются (скорость, задержки, сбои из конфига)
+#   record    — запросы проксируются в настоящую Ollama и пишутся в кассету
+#   replay    — ответы берутся из кассеты с исходными таймингами
+#               (replay_speed=0 — без задержек)
+#
+# Использование:
+#   python ollama_standin.py --port 11500 --tps 25 --fail-rate 0.05
+#   python ollama_standin.py --mode record --cassette session.json
+#   OLLAMA_HOST=http://127.0.0.1:11500 python run.py
+#
+#   from ollama_standin import OllamaStandIn, StandInConfig
+#   with OllamaStandIn(StandInConfig(tokens_per_sec=50)) as srv:
+#       os.environ["OLLAMA_HOST"] = srv.url   # до импорта ollama_client
+# ═══════════════════════════════════════════════════════════════════════
+
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import requests
+
+_NS = 1_000_000_000
+
+# Модели, которые подмена «знает» по умолчанию (имя, размер в байтах)
+DEFAULT_MODELS = [
+    ("llama3:latest",        4_661_224_676),
+    ("deepseek-llm:7b-chat", 4_000_473_121),
+    ("deepseek-r1:8b",       5_225_376_047),
+    ("mistral-nemo:12b",     7_071_713_232),
+    ("qwen3:14b",            9_276_198_565),
+    ("llava:7b",             4_733_363_377),
+]
+
+# Поля запроса, не влияющие на ответ (ключ кассеты их игнорирует)
+_KEY_IGNORED_FIELDS = ("stream", "keep_alive")
+_KEY_IGNORED_OPTIONS = ("num_ctx", "num_thread", "num_gpu", "num_batch")
+
+
+class StandInConfig:
+    """Параметры синтетического режима и инъекции сбоев."""
+
+    def __init__(self, models=None, latency_ms: float = 20.0, load_ms: float = 800.0,
+                 tokens_per_sec: float = 30.0, prompt_tokens_per_sec: float = 400.0,
+                 fail_rate: float = 0.0, fail_status: int = 503,
+                 disconnect_rate: float = 0.0, reply=None, seed: int = None,
+                 mode: str = "synthetic", cassette_path: str = None,
+                 upstream: str = "http://127.0.0.1:11434", replay_speed: float = 1.0):
+        self.models = list(models or DEFAULT_MODELS)
+        self.latency_ms = latency_ms              # задержка до первого байта
+        self.load_ms = load_ms                    # «загрузка» модели, которой нет в памяти
+        self.tokens_per_sec = tokens_per_sec      # скорость генерации
+        self.prompt_tokens_per_sec = prompt_tokens_per_sec
+        self.fail_rate = fail_rate                # доля запросов с HTTP fail_status
+        self.fail_status = fail_status
+        self.disconnect_rate = disconnect_rate    # доля стримов, обрываемых на середине
+        self.reply = reply                        # fn(request_body) -> str
+        self.random = random.Random(seed)
+        self.mode = mode
+        self.cassette_path = cassette_path
+        self.upstream = upstream.rstrip("/")
+        self.replay_speed = replay_speed
+
+
+def _canon(name: str) -> str:
+    if not name or ":" in name:
+        return name
+    return f"{name}:latest"
+
+
+def cassette_key(path: str, body: dict) -> str:
+    """Ключ взаимодействия: путь + всё, что определяет ответ."""
+    body = {k: v for k, v in (body or {}).items() if k not in _KEY_IGNORED_FIELDS}
+    if isinstance(body.get("options"), dict):
+        body["options"] = {k: v for k, v in body["options"].items()
+                           if k not in _KEY_IGNORED_OPTIONS}
+    if not body.get("options"):
+        body.pop("options", None)
+    if body.get("model"):
+        body["model"] = _canon(body["model"])
+    raw = json.dumps([path, body], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# КАССЕТА
+# ═══════════════════════════════════════════════════════════════════════
+
+class Cassette:
+    """
+    JSON-файл с записанными взаимодействиями:
+        {"version": 1, "interactions": [{"key", "path", "request", "status",
+         "stream", "body" | "chunks": [{"delay_ms", "body"}], "elapsed_ms"}]}
+    Одинаковые запросы воспроизводятся по кругу в порядке записи.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.interactions: list = []
+        self._cursor: dict = {}
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.interactions = json.load(f).get("interactions", [])
+            print(f"[STANDIN] 📼 Кассета {path}: {len(self.interactions)} записей")
+
+    def find(self, key: str):
+        with self._lock:
+            matches = [i for i in self.interactions if i["key"] == key]
+            if not matches:
+                return None
+            n = self._cursor.get(key, 0)
+            self._cursor[key] = n + 1
+            return matches[n % len(matches)]
+
+    def add(self, interaction: dict):
+        with self._lock:
+            self.interactions.append(interaction)
+            self._save_locked()
+
+    def _save_locked(self):
+        if not self.path:
+            return
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "interactions": self.interactions}, f,
+                      ensure_ascii=False, indent=1)
+        os.replace(tmp, self.path)
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# СИНТЕТИЧЕСКАЯ МОДЕЛЬ
+# ═══════════════════════════════════════════════════════════════════════
+
+class _SyntheticBackend:
+    """Состояние «сервера»: загруженные модели, KV-cache префикса, num_ctx."""
+
+    def __init__(self, config: StandInConfig):
+        self.config = config
+        self._lock = threading.Lock()
+        self.loaded: dict = {}        # модель → {"expires_at", "num_ctx", "size"}
+        self._last_prompt: dict = {}  # модель → текст прошлого промпта (для prompt-cache)
+
+    def _size(self, model: str) -> int:
+        for name, size in self.config.models:
+            if _canon(name) == _canon(model):
+                return size
+        return 0
+
+    def known(self, model: str) -> bool:
+        return any(_canon(n) == _canon(model) for n, _ in self.config.models)
+
+    @staticmethod
+    def _keep_alive_seconds(value) -> float:
+        if value is None:
+            return 300.0
+        if isinstance(value, (int, float)):
+            return float(value)
+        value = str(value).strip()
+        units = {"s": 1, "m": 60, "h": 3600}
+        if value and value[-1] in units:
+            return float(value[:-1]) * units[value[-1]]
+        return float(value)
+
+    def ensure_loaded(self, model: str, body: dict) -> float:
+        """Возвращает время «загрузки» (сек): 0, если модель уже в памяти с тем же num_ctx."""
+        model = _canon(model)
+        options = body.get("options") or {}
+        num_ctx = options.get("num_ctx", 2048)
+        keep = self._keep_alive_seconds(body.get("keep_alive"))
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            entry = self.loaded.get(model)
+            reload = entry is None or entry["num_ctx"] != num_ctx
+            if keep <= 0:
+                self.loaded.pop(model, None)
+                return 0.0
+            self.loaded[model] = {"expires_at": now + keep, "num_ctx": num_ctx,
+                                  "size": self._size(model)}
+            if reload:
+                self._last_prompt.pop(model, None)
+        return self.config.load_ms / 1000 if reload else 0.0
+
+    def _expire(self, now: float):
+        for name in [n for n, e in self.loaded.items() if e["expires_at"] < now]:
+            del self.loaded[name]
+            self._last_prompt.pop(name, None)
+
+    def prompt_eval(self, model: str, text: str) -> tuple:
+        """(токенов в промпте, токенов реально прогнанных) с учётом общего префикса."""
+        model = _canon(model)
+        total = max(1, len(text) // 4)
+        with self._lock:
+            prev = self._last_prompt.get(model, "")
+            self._last_prompt[model] = text
+        common = 0
+        for a, b in zip(prev, text):
+            if a != b:
+                break
+            common += 1
+        evaluated = max(1, total - common // 4)
+        return total, evaluated
+
+    def reply_text(self, body: dict) -> str:
+        if self.config.reply is not None:
+            return self.config.reply(body)
+        if body.get("messages"):
+            last = body["messages"][-1].get("content", "")
+        else:
+            last = body.get("prompt", "")
+        words = last.split()[:12]
+        return ("Это ответ локальной подмены Ollama. Вы спросили: "
+                + " ".join(words) + ". Ответ сгенерирован для проверки пайплайна.")
+
+    def ps(self) -> list:
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            return [{
+                "name": name, "model": name, "size": e["size"],
+                "size_vram": 0, "context_length": e["num_ctx"],
+                "expires_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(e["expires_at"])),
+            } for name, e in self.loaded.items()]
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# HTTP
+# ═══════════════════════════════════════════════════════════════════════
+
+def _make_handler(server: "OllamaStandIn"):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):
+            if server.verbose:
+                print(f"[STANDIN] {self.address_string()} {fmt % args}")
+
+        # ── Ответы ────────────────────────────────────────────────────
+        def _send_json(self, status: int, obj):
+            data = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _start_stream(self, status: int = 200):
+            self.send_response(status)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+        def _write_chunk(self, obj):
+            line = (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+            self.wfile.write(f"{len(line):X}\r\n".encode("ascii") + line + b"\r\n")
+            self.wfile.flush()
+
+        def _end_stream(self):
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+
+        def _read_body(self) -> dict:
+            length = int(self.headers.get("Content-Length") or 0)
+            if not length:
+                return {}
+            try:
+                return json.loads(self.rfile.read(length).decode("utf-8"))
+            except ValueError:
+                return {}
+
+        # ── Маршрутизация ─────────────────────────────────────────────
+        def do_HEAD(self):
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def do_GET(self):
+            path = urlsplit(self.path).path
+            server.count(path)
+            if path in ("/", ""):
+                data = b"Ollama is running"
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            elif path in ("/api/tags", "/api/ps"):
+                self._dispatch(path, {})
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            path = urlsplit(self.path).path
+            server.count(path)
+            body = self._read_body()
+            self._dispatch(path, body)
+
+        def _dispatch(self, path: str, body: dict):
+            try:
+                if server.config.mode == "record":
+                    self._record(path, body)
+                elif server.config.mode == "replay":
+                    self._replay(path, body)
+                else:
+                    self._synthetic(path, body)
+            except (BrokenPipeError, ConnectionResetError):
+                # Клиент закрыл соединение (например, «Стоп» в приложении)
+                server.count("_client_aborts")
+
+        # ── synthetic ─────────────────────────────────────────────────
+        def _synthetic(self, path: str, body: dict):
+            cfg = server.config
+            if path not in ("/api/tags", "/api/ps") and cfg.random.random() < cfg.fail_rate:
+                self._send_json(cfg.fail_status, {"error": "injected failure"})
+                return
+            if path == "/api/tags":
+                self._send_json(200, {"models": [
+                    {"name": n, "model": n, "size": s, "modified_at": "2024-01-01T00:00:00Z"}
+                    for n, s in cfg.models]})
+                return
+            if path == "/api/ps":
+                self._send_json(200, {"models": server.backend.ps()})
+                return
+            if path == "/api/show":
+                if not server.backend.known(body.get("model") or body.get("name", "")):
+                    self._send_json(404, {"error": "model not found"})
+                    return
+                self._send_json(200, {"modelfile": "", "parameters": "", "template": "",
+                                      "details": {"format": "gguf"}})
+                return
+            if path == "/api/pull":
+                self._pull(body)
+                return
+            if path in ("/api/chat", "/api/generate"):
+                self._generate(path, body)
+                return
+            self._send_json(404, {"error": "not found"})
+
+        def _pull(self, body: dict):
+            name = body.get("model") or body.get("name") or ""
+            steps = [{"status": "pulling manifest"}]
+            total = 1_000_000
+            for done in range(0, total + 1, total // 4):
+                steps.append({"status": f"pulling {name}", "digest": "sha256:standin",
+                              "total": total, "completed": done})
+            steps += [{"status": "verifying sha256 digest"}, {"status": "success"}]
+            if body.get("stream") is False:
+                time.sleep(server.config.latency_ms / 1000)
+                self._send_json(200, steps[-1])
+                return
+            self._start_stream()
+            for step in steps:
+                time.sleep(server.config.latency_ms / 1000)
+                self._write_chunk(step)
+            self._end_stream()
+
+        def _generate(self, path: str, body: dict):
+            cfg = server.config
+            backend = server.backend
+            model = body.get("model", "")
+            if not backend.known(model):
+                self._send_json(404, {"error": f"model '{model}' not found"})
+                return
+            t0 = time.perf_counter()
+            time.sleep(cfg.latency_ms / 1000)
+            load_s = backend.ensure_loaded(model, body)
+            time.sleep(load_s)
+
+            is_chat = path == "/api/chat"
+            if is_chat:
+                prompt_text = "".join(f"<{m.get('role')}>{m.get('content', '')}"
+                                      for m in body.get("messages") or [])
+            else:
+                prompt_text = body.get("prompt", "")
+            # Только загрузка/выгрузка (warm_up, keep_alive=0)
+            options = body.get("options") or {}
+            if (not is_chat and not prompt_text) or options.get("num_predict") == 0:
+                self._send_json(200, {"model": model, "created_at": _now_iso(),
+                                      "response": "", "done": True,
+                                      "done_reason": "load" if body.get("keep_alive") != 0 else "unload",
+                                      "load_duration": int(load_s * _NS),
+                                      "total_duration": int((time.perf_counter() - t0) * _NS)})
+                return
+
+            prompt_total, prompt_eval = backend.prompt_eval(model, prompt_text)
+            prompt_s = prompt_eval / max(cfg.prompt_tokens_per_sec, 1e-6)
+            time.sleep(prompt_s)
+
+            words = backend.reply_text(body).split(" ")
+            limit = options.get("num_predict")
+            if isinstance(limit, int) and limit > 0:
+                words = words[:limit]
+            tokens = [w if i == 0 else " " + w for i, w in enumerate(words)]
+            per_token = 1.0 / max(cfg.tokens_per_sec, 1e-6)
+            stream = body.get("stream", True)
+            drop_at = (cfg.random.randrange(1, max(2, len(tokens)))
+                       if stream and cfg.random.random() < cfg.disconnect_rate else None)
+
+            def _piece(text: str, done: bool = False) -> dict:
+                obj = {"model": model, "created_at": _now_iso(), "done": done}
+                if is_chat:
+                    obj["message"] = {"role": "assistant", "content": text}
+                else:
+                    obj["response"] = text
+                return obj
+
+            def _final(gen_s: float) -> dict:
+                obj = _piece("", done=True)
+                obj.update({
+                    "done_reason": "stop",
+                    "total_duration": int((time.perf_counter() - t0) * _NS),
+                    "load_duration": int(load_s * _NS),
+                    "prompt_eval_count": prompt_eval,
+                    "prompt_eval_duration": int(prompt_s * _NS),
+                    "eval_count": len(tokens),
+                    "eval_duration": int(gen_s * _NS),
+                })
+                return obj
+
+            t_gen = time.perf_counter()
+            if not stream:
+                time.sleep(per_token * len(tokens))
+                final = _final(time.perf_counter() - t_gen)
+                if is_chat:
+                    final["message"] = {"role": "assistant", "content": "".join(tokens)}
+                else:
+                    final["response"] = "".join(tokens)
+                self._send_json(200, final)
+                return
+
+            self._start_stream()
+            for i, tok in enumerate(tokens):
+                if drop_at is not None and i == drop_at:
+                    server.count("_injected_disconnects")
+                    self.close_connection = True
+                    return
+                time.sleep(per_token)
+                self._write_chunk(_piece(tok))
+            self._write_chunk(_final(time.perf_counter() - t_gen))
+            self._end_stream()
+
+        # ── record ────────────────────────────────────────────────────
+        def _record(self, path: str, body: dict):
+            cfg = server.config
+            url = cfg.upstream + path
+            t0 = time.perf_counter()
+            stream = path in ("/api/chat", "/api/generate", "/api/pull") and body.get("stream", True)
+            if path in ("/api/tags", "/api/ps"):
+                r = requests.get(url, timeout=30)
+            else:
+                r = requests.post(url, json=body, stream=bool(stream), timeout=(10, None))
+            interaction = {"key": cassette_key(path, body), "path": path, "request": body,
+                           "status": r.status_code, "stream": bool(stream) and r.ok}
+            if interaction["stream"]:
+                self._start_stream(r.status_code)
+                chunks, last = [], time.perf_counter()
+                for line in r.iter_lines():
+                    if not line:
+                        continue
+                    now = time.perf_counter()
+                    obj = json.loads(line)
+                    chunks.append({"delay_ms": round((now - last) * 1000, 2), "body": obj})
+                    last = now
+                    self._write_chunk(obj)
+                self._end_stream()
+                interaction["chunks"] = chunks
+            else:
+                try:
+                    obj = r.json()
+                except ValueError:
+                    obj = {"error": r.text}
+                interaction["body"] = obj
+                self._send_json(r.status_code, obj)
+            interaction["elapsed_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+            server.cassette.add(interaction)
+
+        # ── replay ────────────────────────────────────────────────────
+        def _replay(self, path: str, body: dict):
+            speed = server.config.replay_speed
+            hit = server.cassette.find(cassette_key(path, body))
+            if hit is None:
+                server.count("_replay_misses")
+                self._send_json(404, {"error": "no recorded interaction for this request"})
+                return
+            if not hit.get("stream"):
+                if speed:
+                    time.sleep(hit.get("elapsed_ms", 0) / 1000 / speed)
+                self._send_json(hit["status"], hit["body"])
+                return
+            self._start_stream(hit["status"])
+            for chunk in hit["chunks"]:
+                if speed:
+                    time.sleep(chunk["delay_ms"] / 1000 / speed)
+                self._write_chunk(chunk["body"])
+            self._end_stream()
+
+    return Handler
+
+
+def _now_iso() -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+
+class OllamaStandIn:
+    """HTTP-сервер подмены. start() запускает его в фоновом потоке."""
+
+    def __init__(self, config: StandInConfig = None, host: str = "127.0.0.1",
+                 port: int = 0, verbose: bool = False):
+        self.config = config or StandInConfig()
+        self.verbose = verbose
+        self.backend = _SyntheticBackend(self.config)
+        self.cassette = Cassette(self.config.cassette_path)
+        self._counts: dict = {}
+        self._counts_lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), _make_handler(self))
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, name: str):
+        with self._counts_lock:
+            self._counts[name] = self._counts.get(name, 0) + 1
+
+    def stats(self) -> dict:
+        with self._counts_lock:
+            return dict(self._counts)
+
+    def start(self) -> "OllamaStandIn":
+        self._thread = threading.Thread(target=self._httpd.serve_forever,
+                                        name="OllamaStandIn", daemon=True)
+        self._thread.start()
+        print(f"[STANDIN] ▶ {self.config.mode} на {self.url}")
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Локальная подмена Ollama")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=11500)
+    p.add_argument("--mode", choices=("synthetic", "record", "replay"), default="synthetic")
+    p.add_argument("--cassette", help="файл кассеты (record/replay)")
+    p.add_argument("--upstream", default="http://127.0.0.1:11434", help="настоящая Ollama для record")
+    p.add_argument("--latency", type=float, default=20.0, help="мс до первого байта")
+    p.add_argument("--load", type=float, default=800.0, help="мс «загрузки» модели")
+    p.add_argument("--tps", type=float, default=30.0, help="токенов/с генерации")
+    p.add_argument("--prompt-tps", type=float, default=400.0, help="токенов/с prompt-eval")
+    p.add_argument("--fail-rate", type=float, default=0.0)
+    p.add_argument("--fail-status", type=int, default=503)
+    p.add_argument("--disconnect-rate", type=float, default=0.0)
+    p.add_argument("--replay-speed", type=float, default=1.0, help="0 — без задержек")
+    p.add_argument("--seed", type=int)
+    p.add_argument("-v", "--verbose", action="store_true")
+    args = p.parse_args(argv)
+
+    if args.mode != "synthetic" and not args.cassette:
+        p.error("--cassette обязателен для record/replay")
+    config = StandInConfig(
+        latency_ms=args.latency, load_ms=args.load, tokens_per_sec=args.tps,
+        prompt_tokens_per_sec=args.prompt_tps, fail_rate=args.fail_rate,
+        fail_status=args.fail_status, disconnect_rate=args.disconnect_rate,
+        seed=args.seed, mode=args.mode, cassette_path=args.cassette,
+        upstream=args.upstream, replay_speed=args.replay_speed,
+    )
+    server = OllamaStandIn(config, host=args.host, port=args.port, verbose=args.verbose)
+    print(f"[STANDIN] Запустите приложение с OLLAMA_HOST={server.url}")
+    try:
+        server.start()._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+        print(f"[STANDIN] ■ Остановлено. Запросы: {server.stats()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+# ═══════════════════════════════════════════════════════════════════════
+# page_cache.py — дисковый кэш загруженных веб-страниц
+#
+# Содержит:
+#   • PageCache          — SQLite-кэш URL → сырой HTML + извлечённый текст,
+#                          с TTL, ETag/Last-Modified и ограничением
+#                          размера (LRU)
+#   • CachedPage         — запись кэша
+#   • get_page_cache()   — общий экземпляр
+#
+# Каждый поиск заново качал одни и те же страницы документации
+# (python.org, релизы GitHub, Википедия). Теперь fetch_page_content
+# отдаёт свежую запись из кэша без сети, а устаревшую перепроверяет
+# условным запросом (If-None-Match / If-Modified-Since): на 304 сервер
+# не шлёт тело, запись продлевается. Для запросов, чувствительных к
+# свежести (needs_freshness_check), перепроверка обязательна даже у
+# свежей записи. Если сеть недоступна — отдаётся устаревшая копия.
+#
+# Использование:
+#   from page_cache import get_page_cache
+#   cache = get_page_cache()
+#   page = cache.get(url)                     # CachedPage или None
+#   if page and page.is_fresh(): ...
+#   cache.conditional_headers(page)           # для requests.get
+#   cache.put(url, html, text, etag, last_modified, ttl=...)
+#   cache.touch(url, ttl=...)                 # после 304
+# ═══════════════════════════════════════════════════════════════════════
+
+import os
+import time
+import sqlite3
+import threading
+from typing import Optional
+
+PAGE_CACHE_DB = "page_cache.db"
+
+DEFAULT_TTL = 6 * 3600
+MAX_CACHE_BYTES = int(os.getenv("AI_ASSISTANT_PAGE_CACHE_MB", "128")) * 1024 * 1024
+# При переполнении чистим до этой доли лимита, чтобы не вытеснять на каждой записи
+_EVICT_TO = 0.9
+# Совсем старые записи удаляем даже без переполнения: перепроверять их
+# уже бессмысленно, а место они занимают
+_MAX_STALE_AGE = 30 * 24 * 3600
+
+
+class CachedPage:
+    """Запись кэша: тело страницы, её текст и валидаторы HTTP."""
+
+    __slots__ = ("url", "html", "encoding", "text", "etag", "last_modified",
+                 "fetched_at", "expires_at")
+
+    def __init__(self, url, html, encoding, text, etag, last_modified, fetched_at, expires_at):
+        self.url = url
+        self.html = html
+        self.encoding = encoding
+        self.text = text
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = fetched_at
+        self.expires_at = expires_at
+
+    def is_fresh(self, now: float = None) -> bool:
+        return (now or time.time()) < self.expires_at
+
+    def can_revalidate(self) -> bool:
+        return bool(self.etag or self.last_modified)
+
+
+class PageCache:
+    """Кэш страниц «URL → HTML + текст» в SQLite."""
+
+    def __init__(self, db_path: str = PAGE_CACHE_DB, max_bytes: int = MAX_CACHE_BYTES):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "revalidated": 0, "misses": 0}
+        self.init_db()
+
+    def init_db(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS page_cache (
+            url            TEXT PRIMARY KEY,
+            html           BLOB,
+            encoding       TEXT,
+            text           TEXT NOT NULL,
+            etag           TEXT,
+            last_modified  TEXT,
+            size           INTEGER NOT NULL,
+            fetched_at     REAL NOT NULL,
+            expires_at     REAL NOT NULL,
+            last_access    REAL NOT NULL
+        )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_page_cache_access ON page_cache(last_access)")
+        conn.commit()
+        conn.close()
+
+    # ── Чтение / запись ──────────────────────────────────────────────
+    def get(self, url: str) -> Optional[CachedPage]:
+        """Запись по URL (в том числе устаревшая) или None."""
+        now = time.time()
+        with self._lock:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                row = conn.execute("""
+                SELECT url, html, encoding, text, etag, last_modified, fetched_at, expires_at
+                FROM page_cache WHERE url = ?
+                """, (url,)).fetchone()
+                if row is None:
+                    return None
+                conn.execute("UPDATE page_cache SET last_access = ? WHERE url = ?", (now, url))
+                conn.commit()
+                return CachedPage(*row)
+            finally:
+                conn.close()
+
+    def put(self, url: str, html: bytes, text: str, etag: str = None,
+            last_modified: str = None, encoding: str = None, ttl: float = DEFAULT_TTL):
+        now = time.time()
+        size = len(html or b"") + len(text.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                conn.execute("""
+                INSERT OR REPLACE INTO page_cache
+                    (url, html, encoding, text, etag, last_modified, size,
+                     fetched_at, expires_at, last_access)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, (url, html, encoding, text, etag, last_modified, size,
+                      now, now + ttl, now))
+                self._evict(conn, now)
+                conn.commit()
+            finally:
+                conn.close()
+
+    def touch(self, url: str, ttl: float = DEFAULT_TTL):
+        """Сервер подтвердил, что страница не менялась (304) — продлеваем."""
+        now = time.time()
+        with self._lock:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                conn.execute("UPDATE page_cache SET expires_at = ?, last_access = ? WHERE url = ?",
+                             (now + ttl, now, url))
+                conn.commit()
+            finally:
+                conn.close()
+
+    def _evict(self, conn, now: float):
+        conn.execute("DELETE FROM page_cache WHERE expires_at < ?", (now - _MAX_STALE_AGE,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM page_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = int(self.max_bytes * _EVICT_TO)
+        removed = 0
+        for url, size in conn.execute(
+                "SELECT url, size FROM page_cache ORDER BY last_access ASC").fetchall():
+            if total <= target:
+                break
+            conn.execute("DELETE FROM page_cache WHERE url = ?", (url,))
+            total -= size
+            removed += 1
+        print(f"[PAGE_CACHE] 🧹 Вытеснено {removed} страниц (LRU), размер ~{total // 1024} КБ")
+
+    # ── Условные запросы ─────────────────────────────────────────────
+    @staticmethod
+    def conditional_headers(page: Optional[CachedPage]) -> dict:
+        """Заголовки If-None-Match / If-Modified-Since для перепроверки."""
+        headers = {}
+        if page is not None:
+            if page.etag:
+                headers["If-None-Match"] = page.etag
+            if page.last_modified:
+                headers["If-Modified-Since"] = page.last_modified
+        return headers
+
+    # ── Статистика ───────────────────────────────────────────────────
+    def count(self, outcome: str):
+        """outcome: hits | revalidated | misses."""
+        self._counters[outcome] = self._counters.get(outcome, 0) + 1
+
+    def stats(self) -> dict:
+        out = dict(self._counters)
+        try:
+            conn = sqlite3.connect(self.db_path)
+            entries, size = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM page_cache").fetchone()
+            conn.close()
+            out["_store"] = {"entries": entries, "bytes": size, "max_bytes": self.max_bytes}
+        except sqlite3.Error:
+            pass
+        return out
+
+    def clear(self):
+        with self._lock:
+            conn = sqlite3.connect(self.db_path)
+            conn.execute("DELETE FROM page_cache")
+            conn.commit()
+            conn.close()
+
+
+_CACHE: PageCache = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_page_cache() -> PageCache:
+    global _CACHE
+    if _CACHE is None:
+        with _CACHE_LOCK:
+            if _CACHE is None:
+                _CACHE = PageCache()
+    return _CACHE
@@ -0,0 +1,238 @@
+# ═══════════════════════════════════════════════════════════════════════
+# page_corpus.py — локальный полнотекстовый корпус загруженных страниц
+#
+# Содержит:
+#   • PageCorpus          — SQLite FTS5: URL, домен, дата загрузки и
+#                           очищенный текст каждой загруженной страницы
+#   • CorpusHit           — найденная страница
+#   • get_page_corpus()   — общий экземпляр
+#
+# Текст каждой загруженной страницы выбрасывался после ответа (page_cache
+# хранит его по URL и вытесняет, но искать по нему нельзя). Теперь
+# fetch_page_content кладёт очищенный текст в индекс FTS5, а
+# deep_web_search сначала ищет в нём: достаточно свежие локальные
+# страницы идут в ответ без сети, DuckDuckGo спрашивается только о
+# недостающих. Если сети нет, ответ собирается из корпуса целиком, без
+# ограничения по возрасту.
+#
+# SQLite без FTS5 (редкие сборки) — корпус выключен (available = False),
+# поиск пустой.
+#
+# Использование:
+#   corpus = get_page_corpus()
+#   corpus.add(url, text)                     # после загрузки страницы
+#   corpus.touch(url)                         # 304: страница не менялась
+#   hits = corpus.search(query, limit=5, max_age=24 * 3600)
+# ═══════════════════════════════════════════════════════════════════════
+
+import os
+import time
+import sqlite3
+import threading
+from urllib.parse import urlparse
+
+from passage_rank import terms
+
+PAGE_CORPUS_DB = "page_corpus.db"
+
+MAX_CORPUS_BYTES = int(os.getenv("AI_ASSISTANT_CORPUS_MB", "256")) * 1024 * 1024
+# При переполнении удаляем самые давно загруженные страницы до этой доли лимита
+_EVICT_TO = 0.9
+# Короче этого текст не индексируем (страницы-заглушки, капчи)
+MIN_INDEX_CHARS = 300
+
+
+def domain_of(url: str) -> str:
+    host = urlparse(url).netloc.lower()
+    return host[4:] if host.startswith("www.") else host
+
+
+class CorpusHit:
+    """Страница из корпуса; score — вес bm25 FTS5 (меньше — лучше)."""
+
+    __slots__ = ("url", "domain", "fetched_at", "text", "score")
+
+    def __init__(self, url, domain, fetched_at, text, score):
+        self.url = url
+        self.domain = domain
+        self.fetched_at = fetched_at
+        self.text = text
+        self.score = score
+
+    def age(self, now: float = None) -> float:
+        return (now or time.time()) - self.fetched_at
+
+
+class PageCorpus:
+    """Индекс FTS5 по тексту загруженных страниц."""
+
+    def __init__(self, db_path: str = PAGE_CORPUS_DB, max_bytes: int = MAX_CORPUS_BYTES):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.available = True
+        self._lock = threading.Lock()
+        self.init_db()
+
+    def init_db(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS corpus_pages (
+                id          INTEGER PRIMARY KEY,
+                url         TEXT NOT NULL UNIQUE,
+                domain      TEXT NOT NULL,
+                fetched_at  REAL NOT NULL,
+                size        INTEGER NOT NULL,
+                text        TEXT NOT NULL
+            )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_corpus_fetched ON corpus_pages(fetched_at)")
+            # Индекс с внешним содержимым: текст хранится один раз, в corpus_pages
+            conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS corpus_fts USING fts5(
+                text, content='corpus_pages', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+            """)
+            conn.executescript("""
+            CREATE TRIGGER IF NOT EXISTS corpus_ai AFTER INSERT ON corpus_pages BEGIN
+                INSERT INTO corpus_fts(rowid, text) VALUES (new.id, new.text);
+            END;
+            CREATE TRIGGER IF NOT EXISTS corpus_ad AFTER DELETE ON corpus_pages BEGIN
+                INSERT INTO corpus_fts(corpus_fts, rowid, text) VALUES ('delete', old.id, old.text);
+            END;
+            CREATE TRIGGER IF NOT EXISTS corpus_au AFTER UPDATE OF text ON corpus_pages BEGIN
+                INSERT INTO corpus_fts(corpus_fts, rowid, text) VALUES ('delete', old.id, old.text);
+                INSERT INTO corpus_fts(rowid, text) VALUES (new.id, new.text);
+            END;
+            """)
+            conn.commit()
+        except sqlite3.OperationalError as e:
+            # no such module: fts5
+            print(f"[PAGE_CORPUS] ⚠️ FTS5 недоступен, корпус выключен: {e}")
+            self.available = False
+        finally:
+            conn.close()
+
+    # ── Запись ───────────────────────────────────────────────────────
+    def add(self, url: str, text: str):
+        """Добавляет или обновляет страницу; fetched_at — сейчас."""
+        if not self.available or len(text) < MIN_INDEX_CHARS:
+            return
+        now = time.time()
+        with self._lock:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                conn.execute("""
+                INSERT INTO corpus_pages (url, domain, fetched_at, size, text)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(url) DO UPDATE SET
+                    fetched_at = excluded.fetched_at, size = excluded.size, text = excluded.text
+                """, (url, domain_of(url), now, len(text.encode("utf-8")), text))
+                self._evict(conn)
+                conn.commit()
+            finally:
+                conn.close()
+
+    def touch(self, url: str):
+        """Сервер подтвердил, что страница не менялась (304)."""
+        if not self.available:
+            return
+        with self._lock:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                conn.execute("UPDATE corpus_pages SET fetched_at = ? WHERE url = ?",
+                             (time.time(), url))
+                conn.commit()
+            finally:
+                conn.close()
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM corpus_pages").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = int(self.max_bytes * _EVICT_TO)
+        removed = 0
+        for page_id, size in conn.execute(
+                "SELECT id, size FROM corpus_pages ORDER BY fetched_at ASC").fetchall():
+            if total <= target:
+                break
+            conn.execute("DELETE FROM corpus_pages WHERE id = ?", (page_id,))
+            total -= size
+            removed += 1
+        print(f"[PAGE_CORPUS] 🧹 Удалено {removed} старых страниц, размер ~{total // 1024} КБ")
+
+    # ── Поиск ────────────────────────────────────────────────────────
+    @staticmethod
+    def match_expression(query: str) -> str:
+        """
+        Запрос → выражение MATCH: основы слов запроса (passage_rank.terms)
+        как префиксы через OR — «версии» найдёт «версия», «release» — «released».
+        """
+        stems = dict.fromkeys(terms(query))
+        return " OR ".join(f'"{stem}"*' for stem in stems)
+
+    def search(self, query: str, limit: int = 5, max_age: float = None,
+               exclude: set = None) -> list:
+        """
+        До limit страниц корпуса по запросу, лучшие первыми (bm25).
+        max_age — не старше стольких секунд (None — любые).
+        """
+        expression = self.match_expression(query)
+        if not self.available or not expression:
+            return []
+        sql = """
+        SELECT p.url, p.domain, p.fetched_at, p.text, bm25(corpus_fts) AS score
+        FROM corpus_fts JOIN corpus_pages p ON p.id = corpus_fts.rowid
+        WHERE corpus_fts MATCH ?
+        """
+        params = [expression]
+        if max_age is not None:
+            sql += " AND p.fetched_at >= ?"
+            params.append(time.time() - max_age)
+        sql += " ORDER BY score LIMIT ?"
+        params.append(limit + len(exclude or ()))
+        with self._lock:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                rows = conn.execute(sql, params).fetchall()
+            finally:
+                conn.close()
+        hits = [CorpusHit(*row) for row in rows if not exclude or row[0] not in exclude]
+        return hits[:limit]
+
+    # ── Статистика ───────────────────────────────────────────────────
+    def stats(self) -> dict:
+        if not self.available:
+            return {"available": False}
+        conn = sqlite3.connect(self.db_path)
+        try:
+            pages, size, domains = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COUNT(DISTINCT domain) "
+                "FROM corpus_pages").fetchone()
+        finally:
+            conn.close()
+        return {"available": True, "pages": pages, "bytes": size, "domains": domains,
+                "max_bytes": self.max_bytes}
+
+    def clear(self):
+        if not self.available:
+            return
+        with self._lock:
+            conn = sqlite3.connect(self.db_path)
+            conn.execute("DELETE FROM corpus_pages")
+            conn.commit()
+            conn.close()
+
+
+_CORPUS: PageCorpus = None
+_CORPUS_LOCK = threading.Lock()
+
+
+def get_page_corpus() -> PageCorpus:
+    global _CORPUS
+    if _CORPUS is None:
+        with _CORPUS_LOCK:
+            if _CORPUS is None:
+                _CORPUS = PageCorpus()
+    return _CORPUS
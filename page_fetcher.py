@@ -0,0 +1,234 @@
+# ═══════════════════════════════════════════════════════════════════════
+# page_fetcher.py — параллельная загрузка страниц для веб-поиска
+#
+# Содержит:
+#   • PageFetcher            — пул загрузок с ограничением параллелизма
+#                              (всего и на один хост); URL можно
+#                              добавлять по мере прихода (add/close),
+#                              принятые страницы — читать по мере готовности
+#   • fetch_relevant_pages() — то же для готового списка URL
+#   • url_host()             — хост URL для лимита «на сайт»
+#
+# deep_web_search качал до 5 страниц по очереди с таймаутом 10 с на
+# каждую: один медленный сайт задерживал весь ответ, а время поиска
+# было суммой всех загрузок. Теперь страницы качаются параллельно и
+# проверяются сразу по приходу (accept), а как только набралось
+# max_accepted подходящих — ещё не начатые загрузки отменяются, начатые
+# бросаются (их результат игнорируется, потоки-демоны завершатся по
+# своему таймауту). Время поиска определяется самыми быстрыми хорошими
+# источниками.
+#
+# Использование:
+# С дедлайном (search_deadline) пул останавливается по его истечении —
+# вызывающий получает то, что успело загрузиться.
+#
+#   pages = fetch_relevant_pages(urls, fetch=..., accept=..., max_accepted=3,
+#                                deadline=deadline)
+#
+#   fetcher = PageFetcher(fetch, accept, max_accepted=8, priority=score)
+#   fetcher.add(urls_from_query_1)     # из потоков поиска, по мере ответов
+#   fetcher.close()                    # URL больше не будет
+#   for record in fetcher:             # по мере принятия
+#       ...; if enough: fetcher.stop()
+# ═══════════════════════════════════════════════════════════════════════
+
+import threading
+from urllib.parse import urlsplit
+
+from ollama_client import is_cancelled
+
+# Одновременных загрузок всего и на один хост
+FETCH_MAX_WORKERS = 4
+FETCH_PER_HOST = 2
+
+# Как часто ожидание проверяет отмену запроса (сек)
+_WAIT_SLICE = 0.1
+
+
+def url_host(url: str) -> str:
+    """Хост URL в нижнем регистре (без порта и www.)."""
+    host = (urlsplit(url).hostname or "").lower()
+    return host[4:] if host.startswith("www.") else host
+
+
+class PageFetcher:
+    """
+    fetch(url) -> str — загрузка страницы.
+    accept(index, url, text) -> запись или None — проверка по приходу
+        (index — порядковый номер URL среди добавленных). Вызывается
+        в потоке загрузки.
+    max_accepted — после стольких принятых записей остальное отменяется.
+    priority(url) -> число — из ожидающих URL первым берётся URL с
+        наибольшим приоритетом (при равенстве — добавленный раньше).
+    deadline — SearchDeadline: по его истечении пул останавливается.
+    """
+
+    def __init__(self, fetch, accept, max_accepted: int, priority=None,
+                 max_workers: int = FETCH_MAX_WORKERS, per_host: int = FETCH_PER_HOST,
+                 deadline=None):
+        self._fetch = fetch
+        self._accept = accept
+        self._priority = priority
+        self._deadline = deadline
+        self.max_accepted = max_accepted
+        self._max_workers = max_workers
+        self._per_host = per_host
+        self._pending: list = []          # (index, url, host, priority)
+        self._seen: set = set()
+        self._active_hosts: dict = {}
+        self._in_flight = 0
+        self._workers = 0
+        self._accepted: list = []         # (index, record) в порядке принятия
+        self._added = 0
+        self._finished = 0
+        self._closed = False
+        self._stopped = max_accepted <= 0
+        self._cond = threading.Condition()
+
+    # ── Подача URL ───────────────────────────────────────────────────
+    def add(self, urls) -> int:
+        """Добавляет URL (повторы игнорируются). Возвращает число новых."""
+        new = 0
+        with self._cond:
+            if self._stopped or self._closed:
+                return 0
+            for url in urls:
+                if url in self._seen:
+                    continue
+                self._seen.add(url)
+                prio = self._priority(url) if self._priority else 0
+                self._pending.append((self._added, url, url_host(url), prio))
+                self._added += 1
+                new += 1
+            spawn = min(self._max_workers - self._workers, len(self._pending))
+            self._workers += max(spawn, 0)
+            self._cond.notify_all()
+        for _ in range(max(spawn, 0)):
+            threading.Thread(target=self._worker, name="PageFetch", daemon=True).start()
+        return new
+
+    def close(self):
+        """Новых URL не будет: пул завершится, когда догрузит добавленные."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def stop(self):
+        """Отменяет ожидающие загрузки, начатые бросает."""
+        with self._cond:
+            self._stop_locked()
+
+    def _stop_locked(self):
+        if not self._stopped:
+            self._stopped = True
+            left = self._added - self._finished
+            if left:
+                print(f"[PAGE_FETCHER] ⏭ Принято {len(self._accepted)}/{self.max_accepted} — "
+                      f"остальные {left} загрузок отменены")
+        self._cond.notify_all()
+
+    @property
+    def accepted_count(self) -> int:
+        with self._cond:
+            return len(self._accepted)
+
+    # ── Потоки загрузки ──────────────────────────────────────────────
+    def _take(self):
+        """Самый приоритетный URL, у хоста которого есть свободный слот."""
+        best = None
+        for pos, job in enumerate(self._pending):
+            if self._active_hosts.get(job[2], 0) >= self._per_host:
+                continue
+            if best is None or job[3] > self._pending[best][3]:
+                best = pos
+        if best is None:
+            return None
+        job = self._pending.pop(best)
+        self._active_hosts[job[2]] = self._active_hosts.get(job[2], 0) + 1
+        self._in_flight += 1
+        return job
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                job = None
+                while not self._stopped:
+                    job = self._take()
+                    if job is not None or (self._closed and not self._pending):
+                        break
+                    self._cond.wait(_WAIT_SLICE)
+                if job is None:
+                    self._workers -= 1
+                    return
+            index, url, host, _ = job
+            record = None
+            try:
+                text = self._fetch(url)
+                record = self._accept(index, url, text)
+            except Exception as e:
+                print(f"[PAGE_FETCHER] ✗ {url[:60]}: {type(e).__name__}: {e}")
+            with self._cond:
+                self._active_hosts[host] -= 1
+                self._in_flight -= 1
+                self._finished += 1
+                if record is not None and not self._stopped:
+                    self._accepted.append((index, record))
+                    if len(self._accepted) >= self.max_accepted:
+                        self._stop_locked()
+                self._cond.notify_all()
+
+    def _done(self) -> bool:
+        return self._stopped or (self._closed and not self._pending and not self._in_flight)
+
+    # ── Результаты ───────────────────────────────────────────────────
+    def __iter__(self):
+        """
+        Принятые записи по мере готовности. Заканчивается, когда пул
+        догрузил всё или остановлен; отмена запроса пользователем
+        (cancel_scope вызвавшего потока) и истечение дедлайна
+        останавливают пул.
+        """
+        pos = 0
+        while True:
+            with self._cond:
+                while pos >= len(self._accepted) and not self._done():
+                    if is_cancelled():
+                        print("[PAGE_FETCHER] ⏹ Запрос отменён — загрузка страниц прервана")
+                        self._stop_locked()
+                        break
+                    if self._deadline is not None and self._deadline.expired():
+                        print(f"[PAGE_FETCHER] ⏱ Время поиска вышло — "
+                              f"беру {len(self._accepted)} готовых страниц")
+                        self._stop_locked()
+                        break
+                    self._cond.wait(_WAIT_SLICE)
+                if pos >= len(self._accepted):
+                    return
+                record = self._accepted[pos][1]
+            pos += 1
+            yield record
+
+    def results(self) -> list:
+        """Ждёт завершения и возвращает принятые записи в порядке добавления URL."""
+        for _ in self:
+            pass
+        self.stop()
+        with self._cond:
+            return [record for _, record in sorted(self._accepted, key=lambda item: item[0])]
+
+
+def fetch_relevant_pages(urls: list, fetch, accept, max_accepted: int,
+                         max_workers: int = FETCH_MAX_WORKERS,
+                         per_host: int = FETCH_PER_HOST, deadline=None) -> list:
+    """
+    Загружает urls параллельно и возвращает принятые записи в порядке
+    исходного списка (он же порядок выдачи поисковика). accept получает
+    index — позицию URL в urls. См. PageFetcher.
+    """
+    if not urls or max_accepted <= 0 or (deadline is not None and deadline.expired()):
+        return []
+    fetcher = PageFetcher(fetch, accept, max_accepted,
+                          max_workers=max_workers, per_host=per_host, deadline=deadline)
+    fetcher.add(urls)
+    fetcher.close()
+    return fetcher.results()
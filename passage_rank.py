@@ -0,0 +1,215 @@
+# ═══════════════════════════════════════════════════════════════════════
+# passage_rank.py — отбор фрагментов страниц по BM25 под бюджет токенов
+#
+# Содержит:
+#   • split_sentences()  — строка → предложения
+#   • split_passages()   — текст страницы → фрагменты ~PASSAGE_CHARS символов
+#   • BM25Index          — BM25 по фрагментам (numpy, без него — Python)
+#   • select_passages()  — лучшие фрагменты всех страниц в пределах бюджета
+#
+# В промпт шли первые 3000 символов каждой страницы, а
+# compress_search_results при переполнении резал описания поровну — и
+# выбрасывал блок страниц целиком. Нужный абзац часто оказывался ниже
+# отрезанного, а меню и вступление — в промпте. Теперь каждая страница
+# режется на фрагменты (по блокам extract_main_content, заголовок — с
+# абзацем за ним), фрагменты всех страниц ранжируются BM25 по запросу, и
+# в промпт (summarize_sources / финальный) идут лучшие из них, пока не
+# кончится бюджет токенов. У каждой страницы сначала берётся её лучший
+# фрагмент, затем остальные по убыванию веса; порядок внутри страницы
+# сохраняется.
+#
+# Частоты термов — матрица «фрагмент × терм запроса» (numpy, если
+# установлен): веса всех фрагментов считаются одной векторной операцией.
+#
+# Использование:
+#   texts = select_passages(query, [p["content"] for p in pages], token_budget=1200)
+# ═══════════════════════════════════════════════════════════════════════
+
+import re
+import math
+from collections import Counter
+
+try:
+    import numpy as _np            # необязательная зависимость (есть в setup.py)
+except ImportError:
+    _np = None
+
+from token_estimator import estimate_tokens
+
+# Целевой размер фрагмента (символов)
+PASSAGE_CHARS = 600
+# Параметры BM25
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Слова длиннее обрезаются до основы этой длины: «версия/версии»,
+# «release/released» — один терм (грубая замена стемминга для ru/en)
+STEM_CHARS = 6
+# Строка между несмежными фрагментами одной страницы
+PASSAGE_GAP = "…"
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_SENTENCE_RE = re.compile(r"(?<=[.!?…])\s+")
+_STOP_WORDS = frozenset({
+    "и", "в", "во", "на", "с", "со", "по", "для", "что", "как", "где", "это",
+    "не", "из", "от", "до", "за", "ли", "или", "а", "но", "же", "бы", "то",
+    "the", "a", "an", "of", "in", "on", "for", "to", "is", "are", "was",
+    "and", "or", "with", "by", "at", "be", "it", "this", "that", "how", "what",
+})
+
+
+def terms(text: str) -> list:
+    """Термы текста: слова в нижнем регистре без стоп-слов, обрезанные до основы."""
+    return [w[:STEM_CHARS] for w in _TOKEN_RE.findall(text.lower())
+            if len(w) > 1 and w not in _STOP_WORDS]
+
+
+def split_sentences(text: str) -> list:
+    """Предложения строки (граница — .!?… и пробел)."""
+    return [s for s in _SENTENCE_RE.split(text.strip()) if s]
+
+
+def _pack(sentences: list, target: int) -> list:
+    """Склеивает соседние предложения в куски не длиннее ~target."""
+    passages, current = [], ""
+    for sentence in sentences:
+        if current and len(current) + len(sentence) + 1 > target:
+            passages.append(current)
+            current = ""
+        current = f"{current} {sentence}" if current else sentence
+    if current:
+        passages.append(current)
+    return passages
+
+
+def split_passages(text: str, target: int = PASSAGE_CHARS) -> list:
+    """
+    Фрагменты текста страницы. Текст extract_main_content — строки-блоки,
+    заголовок («## …») открывает новый фрагмент; сплошной текст
+    (старые записи кэша, extract_text) режется по предложениям.
+    """
+    if not text:
+        return []
+    lines = [line.strip() for line in text.split("\n") if line.strip()]
+    pieces = []
+    for line in lines:
+        if len(line) > target:
+            pieces.extend(_pack(split_sentences(line), target))
+        else:
+            pieces.append(line)
+
+    # Заголовок открывает фрагмент и не отрывается от текста за ним
+    passages, current = [], ""
+    for piece in pieces:
+        heading_only = current.startswith("#") and "\n" not in current
+        if current and not heading_only and (
+                piece.startswith("#") or len(current) + len(piece) + 1 > target):
+            passages.append(current)
+            current = piece
+        else:
+            current = f"{current}\n{piece}" if current else piece
+    if current:
+        passages.append(current)
+    return passages
+
+
+class BM25Index:
+    """BM25 по списку фрагментов; score(query) — вес каждого фрагмента."""
+
+    def __init__(self, passages: list, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self._counts = [Counter(terms(p)) for p in passages]
+        self._lengths = [sum(c.values()) for c in self._counts]
+        self._avg_len = (sum(self._lengths) / len(self._lengths)) if self._lengths else 0.0
+
+    def _idf(self, df: int) -> float:
+        n = len(self._counts)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def score(self, query: str) -> list:
+        query_terms = list(dict.fromkeys(terms(query)))
+        n = len(self._counts)
+        if not n or not query_terms or not self._avg_len:
+            return [0.0] * n
+        if _np is not None:
+            return self._score_numpy(query_terms).tolist()
+        return self._score_python(query_terms)
+
+    def _score_numpy(self, query_terms: list):
+        # tf: фрагменты × термы запроса
+        tf = _np.array([[counts.get(t, 0) for t in query_terms] for counts in self._counts],
+                       dtype=_np.float64)
+        df = (tf > 0).sum(axis=0)
+        n = tf.shape[0]
+        idf = _np.log1p((n - df + 0.5) / (df + 0.5))
+        lengths = _np.array(self._lengths, dtype=_np.float64)
+        norm = self.k1 * (1 - self.b + self.b * lengths / self._avg_len)
+        weights = tf * (self.k1 + 1) / (tf + norm[:, None])
+        return weights @ idf
+
+    def _score_python(self, query_terms: list) -> list:
+        idf = {t: self._idf(sum(1 for c in self._counts if t in c)) for t in query_terms}
+        scores = []
+        for counts, length in zip(self._counts, self._lengths):
+            norm = self.k1 * (1 - self.b + self.b * length / self._avg_len)
+            score = 0.0
+            for t in query_terms:
+                tf = counts.get(t, 0)
+                if tf:
+                    score += idf[t] * tf * (self.k1 + 1) / (tf + norm)
+            scores.append(score)
+        return scores
+
+
+def select_passages(query: str, texts: list, token_budget: int, model: str = None,
+                    passage_chars: int = PASSAGE_CHARS) -> list:
+    """
+    Для каждого текста из texts — его фрагменты, выбранные по BM25 (в
+    исходном порядке, несмежные разделены PASSAGE_GAP). Суммарно не
+    больше token_budget токенов (оценка token_estimator для model).
+    Страница без единого подходящего фрагмента получает начало текста,
+    если на него хватает бюджета.
+    """
+    passages = []                       # (номер текста, позиция, фрагмент)
+    for doc, text in enumerate(texts):
+        for pos, passage in enumerate(split_passages(text, passage_chars)):
+            passages.append((doc, pos, passage))
+    if not passages:
+        return ["" for _ in texts]
+
+    scores = BM25Index([p for _, _, p in passages]).score(query)
+    ranked = sorted(range(len(passages)), key=lambda i: scores[i], reverse=True)
+
+    # Сначала лучший фрагмент каждой страницы, потом остальные по весу
+    best_of_doc = {}
+    for i in ranked:
+        if scores[i] > 0:
+            best_of_doc.setdefault(passages[i][0], i)
+    head_of_doc = {}
+    for i, (doc, pos, _) in enumerate(passages):
+        if pos == 0 and doc not in best_of_doc:
+            head_of_doc[doc] = i
+    order = (list(best_of_doc.values())
+             + [i for i in ranked if scores[i] > 0 and i not in best_of_doc.values()]
+             + list(head_of_doc.values()))
+
+    chosen, used = set(), 0
+    for i in order:
+        cost = estimate_tokens(passages[i][2], model)
+        if used + cost > token_budget:
+            continue
+        chosen.add(i)
+        used += cost
+
+    result = []
+    for doc in range(len(texts)):
+        parts, last_pos = [], None
+        for i, (d, pos, passage) in enumerate(passages):
+            if d != doc or i not in chosen:
+                continue
+            if last_pos is not None and pos != last_pos + 1:
+                parts.append(PASSAGE_GAP)
+            parts.append(passage)
+            last_pos = pos
+        result.append("\n".join(parts))
+    return result
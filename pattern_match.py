@@ -0,0 +1,225 @@
+# ═══════════════════════════════════════════════════════════════════════
+# pattern_match.py — поиск множества подстрок и маркеров фактов за проход
+#
+# Содержит:
+#   • PatternMatcher  — какие из заданных подстрок встречаются в тексте
+#                       (автомат Ахо–Корасик, если установлен pyahocorasick)
+#   • FactCounter     — число маркеров фактов (версии, даты, месяцы,
+#                       «released»…) одним объединённым регулярным выражением
+#   • RegexSet        — сколько регулярок набора находится в тексте; каждая
+#                       запускается, только если в тексте есть её литерал
+#
+# Регулярки вида r'\bdef \w+\(' CPython не ускоряет поиском литерала
+# (мешает \b) и пробует в каждой позиции текста; RegexSet сначала одним
+# проходом PatternMatcher ищет литералы всех регулярок набора и
+# запускает только те, чей литерал нашёлся.
+#
+# Скоринг страниц (score_page_content, is_relevant_page,
+# source_quality_score) на каждую страницу заново делил запрос на слова,
+# перебирал списки доменов и платформ и прогонял шесть регулярок фактов по
+# всему тексту — каждая регулярка пробует совпадение в каждой позиции, на
+# этом уходило ~2 мс на страницу. Теперь запрос компилируется один раз
+# (web_search.QueryScorer), подстроки ищутся PatternMatcher, а факты —
+# одним проходом FactCounter с тем же счётом, что у шести регулярок.
+#
+# PatternMatcher без pyahocorasick проверяет подстроки через `in`: поиск
+# подстроки в CPython написан на C, и для десятков шаблонов он быстрее
+# автомата, написанного на Python.
+#
+# Использование:
+#   matcher = PatternMatcher(["ios", "android", "windows"])
+#   matcher.found(text_lower)               # {"ios", "windows"}
+#
+#   counter = FactCounter(number_patterns, word_prefixes)
+#   counter.count(text_lower)
+#
+#   tech = RegexSet([(re.compile(r'\bdef \w+\('), ("def ",)), (re.compile(r'\d+'), None)])
+#   tech.count_matching(text)
+#
+#   python pattern_match.py                 # бенчмарк скоринга на 50 страницах
+# ═══════════════════════════════════════════════════════════════════════
+
+import re
+import sys
+import time
+import random
+import argparse
+
+try:
+    import ahocorasick as _ahocorasick   # pyahocorasick — необязательная зависимость
+except ImportError:
+    _ahocorasick = None
+
+
+class PatternMatcher:
+    """Набор подстрок; found(text) — те, что встречаются в text (как `p in text`)."""
+
+    def __init__(self, patterns):
+        self.patterns = tuple(dict.fromkeys(p for p in patterns if p))
+        self._automaton = None
+        if _ahocorasick is not None and self.patterns:
+            automaton = _ahocorasick.Automaton()
+            for pattern in self.patterns:
+                automaton.add_word(pattern, pattern)
+            automaton.make_automaton()
+            self._automaton = automaton
+
+    def found(self, text: str) -> set:
+        if not text or not self.patterns:
+            return set()
+        if self._automaton is not None:
+            return {pattern for _, pattern in self._automaton.iter(text)}
+        return {pattern for pattern in self.patterns if pattern in text}
+
+    def first(self, text: str, order) -> str:
+        """Первый по порядку order шаблон, найденный в text, или None."""
+        found = self.found(text)
+        return next((p for p in order if p in found), None) if found else None
+
+
+class FactCounter:
+    """
+    Счётчик маркеров фактов, равный сумме len(p.findall(text)) по
+    number_patterns и r'\\b(?:prefix)\\w*\\b' по word_prefixes.
+
+    Все совпадения числовых шаблонов начинаются с цифры или «v» на границе
+    слова и состоят из [\\w./] — поэтому одно выражение находит такие
+    отрезки, а числовые шаблоны прогоняются только по ним (коротким).
+    Слово с префиксом из word_prefixes считается один раз.
+    """
+
+    def __init__(self, number_patterns, word_prefixes):
+        self._number_patterns = list(number_patterns)
+        words = "|".join(re.escape(p) for p in sorted(word_prefixes, key=len, reverse=True))
+        self._word_re = re.compile(rf"\b(?:{words})")
+        self._combined_re = re.compile(rf"(?<!\w)(?:(v?\d[\w./]*)|(?:{words}))")
+
+    def count(self, text: str) -> int:
+        total = 0
+        for segment in self._combined_re.findall(text):
+            if not segment:
+                total += 1              # слово-маркер
+                continue
+            for pattern in self._number_patterns:
+                total += len(pattern.findall(segment))
+            # «1.2.update» — слово внутри числового отрезка
+            total += len(self._word_re.findall(segment))
+        return total
+
+
+class RegexSet:
+    """
+    entries — [(регулярка, литералы)]: регулярка может совпасть, только
+    если в тексте есть хотя бы один её литерал (None — проверять всегда).
+    Для регулярок с IGNORECASE литералы в нижнем регистре, а
+    anchor_text передаётся в нижнем регистре.
+    """
+
+    def __init__(self, entries):
+        self._entries = [(regex, tuple(anchors) if anchors else None)
+                         for regex, anchors in entries]
+        self._anchors = PatternMatcher(a for _, anchors in self._entries if anchors
+                                       for a in anchors)
+
+    def count_matching(self, text: str, anchor_text: str = None) -> int:
+        """Сколько регулярок набора находят совпадение в text."""
+        present = self._anchors.found(text if anchor_text is None else anchor_text)
+        return sum(1 for regex, anchors in self._entries
+                   if (anchors is None or any(a in present for a in anchors))
+                   and regex.search(text))
+
+
+# ═══════════════════════════════════════════════════════════════════
+# БЕНЧМАРК
+# ═══════════════════════════════════════════════════════════════════
+
+_BENCH_WORDS = (
+    "python release version latest windows android update download install "
+    "documentation changelog features security fix bug performance improved "
+    "новая версия вышла обновление релиз исправления безопасность система "
+    "march october 2024 2025 3.12 3.13.1 v2.4 12.05.2024 ios 17.4 chrome api"
+).split()
+
+
+def _bench_pages(n: int, chars: int, seed: int = 1) -> list:
+    rnd = random.Random(seed)
+    pages = []
+    for i in range(n):
+        words = [rnd.choice(_BENCH_WORDS) for _ in range(chars // 6)]
+        pages.append((f"https://site{i}.example.com/docs/page{i}", " ".join(words)[:chars]))
+    return pages
+
+
+def _timed(fn, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Бенчмарк скоринга страниц: по вызову против скомпилированного запроса")
+    p.add_argument("--pages", type=int, default=50)
+    p.add_argument("--chars", type=int, default=5000, help="длина текста страницы")
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--query", default="latest python version release for windows 2025")
+    args = p.parse_args(argv)
+
+    import web_search as ws
+
+    pages = _bench_pages(args.pages, args.chars)
+    lowered = [(url, text, text.lower()) for url, text in pages]
+    query = args.query
+    scorer = ws.get_query_scorer(query)
+    keywords = scorer.keywords + ws.TOPIC_PLATFORM_KEYWORDS
+    regex_sets = ((ws._SQ_TECH_PATTERNS, lambda t, l: (t[:5000], None)),
+                  (ws._SQ_FACT_PATTERNS, lambda t, l: (l, None)),
+                  (ws._SQ_AUTHOR_PATTERNS, lambda t, l: (t[:3000], t[:3000].lower())))
+
+    # (этап, по-старому на каждой странице, скомпилированно)
+    stages = [
+        ("разбор запроса",
+         lambda: [ws.QueryScorer(query) for _ in pages],
+         lambda: [ws.get_query_scorer(query) for _ in pages]),
+        ("подстроки (ключи, платформы)",
+         lambda: [[kw for kw in keywords if kw in low] for _, _, low in lowered],
+         lambda: [scorer._matcher.found(low) for _, _, low in lowered]),
+        ("счёт фактов",
+         lambda: [sum(len(p.findall(low)) for p in ws._FACT_PATTERNS) for _, _, low in lowered],
+         lambda: [ws._FACT_COUNTER.count(low) for _, _, low in lowered]),
+        ("регулярки source_quality",
+         lambda: [sum(1 for rs, sample in regex_sets for regex, _ in rs._entries
+                      if regex.search(sample(text, low)[0])) for _, text, low in lowered],
+         lambda: [sum(rs.count_matching(*sample(text, low)) for rs, sample in regex_sets)
+                  for _, text, low in lowered]),
+    ]
+
+    mismatched = sum(
+        1 for _, _, low in lowered
+        if ws._FACT_COUNTER.count(low) != sum(len(p.findall(low)) for p in ws._FACT_PATTERNS))
+
+    print(f"Страниц: {args.pages} × {args.chars} символов, "
+          f"pyahocorasick: {'да' if _ahocorasick is not None else 'нет'}")
+    print(f"{'этап':<30} {'было мс':>9} {'стало мс':>9} {'ускорение':>10}")
+    total_before = total_after = 0.0
+    for name, before_fn, after_fn in stages:
+        before, after = _timed(before_fn, args.repeat), _timed(after_fn, args.repeat)
+        total_before += before
+        total_after += after
+        print(f"{name:<30} {before * 1000:>9.1f} {after * 1000:>9.1f} {before / after:>9.1f}×")
+    print(f"{'итого':<30} {total_before * 1000:>9.1f} {total_after * 1000:>9.1f} "
+          f"{total_before / total_after:>9.1f}×")
+
+    full = _timed(lambda: [(scorer.relevance(text, url), scorer.source_quality(url, text))
+                           for url, text in pages], args.repeat)
+    print(f"\nis_relevant_page + source_quality_score целиком: {full * 1000:.1f} мс "
+          f"({full / args.pages * 1000:.2f} мс/стр)")
+    print(f"Расхождений счёта фактов: {mismatched}")
+    return 0 if not mismatched else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,243 @@
+# ═══════════════════════════════════════════════════════════════════════
+# pipeline.py — маленький движок стадий для get_ai_response
+#
+# Содержит:
+#   • PipelineAbort   — досрочный выход из пайплайна со значением
+#   • Pipeline        — именованные стадии с зависимостями:
+#                       add() + start() — фоновые стадии (DAG, параллельно),
+#                       wait() — результат стадии, run() — стадия в текущем потоке,
+#                       cancel() — остановить фоновые стадии (досрочный ответ)
+#   • SKIP_STAGES     — стадии, отключённые через AI_ASSISTANT_SKIP_STAGES
+#
+# get_ai_response выполнял всё последовательно: память, история, чтение
+# файлов (и vision), построение поискового запроса, поиск, суммаризация —
+# хотя они друг от друга не зависят. Теперь независимые стадии стартуют
+# сразу и идут параллельно, а сборка промпта ждёт только то, что ей
+# нужно. Каждая стадия замеряется, может быть пропущена (skip) и видит
+# теги метрик вызвавшего потока. Фоновые стадии работают под дочерним
+# токеном cancel_scope вызвавшего потока: «Стоп» обрывает и их, а
+# cancel() — только их (запрос уже отвечает сам, например ошибкой файла).
+#
+# Использование:
+#   pipe = Pipeline("get_ai_response", cancelled=cancelled_flag)
+#   pipe.add("history", load_history)
+#   pipe.add("search", do_search, deps=("search_query",), skip=not use_search)
+#   pipe.start()
+#   history = pipe.wait("history")
+#   answer = pipe.run("generate", generate)
+#   pipe.report()   # [PIPELINE] history 12 мс | search 3410 мс | …
+#   pipe.cancel()   # перед досрочным return: поиск/суммаризация больше не нужны
+#
+# Отключение стадий для бенчмарков:
+#   AI_ASSISTANT_SKIP_STAGES=validate,translate python run.py
+# ═══════════════════════════════════════════════════════════════════════
+
+import os
+import time
+import threading
+
+from ollama_client import OllamaCancelToken, current_cancel_token, join_cancel_scope, is_cancelled
+from ollama_metrics import get_metrics_context, set_metrics_context
+
+SKIP_STAGES = frozenset(
+    s.strip() for s in os.getenv("AI_ASSISTANT_SKIP_STAGES", "").split(",") if s.strip()
+)
+
+# Как часто wait() проверяет отмену запроса (сек)
+_WAIT_SLICE = 0.1
+
+_PENDING, _RUNNING, _DONE, _SKIPPED, _FAILED = "pending", "running", "done", "skipped", "failed"
+
+
+class PipelineAbort(Exception):
+    """Стадия завершает весь запрос готовым ответом (ошибка файла и т.п.)."""
+
+    def __init__(self, value):
+        super().__init__(value)
+        self.value = value
+
+
+class _Stage:
+    def __init__(self, name: str, fn, deps: tuple, skip, default):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.skip = skip
+        self.default = default
+        self.state = _PENDING
+        self.result = default
+        self.error = None
+        self.elapsed_ms = 0.0
+        self.done = threading.Event()
+
+
+class Pipeline:
+    """
+    Набор стадий одного запроса. Фоновые стадии (add) запускаются в
+    отдельных потоках, как только готовы их зависимости; стадия получает
+    результаты зависимостей как аргументы в порядке deps.
+
+    Ошибка стадии не роняет запрос: в лог, результат — default. Исключение
+    PipelineAbort передаётся в wait()/run() и прерывает запрос.
+    """
+
+    def __init__(self, name: str, cancelled=None):
+        self.name = name
+        self._cancelled = cancelled
+        self._stages: dict = {}
+        self._order: list = []
+        self._lock = threading.Lock()
+        self._started = False
+        self._closed = False
+        self._t0 = time.perf_counter()
+        # Контекст вызвавшего потока — для стадий в других потоках; токен
+        # стадий дочерний: отменяется с запросом или через cancel()
+        parent = current_cancel_token()
+        self._token = parent.child() if parent is not None else OllamaCancelToken()
+        self._metrics = get_metrics_context()
+
+    # ── Описание стадий ──────────────────────────────────────────────
+    def add(self, name: str, fn, deps=(), skip=False, default=None) -> "Pipeline":
+        """
+        fn(*результаты deps) — тело стадии.
+        skip — bool или fn() -> bool (вычисляется перед запуском).
+        default — результат при пропуске или ошибке.
+        """
+        with self._lock:
+            if name in self._stages:
+                raise ValueError(f"Стадия {name!r} уже добавлена")
+            for dep in deps:
+                if dep not in self._stages:
+                    raise ValueError(f"Стадия {name!r}: неизвестная зависимость {dep!r}")
+            self._stages[name] = _Stage(name, fn, deps, skip, default)
+            self._order.append(name)
+        if self._started:
+            self._schedule()
+        return self
+
+    def _should_skip(self, stage: _Stage) -> bool:
+        if stage.name in SKIP_STAGES:
+            return True
+        skip = stage.skip() if callable(stage.skip) else stage.skip
+        return bool(skip) or self.cancelled()
+
+    def cancelled(self) -> bool:
+        return (self._closed or is_cancelled()
+                or (callable(self._cancelled) and bool(self._cancelled())))
+
+    def cancel(self):
+        """
+        Останавливает фоновые стадии: ещё не начатые пропускаются, у идущих
+        обрываются запросы к модели (токен стадий). Запрос при этом не
+        считается отменённым — вызывающий сам возвращает ответ.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        running = [n for n in self._order if self._stages[n].state == _RUNNING]
+        if running:
+            print(f"[PIPELINE] ⏹ {self.name}: останавливаю стадии {', '.join(running)}")
+        self._token.cancel()
+
+    # ── Фоновое выполнение ───────────────────────────────────────────
+    def start(self) -> "Pipeline":
+        """Запускает все стадии, зависимости которых уже готовы."""
+        self._started = True
+        self._schedule()
+        return self
+
+    def _schedule(self):
+        ready = []
+        with self._lock:
+            for name in self._order:
+                stage = self._stages[name]
+                if stage.state != _PENDING:
+                    continue
+                if all(self._stages[d].done.is_set() for d in stage.deps):
+                    stage.state = _RUNNING
+                    ready.append(stage)
+        for stage in ready:
+            threading.Thread(target=self._run_in_thread, args=(stage,),
+                             name=f"Stage-{stage.name}", daemon=True).start()
+
+    def _run_in_thread(self, stage: _Stage):
+        set_metrics_context(**self._metrics)
+        with join_cancel_scope(self._token):
+            self._execute(stage, [self._stages[d].result for d in stage.deps])
+        self._schedule()
+
+    def _execute(self, stage: _Stage, args: list):
+        if any(self._stages[d].state == _FAILED and
+               isinstance(self._stages[d].error, PipelineAbort) for d in stage.deps):
+            stage.state = _SKIPPED
+            stage.done.set()
+            return
+        if self._should_skip(stage):
+            stage.state = _SKIPPED
+            print(f"[PIPELINE] ⏭ {stage.name}: пропущена")
+            stage.done.set()
+            return
+        t0 = time.perf_counter()
+        try:
+            stage.result = stage.fn(*args)
+            stage.state = _DONE
+        except PipelineAbort as e:
+            stage.error = e
+            stage.state = _FAILED
+        except Exception as e:
+            stage.error = e
+            stage.result = stage.default
+            stage.state = _FAILED
+            print(f"[PIPELINE] ✗ {stage.name}: {type(e).__name__}: {e}")
+        finally:
+            stage.elapsed_ms = (time.perf_counter() - t0) * 1000
+            stage.done.set()
+
+    def wait(self, name: str):
+        """
+        Результат фоновой стадии (ждёт её завершения). При отмене запроса
+        не ждёт — сразу возвращает default: ответ всё равно не нужен.
+        """
+        stage = self._stages[name]
+        if not self._started:
+            self.start()
+        while not stage.done.wait(_WAIT_SLICE):
+            if self.cancelled():
+                return stage.default
+        if isinstance(stage.error, PipelineAbort):
+            raise stage.error
+        return stage.result
+
+    # ── Выполнение в текущем потоке ──────────────────────────────────
+    def run(self, name: str, fn, skip=False, default=None):
+        """
+        Последовательная стадия в текущем потоке: замер времени и пропуск
+        по тем же правилам, что у фоновых. Возвращает результат fn().
+        """
+        stage = _Stage(name, fn, (), skip, default)
+        stage.state = _RUNNING   # до регистрации — иначе _schedule запустит её в потоке
+        with self._lock:
+            if name in self._stages:
+                raise ValueError(f"Стадия {name!r} уже добавлена")
+            self._stages[name] = stage
+            self._order.append(name)
+        self._execute(stage, [])
+        if isinstance(stage.error, PipelineAbort):
+            raise stage.error
+        return stage.result
+
+    # ── Отчёт ────────────────────────────────────────────────────────
+    def timings(self) -> dict:
+        """Имя стадии → (состояние, мс)."""
+        return {n: (self._stages[n].state, round(self._stages[n].elapsed_ms, 1))
+                for n in self._order}
+
+    def report(self):
+        parts = []
+        for name, (state, ms) in self.timings().items():
+            if state == _SKIPPED:
+                parts.append(f"{name} —")
+            elif state in (_DONE, _FAILED):
+                parts.append(f"{name} {ms:.0f} мс" + (" ✗" if state == _FAILED else ""))
+        total = (time.perf_counter() - self._t0) * 1000
+        print(f"[PIPELINE] {self.name}: {' | '.join(parts)} → всего {total:.0f} мс")
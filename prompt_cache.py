@@ -0,0 +1,220 @@
+# ═══════════════════════════════════════════════════════════════════════
+# prompt_cache.py — раскладка промпта под prompt-cache Ollama
+#
+# Содержит:
+#   • PROMPT_LAYOUT              — "stable" (по умолчанию) или "legacy"
+#   • build_volatile_block()     — изменчивый контекст для конца промпта
+#   • stable_history_window()    — окно истории с устойчивым началом
+#   • PromptCacheTracker         — доля попаданий в KV-cache по prompt_eval_count
+#   • get_prompt_cache_tracker() — общий экземпляр
+#
+# Ollama переиспользует KV-cache только для общего ПРЕФИКСА нового и
+# предыдущего промпта (побайтово, до первого отличающегося токена).
+# Раньше в system_prompt стояли время (меняется каждую минуту), память
+# и анализ файлов — всё это шло ДО истории, и на каждом ходу модель
+# заново прогоняла тысячи токенов. Плюс окно истории «последние N
+# сообщений» сдвигалось на каждом ходу, ломая префикс ещё раз.
+#
+# В режиме "stable":
+#   [system: статичный промпт + дата] [история с якорем] [user: контекст + вопрос]
+# Время, память и контекст файлов уходят в последнее сообщение, а
+# начало окна истории держится на месте, пока окно не переполнится.
+#
+# Использование:
+#   from prompt_cache import is_stable_layout, get_prompt_cache_tracker
+#   get_prompt_cache_tracker().observe(model, messages, response_json)
+#   get_prompt_cache_tracker().stats()   # {"qwen3:14b": {"hit_ratio": 0.91, ...}}
+# ═══════════════════════════════════════════════════════════════════════
+
+import os
+import hashlib
+import threading
+
+from token_estimator import get_token_estimator
+
+# ── Конфигурация ────────────────────────────────────────────────────────
+# "stable" — префикс-стабильная раскладка; "legacy" — как было раньше
+PROMPT_LAYOUT = os.getenv("AI_ASSISTANT_PROMPT_LAYOUT", "stable").strip().lower()
+
+# При переполнении окна истории начало сдвигается так, чтобы осталась
+# только эта доля лимита — следующие ходы снова дописываются в хвост.
+HISTORY_REBASE_FRACTION = 0.5
+
+
+def is_stable_layout() -> bool:
+    return PROMPT_LAYOUT != "legacy"
+
+
+def build_volatile_block(parts: list, language: str = "russian") -> str:
+    """
+    Собирает изменчивый контекст (время, память, файлы) в один блок,
+    который ставится перед текстом вопроса в последнем сообщении.
+    Пустые части пропускаются; если всё пусто — возвращает "".
+    """
+    body = "\n".join(p.strip("\n") for p in parts if p and p.strip())
+    if not body:
+        return ""
+    if language == "russian":
+        return f"[КОНТЕКСТ ЗАПРОСА]\n{body}\n[/КОНТЕКСТ ЗАПРОСА]"
+    return f"[REQUEST CONTEXT]\n{body}\n[/REQUEST CONTEXT]"
+
+
+# ── Окно истории с якорем ───────────────────────────────────────────────
+_ANCHORS: dict = {}
+_ANCHORS_LOCK = threading.Lock()
+
+
+def _message_hash(msg: dict) -> str:
+    raw = f"{msg.get('role', '')}\x00{msg.get('content', '')}"
+    return hashlib.sha1(raw.encode("utf-8", "replace")).hexdigest()
+
+
+def stable_history_window(key, messages: list, max_messages: int,
+                          token_budget: int, estimate_tokens=None) -> list:
+    """
+    Выбирает окно истории, начало которого не двигается от хода к ходу.
+
+    key              — идентификатор диалога (chat_id + модель)
+    messages         — вся доступная история (старые → новые)
+    max_messages     — максимум сообщений в окне
+    token_budget     — максимум токенов в окне
+    estimate_tokens  — fn(text) → int, по умолчанию token_estimator
+
+    Пока окно от якоря влезает в оба лимита, возвращается оно целиком
+    (префикс промпта совпадает с прошлым ходом). При переполнении якорь
+    переносится вперёд с запасом HISTORY_REBASE_FRACTION — один промах
+    кэша вместо промаха на каждом ходу.
+    """
+    if not messages:
+        return []
+    estimate = estimate_tokens or get_token_estimator().estimate
+    sizes = [estimate(m.get("content", "")) for m in messages]
+
+    def _fits(start: int, count_limit: int, tok_limit: int) -> bool:
+        return (len(messages) - start <= count_limit
+                and sum(sizes[start:]) <= tok_limit)
+
+    with _ANCHORS_LOCK:
+        anchor = _ANCHORS.get(key)
+    start = None
+    if anchor is not None:
+        for i in range(len(messages) - 1, -1, -1):
+            if _message_hash(messages[i]) == anchor:
+                start = i
+                break
+        if start is not None and not _fits(start, max_messages, token_budget):
+            start = None
+
+    if start is None:
+        # Новый якорь: самый ранний старт, влезающий в уменьшенные лимиты
+        count_limit = max(1, int(max_messages * HISTORY_REBASE_FRACTION))
+        tok_limit = max(1, int(token_budget * HISTORY_REBASE_FRACTION))
+        start = len(messages)
+        while start > 0 and _fits(start - 1, count_limit, tok_limit):
+            start -= 1
+        # Диалог ответов ассистента не должен начинаться с полуреплики
+        while start < len(messages) and messages[start].get("role") != "user":
+            start += 1
+        if start < len(messages):
+            print(f"[PROMPT_CACHE] ↪ Новый якорь истории: {len(messages) - start} "
+                  f"из {len(messages)} сообщений")
+
+    with _ANCHORS_LOCK:
+        if start < len(messages):
+            _ANCHORS[key] = _message_hash(messages[start])
+        else:
+            _ANCHORS.pop(key, None)
+    return messages[start:]
+
+
+# ── Учёт попаданий в prompt-cache ───────────────────────────────────────
+def _serialize(messages: list) -> str:
+    return "".join(f"<{m.get('role', '')}>{m.get('content', '')}" for m in messages or [])
+
+
+def _common_prefix_len(a: str, b: str) -> int:
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+class PromptCacheTracker:
+    """
+    Считает, какая часть промпта была взята из KV-cache Ollama.
+
+    Ollama сообщает prompt_eval_count — число токенов, которые реально
+    прогонялись; закэшированный префикс в него не входит. Доля попаданий:
+        hit = 1 − prompt_eval_count / оценка_токенов_промпта
+    Дополнительно считается prefix_reuse — доля символов, совпавших с
+    предыдущим промптом этой модели (что кэш МОГ переиспользовать).
+
+    Заодно калибрует token_estimator: по eval_count — всегда, по
+    prompt_eval_count — только когда промпт явно прогонялся целиком.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_prompt: dict = {}   # модель → сериализованный прошлый промпт
+        self._totals: dict = {}        # модель → накопленные счётчики
+        self.last: dict = {}           # последнее наблюдение
+
+    def observe(self, model: str, messages: list, response: dict,
+                completion_text: str = None):
+        """
+        Вызывается с финальным JSON ответа /api/chat (done=true).
+        completion_text — сгенерированный текст (для стрима в финальном
+        чанке его нет); по умолчанию берётся из response["message"].
+        """
+        if not model or not isinstance(response, dict):
+            return None
+        text = _serialize(messages)
+        estimator = get_token_estimator()
+        est_tokens = max(1, estimator.estimate_messages(messages, model))
+        evaluated = response.get("prompt_eval_count")
+        if completion_text is None:
+            completion_text = (response.get("message") or {}).get("content", "")
+        if response.get("eval_count") and completion_text:
+            estimator.observe_completion(model, completion_text, response["eval_count"])
+        with self._lock:
+            prev = self._last_prompt.get(model, "")
+            self._last_prompt[model] = text
+            reuse = _common_prefix_len(prev, text) / len(text) if text else 0.0
+            # Промпт прогонялся целиком: с прошлым промптом общего префикса нет,
+            # и число токенов правдоподобно (кэш прошлого запуска не в счёт)
+            full_eval = (evaluated is not None and reuse < 0.02
+                         and evaluated >= est_tokens * 0.5)
+            if evaluated is None:
+                # Весь промпт из кэша: некоторые версии Ollama опускают поле
+                evaluated = 0
+            hit = max(0.0, min(1.0, 1.0 - evaluated / est_tokens))
+            t = self._totals.setdefault(model, {"requests": 0, "prompt_tokens": 0,
+                                                "evaluated_tokens": 0})
+            t["requests"] += 1
+            t["prompt_tokens"] += est_tokens
+            t["evaluated_tokens"] += min(evaluated, est_tokens)
+            self.last = {"model": model, "prompt_tokens": est_tokens,
+                         "prompt_eval_count": evaluated, "hit_ratio": round(hit, 3),
+                         "prefix_reuse": round(reuse, 3)}
+        if full_eval:
+            estimator.observe_prompt(model, messages, evaluated)
+        print(f"[PROMPT_CACHE] {model}: попадание {hit:.0%} "
+              f"(прогнано {evaluated} из ~{est_tokens} токенов, общий префикс {reuse:.0%})")
+        return dict(self.last)
+
+    def stats(self) -> dict:
+        """Накопленная доля попаданий по моделям."""
+        with self._lock:
+            out = {}
+            for model, t in self._totals.items():
+                total = t["prompt_tokens"] or 1
+                out[model] = dict(t, hit_ratio=round(1.0 - t["evaluated_tokens"] / total, 3))
+            return out
+
+
+_TRACKER = PromptCacheTracker()
+
+
+def get_prompt_cache_tracker() -> PromptCacheTracker:
+    return _TRACKER
@@ -10,7 +10,6 @@ import platform
 from datetime import datetime
 from typing import Any
 from PyQt6 import QtWidgets, QtGui, QtCore
-import requests
 import json
 
 # ── Директория приложения и настройка путей ─────────────────────────────────
@@ -272,10 +271,12 @@ from llama_handler import (
     get_current_ollama_model, get_current_display_name,
     call_ollama_chat, warm_up_model, unload_model, unload_all_models,
 )
+from ollama_client import OllamaCancelToken, cancel_scope
+from token_estimator import get_token_estimator
 # Мутируемые глобалы LLaMA — доступ только через модуль:
 #   llama_handler.CURRENT_AI_MODEL_KEY   — текущая модель
 #   llama_handler._APP_SHUTTING_DOWN     — флаг закрытия приложения
-#   llama_handler._OLLAMA_SESSION        — HTTP-сессия
+#   llama_handler._OLLAMA_CLIENT         — общий пул соединений Ollama
 
 APP_TITLE = "AI Assistant"
 
@@ -606,6 +607,7 @@ from ai_core import (
     MAX_HISTORY_LOAD,
     SHORT_TEXT_THRESHOLD,
 )
+from search_prefetch import get_search_prefetcher
 
 # -------------------------
 # Animated Checkbox
@@ -3029,6 +3031,8 @@ class WorkerSignals(QtCore.QObject):
     # (response_text, list of (title, url) source tuples)
     finished = QtCore.pyqtSignal(str, list)
     chunk    = QtCore.pyqtSignal(str)   # очередной токен из стрима
+    stream_reset = QtCore.pyqtSignal()  # показанный стрим заменяется новым (перегенерация)
+    cancelled = QtCore.pyqtSignal(float)  # запрос прерван; время до обрыва, мс
 
 class AIWorker(QtCore.QRunnable):
     def __init__(self, user_message: str, current_language: str, deep_thinking: bool, use_search: bool, should_forget: bool = False, chat_manager=None, chat_id=None, file_paths: list = None, ai_mode: str = AI_MODE_FAST, model_key_override: str = None):
@@ -3043,6 +3047,8 @@ class AIWorker(QtCore.QRunnable):
         self.file_paths = file_paths if file_paths else []
         self.ai_mode = ai_mode
         self._cancelled = False
+        # Токен жёсткой отмены: cancel() закрывает сокет активного запроса к Ollama
+        self.cancel_token = OllamaCancelToken()
         # Уникальный ID запроса — для защиты от "призраков" после стопа
         self.request_id = id(self)
         self.signals = WorkerSignals()
@@ -3050,6 +3056,19 @@ class AIWorker(QtCore.QRunnable):
         # Если не передан — берём текущую активную модель из глобала
         self.model_key = model_key_override if model_key_override is not None else llama_handler.CURRENT_AI_MODEL_KEY
 
+    def cancel(self):
+        """Отмена из GUI-потока: помечает воркер и сразу обрывает запрос к Ollama."""
+        self._cancelled = True
+        self.cancel_token.cancel()
+
+    def _emit_cancelled(self):
+        _ms = self.cancel_token.time_to_abort_ms()
+        print(f"[WORKER] ⏹ Запрос {self.request_id} прерван за {_ms:.0f} мс")
+        try:
+            self.signals.cancelled.emit(_ms)
+        except RuntimeError:
+            pass
+
     @QtCore.pyqtSlot()
     def run(self):
         try:
@@ -3060,17 +3079,15 @@ class AIWorker(QtCore.QRunnable):
             # При старте программы Ollama запускается в фоне. Если пользователь
             # успел написать раньше — делаем до 5 попыток по 3 секунды (15 сек).
             for _attempt in range(5):
-                try:
-                    requests.get("http://localhost:11434/api/tags", timeout=2)
+                if llama_handler._OLLAMA_CLIENT.is_alive(timeout=2):
                     break  # Ollama отвечает — продолжаем
-                except Exception:
-                    if self._cancelled or llama_handler._APP_SHUTTING_DOWN:
-                        return
-                    if _attempt < 4:
-                        print(f"[WORKER] ⏳ Ollama не готова, попытка {_attempt + 1}/5 — ждём 3с...")
-                        time.sleep(3)
-                    # На последней попытке просто идём дальше — get_ai_response
-                    # сам вернёт ошибку если Ollama так и не поднялась
+                if self._cancelled or llama_handler._APP_SHUTTING_DOWN:
+                    return
+                if _attempt < 4:
+                    print(f"[WORKER] ⏳ Ollama не готова, попытка {_attempt + 1}/5 — ждём 3с...")
+                    time.sleep(3)
+                # На последней попытке просто идём дальше — get_ai_response
+                # сам вернёт ошибку если Ollama так и не поднялась
 
             def _on_chunk(token: str):
                 if self._cancelled or llama_handler._APP_SHUTTING_DOWN:
@@ -3080,23 +3097,35 @@ class AIWorker(QtCore.QRunnable):
                 except RuntimeError:
                     pass
 
-            response, sources = get_ai_response(
-                self.user_message,
-                self.current_language,
-                self.deep_thinking,
-                self.use_search,
-                self.should_forget,
-                self.chat_manager,
-                self.chat_id,
-                self.file_paths,
-                self.ai_mode,
-                self.model_key,
-                on_chunk=_on_chunk,
-                cancelled_flag=lambda: self._cancelled or llama_handler._APP_SHUTTING_DOWN,
-            )
+            def _on_stream_reset():
+                if self._cancelled or llama_handler._APP_SHUTTING_DOWN:
+                    return
+                try:
+                    self.signals.stream_reset.emit()
+                except RuntimeError:
+                    pass
+
+            with cancel_scope(self.cancel_token):
+                response, sources = get_ai_response(
+                    self.user_message,
+                    self.current_language,
+                    self.deep_thinking,
+                    self.use_search,
+                    self.should_forget,
+                    self.chat_manager,
+                    self.chat_id,
+                    self.file_paths,
+                    self.ai_mode,
+                    self.model_key,
+                    on_chunk=_on_chunk,
+                    cancelled_flag=lambda: self._cancelled or llama_handler._APP_SHUTTING_DOWN,
+                    on_stream_reset=_on_stream_reset,
+                )
             # Проверяем ещё раз после долгого ожидания ответа от Ollama
             if self._cancelled or llama_handler._APP_SHUTTING_DOWN:
                 print(f"[WORKER] ⚠️ Запрос {self.request_id} отменён — ответ сброшен")
+                if self._cancelled and not llama_handler._APP_SHUTTING_DOWN:
+                    self._emit_cancelled()
                 return
             if hasattr(self, 'signals') and self.signals is not None:
                 try:
@@ -3105,6 +3134,8 @@ class AIWorker(QtCore.QRunnable):
                     pass
         except Exception as e:
             if self._cancelled:
+                if not llama_handler._APP_SHUTTING_DOWN:
+                    self._emit_cancelled()
                 return
             if hasattr(self, 'signals') and self.signals is not None:
                 try:
@@ -5984,6 +6015,8 @@ class MainWindow(AttachmentMixin, QtWidgets.QMainWindow):
         self.input_field.setFont(font_input)
         self.input_field.setMinimumHeight(56)
         self.input_field.returnPressed.connect(self.send_message)
+        # Пока пользователь печатает — упреждающий веб-поиск по черновику
+        self.input_field.textChanged.connect(self._on_draft_changed)
         _wrap_layout.addWidget(self.input_field, stretch=1)
 
         # ── Кнопка микрофона (внутри поля ввода) ────────────────────────────
@@ -6307,7 +6340,7 @@ class MainWindow(AttachmentMixin, QtWidgets.QMainWindow):
         # 2. Отменяем текущего воркера
         if hasattr(self, 'current_worker') and self.current_worker is not None:
             try:
-                self.current_worker._cancelled = True
+                self.current_worker.cancel()
             except Exception:
                 pass
 
@@ -6322,9 +6355,28 @@ class MainWindow(AttachmentMixin, QtWidgets.QMainWindow):
         unload_all_models(except_key=None, synchronous=True, timeout=4)
         print("[CLOSE] ✓ Модели выгружены")
 
-        # 5. Закрываем HTTP-сессию
+        # 5. Закрываем пул соединений Ollama
+        try:
+            llama_handler._OLLAMA_CLIENT.close()
+        except Exception:
+            pass
+
+        # 5a. Сохраняем калибровку оценщика токенов (пишется с троттлингом)
+        try:
+            get_token_estimator().save()
+        except Exception:
+            pass
+
+        # 5b. Сохраняем статистику сайтов веб-поиска (save() пишет сразу, без троттлинга)
         try:
-            llama_handler._OLLAMA_SESSION.close()
+            from domain_stats import get_domain_stats
+            get_domain_stats().save()
+        except Exception:
+            pass
+
+        # 5c. Прерываем упреждающий поиск по черновику
+        try:
+            get_search_prefetcher().cancel()
         except Exception:
             pass
 
@@ -8384,9 +8436,8 @@ class MainWindow(AttachmentMixin, QtWidgets.QMainWindow):
         # ── LLaMA 3.2 Vision ─────────────────────────────────────────
         llama32_installed = False
         try:
-            import requests as _req
-            _r = _req.get("http://localhost:11434/api/tags", timeout=1)
-            _models = [m.get("name","") for m in _r.json().get("models",[])]
+            _tags = llama_handler._OLLAMA_CLIENT.tags(timeout=1)
+            _models = [m.get("name","") for m in _tags.get("models",[])]
             llama32_installed = any("llama3.2" in m for m in _models)
         except Exception:
             pass
@@ -10698,6 +10749,11 @@ class MainWindow(AttachmentMixin, QtWidgets.QMainWindow):
     # СТРИМИНГ: побуквенный вывод токенов от Ollama
     # ──────────────────────────────────────────────────────────────────────────
 
+    def _on_worker_cancelled(self, abort_ms: float):
+        """Слот — воркер подтвердил отмену; abort_ms — время от «Стоп» до обрыва запроса."""
+        print(f"[STOP] ⏹ Генерация прервана, запрос к Ollama закрыт за {abort_ms:.0f} мс")
+        self._last_abort_ms = abort_ms
+
     def _on_stream_chunk(self, token: str):
         """
         Слот — вызывается из AIWorker для каждого токена.
@@ -10781,6 +10837,28 @@ class MainWindow(AttachmentMixin, QtWidgets.QMainWindow):
         self._stream_buf += token
         self._char_queue.extend(list(token))
 
+    def _on_stream_reset(self):
+        """
+        Слот — ответ перегенерируется после валидации: очищаем уже
+        показанный текст в том же пузыре, новые токены пойдут в него же.
+        """
+        if not getattr(self, '_stream_active', False):
+            return
+        self._stream_raw     = ""
+        self._stream_buf     = ""
+        self._displayed_text = ""
+        if getattr(self, '_char_queue', None):
+            self._char_queue.clear()
+        mw = getattr(self, '_stream_widget', None)
+        if mw is None:
+            return
+        try:
+            mw.message_label.setText(
+                f"<b style='color:{mw._speaker_color};'>{mw.speaker}:</b><br>"
+            )
+        except Exception:
+            pass
+
     def _stream_flush(self):
         """Вызывается каждые 16 мс — побуквенно выводит символы из очереди."""
         char_queue = getattr(self, '_char_queue', None)
@@ -12473,6 +12551,17 @@ class MainWindow(AttachmentMixin, QtWidgets.QMainWindow):
             # Запускаем управление кнопками отложенно
             QtCore.QTimer.singleShot(100, manage_buttons)
     
+    def _on_draft_changed(self, text: str):
+        """Черновик в поле ввода → search_prefetch (оценка и поиск в фоне, после паузы)"""
+        if self.is_generating:
+            return
+        get_search_prefetcher().update_draft(
+            text, self.chat_manager, self.current_chat_id,
+            forced_search=self.use_search,
+            model_key=llama_handler.CURRENT_AI_MODEL_KEY,
+            has_files=bool(self.attached_files),
+        )
+
     def send_message(self):
         """Отправка сообщения пользователя
         
@@ -12489,8 +12578,8 @@ class MainWindow(AttachmentMixin, QtWidgets.QMainWindow):
             
             # Помечаем текущий worker как отменённый
             if hasattr(self, 'current_worker') and self.current_worker:
-                self.current_worker._cancelled = True
-                print(f"[SEND] ✓ Worker помечен как отменённый")
+                self.current_worker.cancel()
+                print(f"[SEND] ✓ Worker отменён, запрос к Ollama прерван")
             
             self.current_worker = None
             
@@ -12829,6 +12918,9 @@ class MainWindow(AttachmentMixin, QtWidgets.QMainWindow):
         # ✅ ВОССТАНОВЛЕНИЕ ПРИ ОТМЕНЕ: сохраняем текст и файлы ДО очистки поля
         self._last_sent_text = user_text
         self._last_sent_files = list(self.attached_files) if self.attached_files else []
+
+        # Упреждающий поиск по этому тексту продолжается, по другому — отменяется
+        get_search_prefetcher().on_send(user_text)
         
         # ═══════════════════════════════════════════════════════════
         # УМНАЯ АДАПТИВНАЯ СИСТЕМА ВЕБ-ПОИСКА
@@ -13014,7 +13106,9 @@ class MainWindow(AttachmentMixin, QtWidgets.QMainWindow):
         print(f"[SEND] Модель зафиксирована: {_locked_model_key}")
         worker = AIWorker(user_text, self.current_language, actual_deep_thinking, actual_use_search, False, self.chat_manager, self.current_chat_id, self.attached_files, self.ai_mode, model_key_override=_locked_model_key)
         worker.signals.chunk.connect(self._on_stream_chunk)
+        worker.signals.stream_reset.connect(self._on_stream_reset)
         worker.signals.finished.connect(self.handle_response)
+        worker.signals.cancelled.connect(self._on_worker_cancelled)
         self.current_worker = worker  # Сохраняем ссылку на текущего воркера
         self._current_request_id = worker.request_id  # Запоминаем ID запроса
         
@@ -13659,7 +13753,9 @@ class MainWindow(AttachmentMixin, QtWidgets.QMainWindow):
                          None, self.ai_mode,
                          model_key_override=force_model_key)
         worker.signals.chunk.connect(self._on_stream_chunk)
+        worker.signals.stream_reset.connect(self._on_stream_reset)
         worker.signals.finished.connect(self.handle_response)
+        worker.signals.cancelled.connect(self._on_worker_cancelled)
         self._current_request_id = worker.request_id
         self.current_worker = worker
         
@@ -0,0 +1,138 @@
+# ═══════════════════════════════════════════════════════════════════════
+# search_cache.py — кэш результатов поиска на время сессии
+#
+# Содержит:
+#   • normalize_query()   — запрос → ключ (регистр, пунктуация, порядок слов)
+#   • SearchCache         — TTL-кэш «запрос + регион + язык → ранжированные
+#                           результаты» с LRU-ограничением по числу записей
+#   • get_search_cache()  — общий экземпляр
+#
+# За один ход google_search вызывается много раз с почти одинаковыми
+# запросами: deep_web_search, retry_search_if_needed, повтор
+# VERSION_GUARD в ai_core, шесть шаблонов vp_search. Каждый вызов —
+# отдельный запрос к DuckDuckGo и шанс упереться в rate limit. Теперь
+# повтор в пределах TTL берётся из памяти, а одинаковые одновременные
+# запросы (параллельный vp_search) ждут первый вместо второго похода в
+# сеть.
+#
+# Хранятся ранжированный и сырой списки результатов для запрошенного
+# num_results: запрос с тем же или меньшим числом результатов
+# обслуживается из кэша, с большим — идёт в сеть.
+#
+# Использование:
+#   cache = get_search_cache()
+#   key = cache.key_for(query, region, language)
+#   with cache.lock_for(key):
+#       entry = cache.get(key, num_results)   # (ranked, raw) или None
+#       if entry is None:
+#           ...; cache.put(key, num_results, ranked, raw)
+# ═══════════════════════════════════════════════════════════════════════
+
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+SEARCH_CACHE_TTL = int(os.getenv("AI_ASSISTANT_SEARCH_CACHE_TTL", str(30 * 60)))
+SEARCH_CACHE_MAX_ENTRIES = 256
+
+_PUNCT_RE = re.compile(r"[^\w\s.+#-]+", re.UNICODE)
+
+
+def normalize_query(query: str) -> str:
+    """
+    Ключ запроса: нижний регистр, без пунктуации, уникальные слова по
+    алфавиту. «Python latest version?» и «latest version python» —
+    один и тот же поиск для DDG и для filter_and_rank_results.
+    """
+    words = _PUNCT_RE.sub(" ", (query or "").lower()).split()
+    return " ".join(sorted(set(words)))
+
+
+class _Entry:
+    __slots__ = ("num_results", "ranked", "raw", "expires_at")
+
+    def __init__(self, num_results: int, ranked: list, raw: list, expires_at: float):
+        self.num_results = num_results
+        self.ranked = ranked
+        self.raw = raw
+        self.expires_at = expires_at
+
+
+class SearchCache:
+    """Кэш результатов google_search в памяти процесса."""
+
+    def __init__(self, ttl: float = SEARCH_CACHE_TTL, max_entries: int = SEARCH_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._key_locks: dict = {}
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def key_for(query: str, region: str, language: str) -> tuple:
+        return normalize_query(query), region, language
+
+    @contextmanager
+    def lock_for(self, key: tuple):
+        """Одинаковые одновременные запросы выполняются по одному."""
+        with self._lock:
+            entry = self._key_locks.get(key)
+            if entry is None:
+                entry = self._key_locks[key] = [threading.Lock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    self._key_locks.pop(key, None)
+
+    def get(self, key: tuple, num_results: int):
+        """(ranked, raw) для num_results или None."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at < now:
+                del self._entries[key]
+                entry = None
+            if entry is None or entry.num_results < num_results:
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return entry.ranked, entry.raw
+
+    def put(self, key: tuple, num_results: int, ranked: list, raw: list):
+        with self._lock:
+            self._entries[key] = _Entry(num_results, list(ranked), list(raw),
+                                        time.time() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._counters, entries=len(self._entries))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_CACHE: SearchCache = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_search_cache() -> SearchCache:
+    global _CACHE
+    if _CACHE is None:
+        with _CACHE_LOCK:
+            if _CACHE is None:
+                _CACHE = SearchCache()
+    return _CACHE
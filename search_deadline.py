@@ -0,0 +1,105 @@
+# ═══════════════════════════════════════════════════════════════════════
+# search_deadline.py — общий лимит времени на поиск одного ответа
+#
+# Содержит:
+#   • SearchDeadline             — момент, к которому поиск должен отдать
+#                                  результат; remaining() / allows() / clamp()
+#   • SEARCH_BUDGETS             — лимит (сек) по режимам, настраивается
+#                                  через AI_ASSISTANT_SEARCH_BUDGET
+#   • search_deadline_for_mode() — дедлайн для режима ответа
+#
+# deep_web_search мог выполнить подряд первичный поиск, до 5 загрузок
+# страниц, retry_search_if_needed, повторный rank_and_select_sources,
+# затем повтор VERSION_GUARD в ai_core и суммаризацию — без общего
+# ограничения, в худшем случае больше минуты. Теперь get_ai_response
+# заводит один SearchDeadline на ход и передаёт его по всему пайплайну
+# поиска: загрузки страниц (PageFetcher) прекращаются по его истечении,
+# необязательные повторы пропускаются, если на них не осталось
+# RETRY_MIN_SECONDS, суммаризация моделью укладывается в остаток — и
+# каждая стадия отдаёт лучшее, что успела собрать.
+#
+# Настройка (секунды, 0 — без лимита):
+#   AI_ASSISTANT_SEARCH_BUDGET="fast=12,thinking=30,pro=0" python run.py
+#
+# Использование:
+#   deadline = search_deadline_for_mode(ai_mode)
+#   deep_web_search(query, deadline=deadline)
+#   if deadline.allows(RETRY_MIN_SECONDS): ...повторный поиск...
+#   timeout = deadline.clamp(SUMMARIZE_TIMEOUT)
+# ═══════════════════════════════════════════════════════════════════════
+
+import os
+import time
+
+# Лимиты по умолчанию (сек) для режимов быстрый / думающий / про
+DEFAULT_SEARCH_BUDGETS = {"fast": 15.0, "thinking": 30.0, "pro": 60.0}
+# Меньше этого остатка повторный поиск не запускаем — он не успеет
+RETRY_MIN_SECONDS = 5.0
+
+# Режимы ответа (llama_handler.AI_MODE_*) → ключи настройки
+_MODE_KEYS = {"быстрый": "fast", "думающий": "thinking", "про": "pro"}
+
+
+def _parse_budgets(spec: str) -> dict:
+    """«fast=12,pro=0» поверх DEFAULT_SEARCH_BUDGETS; 0 — без лимита (None)."""
+    budgets = dict(DEFAULT_SEARCH_BUDGETS)
+    for item in spec.split(","):
+        key, sep, value = item.partition("=")
+        key = _MODE_KEYS.get(key.strip(), key.strip().lower())
+        if not sep or key not in budgets:
+            continue
+        try:
+            seconds = float(value)
+        except ValueError:
+            print(f"[SEARCH_DEADLINE] ⚠️ Некорректный лимит «{item.strip()}» — пропущен")
+            continue
+        budgets[key] = seconds if seconds > 0 else None
+    return budgets
+
+
+SEARCH_BUDGETS = _parse_budgets(os.getenv("AI_ASSISTANT_SEARCH_BUDGET", ""))
+
+
+class SearchDeadline:
+    """Лимит времени поиска; seconds=None — без ограничения."""
+
+    def __init__(self, seconds: float = None, label: str = "search"):
+        self.seconds = seconds
+        self.label = label
+        self.started = time.monotonic()
+        self._end = None if seconds is None else self.started + seconds
+
+    @property
+    def limited(self) -> bool:
+        return self._end is not None
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def remaining(self) -> float:
+        """Сколько секунд осталось (inf без лимита, не меньше 0)."""
+        if self._end is None:
+            return float("inf")
+        return max(self._end - time.monotonic(), 0.0)
+
+    def expired(self) -> bool:
+        return self._end is not None and time.monotonic() >= self._end
+
+    def allows(self, seconds: float) -> bool:
+        """Осталось ли хотя бы seconds — стоит ли начинать необязательный шаг."""
+        return self.remaining() >= seconds
+
+    def clamp(self, timeout: float) -> float:
+        """Таймаут шага, не выходящий за дедлайн."""
+        return min(timeout, self.remaining())
+
+    def __repr__(self):
+        if self._end is None:
+            return f"SearchDeadline({self.label}, без лимита)"
+        return f"SearchDeadline({self.label}, осталось {self.remaining():.1f} из {self.seconds:.0f} с)"
+
+
+def search_deadline_for_mode(mode: str) -> SearchDeadline:
+    """Дедлайн поиска для режима ответа (AI_MODE_* или fast/thinking/pro)."""
+    key = _MODE_KEYS.get(mode, mode)
+    return SearchDeadline(SEARCH_BUDGETS.get(key), label=key)
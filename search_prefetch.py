@@ -0,0 +1,243 @@
+# ═══════════════════════════════════════════════════════════════════════
+# search_prefetch.py — упреждающий веб-поиск, пока пользователь печатает
+#
+# Содержит:
+#   • SearchPrefetcher         — по паузе в наборе (debounce) оценивает
+#                                черновик analyze_intent_for_search и, если
+#                                поиск почти наверняка понадобится,
+#                                заранее выполняет google_search и
+#                                загружает первые страницы выдачи
+#   • get_search_prefetcher()  — общий экземпляр
+#
+# Ход с поиском начинался с нуля уже после Enter: запрос к DuckDuckGo и
+# загрузка страниц — несколько секунд до первого токена ответа. Но
+# analyze_intent_for_search — чистая эвристика, её можно дёшево прогнать
+# по черновику в поле ввода. Когда набор замирает на PREFETCH_DEBOUNCE
+# секунд и черновик уверенно (≥ PREFETCH_MIN_CONFIDENCE) требует поиска,
+# в фоне строится тот же запрос, что построит get_ai_response
+# (build_search_query), и прогреваются search_cache (google_search) и
+# page_cache / page_corpus (fetch_page_content). После отправки
+# deep_web_search находит всё это в кэшах и корпусе; если прогрев ещё
+# идёт, одинаковый запрос к поисковику ждёт его на блокировке ключа
+# search_cache, а не дублирует.
+#
+# Черновик изменился (другой normalize_query) — текущий прогрев
+# отменяется (OllamaCancelToken: PageFetcher бросает загрузки). При
+# отправке прогрев, не совпадающий с отправленным текстом, тоже
+# отменяется. Запросы о версиях ПО не прогреваются — у
+# version_search_pipeline свои поисковые запросы.
+#
+# Выключение: AI_ASSISTANT_SEARCH_PREFETCH=0
+#
+# Использование:
+#   prefetcher = get_search_prefetcher()
+#   prefetcher.update_draft(text, chat_manager, chat_id,
+#                           forced_search=..., model_key=..., has_files=...)
+#   prefetcher.on_send(text)            # перед запуском ответа
+# ═══════════════════════════════════════════════════════════════════════
+
+import os
+import re
+import threading
+
+from ollama_client import OllamaCancelToken, cancel_scope
+from search_cache import normalize_query
+from domain_stats import get_domain_stats
+from page_fetcher import fetch_relevant_pages
+from web_search import (
+    analyze_intent_for_search,
+    build_search_query,
+    detect_search_language,
+    search_region,
+    google_search,
+    fetch_page_content,
+    is_version_query,
+    needs_freshness_check,
+    DEEP_PAGE_CHARS,
+)
+
+PREFETCH_ENABLED = os.getenv("AI_ASSISTANT_SEARCH_PREFETCH", "1").strip() not in ("0", "false", "no")
+
+# Пауза в наборе (сек), после которой черновик оценивается
+PREFETCH_DEBOUNCE = 0.6
+# Порог уверенности analyze_intent_for_search (сам поиск включается от 0.4)
+PREFETCH_MIN_CONFIDENCE = 0.6
+# Черновики короче не оцениваем — намерение ещё не видно
+PREFETCH_MIN_CHARS = 12
+# Результатов поиска: 8 покрывает и быстрый (3), и думающий (8) режим
+PREFETCH_RESULTS = 8
+# Сколько страниц выдачи загрузить заранее
+PREFETCH_PAGES = 3
+
+# Модели без веб-поиска (как в send_message)
+_NO_SEARCH_MODELS = {"deepseek"}
+
+
+class _PrefetchJob:
+    """Один прогрев: ключ черновика, токен отмены, поток."""
+
+    __slots__ = ("key", "token", "thread")
+
+    def __init__(self, key: str):
+        self.key = key
+        self.token = OllamaCancelToken()
+        self.thread = None
+
+
+class SearchPrefetcher:
+    """Прогрев search_cache и page_cache по черновику сообщения."""
+
+    def __init__(self, debounce: float = PREFETCH_DEBOUNCE, enabled: bool = PREFETCH_ENABLED):
+        self.debounce = debounce
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._timer = None
+        # Номер последнего черновика: сработавший таймер устаревшего не запускает
+        self._generation = 0
+        self._job = None
+        # Ключ последнего запущенного прогрева — тот же черновик не греем дважды
+        self._last_key = None
+
+    # ── Вызовы из UI ─────────────────────────────────────────────────
+    def update_draft(self, text: str, chat_manager, chat_id: int, forced_search: bool = False,
+                     model_key: str = None, has_files: bool = False):
+        """
+        Черновик изменился. Дёшево: только перезапуск таймера; оценка
+        и поиск — в фоне после паузы.
+        """
+        if not self.enabled:
+            return
+        draft = (text or "").strip()
+        key = normalize_query(draft)
+        with self._lock:
+            self._generation += 1
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._job is not None and self._job.key != key:
+                self._cancel_job_locked("черновик изменился")
+            if (len(draft) < PREFETCH_MIN_CHARS or has_files
+                    or model_key in _NO_SEARCH_MODELS or key == self._last_key):
+                return
+            self._timer = threading.Timer(
+                self.debounce, self._start,
+                args=(self._generation, draft, key, chat_manager, chat_id, forced_search, model_key))
+            self._timer.daemon = True
+            self._timer.start()
+
+    def on_send(self, text: str) -> bool:
+        """
+        Сообщение отправлено. Прогрев того же текста продолжается (ход
+        подхватит его через кэши), любой другой — отменяется.
+        True — прогрев этого текста идёт или уже завершён.
+        """
+        key = normalize_query((text or "").strip())
+        with self._lock:
+            self._generation += 1
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            matched = key == self._last_key
+            if self._job is not None and self._job.key != key:
+                self._cancel_job_locked("отправлен другой текст")
+            # Прогрев отправленного текста дорабатывает сам: следующий
+            # черновик (и очистка поля после отправки) его уже не отменит
+            self._job = None
+            self._last_key = None
+        if matched:
+            print("[SEARCH_PREFETCH] ✓ Отправлен черновик, по которому уже шёл прогрев")
+        return matched
+
+    def cancel(self):
+        with self._lock:
+            self._generation += 1
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._cancel_job_locked("отмена")
+
+    # ── Фон ──────────────────────────────────────────────────────────
+    def _cancel_job_locked(self, reason: str):
+        job, self._job = self._job, None
+        if job is None:
+            return
+        if self._last_key == job.key:
+            self._last_key = None
+        if job.thread is not None and job.thread.is_alive():
+            print(f"[SEARCH_PREFETCH] ⏹ Прогрев отменён ({reason})")
+            job.token.cancel()
+
+    def _start(self, generation: int, draft: str, key: str, chat_manager, chat_id: int,
+               forced_search: bool, model_key: str):
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._timer = None
+            if self._job is not None:
+                if self._job.key == key:
+                    return
+                self._cancel_job_locked("черновик изменился")
+            job = self._job = _PrefetchJob(key)
+            self._last_key = key
+            job.thread = threading.Thread(
+                target=self._run, args=(job, draft, chat_manager, chat_id, forced_search, model_key),
+                daemon=True, name="search-prefetch")
+            job.thread.start()
+
+    def _run(self, job: _PrefetchJob, draft: str, chat_manager, chat_id: int,
+             forced_search: bool, model_key: str):
+        try:
+            with cancel_scope(job.token):
+                self._prefetch(job, draft, chat_manager, chat_id, forced_search, model_key)
+        except Exception as e:
+            print(f"[SEARCH_PREFETCH] ⚠️ Прогрев не удался: {type(e).__name__}: {e}")
+        finally:
+            with self._lock:
+                if self._job is job:
+                    self._job = None
+
+    def _prefetch(self, job: _PrefetchJob, draft: str, chat_manager, chat_id: int,
+                  forced_search: bool, model_key: str):
+        chat_history = chat_manager.get_chat_messages(chat_id, limit=5) if chat_id else []
+        intent = analyze_intent_for_search(draft, forced_search=forced_search, chat_history=chat_history)
+        if not intent["requires_search"] or intent["confidence"] < PREFETCH_MIN_CONFIDENCE:
+            return
+        if job.token.cancelled:
+            return
+
+        language = detect_search_language(draft, model_key)
+        query = build_search_query(draft, chat_manager, chat_id, language)
+        if is_version_query(query):
+            return
+        print(f"[SEARCH_PREFETCH] 🔮 Прогрев (уверенность {intent['confidence']:.2f}): {query}")
+
+        search_results = google_search(query, PREFETCH_RESULTS, search_region(language), language)
+        if job.token.cancelled or "Ничего не найдено" in search_results or "Ошибка" in search_results:
+            return
+
+        urls = get_domain_stats().order(re.findall(r'Ссылка: (https?://[^\s]+)', search_results))
+        revalidate = needs_freshness_check(query)
+        # Релевантность страниц проверит сам ход: здесь достаточно положить
+        # текст в page_cache и page_corpus
+        pages = fetch_relevant_pages(
+            urls[:PREFETCH_PAGES],
+            fetch=lambda url: fetch_page_content(url, max_chars=DEEP_PAGE_CHARS,
+                                                 revalidate=revalidate),
+            accept=lambda index, url, text: url if text and "[Ошибка" not in text else None,
+            max_accepted=PREFETCH_PAGES,
+        )
+        if not job.token.cancelled:
+            print(f"[SEARCH_PREFETCH] ✓ Прогрето: поиск + {len(pages)} страниц")
+
+
+_PREFETCHER = None
+_PREFETCHER_LOCK = threading.Lock()
+
+
+def get_search_prefetcher() -> SearchPrefetcher:
+    global _PREFETCHER
+    if _PREFETCHER is None:
+        with _PREFETCHER_LOCK:
+            if _PREFETCHER is None:
+                _PREFETCHER = SearchPrefetcher()
+    return _PREFETCHER
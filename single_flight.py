@@ -0,0 +1,233 @@
+# ═══════════════════════════════════════════════════════════════════════
+# single_flight.py — склейка одинаковых одновременных запросов к модели
+#
+# Содержит:
+#   • request_key()       — ключ запроса: модель + хэш сообщений + options
+#   • SingleFlight        — stream() для стриминга, call() для обычных вызовов
+#   • get_single_flight() — общий экземпляр
+#
+# Двойной клик по «Перегенерировать», повтор из меню или retry в
+# call_ollama_chat ставили в очередь однослотовой Ollama один и тот же
+# промпт дважды — вдвое больше GPU/CPU на общих машинах. Теперь второй
+# одинаковый запрос, пришедший пока первый ещё идёт, подписывается на
+# тот же апстрим и получает те же чанки (с начала, из буфера).
+#
+# Стрим качает отдельный поток со своим OllamaCancelToken: отмена
+# одного подписчика лишь отписывает его, а апстрим обрывается, когда
+# отписались все. Так же работает лимит времени подписчика (deadline):
+# истёк — FlightTimeout, даже если апстрим ещё не прислал ни строки
+# (загрузка модели, prompt-eval).
+# ═══════════════════════════════════════════════════════════════════════
+
+import json
+import time
+import hashlib
+import threading
+
+from ollama_client import OllamaCancelled, OllamaCancelToken, cancel_scope, is_cancelled
+
+# Как часто ожидающий подписчик проверяет собственную отмену (сек)
+_WAIT_SLICE = 0.1
+
+# Поля payload, не влияющие на результат генерации
+_IGNORED_FIELDS = ("stream", "keep_alive")
+
+
+class FlightTimeout(Exception):
+    """Истёк лимит времени подписчика (stream(..., deadline=...))."""
+
+
+def request_key(payload: dict) -> str:
+    """Ключ склейки: всё, что определяет генерацию (модель, сообщения, options…)."""
+    body = {k: v for k, v in payload.items() if k not in _IGNORED_FIELDS}
+    raw = json.dumps(body, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    def __init__(self, key: str):
+        self.key = key
+        self.items: list = []
+        self.done = False
+        self.error = None
+        self.cond = threading.Condition()
+        self.subscribers = 0
+        self.token = OllamaCancelToken()
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class FlightSubscription:
+    """
+    Итератор по элементам общего стрима. leader=True — подписчик,
+    запустивший апстрим (метрики и учёт кэша пишет только он).
+    """
+
+    def __init__(self, owner: "SingleFlight", flight: _Flight, leader: bool, cancelled=None,
+                 deadline: float = None):
+        self._owner = owner
+        self._flight = flight
+        self._cancelled = cancelled
+        self._deadline = deadline
+        self._closed = False
+        self.leader = leader
+
+    def _cancel_requested(self) -> bool:
+        return is_cancelled() or (callable(self._cancelled) and self._cancelled())
+
+    def __iter__(self):
+        flight = self._flight
+        pos = 0
+        try:
+            while True:
+                with flight.cond:
+                    while pos >= len(flight.items) and not flight.done:
+                        if self._cancel_requested():
+                            raise OllamaCancelled("Подписчик отменил запрос")
+                        if self._deadline is not None and time.monotonic() >= self._deadline:
+                            raise FlightTimeout("Истёк лимит времени подписчика")
+                        flight.cond.wait(_WAIT_SLICE)
+                    if pos < len(flight.items):
+                        batch = flight.items[pos:]
+                        pos = len(flight.items)
+                    elif flight.error is not None:
+                        raise flight.error
+                    else:
+                        return
+                for item in batch:
+                    yield item
+        finally:
+            self.close()
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._owner._release(self._flight)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class SingleFlight:
+    """Реестр запросов «в полёте»; одинаковые ключи делят один апстрим."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: dict = {}
+        self._calls: dict = {}
+        self._stats = {"started": 0, "coalesced": 0}
+
+    # ── Стриминг ─────────────────────────────────────────────────────
+    def stream(self, key: str, producer, cancelled=None,
+               deadline: float = None) -> FlightSubscription:
+        """
+        producer() — генератор элементов апстрима (вызывается один раз на ключ,
+        в отдельном потоке внутри cancel_scope токена полёта).
+        cancelled() — необязательный флаг отмены подписчика.
+        deadline — момент time.monotonic(), после которого ожидание
+        следующего элемента прерывается FlightTimeout.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight(key)
+                self._flights[key] = flight
+                self._stats["started"] += 1
+            else:
+                self._stats["coalesced"] += 1
+            flight.subscribers += 1
+        if leader:
+            threading.Thread(target=self._pump, args=(flight, producer),
+                             name="SingleFlightPump", daemon=True).start()
+        else:
+            print(f"[SINGLE_FLIGHT] 🔗 Одинаковый запрос уже выполняется — "
+                  f"подписываюсь на общий стрим ({key[:10]})")
+        return FlightSubscription(self, flight, leader, cancelled, deadline)
+
+    def _pump(self, flight: _Flight, producer):
+        try:
+            with cancel_scope(flight.token):
+                for item in producer():
+                    with flight.cond:
+                        flight.items.append(item)
+                        flight.cond.notify_all()
+        except BaseException as e:
+            flight.error = e
+        finally:
+            with self._lock:
+                if self._flights.get(flight.key) is flight:
+                    del self._flights[flight.key]
+            with flight.cond:
+                flight.done = True
+                flight.cond.notify_all()
+
+    def _release(self, flight: _Flight):
+        with self._lock:
+            flight.subscribers -= 1
+            abandoned = flight.subscribers <= 0 and not flight.done
+            if abandoned and self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+        if abandoned:
+            # Больше никто не слушает — обрываем апстрим
+            flight.token.cancel()
+
+    # ── Обычный вызов ────────────────────────────────────────────────
+    def call(self, key: str, fn):
+        """
+        Выполняет fn() один раз на ключ; одновременные вызовы ждут результат.
+        Возвращает (result, leader). Если лидер был отменён, а ожидающий —
+        нет, ожидающий повторяет запрос сам.
+        """
+        with self._lock:
+            pending = self._calls.get(key)
+            leader = pending is None
+            if leader:
+                pending = _Call()
+                self._calls[key] = pending
+                self._stats["started"] += 1
+            else:
+                self._stats["coalesced"] += 1
+        if leader:
+            try:
+                pending.result = fn()
+            except BaseException as e:
+                pending.error = e
+            finally:
+                with self._lock:
+                    if self._calls.get(key) is pending:
+                        del self._calls[key]
+                pending.event.set()
+            if pending.error is not None:
+                raise pending.error
+            return pending.result, True
+
+        print(f"[SINGLE_FLIGHT] 🔗 Одинаковый запрос уже выполняется — жду его результат ({key[:10]})")
+        while not pending.event.wait(_WAIT_SLICE):
+            if is_cancelled():
+                raise OllamaCancelled("Ожидающий запрос отменён")
+        if isinstance(pending.error, OllamaCancelled) and not is_cancelled():
+            return self.call(key, fn)
+        if pending.error is not None:
+            raise pending.error
+        return pending.result, False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, in_flight=len(self._flights) + len(self._calls))
+
+
+_SINGLE_FLIGHT = SingleFlight()
+
+
+def get_single_flight() -> SingleFlight:
+    return _SINGLE_FLIGHT
@@ -0,0 +1,100 @@
+# Лимит времени поиска (search_deadline) против зависшей модели и поисковика.
+# Модель — ollama_standin с долгой «загрузкой»; OLLAMA_HOST задаётся до
+# импорта ollama_client.
+
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ollama_standin import OllamaStandIn, StandInConfig
+
+_SERVER = OllamaStandIn(StandInConfig(load_ms=0, latency_ms=0)).start()
+os.environ["OLLAMA_HOST"] = _SERVER.url
+
+import web_search                                   # noqa: E402
+from llm_cache import get_llm_cache                 # noqa: E402
+from search_deadline import SearchDeadline          # noqa: E402
+
+_RAW = ("[Результат 1]\nЗаголовок: Python 3.13\nОписание: "
+        + "Python 3.13 вышел в октябре с экспериментальным JIT. " * 200)
+_FACTS = "\n".join(f"• Факт {i}: Python 3.13 получил JIT-компилятор" for i in range(12))
+
+
+@pytest.fixture(scope="module", autouse=True)
+def workdir(tmp_path_factory):
+    # llm_cache, калибровка токенов и т.п. пишутся в рабочий каталог
+    # (общие экземпляры запоминают относительный путь — каталог один на модуль)
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("search_deadline"))
+    yield
+    os.chdir(cwd)
+
+
+@pytest.fixture(autouse=True)
+def standin():
+    config = _SERVER.config
+    saved = (config.load_ms, config.tokens_per_sec, config.prompt_tokens_per_sec, config.reply)
+    _SERVER.backend.loaded.clear()                  # каждая модель снова «грузится»
+    yield config
+    config.load_ms, config.tokens_per_sec, config.prompt_tokens_per_sec, config.reply = saved
+
+
+def _entries() -> int:
+    return get_llm_cache().stats()["_store"]["entries"]
+
+
+def test_summarize_respects_deadline_while_model_loads(standin):
+    standin.load_ms = 20000
+    deadline = SearchDeadline(2.0)
+    entries = _entries()
+
+    t0 = time.monotonic()
+    out = web_search.summarize_sources(
+        _RAW, "python 3.13", "russian",
+        timeout=deadline.clamp(web_search.SUMMARIZE_TIMEOUT))
+    elapsed = time.monotonic() - t0
+
+    assert elapsed < 4.0
+    assert out == _RAW                              # модель не ответила — исходные результаты
+    assert _entries() == entries
+
+
+def test_summary_cut_by_budget_is_not_cached(standin):
+    standin.tokens_per_sec = 5
+    standin.prompt_tokens_per_sec = 1_000_000
+    standin.reply = lambda body: _FACTS
+    entries = _entries()
+
+    out = web_search.summarize_sources(_RAW, "python 3.13 jit", "russian", timeout=2.0)
+
+    assert out.startswith("• Факт 0")               # собранное к лимиту отдаётся…
+    assert _entries() == entries                    # …но в кэш не попадает
+
+
+def test_complete_summary_is_cached(standin):
+    standin.tokens_per_sec = 2000
+    standin.prompt_tokens_per_sec = 1_000_000
+    standin.reply = lambda body: _FACTS
+    entries = _entries()
+
+    out = web_search.summarize_sources(_RAW, "python 3.13 release", "russian", timeout=10.0)
+
+    assert out.startswith("• Факт 0")
+    assert _entries() == entries + 1
+
+
+def test_google_search_skips_network_after_deadline(monkeypatch):
+    def _no_network(*args, **kwargs):
+        raise AssertionError("запрос к DuckDuckGo после дедлайна")
+
+    monkeypatch.setattr(web_search, "_ddg_search_ranked", _no_network)
+    deadline = SearchDeadline(0.0)
+
+    out = web_search.google_search("python 3.13 deadline test", 3, "us-en", "english",
+                                   deadline=deadline)
+
+    assert "Ошибка" in out
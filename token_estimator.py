@@ -0,0 +1,225 @@
+# ═══════════════════════════════════════════════════════════════════════
+# token_estimator.py — самокалибрующаяся оценка числа токенов
+#
+# Содержит:
+#   • TokenEstimator          — символов-на-токен по модели и письменности
+#   • estimate_tokens()       — оценка для строки
+#   • estimate_messages_tokens() — оценка для списка сообщений /api/chat
+#   • chars_for_tokens()      — сколько символов влезает в N токенов
+#   • get_token_estimator()   — общий экземпляр
+#
+# Раньше везде стояло «1 токен ≈ 4 символа». Для кириллицы на
+# LLaMA/Qwen/Mistral это неверно в разы: история либо переполняла
+# num_ctx (Ollama молча обрезает НАЧАЛО промпта), либо бюджет
+# недоиспользовался. Здесь отношение символы/токен хранится отдельно
+# для каждой модели и письменности (латиница, кириллица, CJK, прочее)
+# и уточняется по prompt_eval_count / eval_count из ответов Ollama.
+# Выученное сохраняется в token_estimator.json между запусками.
+# ═══════════════════════════════════════════════════════════════════════
+
+import os
+import json
+import time
+import threading
+
+ESTIMATOR_FILE = "token_estimator.json"
+
+# Начальные оценки «символов на токен» (без пробелов) до калибровки
+_PRIOR_RATIOS = {
+    "latin":    4.2,
+    "cyrillic": 2.6,
+    "cjk":      1.1,
+    "other":    1.6,   # цифры, пунктуация, эмодзи
+}
+# Служебные токены шаблона чата на одно сообщение
+_MSG_OVERHEAD = 4
+
+# Калибровка: скорость EMA и допустимый диапазон наблюдений
+_MIN_ALPHA = 0.05
+_RATIO_BOUNDS = (0.4, 10.0)
+# Наблюдение учитывается, если доминирующая письменность ≥ этой доли букв
+_DOMINANT_SHARE = 0.7
+# Сохранять файл не чаще, чем раз в N секунд
+_SAVE_INTERVAL = 30.0
+
+
+def _script_counts(text: str) -> dict:
+    """Число непробельных символов каждой письменности."""
+    counts = {"latin": 0, "cyrillic": 0, "cjk": 0, "other": 0}
+    for ch in text:
+        if ch.isspace():
+            continue
+        o = ord(ch)
+        if ch.isascii() and ch.isalpha():
+            counts["latin"] += 1
+        elif 0x0400 <= o <= 0x052F:
+            counts["cyrillic"] += 1
+        elif 0x00C0 <= o <= 0x024F:
+            counts["latin"] += 1          # латиница с диакритикой (pl, de, fr…)
+        elif 0x3040 <= o <= 0x30FF or 0x4E00 <= o <= 0x9FFF or 0xAC00 <= o <= 0xD7AF:
+            counts["cjk"] += 1
+        else:
+            counts["other"] += 1
+    return counts
+
+
+def _model_family(model: str) -> str:
+    """qwen3:14b → qwen3:14b; llama3 → llama3:latest (как в Ollama)."""
+    if not model:
+        return "default"
+    return model if ":" in model else f"{model}:latest"
+
+
+class TokenEstimator:
+    """
+    Оценивает число токенов по письменности текста и выученным
+    отношениям символы/токен конкретной модели.
+    """
+
+    def __init__(self, path: str = ESTIMATOR_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        # модель → письменность → [символов_на_токен, число_наблюдений]
+        self._ratios: dict = {}
+        self._dirty = False
+        self._last_save = 0.0
+        self._load()
+
+    # ── Оценка ────────────────────────────────────────────────────────
+    def ratio(self, model: str, script: str) -> float:
+        with self._lock:
+            entry = self._ratios.get(_model_family(model), {}).get(script)
+        return entry[0] if entry else _PRIOR_RATIOS[script]
+
+    def estimate(self, text: str, model: str = None) -> int:
+        if not text:
+            return 0
+        counts = _script_counts(text)
+        tokens = sum(n / self.ratio(model, s) for s, n in counts.items() if n)
+        return int(round(tokens))
+
+    def estimate_messages(self, messages: list, model: str = None) -> int:
+        return sum(self.estimate(m.get("content", ""), model) + _MSG_OVERHEAD
+                   for m in messages or [])
+
+    def chars_for_tokens(self, tokens: int, model: str = None, sample: str = "") -> int:
+        """
+        Сколько символов текста, похожего на sample, влезет в tokens токенов.
+        Без sample считается по латинице.
+        """
+        if tokens <= 0:
+            return 0
+        if not sample:
+            return int(tokens * self.ratio(model, "latin"))
+        est = self.estimate(sample, model)
+        if est <= 0:
+            return int(tokens * self.ratio(model, "latin"))
+        return int(tokens * len(sample) / est)
+
+    # ── Калибровка ────────────────────────────────────────────────────
+    def observe(self, model: str, text: str, actual_tokens: int, overhead: int = 0):
+        """
+        Уточняет отношение для доминирующей письменности text по реальному
+        числу токенов. Вклад остальных письменностей и служебных токенов
+        вычитается по текущим оценкам.
+        """
+        if not model or not text or not actual_tokens or actual_tokens <= overhead:
+            return
+        counts = _script_counts(text)
+        letters = counts["latin"] + counts["cyrillic"] + counts["cjk"]
+        if letters < 40:
+            return
+        dominant = max(("latin", "cyrillic", "cjk"), key=lambda s: counts[s])
+        if counts[dominant] / letters < _DOMINANT_SHARE:
+            return
+        rest = sum(n / self.ratio(model, s) for s, n in counts.items()
+                   if n and s != dominant)
+        dominant_tokens = actual_tokens - overhead - rest
+        if dominant_tokens <= 0:
+            return
+        observed = counts[dominant] / dominant_tokens
+        if not (_RATIO_BOUNDS[0] <= observed <= _RATIO_BOUNDS[1]):
+            return
+        family = _model_family(model)
+        with self._lock:
+            per_model = self._ratios.setdefault(family, {})
+            current, n = per_model.get(dominant, [_PRIOR_RATIOS[dominant], 0])
+            alpha = max(_MIN_ALPHA, 1.0 / (n + 2))
+            per_model[dominant] = [round(current + alpha * (observed - current), 4), n + 1]
+            self._dirty = True
+        self._maybe_save()
+
+    def observe_prompt(self, model: str, messages: list, prompt_eval_count: int):
+        """Калибровка по промпту. Вызывать только если промпт прогонялся целиком."""
+        text = "\n".join(m.get("content", "") for m in messages or [])
+        self.observe(model, text, prompt_eval_count,
+                     overhead=_MSG_OVERHEAD * len(messages or []))
+
+    def observe_completion(self, model: str, text: str, eval_count: int):
+        """Калибровка по сгенерированному тексту (eval_count точен всегда)."""
+        self.observe(model, text, eval_count)
+
+    # ── Хранение ──────────────────────────────────────────────────────
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                self._ratios = {
+                    m: {s: list(v) for s, v in scripts.items() if s in _PRIOR_RATIOS}
+                    for m, scripts in data.items() if isinstance(scripts, dict)
+                }
+                print(f"[TOKENS] ✓ Калибровка загружена для {len(self._ratios)} моделей")
+        except (OSError, ValueError, TypeError) as e:
+            print(f"[TOKENS] ⚠️ Не удалось прочитать {self.path}: {e}")
+
+    def _maybe_save(self, force: bool = False):
+        now = time.monotonic()
+        if not self._dirty or (not force and now - self._last_save < _SAVE_INTERVAL):
+            return
+        self.save()
+
+    def save(self):
+        with self._lock:
+            snapshot = json.dumps(self._ratios, ensure_ascii=False, indent=1)
+            self._dirty = False
+            self._last_save = time.monotonic()
+        try:
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(snapshot)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"[TOKENS] ⚠️ Не удалось сохранить калибровку: {e}")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return json.loads(json.dumps(self._ratios))
+
+
+# ── Общий экземпляр ─────────────────────────────────────────────────────
+_ESTIMATOR = None
+_ESTIMATOR_LOCK = threading.Lock()
+
+
+def get_token_estimator() -> TokenEstimator:
+    global _ESTIMATOR
+    if _ESTIMATOR is None:
+        with _ESTIMATOR_LOCK:
+            if _ESTIMATOR is None:
+                _ESTIMATOR = TokenEstimator()
+    return _ESTIMATOR
+
+
+def estimate_tokens(text: str, model: str = None) -> int:
+    return get_token_estimator().estimate(text, model)
+
+
+def estimate_messages_tokens(messages: list, model: str = None) -> int:
+    return get_token_estimator().estimate_messages(messages, model)
+
+
+def chars_for_tokens(tokens: int, model: str = None, sample: str = "") -> int:
+    return get_token_estimator().chars_for_tokens(tokens, model, sample)
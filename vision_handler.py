@@ -22,6 +22,10 @@ import traceback
 
 import requests
 
+from ollama_client import get_ollama_client, OllamaCancelled
+from model_residency import get_residency_manager
+from ollama_metrics import record_ollama_metrics, STAGE_VISION
+
 # ── Конфигурация ────────────────────────────────────────────────────────
 OLLAMA_VISION_MODEL: str = os.getenv("OLLAMA_VISION_MODEL", "llama3.2-vision")
 OLLAMA_HOST: str = os.getenv("OLLAMA_HOST", "http://127.0.0.1:11434")
@@ -46,8 +50,8 @@ def call_ollama_vision(image_path: str, prompt: str,
     Отправляет изображение и промпт в Ollama vision-модель,
     возвращает текстовый ответ.
 
-    После успешного ответа автоматически выгружает модель из RAM
-    (keep_alive=0), чтобы она не занимала память между запросами.
+    Время жизни модели в RAM задаёт ModelResidencyManager (короткий
+    keep_alive для vision), поэтому явная выгрузка после ответа не нужна.
 
     Возвращает строку — либо ответ модели, либо сообщение об ошибке
     (начинающееся с «❌»).
@@ -76,7 +80,7 @@ def call_ollama_vision(image_path: str, prompt: str,
         print(f"[VISION] Размер файла: {len(image_bytes) / 1024:.1f} KB")
 
         # ── Запрос к Ollama ─────────────────────────────────────────
-        payload = {
+        payload = get_residency_manager().prepare({
             "model": OLLAMA_VISION_MODEL,
             "messages": [
                 {
@@ -90,14 +94,13 @@ def call_ollama_vision(image_path: str, prompt: str,
                 "num_predict": max_tokens,
                 "temperature": temperature,
             },
-        }
+        })
 
-        url = f"{OLLAMA_HOST}/api/chat"
-        print(f"[VISION] Отправка запроса → {url}")
+        _client = get_ollama_client()
+        print(f"[VISION] Отправка запроса → {_client.url('/api/chat')}")
         print(f"[VISION] Ожидание ответа (таймаут: {timeout}s)...")
 
-        r = requests.post(url, headers={"Content-Type": "application/json"},
-                          json=payload, timeout=timeout)
+        r = _client.chat(payload, timeout=timeout)
 
         print(f"[VISION] HTTP статус: {r.status_code}")
 
@@ -106,6 +109,7 @@ def call_ollama_vision(image_path: str, prompt: str,
             r.raise_for_status()
 
         j = r.json()
+        record_ollama_metrics(OLLAMA_VISION_MODEL, j, STAGE_VISION)
 
         # ── Разбор ответа ───────────────────────────────────────────
         if "message" in j and "content" in j["message"]:
@@ -118,23 +122,14 @@ def call_ollama_vision(image_path: str, prompt: str,
             print(f"[VISION] ⚠️ Неожиданный формат: {json.dumps(j)[:500]}")
             return "[Ошибка] Неожиданный формат ответа от модели. Проверьте консоль."
 
-        # ── Выгрузка модели из RAM ──────────────────────────────────
-        # keep_alive=0 говорит Ollama немедленно освободить память.
-        # Модель загружается только когда нужна — остальное время
-        # не занимает RAM.
-        try:
-            requests.post(
-                f"{OLLAMA_HOST}/api/generate",
-                json={"model": OLLAMA_VISION_MODEL, "keep_alive": 0},
-                timeout=10,
-            )
-            print(f"[VISION] ✓ Модель {OLLAMA_VISION_MODEL} выгружена из RAM")
-        except Exception as unload_err:
-            print(f"[VISION] ⚠️ Не удалось выгрузить модель: {unload_err}")
-
         return response
 
     # ── Обработка ошибок ────────────────────────────────────────────
+    except OllamaCancelled:
+        msg = "❌ Анализ изображения отменён пользователем"
+        print(f"[VISION] {msg}")
+        return msg
+
     except FileNotFoundError:
         msg = f"❌ Файл изображения не найден: {image_path}"
         print(f"[VISION] {msg}")
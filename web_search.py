@@ -6,10 +6,11 @@ web_search.py — Модуль веб-поиска и анализа источ
   - analyze_intent_for_search, analyze_query_type
   - google_search, deep_web_search, fallback_web_search, fetch_page_content
   - rank_and_select_sources, source_quality_score
+  - QueryScorer / get_query_scorer — запрос, скомпилированный для скоринга
   - version_search_pipeline (vp_*)
   - summarize_sources, compress_search_results
   - validate_answer, build_final_answer_prompt
-  - build_contextual_search_query
+  - build_contextual_search_query, build_search_query, detect_search_language
   - _conversational_response, is_short_acknowledgment
 
 Использование в run.py / ai_core.py:
@@ -27,6 +28,9 @@ if os.path.isdir(_WS_AI_CONFIG) and _WS_AI_CONFIG not in sys.path:
     sys.path.insert(1, _WS_AI_CONFIG)
 import json
 import time
+import sqlite3
+import functools
+import threading
 import random as _random
 import datetime as _dt_vp
 import re as _re
@@ -42,12 +46,28 @@ try:
     import llama_handler
     from llama_handler import (
         OLLAMA_HOST, get_current_ollama_model, SUPPORTED_MODELS,
+        stream_ollama_chat, OLLAMA_CANCELLED,
     )
 except ImportError:
     OLLAMA_HOST = "http://localhost:11434"
     SUPPORTED_MODELS = {}
     def get_current_ollama_model(): return "llama3"
 
+from ollama_client import OllamaCancelled
+from token_estimator import estimate_tokens
+from passage_rank import select_passages
+from extractive_summary import summarize_extractive
+from page_corpus import get_page_corpus
+from domain_stats import get_domain_stats, FAIL_HOST, FAIL_CLIENT, FAIL_PAGE
+from llm_cache import get_llm_cache
+from ollama_metrics import STAGE_SUMMARIZE
+from page_fetcher import PageFetcher, fetch_relevant_pages
+from page_cache import PageCache, get_page_cache
+from search_cache import get_search_cache
+from search_deadline import SearchDeadline, RETRY_MIN_SECONDS
+from pattern_match import PatternMatcher, FactCounter, RegexSet
+from html_extract import extract_main_content, charset_from_content_type, is_text_content_type
+
 try:
     from qwen_config import QWEN_MODEL_NAME
 except ImportError:
@@ -1601,6 +1621,10 @@ def check_spelling_and_suggest(text: str, language: str = "russian") -> dict:
         }
 
 
+# Перевод детерминирован — кэшируем на неделю (llm_cache)
+TRANSLATE_CACHE_TTL = 7 * 24 * 3600
+
+
 # -------------------------
 # DuckDuckGo Search helper (named google_search for compatibility)
 # -------------------------
@@ -1618,7 +1642,9 @@ def translate_to_russian(text: str) -> str:
         # Переводим по частям, если текст большой
         max_chunk = 4500
         if len(text) <= max_chunk:
-            translated = translator.translate(text)
+            translated = get_llm_cache().get_or_compute(
+                "translate", "google:en-ru", text, None,
+                lambda: translator.translate(text), ttl=TRANSLATE_CACHE_TTL)
         else:
             # Разбиваем на части по предложениям
             sentences = text.split('. ')
@@ -1658,7 +1684,16 @@ def analyze_query_type(query: str, language: str) -> dict:
         'domains': list,  # Релевантные домены (пустой = все)
         'keywords': list  # Ключевые слова для улучшения поиска
     }
+
+    Результат мемоизирован (google_search зовёт анализ на каждый повтор
+    поиска); возвращается копия — вызывающий может её менять.
     """
+    cached = _analyze_query_type_cached(query, language)
+    return {k: (list(v) if isinstance(v, list) else v) for k, v in cached.items()}
+
+
+@functools.lru_cache(maxsize=512)
+def _analyze_query_type_cached(query: str, language: str) -> dict:
     query_lower = query.lower()
 
     # 🕐 ДАТА И ВРЕМЯ (приоритет выше погоды)
@@ -1964,63 +1999,7 @@ def score_result(result: dict, query: str, freshness_needed: bool = False) -> fl
     - Наличие актуальных дат (если запрос требует свежести)
     - Длина описания (короткие описания — меньше информации)
     """
-    import re
-    
-    title = result.get('title', '').lower()
-    body = result.get('body', '').lower()
-    link = result.get('href', '').lower()
-    full_text = title + ' ' + body
-    
-    score = 0.0
-    
-    # ── 1. Совпадение ключевых слов ──
-    # Очищаем запрос от стоп-слов
-    stop_words = {'и', 'в', 'на', 'с', 'по', 'для', 'что', 'как', 'где',
-                  'the', 'a', 'an', 'of', 'in', 'for', 'to', 'is', 'how'}
-    keywords = [w for w in re.split(r'[\s,?!.]+', query.lower()) 
-                if len(w) > 2 and w not in stop_words]
-    
-    keyword_hits = sum(1 for kw in keywords if kw in full_text)
-    if keywords:
-        keyword_ratio = keyword_hits / len(keywords)
-        score += keyword_ratio * 40  # Макс 40 баллов за ключевые слова
-    
-    # Бонус за совпадение ключевых слов в заголовке (более ценно)
-    title_hits = sum(1 for kw in keywords if kw in title)
-    score += title_hits * 5  # +5 за каждое слово в заголовке
-    
-    # ── 2. Трастовость домена ──
-    domain_bonus = sum(10 for trusted in TRUSTED_DOMAINS if trusted in link)
-    score += min(domain_bonus, 15)  # Макс 15 баллов за домен
-    
-    # ── 3. Длина описания (больше текста = больше информации) ──
-    body_length = len(result.get('body', ''))
-    if body_length > 200:
-        score += 10
-    elif body_length > 100:
-        score += 5
-    elif body_length < 30:
-        score -= 10  # Штраф за слишком короткое описание
-    
-    # ── 4. Проверка актуальности ──
-    if freshness_needed:
-        import datetime
-        current_year = datetime.datetime.now().year
-        year_in_text = extract_year_from_text(full_text + link)
-        
-        if year_in_text == current_year:
-            score += 20  # Текущий год — отличный бонус
-        elif year_in_text == current_year - 1:
-            score += 10  # Прошлый год — небольшой бонус
-        elif year_in_text > 0 and year_in_text < current_year - 2:
-            score -= 20  # Старые страницы — штраф при freshness-запросе
-    
-    # ── 5. Штраф за нерелевантный контент ──
-    # Если ни одного ключевого слова не совпало — штраф
-    if keyword_hits == 0 and keywords:
-        score -= 15
-    
-    return score
+    return get_query_scorer(query).result_score(result, freshness_needed)
 
 
 def filter_and_rank_results(results: list, query: str, min_score: float = -10.0) -> list:
@@ -2028,11 +2007,12 @@ def filter_and_rank_results(results: list, query: str, min_score: float = -10.0)
     Фильтрует и сортирует результаты поиска по скору релевантности.
     Отбрасывает явно нерелевантные страницы.
     """
-    freshness = needs_freshness_check(query)
+    scorer = get_query_scorer(query)
+    freshness = scorer.freshness_needed
     
     scored = []
     for r in results:
-        s = score_result(r, query, freshness)
+        s = scorer.result_score(r, freshness)
         scored.append((s, r))
         print(f"[SMART_SEARCH] Скор {s:.1f} | {r.get('title', '')[:50]}")
     
@@ -2109,17 +2089,52 @@ TOPIC_PLATFORM_KEYWORDS = [
 
 # Маркеры конкретных фактов: версии, даты, номера
 import re as _re
-_FACT_PATTERNS = [
+_FACT_NUMBER_PATTERNS = [
     _re.compile(r'\b\d+\.\d+(?:\.\d+)*\b'),          # версии: 17.4.1, 3.12
     _re.compile(r'\b(19|20)\d{2}\b'),                    # годы: 2023, 2025
     _re.compile(r'\b\d{1,2}[./]\d{1,2}[./]\d{2,4}\b'), # даты: 12.05.2024
-    _re.compile(r'\b(?:january|february|march|april|may|june|july|august|'
-                r'september|october|november|december|'
-                r'январ|феврал|март|апрел|май|июн|июл|август|сентябр|октябр|ноябр|декабр)'
-                r'\w*\b', _re.IGNORECASE),
     _re.compile(r'\bv?\d+(?:\.\d+){1,3}\b'),           # v1.2.3
-    _re.compile(r'\b(?:обновлен|released|вышел|launch|update|релиз)\w*\b', _re.IGNORECASE),
 ]
+_FACT_MONTH_PREFIXES = (
+    'january', 'february', 'march', 'april', 'may', 'june', 'july', 'august',
+    'september', 'october', 'november', 'december',
+    'январ', 'феврал', 'март', 'апрел', 'май', 'июн', 'июл', 'август',
+    'сентябр', 'октябр', 'ноябр', 'декабр',
+)
+_FACT_RELEASE_PREFIXES = ('обновлен', 'released', 'вышел', 'launch', 'update', 'релиз')
+
+# Эталонное определение: по регулярке на вид маркера. Считает их
+# _FACT_COUNTER (QueryScorer) одним проходом с тем же результатом.
+_FACT_PATTERNS = _FACT_NUMBER_PATTERNS + [
+    _re.compile(r'\b(?:' + '|'.join(_FACT_MONTH_PREFIXES) + r')\w*\b', _re.IGNORECASE),
+    _re.compile(r'\b(?:' + '|'.join(_FACT_RELEASE_PREFIXES) + r')\w*\b', _re.IGNORECASE),
+]
+_FACT_COUNTER = FactCounter(_FACT_NUMBER_PATTERNS, _FACT_MONTH_PREFIXES + _FACT_RELEASE_PREFIXES)
+
+# Домены, которые гарантированно не содержат релевантного контента
+# (URL-фильтр is_relevant_page)
+_URL_BLOCKLIST = (
+    # Социальные сети
+    "facebook.com", "fb.com", "instagram.com", "twitter.com", "x.com",
+    "tiktok.com", "vk.com", "ok.ru", "pinterest.com", "tumblr.com",
+    "linkedin.com", "snapchat.com", "telegram.org", "t.me",
+    # Видеохостинги (текста нет)
+    "youtube.com", "youtu.be", "vimeo.com", "twitch.tv", "rutube.ru",
+    # Интернет-магазины
+    "amazon.com", "amazon.co.uk", "ebay.com", "aliexpress.com",
+    "ozon.ru", "wildberries.ru", "avito.ru", "market.yandex.ru",
+    "etsy.com", "walmart.com", "bestbuy.com", "newegg.com",
+    # Маркетплейсы приложений
+    "play.google.com", "apps.apple.com", "microsoft.com/store",
+    # Рекламные и трекинговые сети
+    "doubleclick.net", "googlesyndication.com", "googletagmanager.com",
+    "analytics.google.com", "yandex.ru/adv", "ads.google.com",
+    # Агрегаторы цен и отзывов без контента
+    "pricespy.com", "price.ru", "hotline.ua", "rozetka.ua",
+    # Паблики / форумы без факто-ориентированного контента
+    "reddit.com", "quora.com",          # мнения ≠ факты (можно снять)
+    "yahoo.com/answers",
+)
 
 
 def score_page_content(query: str, page_text: str) -> dict:
@@ -2137,65 +2152,7 @@ def score_page_content(query: str, page_text: str) -> dict:
         "facts_count":      int,
     }
     """
-    stop_words = {
-        "и", "в", "на", "с", "по", "для", "что", "как", "где", "это",
-        "the", "a", "an", "of", "in", "for", "to", "is", "are", "was",
-    }
-
-    # --- Ключевые слова запроса ---
-    raw_keywords = _re.split(r"[\s,?!.;:]+", query.lower())
-    keywords = [w for w in raw_keywords if len(w) > 2 and w not in stop_words]
-
-    page_lower = page_text.lower()
-
-    keyword_hits = sum(1 for kw in keywords if kw in page_lower)
-    if keywords:
-        keyword_ratio = keyword_hits / len(keywords)
-    else:
-        keyword_ratio = 1.0
-    keyword_score = round(keyword_ratio * 40, 2)   # макс 40
-
-    # --- Тематика / платформы ---
-    # Проверяем запрос И страницу: если тема есть в запросе, ищем её на странице
-    query_has_platform = [p for p in TOPIC_PLATFORM_KEYWORDS if p in query.lower()]
-    topic_hits = []
-    if query_has_platform:
-        # Запрос специфичен — ищем только эти платформы
-        topic_hits = [p for p in query_has_platform if p in page_lower]
-        topic_score = min(len(topic_hits) / max(len(query_has_platform), 1), 1.0) * 30
-    else:
-        # Запрос общий — любая платформа/тема добавляет балл
-        topic_hits = [p for p in TOPIC_PLATFORM_KEYWORDS if p in page_lower]
-        topic_score = min(len(topic_hits) * 5, 30)   # +5 за каждую, макс 30
-    topic_score = round(topic_score, 2)
-
-    # --- Конкретные факты (версии, даты, названия) ---
-    facts_count = 0
-    for pattern in _FACT_PATTERNS:
-        matches = pattern.findall(page_lower)
-        facts_count += len(matches)
-    # Нелинейный скор: первые 3 факта дают больше всего очков
-    if facts_count == 0:
-        facts_score = 0.0
-    elif facts_count <= 3:
-        facts_score = facts_count * 7.0        # 7/14/21
-    elif facts_count <= 10:
-        facts_score = 21 + (facts_count - 3) * 1.0  # до 28
-    else:
-        facts_score = 30.0                     # насыщение
-    facts_score = round(min(facts_score, 30), 2)
-
-    total_score = keyword_score + topic_score + facts_score
-
-    return {
-        "total_score":   round(total_score, 2),
-        "keyword_score": keyword_score,
-        "topic_score":   topic_score,
-        "facts_score":   facts_score,
-        "keyword_hits":  keyword_hits,
-        "topic_hits":    topic_hits,
-        "facts_count":   facts_count,
-    }
+    return get_query_scorer(query).page_scores(page_text)
 
 
 def is_relevant_page(query: str, page_text: str, url: str = "",
@@ -2221,74 +2178,7 @@ def is_relevant_page(query: str, page_text: str, url: str = "",
 
     Возвращает (bool, dict_with_scores, str_reason).
     """
-    # ── Проверка 1: минимальная длина текста ────────────────────────
-    if not page_text or len(page_text) < 200:
-        return False, {}, f"Текст слишком короткий ({len(page_text or '')} символов, нужно ≥200)"
-
-    # ── Проверка 2: URL-фильтр (соцсети, магазины, реклама) ─────────
-    # Домены, которые гарантированно не содержат релевантного контента
-    _URL_BLOCKLIST = (
-        # Социальные сети
-        "facebook.com", "fb.com", "instagram.com", "twitter.com", "x.com",
-        "tiktok.com", "vk.com", "ok.ru", "pinterest.com", "tumblr.com",
-        "linkedin.com", "snapchat.com", "telegram.org", "t.me",
-        # Видеохостинги (текста нет)
-        "youtube.com", "youtu.be", "vimeo.com", "twitch.tv", "rutube.ru",
-        # Интернет-магазины
-        "amazon.com", "amazon.co.uk", "ebay.com", "aliexpress.com",
-        "ozon.ru", "wildberries.ru", "avito.ru", "market.yandex.ru",
-        "etsy.com", "walmart.com", "bestbuy.com", "newegg.com",
-        # Маркетплейсы приложений
-        "play.google.com", "apps.apple.com", "microsoft.com/store",
-        # Рекламные и трекинговые сети
-        "doubleclick.net", "googlesyndication.com", "googletagmanager.com",
-        "analytics.google.com", "yandex.ru/adv", "ads.google.com",
-        # Агрегаторы цен и отзывов без контента
-        "pricespy.com", "price.ru", "hotline.ua", "rozetka.ua",
-        # Паблики / форумы без факто-ориентированного контента
-        "reddit.com", "quora.com",          # мнения ≠ факты (можно снять)
-        "yahoo.com/answers",
-    )
-    url_lower = (url or "").lower()
-    if url_lower:
-        for blocked in _URL_BLOCKLIST:
-            if blocked in url_lower:
-                return (False, {},
-                        f"Заблокированный домен: {blocked}")
-
-    # ── Считаем скоры через score_page_content() ────────────────────
-    scores = score_page_content(query, page_text)
-
-    stop_words = {
-        "и", "в", "на", "с", "по", "для", "что", "как", "где", "это",
-        "the", "a", "an", "of", "in", "for", "to", "is", "are", "was",
-    }
-    raw_keywords = _re.split(r"[\s,?!.;:]+", query.lower())
-    keywords = [w for w in raw_keywords if len(w) > 2 and w not in stop_words]
-
-    # ── Проверка 3: ключевые слова ───────────────────────────────────
-    if keywords:
-        actual_ratio = scores["keyword_hits"] / len(keywords)
-        if actual_ratio < min_keyword_ratio:
-            return (False, scores,
-                    f"Мало ключевых слов запроса: "
-                    f"{scores['keyword_hits']}/{len(keywords)} "
-                    f"({actual_ratio:.0%} < {min_keyword_ratio:.0%})")
-
-    # ── Проверка 4: тематика (платформа в запросе → нужна на странице) ─
-    query_platforms = [p for p in TOPIC_PLATFORM_KEYWORDS if p in query.lower()]
-    if query_platforms and not scores["topic_hits"]:
-        return (False, scores,
-                f"Запрос о платформах {query_platforms}, "
-                f"но они отсутствуют на странице")
-
-    # ── Проверка 5: суммарный балл ───────────────────────────────────
-    if scores["total_score"] < min_total:
-        return (False, scores,
-                f"Низкий суммарный балл: "
-                f"{scores['total_score']:.1f} < {min_total}")
-
-    return True, scores, "OK"
+    return get_query_scorer(query).relevance(page_text, url, min_total, min_keyword_ratio)
 
 
 def refine_search_query(original_query: str, attempt: int = 1) -> str:
@@ -2315,8 +2205,60 @@ def refine_search_query(original_query: str, attempt: int = 1) -> str:
         return f"{core} {suffix} {year}"
 
 
-def google_search(query: str, num_results: int = 5, region: str = "wt-wt", language: str = "russian"):
-    """Поиск через DuckDuckGo API (ddgs) с умной фильтрацией по типу запроса"""
+# Таймаут запроса к DuckDuckGo (сек): ddgs и HTML-fallback; с дедлайном
+# поиска — не больше его остатка
+DDG_TIMEOUT = 5
+FALLBACK_SEARCH_TIMEOUT = 10
+
+
+def _search_timeout(timeout: float, deadline: SearchDeadline = None) -> float:
+    """Таймаут запроса к поисковику с учётом остатка лимита (не меньше 1 с)."""
+    return timeout if deadline is None else max(1.0, deadline.clamp(timeout))
+
+
+def _ddg_search_ranked(query: str, enhanced_query: str, query_analysis: dict,
+                      num_results: int, region: str, timeout: float = DDG_TIMEOUT) -> tuple:
+    """
+    Запрос к DuckDuckGo + доменная фильтрация + скоринг.
+    Возвращает (ranked_results, raw_results) — списки dict ddgs.
+    """
+    # ddgs is optional dependency: pip install ddgs
+    from ddgs import DDGS
+
+    print(f"[DUCKDUCKGO_SEARCH] Отправка запроса...")
+    with DDGS(timeout=max(1, int(timeout))) as ddgs:
+        # Получаем больше результатов для фильтрации
+        raw_results = list(ddgs.text(enhanced_query, region=region, max_results=num_results * 3))
+
+    print(f"[DUCKDUCKGO_SEARCH] Получено сырых результатов: {len(raw_results)}")
+    
+    # 🎯 ШАГ 1: ДОМЕННАЯ ФИЛЬТРАЦИЯ (по категории запроса)
+    domain_filtered = []
+    if query_analysis['domains']:
+        for result in raw_results:
+            link = result.get('href', '').lower()
+            if any(domain in link for domain in query_analysis['domains']):
+                domain_filtered.append(result)
+        
+        # Если мало доменных результатов — добавляем из всех
+        if len(domain_filtered) < max(2, num_results // 2):
+            domain_filtered = raw_results
+    else:
+        domain_filtered = raw_results
+    
+    # 🎯 ШАГ 2: УМНЫЙ СКОРИНГ И РАНЖИРОВАНИЕ
+    print(f"[DUCKDUCKGO_SEARCH] 📊 Запускаю скоринг {len(domain_filtered)} результатов...")
+    ranked_results = filter_and_rank_results(domain_filtered, query)
+    return ranked_results, raw_results
+
+
+def google_search(query: str, num_results: int = 5, region: str = "wt-wt", language: str = "russian",
+                  deadline: SearchDeadline = None):
+    """
+    Поиск через DuckDuckGo API (ddgs) с умной фильтрацией по типу запроса.
+    deadline — таймаут запроса не больше остатка лимита поиска; если он
+    уже истёк, в сеть не идём (ответ из search_cache по-прежнему отдаётся).
+    """
     print(f"[DUCKDUCKGO_SEARCH] Запуск поиска...")
     print(f"[DUCKDUCKGO_SEARCH] Запрос: {query}")
     print(f"[DUCKDUCKGO_SEARCH] Регион: {region}")
@@ -2333,35 +2275,26 @@ def google_search(query: str, num_results: int = 5, region: str = "wt-wt", langu
         enhanced_query = f"{query} {' '.join(query_analysis['keywords'][:2])}"
         print(f"[DUCKDUCKGO_SEARCH] ✨ Улучшенный запрос: {enhanced_query}")
 
-    try:
-        # ddgs is optional dependency: pip install ddgs
-        from ddgs import DDGS
+    # Повтор того же (с точностью до регистра/порядка слов) запроса за
+    # последние минуты — из search_cache, без похода в DuckDuckGo
+    cache = get_search_cache()
+    cache_key = cache.key_for(query, region, language)
 
-        print(f"[DUCKDUCKGO_SEARCH] Отправка запроса...")
-        with DDGS() as ddgs:
-            # Получаем больше результатов для фильтрации
-            raw_results = list(ddgs.text(enhanced_query, region=region, max_results=num_results * 3))
+    try:
+        with cache.lock_for(cache_key):
+            cached = cache.get(cache_key, num_results)
+            if cached is not None:
+                ranked_results, raw_results = cached
+                print(f"[DUCKDUCKGO_SEARCH] ✓ Из кэша поиска ({len(ranked_results)} результатов)")
+            elif deadline is not None and deadline.expired():
+                print(f"[DUCKDUCKGO_SEARCH] ⏱ Время поиска вышло — запрос не отправлен")
+                return "⚠️ Ошибка поиска: время поиска истекло"
+            else:
+                ranked_results, raw_results = _ddg_search_ranked(
+                    query, enhanced_query, query_analysis, num_results, region,
+                    timeout=_search_timeout(DDG_TIMEOUT, deadline))
+                cache.put(cache_key, num_results, ranked_results, raw_results)
 
-        print(f"[DUCKDUCKGO_SEARCH] Получено сырых результатов: {len(raw_results)}")
-        
-        # 🎯 ШАГ 1: ДОМЕННАЯ ФИЛЬТРАЦИЯ (по категории запроса)
-        domain_filtered = []
-        if query_analysis['domains']:
-            for result in raw_results:
-                link = result.get('href', '').lower()
-                if any(domain in link for domain in query_analysis['domains']):
-                    domain_filtered.append(result)
-            
-            # Если мало доменных результатов — добавляем из всех
-            if len(domain_filtered) < max(2, num_results // 2):
-                domain_filtered = raw_results
-        else:
-            domain_filtered = raw_results
-        
-        # 🎯 ШАГ 2: УМНЫЙ СКОРИНГ И РАНЖИРОВАНИЕ
-        print(f"[DUCKDUCKGO_SEARCH] 📊 Запускаю скоринг {len(domain_filtered)} результатов...")
-        ranked_results = filter_and_rank_results(domain_filtered, query)
-        
         # Берём топ N результатов
         results = ranked_results[:num_results]
         
@@ -2393,7 +2326,8 @@ def google_search(query: str, num_results: int = 5, region: str = "wt-wt", langu
         # FALLBACK: Используем простой веб-скрейпинг DuckDuckGo HTML
         print(f"[DUCKDUCKGO_SEARCH] ⚠️ Библиотека ddgs не установлена, используем fallback...")
         try:
-            return fallback_web_search(enhanced_query, num_results, language)
+            return fallback_web_search(enhanced_query, num_results, language,
+                                       timeout=_search_timeout(FALLBACK_SEARCH_TIMEOUT, deadline))
         except Exception as fallback_error:
             error_msg = f"⚠️ Установите библиотеку ddgs: pip install ddgs\nОшибка fallback: {fallback_error}"
             print(f"[DUCKDUCKGO_SEARCH] {error_msg}")
@@ -2403,17 +2337,122 @@ def google_search(query: str, num_results: int = 5, region: str = "wt-wt", langu
         print(f"[DUCKDUCKGO_SEARCH] {error_msg}")
         return error_msg
 
-def fetch_page_content(url: str, max_chars: int = 5000) -> str:
+# Сколько страница считается свежей в page_cache (потом — условный запрос)
+PAGE_CACHE_TTL = 6 * 3600
+
+# Сколько байт страницы качаем: остаток многомегабайтных страниц не нужен,
+# текста из первого мегабайта хватает с запасом
+PAGE_MAX_BYTES = int(os.getenv("AI_ASSISTANT_PAGE_MAX_KB", "1024")) * 1024
+_PAGE_CHUNK = 64 * 1024
+
+# Сколько текста страницы извлекаем и храним в кэше (вызывающие берут 3–5 тыс.)
+PAGE_TEXT_BUDGET = 16000
+
+# Сколько текста страницы берёт deep_web_search: в промпт идёт не начало
+# страницы, а фрагменты, отобранные select_passages (passage_rank)
+DEEP_PAGE_CHARS = 12000
+# Бюджет токенов на текст страниц в результате deep_web_search
+SEARCH_PASSAGE_TOKENS = 1200
+
+
+def _download_page(url: str, headers: dict, timeout: float = 10):
     """
-    Загружает и извлекает текстовое содержимое веб-страницы
+    Потоковая загрузка не больше PAGE_MAX_BYTES.
+    Возвращает (response, body, truncated); body — None для 304.
+    Не-текстовые ответы (PDF, картинки, архивы) — ValueError без загрузки тела.
+    """
+    with requests.get(url, headers=headers, timeout=timeout, stream=True) as response:
+        if response.status_code == 304:
+            return response, None, False
+        response.raise_for_status()
+        content_type = response.headers.get("Content-Type", "")
+        if not is_text_content_type(content_type):
+            raise ValueError(f"не HTML ({content_type.split(';')[0]})")
+
+        chunks, size, truncated = [], 0, False
+        for chunk in response.iter_content(_PAGE_CHUNK):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= PAGE_MAX_BYTES:
+                truncated = True
+                break
+        return response, b"".join(chunks)[:PAGE_MAX_BYTES], truncated
+
+
+def _fetch_failure_kind(error: Exception) -> str:
+    """
+    Вид неудачной загрузки для domain_stats: сбой сайта (нет соединения,
+    таймаут, 5xx, 403 и 429 — сайт отказывает боту), битая ссылка (404,
+    410) или прочий 4xx — сбой сайта, если повторяется на разных URL.
+    """
+    if isinstance(error, requests.exceptions.HTTPError):
+        response = error.response
+        if response is None or response.status_code >= 500 or response.status_code in (403, 429):
+            return FAIL_HOST
+        if response.status_code in (404, 410):
+            return FAIL_PAGE
+        return FAIL_CLIENT
+    if isinstance(error, requests.exceptions.RequestException):
+        return FAIL_HOST
+    return FAIL_PAGE
+
+
+def _clip_page_text(text: str, max_chars: int) -> str:
+    if len(text) > max_chars:
+        text = text[:max_chars] + "..."
+    return text
+
+
+def _corpus_write(action):
+    """Запись в локальный корпус (page_corpus); ошибка SQLite не мешает загрузке."""
+    try:
+        action(get_page_corpus())
+    except sqlite3.Error as e:
+        print(f"[PAGE_CORPUS] ⚠️ Запись: {e}")
+
+
+def fetch_page_content(url: str, max_chars: int = 5000, revalidate: bool = False) -> str:
+    """
+    Загружает и извлекает текстовое содержимое веб-страницы.
+
+    Страницы кэшируются на диске (page_cache): свежая запись отдаётся без
+    сети, устаревшая перепроверяется по ETag/Last-Modified (304 — тело
+    не качаем). Если сеть недоступна — отдаётся устаревшая копия.
+    Качается не больше PAGE_MAX_BYTES, не-HTML ответы отбрасываются по
+    Content-Type до загрузки тела (см. _download_page, html_extract).
+    Извлечённый текст попадает и в локальный корпус (page_corpus).
+    Время и исход загрузки пишутся в domain_stats; сайты, которые там
+    временно заблокированы, не загружаются (отдаётся копия из кэша).
     
     Args:
         url: URL страницы для загрузки
         max_chars: Максимальное количество символов для возврата
+        revalidate: Перепроверить страницу даже если запись свежая
+                    (запросы о «последних» версиях, новостях и т.п.)
     
     Returns:
         Текстовое содержимое страницы или сообщение об ошибке
     """
+    cache = get_page_cache()
+    try:
+        cached = cache.get(url)
+    except sqlite3.Error as e:
+        print(f"[PAGE_CACHE] ⚠️ Чтение: {e}")
+        cached = None
+
+    if cached is not None and cached.is_fresh() and not revalidate:
+        cache.count("hits")
+        print(f"[FETCH_PAGE] ✓ Из кэша: {url[:50]}")
+        return _clip_page_text(cached.text, max_chars)
+
+    domain_stats = get_domain_stats()
+    if domain_stats.is_blocked(url):
+        if cached is not None:
+            print(f"[FETCH_PAGE] ⏭ Сайт временно пропускается — копия из кэша: {url[:50]}")
+            return _clip_page_text(cached.text, max_chars)
+        print(f"[FETCH_PAGE] ⏭ Сайт временно пропускается: {url[:50]}")
+        return "[Ошибка загрузки страницы: сайт временно пропускается после неудачных загрузок]"
+
     try:
         print(f"[FETCH_PAGE] Загрузка страницы: {url[:50]}...")
         
@@ -2421,47 +2460,53 @@ def fetch_page_content(url: str, max_chars: int = 5000) -> str:
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8'
         }
+        headers.update(PageCache.conditional_headers(cached))
         
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
-        
-        # Используем BeautifulSoup для извлечения текста
+        started = time.monotonic()
         try:
-            from bs4 import BeautifulSoup
-            soup = BeautifulSoup(response.content, 'html.parser')
-            
-            # Удаляем скрипты и стили
-            for script in soup(['script', 'style', 'nav', 'header', 'footer']):
-                script.decompose()
-            
-            # Извлекаем текст
-            text = soup.get_text(separator=' ', strip=True)
-            
-            # Очищаем от множественных пробелов
-            import re
-            text = re.sub(r'\s+', ' ', text).strip()
-            
-            # Ограничиваем размер
-            if len(text) > max_chars:
-                text = text[:max_chars] + "..."
-            
-            print(f"[FETCH_PAGE] ✓ Загружено {len(text)} символов")
-            return text
-            
-        except ImportError:
-            # Если BeautifulSoup не установлен, используем простую регулярку
-            import re
-            # Удаляем HTML теги
-            text = re.sub(r'<[^>]+>', '', response.text)
-            # Очищаем от множественных пробелов
-            text = re.sub(r'\s+', ' ', text).strip()
-            # Ограничиваем размер
-            if len(text) > max_chars:
-                text = text[:max_chars] + "..."
-            print(f"[FETCH_PAGE] ✓ Загружено {len(text)} символов (без BS4)")
-            return text
+            response, body, truncated = _download_page(url, headers)
+        except ValueError:
+            raise                   # не HTML — сайт тут ни при чём
+        except Exception as e:
+            domain_stats.record_fetch(url, time.monotonic() - started, ok=False,
+                                      failure=_fetch_failure_kind(e))
+            raise
+        domain_stats.record_fetch(url, time.monotonic() - started, ok=True)
+        if body is None and cached is not None:
+            cache.touch(url, ttl=PAGE_CACHE_TTL)
+            cache.count("revalidated")
+            _corpus_write(lambda corpus: corpus.touch(url))
+            print(f"[FETCH_PAGE] ✓ Не изменилась (304), из кэша: {url[:50]}")
+            return _clip_page_text(cached.text, max_chars)
+        if body is None:
+            raise ValueError("304 без записи в кэше")
+        if truncated:
+            print(f"[FETCH_PAGE] ✂ Страница больше {PAGE_MAX_BYTES // 1024} КБ — дальше не качаю")
+
+        encoding = charset_from_content_type(response.headers.get("Content-Type", ""))
+        # Только основной текст: меню, баннеры cookie и сайдбары съедали
+        # бюджет символов и токены суммаризатора
+        text = extract_main_content(body, encoding, max_chars=PAGE_TEXT_BUDGET)
+        cache.count("misses")
+        if text:
+            try:
+                cache.put(url, body, text,
+                          etag=response.headers.get("ETag"),
+                          last_modified=response.headers.get("Last-Modified"),
+                          encoding=encoding, ttl=PAGE_CACHE_TTL)
+            except sqlite3.Error as e:
+                print(f"[PAGE_CACHE] ⚠️ Запись: {e}")
+            _corpus_write(lambda corpus: corpus.add(url, text))
+
+        # Ограничиваем размер
+        text = _clip_page_text(text, max_chars)
+        print(f"[FETCH_PAGE] ✓ Загружено {len(text)} символов")
+        return text
             
     except Exception as e:
+        if cached is not None:
+            print(f"[FETCH_PAGE] ⚠️ Ошибка загрузки {url}: {e} — отдаю копию из кэша")
+            return _clip_page_text(cached.text, max_chars)
         print(f"[FETCH_PAGE] ✗ Ошибка загрузки {url}: {e}")
         return f"[Ошибка загрузки страницы: {str(e)[:100]}]"
 
@@ -2727,6 +2772,7 @@ def retry_search_if_needed(
     max_pages: int = 3,
     max_attempts: int = 2,
     min_good_sources: int = 2,
+    deadline: SearchDeadline = None,
 ) -> list:
     """
     Если отфильтрованных источников меньше min_good_sources,
@@ -2734,6 +2780,7 @@ def retry_search_if_needed(
 
     При повторном поиске к запросу добавляются:
     «latest version», «release», текущий год — чтобы получить свежие страницы.
+    Попытка не начинается, если до дедлайна меньше RETRY_MIN_SECONDS.
 
     Возвращает дополненный список страниц.
     """
@@ -2744,10 +2791,16 @@ def retry_search_if_needed(
 
     current_year = datetime.datetime.now().year
     existing_urls = {p['url'] for p in page_contents}
+    # Повторный поиск идёт за свежими страницами — кэш перепроверяем всегда
+    fresh_needed = True
 
     for attempt in range(1, max_attempts + 1):
         if len(page_contents) >= min_good_sources:
             break
+        if deadline is not None and not deadline.allows(RETRY_MIN_SECONDS):
+            print(f"[RETRY_SEARCH] ⏱ До дедлайна {deadline.remaining():.1f} с — "
+                  f"попытка {attempt} пропущена")
+            break
 
         # Уточняем запрос: добавляем свежесть-маркеры
         if attempt == 1:
@@ -2762,26 +2815,30 @@ def retry_search_if_needed(
 
         print(f"[RETRY_SEARCH] 🔎 Попытка {attempt}/{max_attempts}: «{retry_query}»")
 
-        retry_results = google_search(retry_query, num_results, region, language)
+        retry_results = google_search(retry_query, num_results, region, language, deadline=deadline)
         if "Ничего не найдено" in retry_results or "Ошибка" in retry_results:
             print(f"[RETRY_SEARCH] ⚠️ Поиск пустой на попытке {attempt}")
             continue
 
         urls = re.findall(r'Ссылка: (https?://[^\s]+)', retry_results)
+        urls = [u for u in urls[:max_pages] if u not in existing_urls]
 
-        for url in urls[:max_pages]:
-            if url in existing_urls:
-                continue
-            page_text = fetch_page_content(url, max_chars=3000)
+        def _accept_retry(_index: int, url: str, page_text: str):
             if not page_text or "[Ошибка" in page_text:
-                continue
-
-            candidate = {"url": url, "content": page_text}
-            filtered = filter_pages([candidate], query)
-            if filtered:
-                page_contents.append(filtered[0])
-                existing_urls.add(url)
-                print(f"[RETRY_SEARCH] ✅ Добавлена: {url[:70]}")
+                return None
+            filtered = filter_pages([{"url": url, "content": page_text}], query)
+            return filtered[0] if filtered else None
+
+        for page in fetch_relevant_pages(
+            urls,
+            fetch=lambda url: fetch_page_content(url, max_chars=DEEP_PAGE_CHARS, revalidate=fresh_needed),
+            accept=_accept_retry,
+            max_accepted=min_good_sources - len(page_contents),
+            deadline=deadline,
+        ):
+            page_contents.append(page)
+            existing_urls.add(page["url"])
+            print(f"[RETRY_SEARCH] ✅ Добавлена: {page['url'][:70]}")
 
     status = "достаточно" if len(page_contents) >= min_good_sources else "недостаточно"
     print(
@@ -2957,133 +3014,340 @@ def source_quality_score(url: str, text: str, query: str = "") -> dict:
         "domain":       str,     # извлечённый домен
     }
     """
-    import re, datetime
+    return get_query_scorer(query).source_quality(url, text)
+
 
-    url_lower = url.lower()
-    text_lower = text.lower() if text else ""
+# ═══════════════════════════════════════════════════════════════════
+# СКОМПИЛИРОВАННЫЙ ЗАПРОС (QueryScorer)
+# score_result / score_page_content / is_relevant_page /
+# source_quality_score делегируют сюда: запрос разбирается один раз на
+# ход (get_query_scorer), подстроки ищутся PatternMatcher, факты —
+# одним проходом FactCounter (см. pattern_match.py).
+# ═══════════════════════════════════════════════════════════════════
+
+# Стоп-слова score_result (и его разбиение запроса)
+_RESULT_STOP_WORDS = {'и', 'в', 'на', 'с', 'по', 'для', 'что', 'как', 'где',
+                      'the', 'a', 'an', 'of', 'in', 'for', 'to', 'is', 'how'}
+# Стоп-слова скоринга страниц (score_page_content, is_relevant_page, source_quality_score)
+_PAGE_STOP_WORDS = {
+    "и", "в", "на", "с", "по", "для", "что", "как", "где", "это",
+    "the", "a", "an", "of", "in", "for", "to", "is", "are", "was",
+}
+
+# source_quality_score, п.2: техническое содержание
+# (\b в п.2, 4 и 6 раньше был записан литеральным символом backspace —
+# эти регулярки не срабатывали никогда)
+_SQ_TECH_PATTERNS = RegexSet([
+    (_re.compile(r'```'), ('```',)),                           # блоки кода
+    (_re.compile(r'\bdef \w+\('), ('def ',)),                   # функции Python
+    (_re.compile(r'\bfunction\s+\w+\s*\('), ('function',)),       # JavaScript функции
+    (_re.compile(r'\bclass \w+'), ('class ',)),                  # классы
+    (_re.compile(r'\bimport \w+'), ('import ',)),                # импорты
+    (_re.compile(r'\$ \w+'), ('$ ',)),                           # shell-команды
+    (_re.compile(r'--\w+'), ('--',)),                             # CLI флаги
+    (_re.compile(r'\bapi\b'), ('api',)),                          # упоминание API
+    (_re.compile(r'https?://[^\s]{10,}'), ('http',)),            # реальные URL в тексте
+    (_re.compile(r'\b(?:curl|wget|npm|pip|apt|brew|docker|kubectl)\b'),
+     ('curl', 'wget', 'npm', 'pip', 'apt', 'brew', 'docker', 'kubectl')),
+    (_re.compile(r'\b\d+\.\d+\.\d+\b'), None),                   # версии X.Y.Z
+    (_re.compile(r'<\w+[^>]*>'), ('<',)),                         # HTML/XML теги (в сыром тексте)
+])
+# п.4: факты — считается число найденных видов (текст в нижнем регистре)
+_SQ_FACT_PATTERNS = RegexSet([
+    (_re.compile(r'\b\d+\.\d+(?:\.\d+)*\b'), None),              # версии
+    (_re.compile(r'\b(19|20)\d{2}\b'), ('19', '20')),             # годы
+    (_re.compile(r'\b\d{1,2}[./]\d{1,2}[./]\d{2,4}\b'), None),  # даты
+    (_re.compile(r'\b(?:january|february|march|april|may|june|july|august|'
+                 r'september|october|november|december|январ|феврал|март|'
+                 r'апрел|май|июн|июл|август|сентябр|октябр|ноябр|декабр)\w*\b',
+                 _re.IGNORECASE), _FACT_MONTH_PREFIXES),
+    (_re.compile(r'\b(?:released?|вышел|вышла|релиз|changelog|'
+                 r'обновлен\w*|запущен\w*)\b', _re.IGNORECASE),
+     ('release', 'вышел', 'вышла', 'релиз', 'changelog', 'обновлен', 'запущен')),
+    (_re.compile(r'\b\d+\s*(?:мб|гб|mb|gb|мс|ms|fps|ghz|ггц|px)\b', _re.IGNORECASE),
+     ('мб', 'гб', 'mb', 'gb', 'мс', 'ms', 'fps', 'ghz', 'ггц', 'px')),
+])
+# п.6: авторство и структура (литералы сверяются с текстом в нижнем регистре)
+_SQ_AUTHOR_PATTERNS = RegexSet([
+    (_re.compile(r'\b(?:by|автор|author|written by|опубликовано|published)\b', _re.IGNORECASE),
+     ('by', 'автор', 'author', 'опубликовано', 'published')),
+    (_re.compile(r'\b(?:updated|обновлено|дата публикации|date)\b', _re.IGNORECASE),
+     ('updated', 'обновлено', 'дата публикации', 'date')),
+    (_re.compile(r'\b(?:editor|редактор|contributor)\b', _re.IGNORECASE),
+     ('editor', 'редактор', 'contributor')),
+    (_re.compile(r'<h[1-3]', _re.IGNORECASE), ('<h',)),             # структурные заголовки в сыром HTML
+    (_re.compile(r'#{1,3} \w', _re.IGNORECASE), ('# ',)),          # markdown-заголовки
+])
+_SQ_DOMAIN_RE = _re.compile(r'https?://(?:www\.)?([^/]+)')
+
+# Доменные списки не зависят от запроса — автоматы строятся один раз.
+# Whitelist проверяется от наиболее специфичного домена к общему.
+_WHITELIST_ORDER = [d for d, _ in sorted(SOURCE_WHITELIST.items(),
+                                         key=lambda x: len(x[0]), reverse=True)]
+_WHITELIST_MATCHER = PatternMatcher(SOURCE_WHITELIST)
+_BLACKLIST_MATCHER = PatternMatcher(SOURCE_BLACKLIST)
+_TRUSTED_MATCHER = PatternMatcher(TRUSTED_DOMAINS)
+_URL_BLOCK_MATCHER = PatternMatcher(_URL_BLOCKLIST)
+
+
+class QueryScorer:
+    """
+    Запрос, разобранный для скоринга: ключевые слова, платформы,
+    нужна ли свежесть, и автомат подстрок по ним. Неизменяемый —
+    один экземпляр на запрос делят все потоки загрузки страниц.
+    """
+
+    def __init__(self, query: str):
+        self.query = query or ""
+        q_lower = self.query.lower()
+        self.result_keywords = [w for w in _re.split(r'[\s,?!.]+', q_lower)
+                                if len(w) > 2 and w not in _RESULT_STOP_WORDS]
+        self.keywords = [w for w in _re.split(r"[\s,?!.;:]+", q_lower)
+                         if len(w) > 2 and w not in _PAGE_STOP_WORDS]
+        self.query_platforms = [p for p in TOPIC_PLATFORM_KEYWORDS if p in q_lower]
+        self.freshness_needed = needs_freshness_check(self.query)
+        self._matcher = PatternMatcher(self.result_keywords + self.keywords
+                                       + TOPIC_PLATFORM_KEYWORDS)
+
+    # ── Результаты поиска (заголовок + описание) ─────────────────────
+    def result_score(self, result: dict, freshness_needed: bool = None) -> float:
+        """См. score_result."""
+        if freshness_needed is None:
+            freshness_needed = self.freshness_needed
+        title = result.get('title', '').lower()
+        body = result.get('body', '').lower()
+        link = result.get('href', '').lower()
+        full_text = title + ' ' + body
+        keywords = self.result_keywords
+
+        score = 0.0
+
+        # ── 1. Совпадение ключевых слов ──
+        in_text = self._matcher.found(full_text)
+        keyword_hits = sum(1 for kw in keywords if kw in in_text)
+        if keywords:
+            keyword_ratio = keyword_hits / len(keywords)
+            score += keyword_ratio * 40  # Макс 40 баллов за ключевые слова
+
+        # Бонус за совпадение ключевых слов в заголовке (более ценно)
+        in_title = self._matcher.found(title)
+        title_hits = sum(1 for kw in keywords if kw in in_title)
+        score += title_hits * 5  # +5 за каждое слово в заголовке
+
+        # ── 2. Трастовость домена ──
+        domain_bonus = 10 * len(_TRUSTED_MATCHER.found(link))
+        score += min(domain_bonus, 15)  # Макс 15 баллов за домен
+
+        # ── 3. Длина описания (больше текста = больше информации) ──
+        body_length = len(result.get('body', ''))
+        if body_length > 200:
+            score += 10
+        elif body_length > 100:
+            score += 5
+        elif body_length < 30:
+            score -= 10  # Штраф за слишком короткое описание
+
+        # ── 4. Проверка актуальности ──
+        if freshness_needed:
+            current_year = datetime.now().year
+            year_in_text = extract_year_from_text(full_text + link)
+
+            if year_in_text == current_year:
+                score += 20  # Текущий год — отличный бонус
+            elif year_in_text == current_year - 1:
+                score += 10  # Прошлый год — небольшой бонус
+            elif year_in_text > 0 and year_in_text < current_year - 2:
+                score -= 20  # Старые страницы — штраф при freshness-запросе
+
+        # ── 5. Штраф за нерелевантный контент ──
+        # Если ни одного ключевого слова не совпало — штраф
+        if keyword_hits == 0 and keywords:
+            score -= 15
+
+        return score
+
+    # ── Текст страницы ───────────────────────────────────────────────
+    def page_scores(self, page_text: str) -> dict:
+        """См. score_page_content."""
+        keywords = self.keywords
+        page_lower = page_text.lower()
+        found = self._matcher.found(page_lower)
+
+        keyword_hits = sum(1 for kw in keywords if kw in found)
+        if keywords:
+            keyword_ratio = keyword_hits / len(keywords)
+        else:
+            keyword_ratio = 1.0
+        keyword_score = round(keyword_ratio * 40, 2)   # макс 40
+
+        # --- Тематика / платформы ---
+        if self.query_platforms:
+            # Запрос специфичен — ищем только эти платформы
+            topic_hits = [p for p in self.query_platforms if p in found]
+            topic_score = min(len(topic_hits) / max(len(self.query_platforms), 1), 1.0) * 30
+        else:
+            # Запрос общий — любая платформа/тема добавляет балл
+            topic_hits = [p for p in TOPIC_PLATFORM_KEYWORDS if p in found]
+            topic_score = min(len(topic_hits) * 5, 30)   # +5 за каждую, макс 30
+        topic_score = round(topic_score, 2)
+
+        # --- Конкретные факты (версии, даты, названия) ---
+        facts_count = _FACT_COUNTER.count(page_lower)
+        # Нелинейный скор: первые 3 факта дают больше всего очков
+        if facts_count == 0:
+            facts_score = 0.0
+        elif facts_count <= 3:
+            facts_score = facts_count * 7.0        # 7/14/21
+        elif facts_count <= 10:
+            facts_score = 21 + (facts_count - 3) * 1.0  # до 28
+        else:
+            facts_score = 30.0                     # насыщение
+        facts_score = round(min(facts_score, 30), 2)
+
+        total_score = keyword_score + topic_score + facts_score
+
+        return {
+            "total_score":   round(total_score, 2),
+            "keyword_score": keyword_score,
+            "topic_score":   topic_score,
+            "facts_score":   facts_score,
+            "keyword_hits":  keyword_hits,
+            "topic_hits":    topic_hits,
+            "facts_count":   facts_count,
+        }
+
+    def relevance(self, page_text: str, url: str = "",
+                  min_total: float = 20.0, min_keyword_ratio: float = 0.20) -> tuple:
+        """См. is_relevant_page."""
+        # ── Проверка 1: минимальная длина текста ────────────────────────
+        if not page_text or len(page_text) < 200:
+            return False, {}, f"Текст слишком короткий ({len(page_text or '')} символов, нужно ≥200)"
+
+        # ── Проверка 2: URL-фильтр (соцсети, магазины, реклама) ─────────
+        url_lower = (url or "").lower()
+        if url_lower:
+            blocked = _URL_BLOCK_MATCHER.first(url_lower, _URL_BLOCKLIST)
+            if blocked:
+                return (False, {},
+                        f"Заблокированный домен: {blocked}")
 
-    # ── 1. Домен: whitelist / blacklist ─────────────────────────────
-    domain_score = 0.0
-    tier = "neutral"
-    matched_domain = ""
+        scores = self.page_scores(page_text)
+        keywords = self.keywords
 
-    # Извлекаем основной домен из URL
-    domain_match = re.search(r'https?://(?:www\.)?([^/]+)', url_lower)
-    raw_domain = domain_match.group(1) if domain_match else url_lower[:60]
+        # ── Проверка 3: ключевые слова ───────────────────────────────────
+        if keywords:
+            actual_ratio = scores["keyword_hits"] / len(keywords)
+            if actual_ratio < min_keyword_ratio:
+                return (False, scores,
+                        f"Мало ключевых слов запроса: "
+                        f"{scores['keyword_hits']}/{len(keywords)} "
+                        f"({actual_ratio:.0%} < {min_keyword_ratio:.0%})")
 
-    # Проверяем whitelist (от наиболее специфичного к общему)
-    for wl_domain, wl_bonus in sorted(SOURCE_WHITELIST.items(),
-                                       key=lambda x: len(x[0]), reverse=True):
-        if wl_domain in raw_domain:
-            domain_score = float(wl_bonus)
+        # ── Проверка 4: тематика (платформа в запросе → нужна на странице) ─
+        if self.query_platforms and not scores["topic_hits"]:
+            return (False, scores,
+                    f"Запрос о платформах {self.query_platforms}, "
+                    f"но они отсутствуют на странице")
+
+        # ── Проверка 5: суммарный балл ───────────────────────────────────
+        if scores["total_score"] < min_total:
+            return (False, scores,
+                    f"Низкий суммарный балл: "
+                    f"{scores['total_score']:.1f} < {min_total}")
+
+        return True, scores, "OK"
+
+    # ── Качество источника ───────────────────────────────────────────
+    def source_quality(self, url: str, text: str) -> dict:
+        """См. source_quality_score."""
+        url_lower = url.lower()
+        text_lower = text.lower() if text else ""
+
+        # ── 1. Домен: whitelist / blacklist ─────────────────────────────
+        domain_score = 0.0
+        tier = "neutral"
+        matched_domain = ""
+
+        # Извлекаем основной домен из URL
+        domain_match = _SQ_DOMAIN_RE.search(url_lower)
+        raw_domain = domain_match.group(1) if domain_match else url_lower[:60]
+
+        wl_domain = _WHITELIST_MATCHER.first(raw_domain, _WHITELIST_ORDER)
+        if wl_domain:
+            domain_score = float(SOURCE_WHITELIST[wl_domain])
             tier = "whitelist"
             matched_domain = wl_domain
-            break
-
-    # Проверяем blacklist (штраф суммируется, если нет бонуса whitelist)
-    if tier != "whitelist":
-        for bl_pattern, bl_penalty in SOURCE_BLACKLIST.items():
-            if bl_pattern in raw_domain or bl_pattern in url_lower:
-                domain_score += float(bl_penalty)
+        else:
+            # raw_domain — подстрока url_lower, достаточно искать в URL
+            bl_pattern = _BLACKLIST_MATCHER.first(url_lower, SOURCE_BLACKLIST)
+            if bl_pattern:
+                domain_score += float(SOURCE_BLACKLIST[bl_pattern])
                 tier = "blacklist"
                 matched_domain = bl_pattern
-                break
 
-    # Ограничиваем диапазон
-    domain_score = max(-80.0, min(40.0, domain_score))
-
-    # ── 2. Техническое содержание ────────────────────────────────────
-    tech_patterns = [
-        r'```',                          # блоки кода
-        r'def \w+\(',                  # функции Python
-        r'function\s+\w+\s*\(',        # JavaScript функции
-        r'class \w+',                  # классы
-        r'import \w+',                 # импорты
-        r'\$ \w+',                       # shell-команды
-        r'--\w+',                        # CLI флаги
-        r'api',                      # упоминание API
-        r'https?://[^\s]{10,}',          # реальные URL в тексте
-        r'(?:curl|wget|npm|pip|apt|brew|docker|kubectl)',
-        r'\d+\.\d+\.\d+',           # версии X.Y.Z
-        r'<\w+[^>]*>',                   # HTML/XML теги (в сыром тексте)
-    ]
-    tech_hits = sum(1 for p in tech_patterns if re.search(p, text[:5000]))
-    tech_score = min(20.0, tech_hits * 2.5)
-
-    # ── 3. Длина текста ──────────────────────────────────────────────
-    text_len = len(text)
-    if text_len >= 3000:
-        length_score = 15.0
-    elif text_len >= 1500:
-        length_score = 10.0
-    elif text_len >= 600:
-        length_score = 5.0
-    elif text_len < 200:
-        length_score = -5.0   # штраф за слишком мало текста
-    else:
-        length_score = 0.0
-
-    # ── 4. Факты: версии, даты, числа ───────────────────────────────
-    fact_patterns_list = [
-        re.compile(r'\d+\.\d+(?:\.\d+)*'),              # версии
-        re.compile(r'(19|20)\d{2}'),                     # годы
-        re.compile(r'\d{1,2}[./]\d{1,2}[./]\d{2,4}'),  # даты
-        re.compile(r'(?:january|february|march|april|may|june|july|august|'
-                   r'september|october|november|december|январ|феврал|март|'
-                   r'апрел|май|июн|июл|август|сентябр|октябр|ноябр|декабр)\w*',
-                   re.IGNORECASE),
-        re.compile(r'(?:released?|вышел|вышла|релиз|changelog|'
-                   r'обновлен\w*|запущен\w*)', re.IGNORECASE),
-        re.compile(r'\d+\s*(?:мб|гб|mb|gb|мс|ms|fps|ghz|ггц|px)',
-                   re.IGNORECASE),
-    ]
-    fact_types_found = sum(1 for fp in fact_patterns_list if fp.search(text_lower))
-    facts_score = min(15.0, fact_types_found * 3.0)
-
-    # ── 5. Совпадение темы с запросом ───────────────────────────────
-    topic_score = 0.0
-    if query:
-        stop = {'и','в','на','с','по','для','что','как','где','это',
-                'the','a','an','of','in','for','to','is','are','was'}
-        kws = [w for w in re.split(r'[\s,?!.;:]+', query.lower())
-               if len(w) > 2 and w not in stop]
+        # Ограничиваем диапазон
+        domain_score = max(-80.0, min(40.0, domain_score))
+
+        # ── 2. Техническое содержание ────────────────────────────────────
+        tech_hits = _SQ_TECH_PATTERNS.count_matching(text[:5000])
+        tech_score = min(20.0, tech_hits * 2.5)
+
+        # ── 3. Длина текста ──────────────────────────────────────────────
+        text_len = len(text)
+        if text_len >= 3000:
+            length_score = 15.0
+        elif text_len >= 1500:
+            length_score = 10.0
+        elif text_len >= 600:
+            length_score = 5.0
+        elif text_len < 200:
+            length_score = -5.0   # штраф за слишком мало текста
+        else:
+            length_score = 0.0
+
+        # ── 4. Факты: версии, даты, числа ───────────────────────────────
+        fact_types_found = _SQ_FACT_PATTERNS.count_matching(text_lower)
+        facts_score = min(15.0, fact_types_found * 3.0)
+
+        # ── 5. Совпадение темы с запросом ───────────────────────────────
+        topic_score = 0.0
+        kws = self.keywords
         if kws:
-            hits = sum(1 for kw in kws if kw in text_lower)
+            found = self._matcher.found(text_lower)
+            hits = sum(1 for kw in kws if kw in found)
             ratio = hits / len(kws)
             topic_score = round(min(20.0, ratio * 20.0), 2)
 
             # Бонус если ключевые слова встречаются в первых 500 символах
-            head = text_lower[:500]
-            head_hits = sum(1 for kw in kws if kw in head)
+            in_head = self._matcher.found(text_lower[:500])
+            head_hits = sum(1 for kw in kws if kw in in_head)
             topic_score = min(20.0, topic_score + head_hits * 1.5)
 
-    # ── 6. Авторство и структура ─────────────────────────────────────
-    author_score = 0.0
-    author_markers = [
-        r'(?:by|автор|author|written by|опубликовано|published)',
-        r'(?:updated|обновлено|дата публикации|date)',
-        r'(?:editor|редактор|contributor)',
-        r'<h[1-3]',         # структурные заголовки в сыром HTML
-        r'#{1,3} \w',       # markdown-заголовки
-    ]
-    author_hits = sum(1 for p in author_markers
-                      if re.search(p, text[:3000], re.IGNORECASE))
-    author_score = min(10.0, author_hits * 3.0)
+        # ── 6. Авторство и структура ─────────────────────────────────────
+        head = text[:3000]
+        author_hits = _SQ_AUTHOR_PATTERNS.count_matching(head, head.lower())
+        author_score = min(10.0, author_hits * 3.0)
 
-    # ── Итог ─────────────────────────────────────────────────────────
-    total = domain_score + tech_score + length_score + facts_score + topic_score + author_score
+        # ── Итог ─────────────────────────────────────────────────────────
+        total = domain_score + tech_score + length_score + facts_score + topic_score + author_score
 
-    return {
-        "total":        round(total, 2),
-        "domain_score": domain_score,
-        "tech_score":   round(tech_score, 2),
-        "length_score": length_score,
-        "facts_score":  round(facts_score, 2),
-        "topic_score":  round(topic_score, 2),
-        "author_score": round(author_score, 2),
-        "tier":         tier,
-        "domain":       matched_domain or raw_domain[:40],
-    }
+        return {
+            "total":        round(total, 2),
+            "domain_score": domain_score,
+            "tech_score":   round(tech_score, 2),
+            "length_score": length_score,
+            "facts_score":  round(facts_score, 2),
+            "topic_score":  round(topic_score, 2),
+            "author_score": round(author_score, 2),
+            "tier":         tier,
+            "domain":       matched_domain or raw_domain[:40],
+        }
+
+
+@functools.lru_cache(maxsize=64)
+def get_query_scorer(query: str) -> QueryScorer:
+    """QueryScorer запроса — один на все результаты и страницы хода."""
+    return QueryScorer(query)
 
 
 def rank_and_select_sources(
@@ -3123,6 +3387,9 @@ def rank_and_select_sources(
         page_with_score["quality_score"]  = scores["total"]
         page_with_score["quality_detail"] = scores
         scored.append(page_with_score)
+        # Повторная оценка после retry и страницы из корпуса уже учтены
+        if "quality_score" not in page and not page.get("from_corpus"):
+            get_domain_stats().record_quality(url, scores["total"])
 
         tier_icon = "✅" if scores["tier"] == "whitelist" else (
                     "❌" if scores["tier"] == "blacklist" else "⚪")
@@ -3186,6 +3453,10 @@ _VERSION_INTENT_KEYWORDS = [
     "latest update", "version history",
 ]
 
+# Сколько страниц version_search_pipeline ждёт минимум, прежде чем
+# остановить загрузку при консенсусе версий с высоким доверием
+VP_EARLY_STOP_MIN_PAGES = 5
+
 # ── Шаблоны поисковых запросов ───────────────────────────────────────────
 _VERSION_QUERY_TEMPLATES = [
     "latest version {name}",
@@ -3414,34 +3685,61 @@ def vp_search(
     region: str = "wt-wt",
     language: str = "russian",
     num_per_query: int = 5,
+    on_urls=None,
+    deadline: SearchDeadline = None,
 ) -> list:
     """
-    Выполняет 5 поисковых запросов по шаблонам и собирает уникальные URL.
+    Выполняет 6 поисковых запросов по шаблонам параллельно и собирает
+    уникальные URL.
 
     Аргументы:
         sw_name:       название ПО (например «Python», «iOS 18», «Firefox»)
         region:        регион поиска
         language:      язык
         num_per_query: результатов за запрос
-
-    Возвращает список уникальных URL (минимум 5–8 источников).
+        on_urls:       on_urls(urls) — новые URL каждого запроса сразу по его
+                       ответу (из потока запроса); так vp_filter начинает
+                       грузить страницы, не дожидаясь остальных запросов
+        deadline:      SearchDeadline — таймаут каждого запроса не больше
+                       его остатка
+
+    Возвращает список уникальных URL (минимум 5–8 источников) в порядке
+    шаблонов — как при последовательном поиске.
     """
     print(f"[VP:SEARCH] 🔍 Мульти-поиск для «{sw_name}»")
+    queries = [tmpl.format(name=sw_name)
+               for tmpl in _VERSION_QUERY_TEMPLATES[:6]]   # берём 6 из 8 шаблонов
+    per_query: list = [[] for _ in queries]
     seen: set = set()
-    all_urls: list = []
+    lock = threading.Lock()
 
-    for tmpl in _VERSION_QUERY_TEMPLATES[:6]:          # берём 6 из 8 шаблонов
-        q = tmpl.format(name=sw_name)
+    def _run(i: int, q: str):
         print(f"[VP:SEARCH]   → {q}")
         try:
             raw = google_search(q, num_results=num_per_query,
-                                region=region, language=language)
-            for url in _re_vp.findall(r'Ссылка: (https?://[^\s]+)', raw):
-                if url not in seen:
-                    seen.add(url)
-                    all_urls.append(url)
+                                region=region, language=language, deadline=deadline)
         except Exception as exc:
             print(f"[VP:SEARCH]   ⚠️ Ошибка запроса: {exc}")
+            return
+        with lock:
+            per_query[i] = _re_vp.findall(r'Ссылка: (https?://[^\s]+)', raw)
+            new = [u for u in per_query[i] if u not in seen]
+            seen.update(new)
+        if new and on_urls:
+            on_urls(new)
+
+    threads = [threading.Thread(target=_run, args=(i, q), name=f"VPSearch-{i}", daemon=True)
+               for i, q in enumerate(queries)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    all_urls: list = []
+    for urls in per_query:
+        for url in urls:
+            if url not in all_urls:
+                all_urls.append(url)
 
     print(f"[VP:SEARCH] ✅ Уникальных URL: {len(all_urls)}")
     return all_urls
@@ -3451,14 +3749,57 @@ def vp_search(
 # ШАГ 2 — FILTER: приоритизация, загрузка, фильтр релевантности
 # ───────────────────────────────────────────────────────────────────────────
 
+def _vp_page_acceptor(query: str):
+    """accept для PageFetcher: отсев коротких и нерелевантных страниц."""
+    def _accept(_index: int, url: str, text: str):
+        priority = _vp_domain_score(url)
+        print(f"[VP:FILTER]  {priority:+4d}  {url[:70]}")
+        if not text or "[Ошибка" in text or len(text) < 200:
+            print(f"[VP:FILTER]   ❌ Слишком короткий или ошибка ({len(text or '')} символов)")
+            return None
+
+        # Фильтр релевантности (URL-блокировка + ключевые слова + тема)
+        ok, scores, reason = is_relevant_page(query, text, url=url)
+        get_domain_stats().record_relevance(url, ok)
+        if not ok:
+            print(f"[VP:FILTER]   ❌ Нерелевантна: {reason}")
+            return None
+
+        print(f"[VP:FILTER]   ✅ Принята | rel={scores.get('total_score',0):.0f}")
+        return {
+            "url":       url,
+            "content":   text,
+            "priority":  priority,
+            "rel_score": scores.get("total_score", 0),
+        }
+    return _accept
+
+
+def _vp_page_fetcher(query: str, max_load: int, deadline: SearchDeadline = None) -> PageFetcher:
+    """
+    Пул загрузок vp_filter: сначала URL с высоким приоритетом домена
+    (статический список + накопленная статистика сайта, domain_stats).
+    """
+    fresh_needed = needs_freshness_check(query)
+    stats = get_domain_stats()
+    return PageFetcher(
+        fetch=lambda url: fetch_page_content(url, max_chars=4000, revalidate=fresh_needed),
+        accept=_vp_page_acceptor(query),
+        max_accepted=max_load,
+        priority=lambda url: _vp_domain_score(url) + stats.priority(url),
+        deadline=deadline,
+    )
+
+
 def vp_filter(
     urls: list,
     query: str,
     max_load: int = 8,
+    deadline: SearchDeadline = None,
 ) -> list:
     """
-    Сортирует URL по приоритету домена, загружает страницы,
-    фильтрует нерелевантные через is_relevant_page.
+    Сортирует URL по приоритету домена, загружает страницы (параллельно,
+    см. page_fetcher), фильтрует нерелевантные через is_relevant_page.
 
     Повышает приоритет: официальные сайты, /releases, /changelog, GitHub,
     крупные тех-СМИ с датами.
@@ -3469,44 +3810,17 @@ def vp_filter(
     Аргументы:
         urls:     список URL из vp_search
         query:    исходный запрос (для is_relevant_page)
-        max_load: максимум страниц для загрузки
+        max_load: максимум принятых страниц
+        deadline: по истечении — только уже загруженные страницы
 
-    Возвращает список dict{'url','content','priority','rel_score'}.
+    Возвращает список dict{'url','content','priority','rel_score'},
+    отсортированный по приоритету.
     """
-    # Сортируем по приоритету
-    ranked = sorted([(u, _vp_domain_score(u)) for u in urls],
-                    key=lambda x: x[1], reverse=True)
     print(f"[VP:FILTER] Загрузка страниц (топ по приоритету)...")
-    pages = []
-
-    for url, priority in ranked:
-        if len(pages) >= max_load:
-            break
-
-        print(f"[VP:FILTER]  {priority:+4d}  {url[:70]}")
-        try:
-            text = fetch_page_content(url, max_chars=4000)
-        except Exception as exc:
-            print(f"[VP:FILTER]   ⚠️ Ошибка загрузки: {exc}")
-            continue
-
-        if not text or "[Ошибка" in text or len(text) < 200:
-            print(f"[VP:FILTER]   ❌ Слишком короткий или ошибка ({len(text or '')} символов)")
-            continue
-
-        # Фильтр релевантности (URL-блокировка + ключевые слова + тема)
-        ok, scores, reason = is_relevant_page(query, text, url=url)
-        if not ok:
-            print(f"[VP:FILTER]   ❌ Нерелевантна: {reason}")
-            continue
-
-        pages.append({
-            "url":       url,
-            "content":   text,
-            "priority":  priority,
-            "rel_score": scores.get("total_score", 0),
-        })
-        print(f"[VP:FILTER]   ✅ Принята | rel={scores.get('total_score',0):.0f}")
+    fetcher = _vp_page_fetcher(query, max_load, deadline)
+    fetcher.add(get_domain_stats().order(urls))
+    fetcher.close()
+    pages = sorted(fetcher.results(), key=lambda p: p["priority"], reverse=True)
 
     print(f"[VP:FILTER] Итого страниц: {len(pages)}")
     return pages
@@ -3516,6 +3830,77 @@ def vp_filter(
 # ШАГ 3 — EXTRACT: версии, даты, changelog
 # ───────────────────────────────────────────────────────────────────────────
 
+def _vp_extract_page(page: dict, ver_map: dict, changelogs: dict, dates: dict):
+    """
+    Добавляет к накопленным ver_map / changelogs / dates данные одной
+    страницы. vp_extract — для готового списка; version_search_pipeline
+    зовёт по мере загрузки страниц.
+    """
+    url      = page["url"]
+    text     = page["content"]
+    priority = page.get("priority", 0)
+
+    # Дата страницы
+    page_date = _vp_extract_date(text)
+    dates[url] = page_date
+
+    # ── Извлекаем версии ─────────────────────────────────────────
+    found_in_page: set = set()
+    for vpat in _VER_PATS:
+        for m in vpat.finditer(text):
+            v = m.group(1)
+            parts = v.split(".")
+            if len(parts) < 2:
+                continue
+            try:
+                major = int(parts[0])
+            except ValueError:
+                continue
+            # Фильтр: не IP, не год, не слишком большие числа
+            if major < 0 or major > 999:
+                continue
+            if 2000 <= major <= 2040:
+                continue   # это год
+            if v in found_in_page:
+                continue
+            found_in_page.add(v)
+
+            # Контекст для определения типа релиза
+            ctx = text[max(0, m.start()-100): m.end()+100]
+            rtype = _vp_classify(v, ctx)
+
+            if v not in ver_map:
+                ver_map[v] = {
+                    "version":      v,
+                    "type":         rtype,
+                    "date":         page_date,
+                    "sources":      [url],
+                    "source_count": 1,
+                    "priority_sum": priority,
+                }
+            else:
+                info = ver_map[v]
+                if url not in info["sources"]:
+                    info["sources"].append(url)
+                    info["source_count"] += 1
+                    info["priority_sum"] += priority
+                # Уточняем тип
+                if rtype in ("rc", "beta", "alpha") and info["type"] == "stable":
+                    info["type"] = rtype
+                if page_date and not info["date"]:
+                    info["date"] = page_date
+
+    # ── Changelog-фрагменты ──────────────────────────────────────
+    trigger = _CHANGELOG_TRIGGER.search(text)
+    if trigger:
+        block = text[trigger.end(): trigger.end() + 2500]
+        lines = [m.group(1).strip()
+                 for m in _CHANGELOG_LINE.finditer(block)
+                 if len(m.group(1).strip()) > 20]
+        if lines:
+            changelogs[url] = lines[:10]
+
+
 def vp_extract(pages: list) -> dict:
     """
     Извлекает из текстов всех страниц:
@@ -3538,70 +3923,12 @@ def vp_extract(pages: list) -> dict:
     dates: dict = {}
 
     for page in pages:
-        url      = page["url"]
-        text     = page["content"]
-        priority = page.get("priority", 0)
-
-        # Дата страницы
-        page_date = _vp_extract_date(text)
-        dates[url] = page_date
-
-        # ── Извлекаем версии ─────────────────────────────────────────
-        found_in_page: set = set()
-        for vpat in _VER_PATS:
-            for m in vpat.finditer(text):
-                v = m.group(1)
-                parts = v.split(".")
-                if len(parts) < 2:
-                    continue
-                try:
-                    major = int(parts[0])
-                except ValueError:
-                    continue
-                # Фильтр: не IP, не год, не слишком большие числа
-                if major < 0 or major > 999:
-                    continue
-                if 2000 <= major <= 2040:
-                    continue   # это год
-                if v in found_in_page:
-                    continue
-                found_in_page.add(v)
-
-                # Контекст для определения типа релиза
-                ctx = text[max(0, m.start()-100): m.end()+100]
-                rtype = _vp_classify(v, ctx)
-
-                if v not in ver_map:
-                    ver_map[v] = {
-                        "version":      v,
-                        "type":         rtype,
-                        "date":         page_date,
-                        "sources":      [url],
-                        "source_count": 1,
-                        "priority_sum": priority,
-                    }
-                else:
-                    info = ver_map[v]
-                    if url not in info["sources"]:
-                        info["sources"].append(url)
-                        info["source_count"] += 1
-                        info["priority_sum"] += priority
-                    # Уточняем тип
-                    if rtype in ("rc", "beta", "alpha") and info["type"] == "stable":
-                        info["type"] = rtype
-                    if page_date and not info["date"]:
-                        info["date"] = page_date
-
-        # ── Changelog-фрагменты ──────────────────────────────────────
-        trigger = _CHANGELOG_TRIGGER.search(text)
-        if trigger:
-            block = text[trigger.end(): trigger.end() + 2500]
-            lines = [m.group(1).strip()
-                     for m in _CHANGELOG_LINE.finditer(block)
-                     if len(m.group(1).strip()) > 20]
-            if lines:
-                changelogs[url] = lines[:10]
+        _vp_extract_page(page, ver_map, changelogs, dates)
+
+    return _vp_extracted(ver_map, changelogs, dates)
 
+
+def _vp_extracted(ver_map: dict, changelogs: dict, dates: dict) -> dict:
     return {
         "versions":   list(ver_map.values()),
         "changelogs": changelogs,
@@ -3876,6 +4203,7 @@ def version_search_pipeline(
     user_query: str,
     region: str = "wt-wt",
     language: str = "russian",
+    deadline: SearchDeadline = None,
 ) -> tuple:
     """
     Полный модульный пайплайн для определения актуальной версии ПО.
@@ -3883,9 +4211,10 @@ def version_search_pipeline(
     Архитектура: search → filter → extract → validate → answer
 
     Шаги:
-    1. vp_search    — 6 поисковых запросов по шаблонам, 5–8 источников
+    1. vp_search    — 6 поисковых запросов по шаблонам (параллельно), 5–8 источников
     2. vp_filter    — приоритизация по домену, загрузка, фильтр релевантности
-    3. vp_extract   — извлечение версий, дат, changelog из всех страниц
+                      (страницы грузятся, пока остальные запросы ещё идут)
+    3. vp_extract   — извлечение версий, дат, changelog по мере загрузки страниц
     4. vp_validate  — консенсус версий, уровень доверия, предупреждения
     5. vp_answer    — форматированный блок с запретом галлюцинаций
 
@@ -3893,6 +4222,8 @@ def version_search_pipeline(
         user_query: исходный запрос пользователя
         region:     регион поиска
         language:   язык результатов
+        deadline:   SearchDeadline — загрузка страниц прекращается по его
+                    истечении, версии извлекаются из уже загруженных
 
     Возвращает КОРТЕЖ (result_str: str, page_contents: list):
         result_str    — форматированный блок данных для передачи в промпт
@@ -3905,22 +4236,60 @@ def version_search_pipeline(
     sw_name = _vp_extract_software_name(user_query)
     print(f"[VP:PIPELINE] 📦 Название ПО: «{sw_name}»")
 
-    # ── 1. SEARCH ────────────────────────────────────────────────────
-    urls = vp_search(sw_name, region=region, language=language, num_per_query=5)
-    if not urls:
+    # ── 1+2. SEARCH + FILTER (параллельно) ───────────────────────────
+    # Запросы vp_search идут одновременно; URL каждого ответа сразу уходят
+    # в пул загрузок, страницы которого разбираются по мере прихода.
+    fetcher = _vp_page_fetcher(user_query, max_load=8, deadline=deadline)
+    stats = get_domain_stats()
+    # URL копятся по мере ответов поисковика: если дедлайн или досрочная
+    # остановка наступят раньше конца vp_search, «ничего не найдено» не соврёт
+    found_urls: list = []
+
+    def _on_urls(urls: list):
+        found_urls.extend(urls)
+        fetcher.add(stats.order(urls))
+
+    def _search():
+        try:
+            vp_search(sw_name, region=region, language=language,
+                      num_per_query=5, deadline=deadline, on_urls=_on_urls)
+        finally:
+            fetcher.close()
+
+    threading.Thread(target=_search, name="VPSearch", daemon=True).start()
+
+    # ── 3. EXTRACT (по мере загрузки) ────────────────────────────────
+    # Версии извлекаются из каждой пришедшей страницы; когда консенсус
+    # уже с высоким доверием, остальные загрузки не ждём.
+    ver_map: dict = {}
+    changelogs: dict = {}
+    dates: dict = {}
+    pages = []
+    for page in fetcher:
+        pages.append(page)
+        _vp_extract_page(page, ver_map, changelogs, dates)
+        if len(pages) >= VP_EARLY_STOP_MIN_PAGES:
+            early = vp_validate(_vp_extracted(ver_map, changelogs, dates))
+            if early["confidence"] == "high":
+                print(f"[VP:PIPELINE] ⚡ Консенсус по {len(pages)} страницам "
+                      f"({early['stable']['version']}) — остальные не ждём")
+                fetcher.stop()
+                break
+    fetcher.stop()
+
+    if not pages and not found_urls:
         msg = "⚠️ Поиск не вернул результатов." if language == "russian" \
               else "⚠️ Search returned no results."
         return msg, []
 
-    # ── 2. FILTER ────────────────────────────────────────────────────
-    pages = vp_filter(urls, query=user_query, max_load=8)
     if not pages:
         msg = ("⚠️ Подходящих источников не найдено после фильтрации." if language == "russian"
                else "⚠️ No suitable sources found after filtering.")
         return msg, []
 
-    # ── 3. EXTRACT ───────────────────────────────────────────────────
-    extracted = vp_extract(pages)
+    pages.sort(key=lambda p: p["priority"], reverse=True)
+    print(f"[VP:FILTER] Итого страниц: {len(pages)}")
+    extracted = _vp_extracted(ver_map, changelogs, dates)
     n_versions = len(extracted["versions"])
     print(f"[VP:PIPELINE] 🔢 Извлечено версий: {n_versions} | "
           f"с changelog: {len(extracted['changelogs'])}")
@@ -3928,9 +4297,11 @@ def version_search_pipeline(
     # Если не нашли ни одной версии — откатываемся к обычному поиску
     if n_versions == 0:
         print(f"[VP:PIPELINE] ⚠️ Версии не найдены, передаём страницы как есть")
+        texts = select_passages(user_query, [p["content"] for p in pages[:4]],
+                                SEARCH_PASSAGE_TOKENS)
         fallback_str = "\n\n".join(
-            f"[Источник {i+1}]\nURL: {p['url']}\n{p['content'][:1500]}"
-            for i, p in enumerate(pages[:4])
+            f"[Источник {i+1}]\nURL: {p['url']}\n{text}"
+            for i, (p, text) in enumerate(zip(pages[:4], texts))
         )
         return fallback_str, pages
 
@@ -3951,24 +4322,86 @@ def version_search_pipeline(
 
     return result_str, pages
 
+# Сколько страница корпуса (page_corpus) годится для ответа без сети;
+# для запросов о свежем (needs_freshness_check) — меньше
+CORPUS_FRESH_AGE = 3 * 24 * 3600
+CORPUS_FRESH_AGE_NEWS = 6 * 3600
+
+
+def _corpus_pages(query: str, needed: int, max_age, accept, exclude: set = None) -> list:
+    """
+    Релевантные страницы локального корпуса (через тот же accept, что и
+    загруженные), не больше needed. max_age=None — любого возраста.
+    accept вызывается с record=False: страница уже учтена в domain_stats,
+    когда её загрузили.
+    """
+    if needed <= 0:
+        return []
+    try:
+        hits = get_page_corpus().search(query, limit=needed + 2, max_age=max_age,
+                                        exclude=exclude)
+    except sqlite3.Error as e:
+        print(f"[PAGE_CORPUS] ⚠️ Поиск: {e}")
+        return []
+    if not hits:
+        return []
+    print(f"[DEEP_SEARCH] 📚 В локальном корпусе кандидатов: {len(hits)}")
+    pages = []
+    for index, hit in enumerate(hits):
+        page = accept(index, hit.url, _clip_page_text(hit.text, DEEP_PAGE_CHARS), record=False)
+        if page is None:
+            continue
+        page["fetched_at"] = hit.fetched_at
+        page["from_corpus"] = True
+        pages.append(page)
+        if len(pages) >= needed:
+            break
+    return pages
+
+
+def _corpus_results_block(pages: list, start: int = 1) -> str:
+    """Страницы корпуса в формате результатов google_search."""
+    blocks = []
+    for i, page in enumerate(pages, start):
+        lines = [l.lstrip("# ").strip() for l in page["content"].split("\n") if l.strip()]
+        title = lines[0][:120] if lines else page["url"]
+        snippet = " ".join(lines[1:])[:200]
+        fetched = _dt_vp.datetime.fromtimestamp(page["fetched_at"]).strftime("%d.%m.%Y")
+        blocks.append(f"[Результат {i}]\nЗаголовок: {title}\n"
+                      f"Описание: (локальная копия от {fetched}) {snippet}\nСсылка: {page['url']}")
+    return "\n\n".join(blocks)
+
+
 def deep_web_search(
     query: str,
     num_results: int = 5,
     region: str = "wt-wt",
     language: str = "russian",
     max_pages: int = 3,
+    context_tokens: int = SEARCH_PASSAGE_TOKENS,
+    model: str = None,
+    deadline: SearchDeadline = None,
 ) -> tuple:
     """
     Глубокий веб-поиск с полным пайплайном качества.
 
     Пайплайн:
-    1. Первичный поиск (DuckDuckGo)
+    0. Локальный корпус (page_corpus): свежие страницы — без сети
+    1. Первичный поиск (DuckDuckGo) — только если корпуса не хватило;
+       без сети ответ собирается из корпуса
     2. Загрузка страниц + фильтр релевантности (is_relevant_page)
     3. Фильтр свежести + наличия фактов (filter_pages)
     4. Оценка качества источников (source_quality_score)
        → сортировка, выбор топ-3 лучших
        → если качественных < 2: автоматический повторный поиск
     5. Финальный retry_search_if_needed если всё ещё мало источников
+    6. Из текста страниц в result_str идут фрагменты, лучшие по BM25,
+       не больше context_tokens токенов (оценка для model)
+
+    deadline (SearchDeadline) ограничивает всё время: загрузки страниц
+    прекращаются по его истечении, повторный поиск пропускается, если на
+    него не осталось RETRY_MIN_SECONDS, — возвращается собранное к тому
+    моменту.
 
     Возвращает КОРТЕЖ (result_str: str, page_contents: list):
       - result_str    — текстовый блок для передачи в промпт
@@ -3976,44 +4409,87 @@ def deep_web_search(
     """
     print(f"[DEEP_SEARCH] ═══ ЗАПУСК ГЛУБОКОГО ВЕБ-ПОИСКА ═══")
     print(f"[DEEP_SEARCH] Запрос: {query}")
+    deadline = deadline or SearchDeadline()
 
-    # ── ШАГ 1: Первичный поиск ──────────────────────────────────────
-    search_results = google_search(query, num_results, region, language)
+    def _accept_page(index: int, url: str, page_text: str, record: bool = True):
+        # record=False — страница из корпуса: в domain_stats её уже записали
+        i = index + 1
+        if not page_text or "[Ошибка" in page_text:
+            print(f"[DEEP_SEARCH] ⚠️ Страница {i}: ошибка загрузки")
+            return None
+        is_ok, scores, reason = is_relevant_page(query, page_text, url=url)
+        if record:
+            get_domain_stats().record_relevance(url, is_ok)
+        if not is_ok:
+            print(f"[DEEP_SEARCH] ❌ Страница {i} ОТКЛОНЕНА: {reason}")
+            return None
+        print(f"[DEEP_SEARCH] ✅ Страница {i} релевантна "
+              f"(total={scores.get('total_score',0):.0f})")
+        return {
+            "url": url,
+            "content": page_text,
+            "relevance_score": scores.get("total_score", 0),
+        }
 
-    if "Ничего не найдено" in search_results or "Ошибка" in search_results:
-        return search_results, []
+    # Минимум 2 — иначе rank_and_select_sources запросит повторный поиск.
+    needed = max(max_pages, 2)
+    fresh_needed = needs_freshness_check(query)
 
-    import re
-    urls = re.findall(r'Ссылка: (https?://[^\s]+)', search_results)
+    # ── ШАГ 0: Локальный корпус ─────────────────────────────────────
+    # Достаточно свежие страницы, загруженные раньше, — без сети
+    corpus_age = CORPUS_FRESH_AGE_NEWS if fresh_needed else CORPUS_FRESH_AGE
+    local_pages = _corpus_pages(query, needed, corpus_age, _accept_page)
 
-    if not urls:
-        print(f"[DEEP_SEARCH] ⚠️ URL не найдены в результатах")
-        return search_results, []
-
-    print(f"[DEEP_SEARCH] Найдено {len(urls)} URL для анализа")
-
-    # ── ШАГ 2: Загрузка + фильтр релевантности ──────────────────────
-    effective_max = min(max(max_pages, 5), len(urls))  # берём чуть больше для отбора
-    raw_pages = []
-
-    for i, url in enumerate(urls[:effective_max], 1):
-        print(f"[DEEP_SEARCH] Загрузка страницы {i}/{effective_max}...")
-        page_text = fetch_page_content(url, max_chars=3000)
-
-        if page_text and "[Ошибка" not in page_text:
-            is_ok, scores, reason = is_relevant_page(query, page_text, url=url)
-            if is_ok:
-                raw_pages.append({
-                    "url": url,
-                    "content": page_text,
-                    "relevance_score": scores.get("total_score", 0),
-                })
-                print(f"[DEEP_SEARCH] ✅ Страница {i} релевантна "
-                      f"(total={scores.get('total_score',0):.0f})")
-            else:
-                print(f"[DEEP_SEARCH] ❌ Страница {i} ОТКЛОНЕНА: {reason}")
+    if len(local_pages) >= needed:
+        print(f"[DEEP_SEARCH] 📚 Все {len(local_pages)} страниц из локального корпуса, без сети")
+        search_results = _corpus_results_block(local_pages)
+        raw_pages = local_pages
+    else:
+        # ── ШАГ 1: Первичный поиск ──────────────────────────────────
+        search_results = google_search(query, num_results, region, language, deadline=deadline)
+
+        if "Ничего не найдено" in search_results or "Ошибка" in search_results:
+            # Сети нет или DDG пуст — отвечаем из корпуса без ограничения возраста
+            local_pages += _corpus_pages(query, needed - len(local_pages), None, _accept_page,
+                                         exclude={p["url"] for p in local_pages})
+            if not local_pages:
+                return search_results, []
+            print(f"[DEEP_SEARCH] 📚 Поиск недоступен — {len(local_pages)} страниц из корпуса")
+            search_results = _corpus_results_block(local_pages)
+            raw_pages = local_pages
         else:
-            print(f"[DEEP_SEARCH] ⚠️ Страница {i}: ошибка загрузки")
+            import re
+            local_urls = {p["url"] for p in local_pages}
+            urls = [u for u in re.findall(r'Ссылка: (https?://[^\s]+)', search_results)
+                    if u not in local_urls]
+            # Быстрые сайты с релевантными страницами — первыми, сбойные — мимо
+            urls = get_domain_stats().order(urls)
+
+            if not urls and not local_pages:
+                print(f"[DEEP_SEARCH] ⚠️ URL не найдены в результатах")
+                return search_results, []
+
+            print(f"[DEEP_SEARCH] Найдено {len(urls)} URL для анализа")
+
+            # ── ШАГ 2: Загрузка + фильтр релевантности ──────────────
+            # Страницы качаются параллельно (page_fetcher) и проверяются по
+            # мере прихода; набрав нужное число релевантных, остальные
+            # загрузки бросаем. Страницы из корпуса уже засчитаны.
+            effective_max = min(max(max_pages, 5), len(urls))  # берём чуть больше для отбора
+            print(f"[DEEP_SEARCH] Загрузка до {effective_max} страниц параллельно...")
+
+            fetched = fetch_relevant_pages(
+                urls[:effective_max],
+                fetch=lambda url: fetch_page_content(url, max_chars=DEEP_PAGE_CHARS,
+                                                     revalidate=fresh_needed),
+                accept=_accept_page,
+                max_accepted=needed - len(local_pages),
+                deadline=deadline,
+            ) if urls else []
+            if local_pages:
+                search_results += "\n\n" + _corpus_results_block(
+                    local_pages, start=search_results.count("[Результат ") + 1)
+            raw_pages = local_pages + fetched
 
     # ── ШАГ 3: Свежесть + факты ─────────────────────────────────────
     fresh_pages = filter_pages(raw_pages, query)
@@ -4024,7 +4500,13 @@ def deep_web_search(
         fresh_pages, query, top_n=3, min_quality_score=20.0, min_sources=2
     )
 
-    if needs_quality_retry:
+    if needs_quality_retry and not deadline.allows(RETRY_MIN_SECONDS):
+        # Без retry — лучшее из собранного со смягчённым порогом, как после
+        # retry: rank_and_select_sources при нехватке отдаёт top_n без порога
+        quality_pages = [p for p in quality_pages if p["quality_score"] >= 5.0]
+        print(f"[DEEP_SEARCH] ⏱ До дедлайна {deadline.remaining():.1f} с — "
+              f"повторный поиск пропущен, беру {len(quality_pages)} источников")
+    elif needs_quality_retry:
         print(f"[DEEP_SEARCH] 🔄 Недостаточно качественных источников, "
               f"запускаю повторный поиск...")
         quality_pages = retry_search_if_needed(
@@ -4035,6 +4517,7 @@ def deep_web_search(
             language=language,
             max_pages=max_pages,
             min_good_sources=2,
+            deadline=deadline,
         )
         # После retry — снова оцениваем и сортируем
         if quality_pages:
@@ -4053,21 +4536,29 @@ def deep_web_search(
     enhanced_results += "📄 СОДЕРЖИМОЕ ПРОАНАЛИЗИРОВАННЫХ СТРАНИЦ:\n"
     enhanced_results += "═" * 60 + "\n\n"
 
-    for i, page in enumerate(page_contents, 1):
+    page_texts = select_passages(query, [p["content"] for p in page_contents],
+                                 context_tokens, model)
+    full_tokens = sum(estimate_tokens(p["content"], model) for p in page_contents)
+    used_tokens = sum(estimate_tokens(t, model) for t in page_texts)
+    print(f"[DEEP_SEARCH] 🧩 Фрагменты BM25: {full_tokens} → {used_tokens} токенов "
+          f"(бюджет {context_tokens})")
+
+    for i, (page, text) in enumerate(zip(page_contents, page_texts), 1):
         q_score = page.get("quality_score", 0)
         tier    = page.get("quality_detail", {}).get("tier", "")
         enhanced_results += f"[Источник {i} | качество: {q_score:.0f}пт | {tier}]\n"
         enhanced_results += f"URL: {page['url']}\n"
-        enhanced_results += f"Текст: {page['content']}\n\n"
+        enhanced_results += f"Текст: {text}\n\n"
         enhanced_results += "-" * 60 + "\n\n"
 
-    print(f"[DEEP_SEARCH] ✓ Завершён. "
+    print(f"[DEEP_SEARCH] ✓ Завершён за {deadline.elapsed():.1f} с. "
           f"Лучших источников: {len(page_contents)}, "
           f"объём: {len(enhanced_results)} символов")
 
     return enhanced_results, page_contents
 
-def fallback_web_search(query: str, num_results: int = 5, language: str = "russian") -> str:
+def fallback_web_search(query: str, num_results: int = 5, language: str = "russian",
+                        timeout: float = FALLBACK_SEARCH_TIMEOUT) -> str:
     """Fallback веб-поиск через DuckDuckGo HTML без внешних библиотек"""
     print(f"[FALLBACK_SEARCH] Запуск fallback поиска для: {query}")
     
@@ -4092,7 +4583,7 @@ def fallback_web_search(query: str, num_results: int = 5, language: str = "russi
         }
         
         print(f"[FALLBACK_SEARCH] Отправка запроса к DuckDuckGo...")
-        response = requests.get(search_url, headers=headers, timeout=10)
+        response = requests.get(search_url, headers=headers, timeout=timeout)
         response.raise_for_status()
         
         html_content = response.text
@@ -4172,20 +4663,38 @@ def fallback_web_search(query: str, num_results: int = 5, language: str = "russi
 # TTS с pyttsx3
 # -------------------------
 def compress_search_results(search_results: str, max_length: int) -> str:
-    """Сжимает результаты поиска до нужной длины, сохраняя самое важное"""
+    """
+    Сжимает результаты поиска до нужной длины, сохраняя самое важное.
+    Блок текста страниц (deep_web_search) сохраняется — его фрагменты уже
+    отобраны под бюджет; сжимается список результатов перед ним.
+    """
     print(f"[COMPRESS] Начальная длина: {len(search_results)} символов")
     print(f"[COMPRESS] Целевая длина: {max_length} символов")
     
     if len(search_results) <= max_length:
         print(f"[COMPRESS] Сжатие не требуется")
         return search_results
+
+    # Блок страниц начинается с разделителя «═══…»; больше 3/4 лимита не отдаём
+    search_results, sep, pages_section = search_results.partition("═" * 60)
+    if sep:
+        pages_section = sep + pages_section
+        if len(pages_section) > max_length * 3 // 4:
+            pages_section = pages_section[:max_length * 3 // 4] + "..."
+        search_results = search_results.rstrip()
+        max_length = max(max_length - len(pages_section) - 2, 0)
+        print(f"[COMPRESS] Блок страниц: {len(pages_section)} символов, "
+              f"на список результатов: {max_length}")
+        if len(search_results) <= max_length:
+            return search_results + "\n\n" + pages_section
+        pages_section = "\n\n" + pages_section
     
     # Разбиваем на отдельные результаты
     results = search_results.split('[Результат ')
     if len(results) <= 1:
         # Если не удалось разбить, просто обрезаем
         print(f"[COMPRESS] Простое обрезание до {max_length} символов")
-        return search_results[:max_length] + "..."
+        return search_results[:max_length] + "..." + pages_section
     
     # Первый элемент - пустой, убираем
     results = results[1:]
@@ -4231,7 +4740,7 @@ def compress_search_results(search_results: str, max_length: int) -> str:
         compressed = f"[Результат {i}]\n{title_line}\n{description_line}\n{link_line}"
         compressed_results.append(compressed)
     
-    final_result = "\n\n".join(compressed_results)
+    final_result = "\n\n".join(compressed_results) + pages_section
     print(f"[COMPRESS] Итоговая длина: {len(final_result)} символов")
     
     return final_result
@@ -4241,19 +4750,61 @@ def compress_search_results(search_results: str, max_length: int) -> str:
 # ПАЙПЛАЙН ОБРАБОТКИ ОТВЕТА ПОСЛЕ ПОИСКА
 # ═══════════════════════════════════════════════════════════════════
 
-def summarize_sources(raw_search_results: str, query: str, detected_language: str = "russian", model_key: str = None) -> str:
+# Ниже этого объёма (в токенах модели) результаты идут в ответ без суммаризации
+SUMMARIZE_MIN_TOKENS = 400
+# Сколько живёт закэшированная выжимка одного и того же набора результатов
+SUMMARIZE_CACHE_TTL = 6 * 3600
+# Промпт просит «максимум 10 фактов» — после 10-го пункта генерация обрывается
+SUMMARIZE_MAX_FACTS = 10
+SUMMARIZE_TIMEOUT = 45
+# Меньше этого остатка лимита поиска суммаризация моделью не начинается
+SUMMARIZE_MIN_SECONDS = 8
+_FACT_BULLET_RE = re.compile(r"^\s*[•\-*]\s+\S", re.MULTILINE)
+
+
+def resolve_summarizer_model(model_key: str = None) -> str:
+    """
+    Имя модели Ollama, которой summarize_sources сжимает результаты поиска.
+    Глобальный резолвер из get_ai_response здесь недоступен, поэтому
+    логика дублируется: mistral/qwen — явно, остальные — SUPPORTED_MODELS.
+    """
+    if model_key == "mistral":
+        return MISTRAL_MODEL_NAME
+    if model_key == "qwen":
+        return QWEN_MODEL_NAME
+    if model_key and model_key in SUPPORTED_MODELS:
+        return SUPPORTED_MODELS[model_key][0]
+    return get_current_ollama_model()
+
+
+def summarize_sources(raw_search_results: str, query: str, detected_language: str = "russian",
+                      model_key: str = None, extractive: bool = False,
+                      timeout: float = SUMMARIZE_TIMEOUT) -> str:
     """
     Вызывает Ollama для извлечения только фактов из сырого содержимого страниц.
     Модели передаётся только сжатый список фактов, а не длинный текст страниц.
     model_key — явный ключ модели; если None, берётся текущий глобал.
+    extractive — факты выбираются без модели (extractive_summary): быстрый
+    режим и ответы с ограниченным временем.
+    timeout — сколько секунд может идти генерация (остаток лимита поиска).
     """
     print(f"[SUMMARIZE] Начинаю извлечение фактов из результатов поиска...")
 
     # Если результаты небольшие — не тратим время на промежуточный вызов
-    if len(raw_search_results) < 1500:
-        print(f"[SUMMARIZE] Результаты небольшие ({len(raw_search_results)} символов), пропускаем суммаризацию")
+    _summ_model = resolve_summarizer_model(model_key)
+    _raw_tokens = estimate_tokens(raw_search_results, _summ_model)
+    if _raw_tokens < SUMMARIZE_MIN_TOKENS:
+        print(f"[SUMMARIZE] Результаты небольшие (~{_raw_tokens} токенов), пропускаем суммаризацию")
         return raw_search_results
 
+    if extractive:
+        _t_start = time.monotonic()
+        facts = summarize_extractive(raw_search_results, query, detected_language,
+                                     max_facts=SUMMARIZE_MAX_FACTS)
+        print(f"[SUMMARIZE] ✓ Факты выбраны без модели за "
+              f"{(time.monotonic() - _t_start) * 1000:.0f} мс. Длина: {len(facts)} символов")
+        return facts
+
     if detected_language == "russian":
         summarize_prompt = f"""Ты — строгий фильтр фактов. Вот содержимое веб-страниц по запросу: "{query}"
 
@@ -4291,30 +4842,50 @@ STRICT RULES:
 
 Answer in English."""
 
+    _messages = [{"role": "user", "content": summarize_prompt}]
+    _options = {"num_predict": 600, "temperature": 0.1}
+
+    _t_start = time.monotonic()
+    # Генерацию оборвал лимит времени — неполные факты не кэшируем
+    _truncated = []
+
+    def _summary_done(text: str) -> bool:
+        # Стоп, как только готовы SUMMARIZE_MAX_FACTS полных пунктов
+        # (или вышло время) — хвост генерации не нужен
+        if time.monotonic() - _t_start > timeout:
+            _truncated.append(True)
+            return True
+        complete = text[:text.rfind("\n") + 1]
+        return len(_FACT_BULLET_RE.findall(complete)) >= SUMMARIZE_MAX_FACTS
+
+    def _summarize_call() -> str:
+        # Стрим вместо блокирующего вызова: досрочная остановка по числу пунктов,
+        # отмена и метрики — внутри stream_ollama_chat. timeout держит лимит и
+        # до первого токена (загрузка модели, prompt-eval)
+        text = stream_ollama_chat(
+            {"model": _summ_model, "messages": _messages, "options": _options},
+            stage=STAGE_SUMMARIZE, should_stop=_summary_done, timeout=timeout)
+        if time.monotonic() - _t_start >= timeout:
+            _truncated.append(True)
+        if text == OLLAMA_CANCELLED:
+            raise OllamaCancelled("Суммаризация отменена")
+        if text.startswith("[Ollama"):
+            print(f"[SUMMARIZE] ⚠️ {text}")
+            return ""
+        return text.strip()
+
     try:
-        # Используем глобальный резолвер из get_ai_response недоступен здесь,
-        # поэтому дублируем логику: mistral/qwen — явно, остальные — SUPPORTED_MODELS
-        if model_key == "mistral":
-            _summ_model = MISTRAL_MODEL_NAME
-        elif model_key == "qwen":
-            _summ_model = QWEN_MODEL_NAME
-        elif model_key and model_key in SUPPORTED_MODELS:
-            _summ_model = SUPPORTED_MODELS[model_key][0]
-        else:
-            _summ_model = get_current_ollama_model()
-        payload = {
-            "model": _summ_model,
-            "messages": [{"role": "user", "content": summarize_prompt}],
-            "stream": False,
-            "options": {"num_predict": 600, "temperature": 0.1}
-        }
-        response = requests.post(f"{OLLAMA_HOST}/api/chat", json=payload, timeout=45)
-        if response.status_code == 200:
-            data = response.json()
-            facts = data.get("message", {}).get("content", "").strip()
-            if facts and len(facts) > 50:
-                print(f"[SUMMARIZE] ✓ Факты извлечены. Длина: {len(facts)} символов")
-                return facts
+        # Те же результаты поиска после «Перегенерировать» — из llm_cache
+        facts = get_llm_cache().get_or_compute(
+            "summarize", _summ_model, _messages, _options, _summarize_call,
+            ttl=SUMMARIZE_CACHE_TTL,
+            accept=lambda f: bool(f) and len(f) > 50 and not _truncated)
+        if facts and len(facts) > 50:
+            print(f"[SUMMARIZE] ✓ Факты извлечены. Длина: {len(facts)} символов")
+            return facts
+    except OllamaCancelled:
+        print(f"[SUMMARIZE] ⏹ Суммаризация отменена пользователем")
+        return raw_search_results
     except Exception as e:
         print(f"[SUMMARIZE] ⚠️ Ошибка при суммаризации: {e}")
 
@@ -4712,4 +5283,58 @@ def build_contextual_search_query(user_message: str, chat_manager, chat_id: int,
         print(f"[CONTEXTUAL_SEARCH] ℹ️  Самостоятельный вопрос, контекст не требуется")
         return user_message
 
+
+_MONTHS_GENITIVE_RU = ["января", "февраля", "марта", "апреля", "мая", "июня",
+                       "июля", "августа", "сентября", "октября", "ноября", "декабря"]
+
+
+def substitute_relative_dates(query: str, detected_language: str) -> str:
+    """
+    «завтра»/«послезавтра»/«вчера» → реальная дата, чтобы поисковик
+    получал точную дату, а не относительное слово.
+    """
+    from datetime import timedelta as _td
+    _sq_now = datetime.now()
+    _sq_tomorrow  = _sq_now + _td(days=1)
+    _sq_dayafter  = _sq_now + _td(days=2)
+    _sq_yesterday = _sq_now - _td(days=1)
+    if detected_language == "russian":
+        def _ru(d):
+            return f"{d.day} {_MONTHS_GENITIVE_RU[d.month - 1]}"
+        query = re.sub(r'\bпослезавтра\b', _ru(_sq_dayafter),  query, flags=re.IGNORECASE)
+        query = re.sub(r'\bзавтра\b',      _ru(_sq_tomorrow),  query, flags=re.IGNORECASE)
+        query = re.sub(r'\bвчера\b',       _ru(_sq_yesterday), query, flags=re.IGNORECASE)
+    else:
+        query = re.sub(r'\bday after tomorrow\b', _sq_dayafter.strftime("%B %d"),  query, flags=re.IGNORECASE)
+        query = re.sub(r'\btomorrow\b',            _sq_tomorrow.strftime("%B %d"),  query, flags=re.IGNORECASE)
+        query = re.sub(r'\byesterday\b',           _sq_yesterday.strftime("%B %d"), query, flags=re.IGNORECASE)
+    return query
+
+
+def build_search_query(user_message: str, chat_manager, chat_id: int, detected_language: str) -> str:
+    """
+    Поисковый запрос хода: контекст диалога (build_contextual_search_query)
+    + реальные даты вместо относительных слов. Один и тот же для
+    get_ai_response и search_prefetch — иначе прогретый кэш не совпадёт.
+    """
+    contextual_query = build_contextual_search_query(user_message, chat_manager, chat_id, detected_language)
+    return substitute_relative_dates(contextual_query, detected_language)
+
+
+def detect_search_language(text: str, model_key: str = None) -> str:
+    """
+    Язык вопроса для поиска. Для Qwen и Mistral хоть одна кириллическая
+    буква — русский: технические термины (API, JSON…) сбивают их на english.
+    """
+    detected_language = detect_message_language(text)
+    if model_key in ("qwen", "mistral") and detected_language != "russian":
+        if any('\u0400' <= ch <= '\u04FF' for ch in text):
+            print(f"[LANG] [{model_key}] Переопределён язык → РУССКИЙ (найдена кириллица)")
+            detected_language = "russian"
+    return detected_language
+
+
+def search_region(detected_language: str) -> str:
+    return "ru-ru" if detected_language == "russian" else "us-en"
+
 # Озвучка полностью удалена
\ No newline at end of file